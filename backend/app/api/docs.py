@@ -2,13 +2,14 @@ from __future__ import annotations
 
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Response
 from pydantic import BaseModel, ConfigDict
 from sqlalchemy.orm import Session
 
+from app.api.pagination import SortKey, paginate, parse_fields, project_items
 from app.db.session import get_db
 from app.db import models
-from app.ingestion.docs_ingestor import ingest_text_document
+from app.ingestion.docs_ingestor import ingest_text_document, remove_document
 
 router = APIRouter(
     tags=["docs"],
@@ -188,21 +189,36 @@ async def upload_text_document(
 @router.get("/projects/{project_id}/docs", response_model=List[DocumentRead])
 def list_project_documents(
     project_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
 ):
     """
-    List all documents attached to a given project.
+    List documents attached to a given project (oldest first).
+
+    Supports keyset pagination (`limit` + `cursor` from X-Next-Cursor),
+    `fields` projection and `include_total` (X-Total-Count).
     """
+    projection = parse_fields(fields, DocumentRead)
     project = db.get(models.Project, project_id)
     if project is None:
         raise HTTPException(status_code=404, detail="Project not found.")
 
-    docs = (
-        db.query(models.Document)
-        .filter(models.Document.project_id == project_id)
-        .order_by(models.Document.id)
-        .all()
+    docs = paginate(
+        db.query(models.Document, models.Document.id).filter(
+            models.Document.project_id == project_id
+        ),
+        [SortKey(models.Document.id)],
+        response,
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total,
     )
+    if projection:
+        return project_items(docs, projection, response)
     return docs
 
 
@@ -263,6 +279,7 @@ def delete_document(doc_id: int, db: Session = Depends(get_db)):
     doc = db.get(models.Document, doc_id)
     if doc is None:
         raise HTTPException(status_code=404, detail="Document not found.")
-    db.delete(doc)
+
+    remove_document(db, doc)
     db.commit()
     return {"status": "deleted", "doc_id": doc_id}
\ No newline at end of file
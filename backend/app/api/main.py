@@ -9,24 +9,36 @@ import re
 import time
 import threading
 from collections import deque
-from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
 from pathlib import Path
-from typing import Optional, List, Dict, Deque, Any, Literal, cast, TYPE_CHECKING, Generator
+from typing import Optional, List, Dict, Deque, Any, Literal, cast, TYPE_CHECKING, Generator, Union
 
-from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, ConfigDict, model_validator
-from sqlalchemy import case
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import OperationalError
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import Session, joinedload
 
-from app.db.base import Base
+from app.db.migrations import run_migrations
 from app.db.session import engine, get_db, SessionLocal
+from app.db.usage_rollups import GROUP_BY_CHOICES, record_usage, usage_breakdown
+from app.db.write_lane import get_write_lane_stats, run_write
 from app.db import models
+from app.llm import context_budget, context_compress, prompt_layout
 from app.llm import openai_client as openai_module
 from app.llm.openai_client import generate_reply_from_history
-from app.llm.embeddings import get_embedding
-from app.llm.pricing import estimate_call_cost
+from app.llm.embeddings import (
+    configured_embedding_spec,
+    embedding_spec,
+    get_embedding,
+    query_embedder,
+)
+from app.llm.embedding_providers import HASHED_NGRAM_MODEL
+from app.llm.pricing import estimate_call_cost, recompute_usage_costs, unpriced_models
+from app.llm.budgets import BudgetExceeded, get_budget_stats
+from app.llm.router import RoutingPolicy, get_router_stats
 from app.vectorstore.chroma_store import (
     add_message_embedding,
     query_similar_messages,
@@ -35,18 +47,100 @@ from app.vectorstore.chroma_store import (
     delete_memory_embedding,
     query_similar_memory_items,
 )
+from app.vectorstore.reconcile import (
+    ReconcileInProgress,
+    ReconcileScheduler,
+    last_reconcile_report,
+    reconcile_vectors,
+)
+from app.vectorstore import registry as vector_registry
+from app.vectorstore import retrieval_cache
+from app.vectorstore.reindex import ReindexInProgress, purge_retired, reindex_status, start_reindex
+from app.api.pagination import (
+    NEXT_CURSOR_HEADER,
+    TOTAL_COUNT_HEADER,
+    SortKey,
+    paginate,
+    pagination_headers,
+    parse_fields,
+    project_items,
+    project_rows,
+)
 from app.api.search import router as search_router
 from app.api.docs import router as docs_router
 from app.api.github import router as github_router
+from app.ingestion.chunk_dedupe import collapse_duplicate_hits
 from app.ingestion.github_ingestor import ingest_repo_job, get_ingest_telemetry
+from app.observability.metrics import (
+    CHAT_STAGE_LATENCY,
+    RETRIEVAL_HITS,
+    MetricsMiddleware,
+    StageTimer,
+    get_latency_summary,
+    render_metrics,
+)
+from app.observability.tracing import (
+    TRACE_ID_HEADER,
+    TracingMiddleware,
+    get_trace,
+    recent_traces,
+    set_trace_attributes,
+)
+
+# Apply pending schema migrations; a current DB costs one schema_version read.
+run_migrations(engine)
+
+
+def _check_vector_collections() -> None:
+    """
+    Record which embedding spec and layout the vector collections use, warn
+    when the environment asks for another spec and start migrating shared
+    collections to per-project partitions (IW_VECTOR_PARTITIONING).
+    """
+    db = SessionLocal()
+    try:
+        vector_registry.record_active(db)
+        purge_retired(db)
+        active = vector_registry.active_specs()
+        for name, spec in active.items():
+            wanted = configured_embedding_spec(name)
+            if spec != wanted:
+                print(
+                    f"[WARN] Vector collection {name} uses {spec.model} ({spec.vector_size or '?'} dims) "
+                    f"but {wanted.model} ({wanted.vector_size or '?'} dims) is configured; "
+                    "embeddings keep using the recorded spec until POST /vectors/reindex migrates it."
+                )
+        partitioned = vector_registry.configured_partitioned()
+        if vector_registry.active_partitioned() != partitioned:
+            # Same specs: the vectors are copied, not re-embedded.
+            start_reindex(lambda: SessionLocal(), active, partitioned)
+            print(
+                "[INFO] Migrating vector collections to the "
+                f"{'per-project' if partitioned else 'shared'} layout in the background"
+            )
+    except Exception as exc:  # noqa: BLE001
+        print(f"[WARN] Unable to check vector collections: {exc!r}")
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    # SessionLocal is looked up at call time so tests can patch it.
+    _check_vector_collections()
+    scheduler = ReconcileScheduler(lambda: SessionLocal())
+    scheduler.start()
+    try:
+        yield
+    finally:
+        scheduler.stop()
 
-# Create tables on import (simple approach for now; later we can use migrations)
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="InfinityWindow Backend",
     description="Backend service for the InfinityWindow personal AI workbench.",
     version="0.3.0",
+    lifespan=_lifespan,
 )
 
 # QA: open CORS to unblock local dev ports (5175, 5173, etc.)
@@ -56,8 +150,12 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER, TRACE_ID_HEADER],
 )
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
 app.include_router(search_router)
 app.include_router(docs_router)
 app.include_router(github_router)
@@ -102,6 +200,8 @@ class ProjectRead(BaseModel):
     instruction_text: Optional[str] = None
     instruction_updated_at: Optional[datetime] = None
     pinned_note_text: Optional[str] = None
+    latency_slo_ms: Optional[int] = None
+    daily_budget_usd: Optional[float] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -112,6 +212,9 @@ class ProjectUpdate(BaseModel):
     local_root_path: Optional[str] = None
     instruction_text: Optional[str] = None
     pinned_note_text: Optional[str] = None
+    # Auto-mode routing; send 0 to clear.
+    latency_slo_ms: Optional[int] = Field(default=None, ge=0)
+    daily_budget_usd: Optional[float] = Field(default=None, ge=0)
 
     @model_validator(mode="before")
     @classmethod
@@ -222,6 +325,7 @@ class UsageRecordRead(BaseModel):
     model: str
     tokens_in: Optional[int]
     tokens_out: Optional[int]
+    cached_tokens_in: Optional[int] = None
     cost_estimate: Optional[float]
     created_at: datetime
 
@@ -232,9 +336,34 @@ class ConversationUsageSummary(BaseModel):
     conversation_id: int
     total_tokens_in: Optional[int]
     total_tokens_out: Optional[int]
+    total_cached_tokens_in: Optional[int] = None
     total_cost_estimate: Optional[float]
     records: List[UsageRecordRead]
 
+
+class UsageBucketRead(BaseModel):
+    # Model name, ISO day or conversation id (None = not tied to a conversation)
+    key: Optional[Union[str, int]]
+    calls: int
+    tokens_in: int
+    tokens_out: int
+    cached_tokens_in: int = 0
+    cost_estimate: float
+
+
+class ProjectUsageBreakdown(BaseModel):
+    project_id: int
+    group_by: str
+    start: Optional[date] = None
+    end: Optional[date] = None
+    model: Optional[str] = None
+    total_calls: int
+    total_tokens_in: int
+    total_tokens_out: int
+    total_cached_tokens_in: int = 0
+    total_cost_estimate: float
+    buckets: List[UsageBucketRead]
+
 if TYPE_CHECKING:
     # Hints for dynamic attributes added to SQLAlchemy models at runtime
     models.Task.auto_confidence: Optional[float]
@@ -517,46 +646,6 @@ def _normalize_instruction_text(value: Optional[str]) -> Optional[str]:
     return trimmed or None
 
 
-def _commit_with_retry(db: Session, attempts: int = 6, base_delay: float = 0.3):
-    """
-    Commit the session with a retry loop to tolerate transient SQLite locks.
-    The delay increases linearly to give the lock holder time to finish.
-    """
-    last_exc: Optional[Exception] = None
-    for i in range(attempts):
-        try:
-            db.commit()
-            return
-        except OperationalError as exc:  # SQLite locked
-            db.rollback()
-            last_exc = exc
-            if "locked" not in str(exc).lower():
-                raise
-            # backoff: 0.3s, 0.6s, 0.9s, ...
-            time.sleep(base_delay * (i + 1))
-    if last_exc:
-        raise last_exc
-
-
-def _flush_with_retry(db: Session, attempts: int = 6, base_delay: float = 0.3):
-    """
-    Flush pending objects with retries to tolerate transient SQLite locks.
-    """
-    last_exc: Optional[Exception] = None
-    for i in range(attempts):
-        try:
-            db.flush()
-            return
-        except OperationalError as exc:
-            db.rollback()
-            last_exc = exc
-            if "locked" not in str(exc).lower():
-                raise
-            time.sleep(base_delay * (i + 1))
-    if last_exc:
-        raise last_exc
-
-
 def _normalize_tags(tags: Optional[List[str]]) -> Optional[str]:
     if not tags:
         return None
@@ -811,6 +900,7 @@ _RETRIEVAL_TELEMETRY: Dict[str, int] = {
     "search_memory_hits": 0,
     "search_tasks_hits": 0,
 }
+_RETRIEVAL_TELEMETRY_LOCK = threading.Lock()
 
 
 def record_retrieval_event(
@@ -822,11 +912,15 @@ def record_retrieval_event(
     key = f"{surface}_{kind}_hits"
     if key not in _RETRIEVAL_TELEMETRY:
         return
-    _RETRIEVAL_TELEMETRY[key] = _RETRIEVAL_TELEMETRY.get(key, 0) + max(int(hits or 0), 0)
+    count = max(int(hits or 0), 0)
+    with _RETRIEVAL_TELEMETRY_LOCK:
+        _RETRIEVAL_TELEMETRY[key] = _RETRIEVAL_TELEMETRY.get(key, 0) + count
+    RETRIEVAL_HITS.inc(count, surface=surface, kind=kind)
 
 
 def get_retrieval_telemetry(reset: bool = False) -> Dict[str, int]:
-    snapshot: Dict[str, int] = dict(_RETRIEVAL_TELEMETRY)
+    with _RETRIEVAL_TELEMETRY_LOCK:
+        snapshot: Dict[str, int] = dict(_RETRIEVAL_TELEMETRY)
     if reset:
         reset_retrieval_telemetry()
         snapshot = dict(_RETRIEVAL_TELEMETRY)
@@ -834,8 +928,9 @@ def get_retrieval_telemetry(reset: bool = False) -> Dict[str, int]:
 
 
 def reset_retrieval_telemetry() -> None:
-    for key in _RETRIEVAL_TELEMETRY:
-        _RETRIEVAL_TELEMETRY[key] = 0
+    with _RETRIEVAL_TELEMETRY_LOCK:
+        for key in _RETRIEVAL_TELEMETRY:
+            _RETRIEVAL_TELEMETRY[key] = 0
 
 
 # ---------- Helper: AI‑assisted task extraction ----------
@@ -907,7 +1002,8 @@ def _run_auto_update_with_retry(
     for i in range(attempts):
         try:
             auto_update_tasks_from_conversation(db, conversation, model_name=model_name)
-            _commit_with_retry(db)
+            _cleanup_stale_suggestions(db, conversation.project_id)
+            db.commit()
             return True, None
         except Exception as exc:  # noqa: BLE001
             db.rollback()
@@ -1732,6 +1828,8 @@ def auto_update_tasks_from_conversation(
             prompt,
             model=None,  # let openai_client pick a cheap/fast model
             mode="fast",
+            project_id=conversation.project_id,
+            optional=True,  # skipped when the project is over budget
         )
         if not raw:
             return
@@ -1972,6 +2070,8 @@ def auto_title_conversation(
             prompt,
             model=None,  # let openai_client pick a cheap/fast model
             mode="fast",
+            project_id=conversation.project_id,
+            optional=True,  # skipped when the project is over budget
         )
         if not raw:
             return
@@ -2111,7 +2211,7 @@ def create_project(
         instruction_updated_at=datetime.now(timezone.utc) if instructions else None,
     )
     db.add(project)
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(project)
     return project
 
@@ -2162,8 +2262,12 @@ def update_project(
         project.instruction_updated_at = datetime.now(timezone.utc)
     if payload.pinned_note_text is not None:
         project.pinned_note_text = payload.pinned_note_text.strip() or None
+    if payload.latency_slo_ms is not None:
+        project.latency_slo_ms = payload.latency_slo_ms or None
+    if payload.daily_budget_usd is not None:
+        project.daily_budget_usd = payload.daily_budget_usd or None
 
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(project)
     return project
 
@@ -2495,6 +2599,7 @@ def _conversation_with_folder_meta(
     """
     folder: Optional[models.ConversationFolder] = None
     if getattr(conversation, "folder_id", None):
+        # Listings eager-load the folder; single lookups lazy-load it here.
         folder = conversation.folder
         if folder is None:
             folder = db.get(models.ConversationFolder, conversation.folder_id)
@@ -2560,15 +2665,39 @@ def _active_memory_query(db: Session, project_id: int):
 )
 def list_memory_items(
     project_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
 ):
+    """
+    List active memory items, pinned first then newest.
+
+    Supports keyset pagination (`limit` + `cursor` from X-Next-Cursor),
+    `fields` projection and `include_total` (X-Total-Count).
+    """
+    projection = parse_fields(fields, MemoryItemRead)
     _ensure_project(db, project_id)
-    items = (
-        _active_memory_query(db, project_id)
-        .order_by(models.MemoryItem.pinned.desc(), models.MemoryItem.id.desc())
-        .all()
+    keys = [
+        SortKey(models.MemoryItem.pinned, descending=True),
+        SortKey(models.MemoryItem.id, descending=True),
+    ]
+    items = paginate(
+        _active_memory_query(db, project_id).add_columns(
+            models.MemoryItem.pinned, models.MemoryItem.id
+        ),
+        keys,
+        response,
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total,
     )
-    return [_memory_item_to_read_model(item) for item in items]
+    read_items = [_memory_item_to_read_model(item) for item in items]
+    if projection:
+        return project_items(read_items, projection, response)
+    return read_items
 
 
 @app.post(
@@ -2611,7 +2740,7 @@ def create_memory_item(
         source_message_id=payload.source_message_id,
     )
     db.add(memory_item)
-    _flush_with_retry(db)
+    db.flush()
 
     if payload.supersedes_memory_id is not None:
         superseded = _ensure_memory_item(
@@ -2620,7 +2749,7 @@ def create_memory_item(
         superseded.superseded_by_id = memory_item.id
 
     try:
-        embedding = get_embedding(memory_item.content)
+        embedding = get_embedding(memory_item.content, collection="memory_items")
         add_memory_embedding(
             memory_id=memory_item.id,
             project_id=project.id,
@@ -2635,7 +2764,7 @@ def create_memory_item(
             detail="Vector store unavailable while saving memory item; please retry.",
         ) from exc
 
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(memory_item)
     return _memory_item_to_read_model(memory_item)
 
@@ -2708,9 +2837,10 @@ def update_memory_item(
             memory_item.superseded_by_id = superseder.id
 
     if content_changed:
-        delete_memory_embedding(memory_item.id)
         try:
-            embedding = get_embedding(memory_item.content)
+            # Chroma ignores add() for an existing id, so drop the old vector first.
+            delete_memory_embedding(memory_item.id, memory_item.project_id)
+            embedding = get_embedding(memory_item.content, collection="memory_items")
             add_memory_embedding(
                 memory_id=memory_item.id,
                 project_id=memory_item.project_id,
@@ -2725,7 +2855,7 @@ def update_memory_item(
                 detail="Vector store unavailable while updating memory item; please retry.",
             ) from exc
 
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(memory_item)
     return _memory_item_to_read_model(memory_item)
 
@@ -2733,9 +2863,14 @@ def update_memory_item(
 @app.delete("/memory_items/{memory_id}")
 def delete_memory_item(memory_id: int, db: Session = Depends(get_db)):
     memory_item = _ensure_memory_item(db, memory_id)
-    delete_memory_embedding(memory_item.id)
+    project_id = memory_item.project_id
     db.delete(memory_item)
-    _commit_with_retry(db)
+    db.commit()
+    try:
+        delete_memory_embedding(memory_id, project_id)
+    except Exception as exc:  # noqa: BLE001
+        # The row is gone; the vector reconciler removes the orphan later.
+        print(f"[WARN] Failed to delete vector for memory item {memory_id}: {exc!r}")
     return {"status": "deleted", "memory_id": memory_id}
 
 
@@ -2748,22 +2883,38 @@ def delete_memory_item(memory_id: int, db: Session = Depends(get_db)):
 )
 def list_project_conversations(
     project_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
 ):
     """
-    List all conversations under a given project.
+    List conversations under a given project (oldest first).
+
+    Supports keyset pagination (`limit` + `cursor` from X-Next-Cursor),
+    `fields` projection and `include_total` (X-Total-Count).
     """
+    projection = parse_fields(fields, ConversationRead)
     project = db.get(models.Project, project_id)
     if project is None:
         raise HTTPException(status_code=404, detail="Project not found.")
 
-    conversations = (
-        db.query(models.Conversation)
-        .filter(models.Conversation.project_id == project_id)
-        .order_by(models.Conversation.id)
-        .all()
+    conversations = paginate(
+        db.query(models.Conversation, models.Conversation.id)
+        .options(joinedload(models.Conversation.folder))
+        .filter(models.Conversation.project_id == project_id),
+        [SortKey(models.Conversation.id)],
+        response,
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total,
     )
-    return [_conversation_with_folder_meta(db, convo) for convo in conversations]
+    conversations = [_conversation_with_folder_meta(db, convo) for convo in conversations]
+    if projection:
+        return project_items(conversations, projection, response)
+    return conversations
 
 
 @app.post("/conversations", response_model=ConversationRead)
@@ -2841,23 +2992,40 @@ def rename_conversation(
 )
 def list_conversation_messages(
     conversation_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    newest_first: bool = False,
+    fields: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
 ):
     """
-    List all messages in a conversation, in chronological order.
+    List messages in a conversation, in chronological order
+    (`newest_first=true` pages backwards from the latest message).
+
+    Supports keyset pagination (`limit` + `cursor` from X-Next-Cursor),
+    `fields` projection and `include_total` (X-Total-Count).
     """
+    projection = parse_fields(fields, MessageRead)
     conversation = db.get(models.Conversation, conversation_id)
     if conversation is None:
         raise HTTPException(
             status_code=404, detail="Conversation not found."
         )
 
-    messages = (
-        db.query(models.Message)
-        .filter(models.Message.conversation_id == conversation_id)
-        .order_by(models.Message.id.asc())
-        .all()
+    messages = paginate(
+        db.query(models.Message, models.Message.id).filter(
+            models.Message.conversation_id == conversation_id
+        ),
+        [SortKey(models.Message.id, descending=newest_first)],
+        response,
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total,
     )
+    if projection:
+        return project_items(messages, projection, response)
     return messages
 
 
@@ -2870,11 +3038,21 @@ def list_conversation_messages(
 )
 def list_project_tasks(
     project_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
 ):
     """
-    List all tasks for a given project.
+    List tasks for a given project: open before done, then by priority,
+    ready before blocked, most recently updated first.
+
+    Supports keyset pagination (`limit` + `cursor` from X-Next-Cursor),
+    `fields` projection and `include_total` (X-Total-Count).
     """
+    projection = parse_fields(fields, TaskRead)
     project = db.get(models.Project, project_id)
     if project is None:
         raise HTTPException(status_code=404, detail="Project not found.")
@@ -2889,21 +3067,28 @@ def list_project_tasks(
         (models.Task.priority == "normal", 2),
         else_=3,
     )
-    tasks = (
-        db.query(models.Task)
-        .filter(models.Task.project_id == project_id)
-        .order_by(
-            status_order,
-            priority_order,
-            # Ready (no blocked_reason) should surface before blocked
-            case((models.Task.blocked_reason.is_(None), 0), else_=1),
-            models.Task.updated_at.desc(),
-            models.Task.id.asc(),
-        )
-        .all()
+    # Ready (no blocked_reason) should surface before blocked
+    blocked_order = case((models.Task.blocked_reason.is_(None), 0), else_=1)
+    keys = [
+        SortKey(status_order),
+        SortKey(priority_order),
+        SortKey(blocked_order),
+        SortKey(models.Task.updated_at, descending=True, is_datetime=True),
+        SortKey(models.Task.id),
+    ]
+    tasks = paginate(
+        db.query(models.Task, *(key.expr for key in keys)).filter(
+            models.Task.project_id == project_id
+        ),
+        keys,
+        response,
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total,
     )
     _attach_task_action_metadata(tasks)
-    _cleanup_stale_suggestions(db, project_id)
+    if projection:
+        return project_items(tasks, projection, response)
     return tasks
 
 
@@ -2953,7 +3138,7 @@ def create_task(
         auto_notes=payload.auto_notes,
     )
     db.add(task)
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(task)
     return task
 
@@ -2981,8 +3166,11 @@ def update_task(
         task.blocked_reason = payload.blocked_reason
     if payload.auto_notes is not None:
         task.auto_notes = payload.auto_notes
+    if task.status == "done":
+        db.flush()
+        _cleanup_stale_suggestions(db, task.project_id)
 
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(task)
     return task
 
@@ -2996,7 +3184,7 @@ def delete_task(task_id: int, db: Session = Depends(get_db)):
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found.")
     db.delete(task)
-    _commit_with_retry(db)
+    db.commit()
     return {"status": "deleted", "task_id": task_id}
 
 
@@ -3079,8 +3267,7 @@ def list_tasks_with_suggestions(
     (low-confidence add/complete) for a project in one call.
     """
     _ensure_project(db, project_id)
-    tasks = list_project_tasks(project_id=project_id, db=db)
-    _cleanup_stale_suggestions(db, project_id)
+    tasks = list_project_tasks(project_id=project_id, response=Response(), db=db)
     suggestions = list_task_suggestions(
         project_id=project_id,
         status=suggestion_status,
@@ -3184,7 +3371,10 @@ def approve_task_suggestion(
             detail=f"Unsupported suggestion action: {suggestion.action_type}",
         )
 
-    _commit_with_retry(db)
+    if suggestion.action_type == "complete":
+        db.flush()
+        _cleanup_stale_suggestions(db, suggestion.project_id)
+    db.commit()
     db.refresh(suggestion)
     return _task_suggestion_to_schema(suggestion)
 
@@ -3204,7 +3394,7 @@ def dismiss_task_suggestion(
         )
     suggestion.status = "dismissed"
     suggestion.updated_at = datetime.now(timezone.utc)
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(suggestion)
     try:
         payload = json.loads(suggestion.payload or "{}")
@@ -3221,26 +3411,33 @@ def dismiss_task_suggestion(
     return _task_suggestion_to_schema(suggestion)
 
 
-def _cleanup_stale_suggestions(db: Session, project_id: int) -> None:
+def _cleanup_stale_suggestions(db: Session, project_id: int) -> int:
     """
-    Dismiss completion suggestions whose target tasks are already done.
+    Dismiss pending completion suggestions whose target tasks are already done.
+
+    One set-based UPDATE; the caller commits. Run it on the paths that mark
+    tasks done, not on reads.
     """
-    stale = (
-        db.query(models.TaskSuggestion)
-        .filter(
+    target_done = (
+        select(models.Task.id)
+        .where(
+            models.Task.id == models.TaskSuggestion.target_task_id,
+            models.Task.status == "done",
+        )
+        .exists()
+    )
+    result = db.execute(
+        update(models.TaskSuggestion)
+        .where(
             models.TaskSuggestion.project_id == project_id,
             models.TaskSuggestion.action_type == "complete",
             models.TaskSuggestion.status == "pending",
+            target_done,
         )
-        .all()
+        .values(status="dismissed", updated_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session="fetch")
     )
-    for s in stale:
-        if s.target_task_id:
-            task = db.get(models.Task, s.target_task_id)
-            if task and task.status == "done":
-                s.status = "dismissed"
-                s.updated_at = datetime.now(timezone.utc)
-    db.commit()
+    return result.rowcount or 0
 
 
 # ---------- Usage (per-conversation) ----------
@@ -3252,58 +3449,225 @@ def _cleanup_stale_suggestions(db: Session, project_id: int) -> None:
 )
 def get_conversation_usage(
     conversation_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
 ):
     """
     Return usage records (tokens, model, etc.) for a given conversation,
     plus simple totals.
 
+    Totals always cover the whole conversation (aggregated in SQL); `records`
+    supports keyset pagination (`limit` + `cursor` from X-Next-Cursor),
+    `fields` projection and `include_total` (X-Total-Count).
+
     Cost is computed dynamically from tokens using the pricing table.
     """
+    projection = parse_fields(fields, UsageRecordRead)
     conversation = db.get(models.Conversation, conversation_id)
     if conversation is None:
         raise HTTPException(
             status_code=404, detail="Conversation not found."
         )
 
-    records_db = (
-        db.query(models.UsageRecord)
+    keys = [
+        SortKey(models.UsageRecord.created_at, is_datetime=True),
+        SortKey(models.UsageRecord.id),
+    ]
+    records_db = paginate(
+        db.query(models.UsageRecord, *(key.expr for key in keys)).filter(
+            models.UsageRecord.conversation_id == conversation_id
+        ),
+        keys,
+        response,
+        cursor=cursor,
+        limit=limit,
+        include_total=include_total,
+    )
+
+    per_model = (
+        db.query(
+            models.UsageRecord.model,
+            func.count(models.UsageRecord.id),
+            func.sum(func.coalesce(models.UsageRecord.tokens_in, 0)),
+            func.sum(func.coalesce(models.UsageRecord.tokens_out, 0)),
+            func.sum(func.coalesce(models.UsageRecord.cached_tokens_in, 0)),
+        )
         .filter(models.UsageRecord.conversation_id == conversation_id)
-        .order_by(models.UsageRecord.created_at.asc())
+        .group_by(models.UsageRecord.model)
         .all()
     )
-    records: List[UsageRecordRead] = [
-        UsageRecordRead.model_validate(r) for r in records_db
-    ]
-
-    total_in = sum((r.tokens_in or 0) for r in records)
-    total_out = sum((r.tokens_out or 0) for r in records)
+    total_in = sum(int(tokens_in or 0) for _, _, tokens_in, _, _ in per_model)
+    total_out = sum(int(tokens_out or 0) for _, _, _, tokens_out, _ in per_model)
+    total_cached = sum(int(cached_in or 0) for _, _, _, _, cached_in in per_model)
 
     total_cost: Optional[float] = None
-    if records:
+    if per_model:
         running_cost = 0.0
-        for r in records:
+        for model_name, _, tokens_in, tokens_out, cached_in in per_model:
             try:
+                # Pricing is linear in tokens, so per-model sums price exactly
+                # like summing per-record estimates.
                 running_cost += estimate_call_cost(
-                    model=r.model,
-                    tokens_in=r.tokens_in or 0,
-                    tokens_out=r.tokens_out or 0,
+                    model=model_name,
+                    tokens_in=int(tokens_in or 0),
+                    tokens_out=int(tokens_out or 0),
+                    cached_tokens_in=int(cached_in or 0),
                 )
             except Exception as e:  # noqa: BLE001
                 print(
-                    f"[WARN] estimate_call_cost failed for record {r.id}: {e!r}"
+                    f"[WARN] estimate_call_cost failed for model {model_name!r}: {e!r}"
                 )
         total_cost = running_cost
 
+    if projection:
+        return JSONResponse(
+            content={
+                "conversation_id": conversation_id,
+                "total_tokens_in": total_in,
+                "total_tokens_out": total_out,
+                "total_cached_tokens_in": total_cached,
+                "total_cost_estimate": total_cost,
+                "records": project_rows(records_db, projection),
+            },
+            headers=pagination_headers(response),
+        )
+
     return ConversationUsageSummary(
         conversation_id=conversation_id,
         total_tokens_in=total_in,
         total_tokens_out=total_out,
+        total_cached_tokens_in=total_cached,
         total_cost_estimate=total_cost,
-        records=cast(List[UsageRecordRead], records),  # type: ignore[arg-type]
+        records=[UsageRecordRead.model_validate(r) for r in records_db],
+    )
+
+
+@app.get(
+    "/projects/{project_id}/usage",
+    response_model=ProjectUsageBreakdown,
+)
+def get_project_usage(
+    project_id: int,
+    group_by: str = "model",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    model: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Project usage totals broken down by model, day or conversation.
+
+    `start`/`end` are inclusive UTC days (YYYY-MM-DD); `model` narrows the
+    breakdown to one model. Served from the usage rollup table, so the cost
+    is proportional to the number of buckets, not usage records.
+    """
+    _ensure_project(db, project_id)
+    if group_by not in GROUP_BY_CHOICES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by must be one of: {', '.join(GROUP_BY_CHOICES)}",
+        )
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end.")
+    return usage_breakdown(
+        db, project_id, group_by=group_by, start=start, end=end, model=model
     )
 
 
+@app.post("/usage/recompute_costs")
+def recompute_costs(project_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Re-price stored usage records (all projects, or one) with the current
+    pricing registry, e.g. after changing IW_MODEL_PRICING.
+    """
+    if project_id is not None:
+        _ensure_project(db, project_id)
+    result = recompute_usage_costs(db, project_id=project_id)
+    db.commit()
+    return result
+
+
+@app.post("/vectors/reconcile")
+def run_vector_reconcile(
+    collection: Optional[List[str]] = Query(None),
+    dry_run: bool = False,
+    db: Session = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Diff vector collections against SQL: delete orphaned/stale vectors and
+    re-embed rows that have none. `dry_run=true` only reports the drift.
+    """
+    try:
+        return reconcile_vectors(db, collection, dry_run=dry_run)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except ReconcileInProgress as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+
+
+@app.get("/vectors/reconcile")
+def read_vector_reconcile() -> Dict[str, Any]:
+    """
+    Report of the last (non dry-run) reconcile pass, manual or scheduled.
+    """
+    return {"last_run": last_reconcile_report()}
+
+
+class VectorReindexRequest(BaseModel):
+    # Defaults: each collection's configured model/dimensions
+    # (IW_EMBEDDING_MODEL_<NAME>, else OPENAI_EMBEDDING_MODEL) and
+    # IW_VECTOR_PARTITIONING. `collections` limits which collections get the
+    # new spec; the others keep theirs.
+    model: Optional[str] = None
+    dimensions: Optional[int] = None
+    partitioning: Optional[Literal["project", "shared"]] = None
+    collections: Optional[List[str]] = None
+
+
+def _reindex_payload(db: Session) -> Dict[str, Any]:
+    return {"job": reindex_status(), "collections": vector_registry.describe(db)}
+
+
+@app.post("/vectors/reindex")
+def run_vector_reindex(
+    payload: VectorReindexRequest,
+    db: Session = Depends(get_db),
+) -> Dict[str, Any]:
+    """
+    Start re-embedding every vector collection with another model/dimension
+    or moving it to another layout. Writes are mirrored into the new
+    collections and reads stay on the old ones until the job swaps them in.
+    """
+    try:
+        specs = {}
+        for name in payload.collections or vector_registry.LOGICAL_NAMES:
+            configured = configured_embedding_spec(name)
+            specs[name] = embedding_spec(
+                payload.model or configured.model,
+                payload.dimensions if (payload.model or payload.dimensions) else configured.dimensions,
+            )
+        partitioned = None if payload.partitioning is None else payload.partitioning == "project"
+        start_reindex(lambda: SessionLocal(), specs, partitioned)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except ReindexInProgress as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return _reindex_payload(db)
+
+
+@app.get("/vectors/reindex")
+def read_vector_reindex(db: Session = Depends(get_db)) -> Dict[str, Any]:
+    """
+    Progress of the current/last re-index and every collection version with
+    its embedding model, dimension and layout.
+    """
+    return _reindex_payload(db)
+
+
 # ---------- Telemetry & diagnostics ----------
 
 
@@ -3348,9 +3712,47 @@ def read_telemetry(reset: bool = False) -> Dict[str, Any]:
         "tasks": task_snapshot,
         "ingestion": ingestion_snapshot,
         "retrieval": retrieval_snapshot,
+        "write_lane": get_write_lane_stats(reset=reset),
+        "pricing": {"unpriced_models": unpriced_models()},
+        "router": get_router_stats(reset=reset),
+        "budgets": get_budget_stats(reset=reset),
+        # Histogram percentiles are cumulative since start-up; see /metrics.
+        "latency": get_latency_summary(),
     }
 
 
+@app.get("/debug/traces")
+def read_traces(
+    limit: int = Query(20, ge=1, le=500),
+    name: Optional[str] = None,
+    min_duration_ms: float = Query(0.0, ge=0.0),
+) -> Dict[str, Any]:
+    """
+    Recent request traces (newest first) with per-stage spans.
+
+    Filter by root span `name` (e.g. "POST /chat") or a minimum duration.
+    """
+    return {"traces": recent_traces(limit=limit, name=name, min_duration_ms=min_duration_ms)}
+
+
+@app.get("/debug/traces/{trace_id}")
+def read_trace(trace_id: str) -> Dict[str, Any]:
+    trace = get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found (or evicted from the buffer).")
+    return trace
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics() -> PlainTextResponse:
+    """
+    Counters, gauges and latency histograms in Prometheus text format.
+    """
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 class SeedTaskActionPayload(BaseModel):
     project_id: int
     description: str
@@ -3693,12 +4095,16 @@ def ai_edit_project_file(
 
     # 3) Call OpenAI
     usage_info: Dict[str, object] = {}
-    edited_content = generate_reply_from_history(
-        messages,
-        model=payload.model,
-        mode=payload.mode or "code",
-        usage_out=usage_info,
-    )
+    try:
+        edited_content = generate_reply_from_history(
+            messages,
+            model=payload.model,
+            mode=payload.mode or "code",
+            usage_out=usage_info,
+            project_id=project.id,
+        )
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
 
     if not isinstance(edited_content, str):
         edited_content = str(edited_content)
@@ -3735,6 +4141,7 @@ def ai_edit_project_file(
                     model=model_name,
                     tokens_in=ti or 0,
                     tokens_out=to or 0,
+                    cached_tokens_in=_safe_int(usage_info.get("cached_tokens_in")) or 0,
                 )
         except Exception as e:  # noqa: BLE001
             print(
@@ -3748,9 +4155,10 @@ def ai_edit_project_file(
             model=model_name,
             tokens_in=ti,
             tokens_out=to,
+            cached_tokens_in=_safe_int(usage_info.get("cached_tokens_in")),
             cost_estimate=cost_estimate,
         )
-        db.add(usage_record)
+        record_usage(db, usage_record)
     except Exception as e:  # noqa: BLE001
         print(f"[WARN] Failed to create usage record for fs ai_edit: {e!r}")
 
@@ -3799,7 +4207,7 @@ def _run_ingestion_job(
             job.status = "running"
             job.started_at = datetime.now(timezone.utc)
             job.error_message = None
-            _commit_with_retry(session)
+            session.commit()
         try:
             ingest_repo_job(
                 db=session,
@@ -3811,7 +4219,7 @@ def _run_ingestion_job(
             if job.status in {None, "pending", "running"}:
                 job.status = "completed"
                 job.finished_at = datetime.now(timezone.utc)
-                _commit_with_retry(session)
+                session.commit()
         except Exception as exc:  # noqa: BLE001
             try:
                 session.refresh(job)
@@ -3821,7 +4229,7 @@ def _run_ingestion_job(
                 job.status = "failed"
                 job.error_message = str(exc)
                 job.finished_at = datetime.now(timezone.utc)
-                _commit_with_retry(session)
+                session.commit()
             print(f"[INGEST] Job {job_id} failed: {exc!r}")
     except Exception as exc:  # noqa: BLE001
         print(f"[INGEST] Unable to run job {job_id}: {exc!r}")
@@ -3880,14 +4288,14 @@ def create_ingestion_job_endpoint(
         },
     )
     db.add(job)
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(job)
 
     if payload.kind != "repo":
         job.status = "failed"
         job.error_message = f"Unsupported ingestion kind: {payload.kind}"
         job.finished_at = datetime.now(timezone.utc)
-        _commit_with_retry(db)
+        db.commit()
         db.refresh(job)
         return job
 
@@ -3896,12 +4304,12 @@ def create_ingestion_job_endpoint(
         job.status = "failed"
         job.error_message = f"Root path is not a directory: {payload.source}"
         job.finished_at = datetime.now(timezone.utc)
-        _commit_with_retry(db)
+        db.commit()
         db.refresh(job)
         return job
 
     job.source = str(source_path)
-    _commit_with_retry(db)
+    db.commit()
     _schedule_ingestion_job(
         background_tasks,
         job,
@@ -3962,7 +4370,7 @@ def cancel_ingestion_job_endpoint(
     if job.status not in {"pending", "running"}:
         raise HTTPException(status_code=400, detail="Job already finished.")
     job.cancel_requested = True
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(job)
     return job
 
@@ -3991,7 +4399,7 @@ def legacy_ingest(payload: dict, db: Session = Depends(get_db)):
         meta={"include_globs": include, "name_prefix": name_prefix},
     )
     db.add(job)
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(job)
     return job
 
@@ -4132,6 +4540,29 @@ def list_terminal_history(project_id: int, db: Session = Depends(get_db)):
 # ---------- Chat ----------
 
 
+def _routing_policy_for_project(db: Session, project: models.Project) -> RoutingPolicy:
+    """
+    Auto-mode routing constraints for a project, with today's spend taken
+    from the usage rollups.
+    """
+    spent_today = 0.0
+    if project.daily_budget_usd is not None:
+        spent_today = float(
+            db.query(func.coalesce(func.sum(models.UsageRollup.cost_estimate), 0.0))
+            .filter(
+                models.UsageRollup.project_id == project.id,
+                models.UsageRollup.day == datetime.utcnow().date(),
+            )
+            .scalar()
+            or 0.0
+        )
+    return RoutingPolicy(
+        latency_slo_ms=project.latency_slo_ms,
+        daily_budget_usd=project.daily_budget_usd,
+        spent_today_usd=spent_today,
+    )
+
+
 @app.post("/chat", response_model=ChatResponse)
 def chat(payload: ChatRequest, db: Session = Depends(get_db)):
     """
@@ -4146,6 +4577,8 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
         * create a new conversation under it.
     """
 
+    stages = StageTimer(CHAT_STAGE_LATENCY)
+
     # 1) Resolve or create conversation
     project: Optional[models.Project] = None
 
@@ -4207,6 +4640,13 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
     if conversation.folder_id:
         folder = db.get(models.ConversationFolder, conversation.folder_id)
 
+    stages.lap("resolve", conversation_id=conversation.id, project_id=project.id)
+    set_trace_attributes(
+        conversation_id=conversation.id,
+        project_id=project.id,
+        mode=payload.mode or "auto",
+    )
+
     # 2) Load existing messages for this conversation as history
     existing_messages = (
         db.query(models.Message)
@@ -4215,59 +4655,103 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
         .all()
     )
 
-    # 3) Save the new user message (but don't commit yet)
+    stages.lap("history", messages=len(existing_messages))
+
+    # 3) Stage the new user message. It is flushed together with the reply in
+    #    step 7 so no write transaction stays open across retrieval and the
+    #    model call.
     user_message = models.Message(
         conversation_id=conversation.id,
         role="user",
         content=payload.message,
     )
     db.add(user_message)
-    db.flush()  # ensures user_message gets an ID before we commit
 
     # 4) Retrieval: embed user message and pull relevant messages & docs
     retrieval_context_text = ""
+    retrieval_stats: Dict[str, int] = {}
     user_embedding = None
 
     try:
-        user_embedding = get_embedding(payload.message)
-
-        # 4a) Similar messages in this project's conversation
-        msg_results = query_similar_messages(
-            project_id=conversation.project_id,
-            query_embedding=user_embedding,
+        # Query vectors are embedded on first use, once per distinct spec, so
+        # docs/memory lookups served from the retrieval cache cost no call
+        # unless they share the messages spec. The messages vector is always
+        # needed: that collection changes every turn (a miss), and the user
+        # message is indexed with it (step 8).
+        query_vector = query_embedder(payload.message)
+        user_embedding = query_vector("messages")
+        stages.lap("embed_query")
+
+        # 4a) Similar messages in this project's conversation. Vector results
+        #     are cached per project index generation (app.vectorstore
+        #     .retrieval_cache); every turn adds messages, so in practice the
+        #     docs and memory lookups are the ones that repeat. Each source is
+        #     over-fetched; the context budgeter (4d) decides what is used.
+        limits = context_budget.env_limits()
+        n_fetch = context_budget.fetch_k(limits)
+        candidates: List[context_budget.Candidate] = []
+        msg_results = retrieval_cache.cached_query(
+            "messages",
+            conversation.project_id,
+            payload.message,
+            n_fetch,
+            lambda: query_similar_messages(
+                project_id=conversation.project_id,
+                query_embedding=user_embedding,
+                conversation_id=conversation.id,
+                folder_id=conversation.folder_id,
+                n_results=n_fetch,
+            ),
             conversation_id=conversation.id,
             folder_id=conversation.folder_id,
-            n_results=5,
         )
 
         msg_docs_nested = msg_results.get("documents", [[]])
         msg_metas_nested = msg_results.get("metadatas", [[]])
+        msg_dists_nested = msg_results.get("distances", [[]])
         msg_docs = msg_docs_nested[0] if msg_docs_nested else []
         msg_metas = msg_metas_nested[0] if msg_metas_nested else []
+        msg_dists = msg_dists_nested[0] if msg_dists_nested else []
         record_retrieval_event(surface="chat", kind="messages", hits=len(msg_docs))
+        stages.lap("retrieve_messages", hits=len(msg_docs))
 
-        msg_snippets: List[str] = []
-        for doc, meta in zip(msg_docs, msg_metas):
+        for doc, meta, dist in zip(msg_docs, msg_metas, msg_dists):
             role = meta.get("role", "unknown")
-            msg_snippets.append(f"[{role} message] {doc}")
+            candidates.append(
+                context_budget.Candidate("messages", f"[{role} message]", doc or "", float(dist))
+            )
 
         # 4b) Similar document chunks in this project
-        doc_results = query_similar_document_chunks(
-            project_id=conversation.project_id,
-            query_embedding=user_embedding,
+        doc_results = retrieval_cache.cached_query(
+            "docs",
+            conversation.project_id,
+            payload.message,
+            n_fetch,
+            lambda: query_similar_document_chunks(
+                project_id=conversation.project_id,
+                query_embedding=query_vector("docs"),
+                document_id=None,
+                n_results=n_fetch,
+            ),
             document_id=None,
-            n_results=5,
         )
 
+        doc_ids_nested = doc_results.get("ids", [[]])
         doc_docs_nested = doc_results.get("documents", [[]])
         doc_metas_nested = doc_results.get("metadatas", [[]])
+        doc_dists_nested = doc_results.get("distances", [[]])
+        doc_ids = doc_ids_nested[0] if doc_ids_nested else []
         doc_docs = doc_docs_nested[0] if doc_docs_nested else []
         doc_metas = doc_metas_nested[0] if doc_metas_nested else []
+        doc_dists = doc_dists_nested[0] if doc_dists_nested else []
+        # Copies of the same boilerplate should not crowd out distinct context.
+        _, doc_docs, doc_metas, doc_dists = collapse_duplicate_hits(
+            doc_ids, doc_docs, doc_metas, doc_dists
+        )
         record_retrieval_event(surface="chat", kind="docs", hits=len(doc_docs))
 
         # Resolve document titles for the retrieved chunks so responses can
         # surface doc names (not just ids).
-        doc_snippets: List[str] = []
         doc_id_set = {
             int(meta.get("document_id"))
             for meta in doc_metas
@@ -4282,36 +4766,38 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
             )
             doc_title_map = {d.id: (d.name or f"Document {d.id}") for d in docs}
 
-        for doc_text, meta in zip(doc_docs, doc_metas):
+        for doc_text, meta, dist in zip(doc_docs, doc_metas, doc_dists):
             document_id = meta.get("document_id")
             chunk_index = meta.get("chunk_index")
             title = doc_title_map.get(int(document_id)) if document_id is not None else None
             label = (
                 f"Document {document_id}" if title is None else f"Document {document_id} ({title})"
             )
-            doc_snippets.append(f"[{label}, chunk {chunk_index}] {doc_text}")
-
-        context_parts: List[str] = []
-        if msg_snippets:
-            context_parts.append(
-                "Relevant past messages:\n" + "\n\n".join(msg_snippets)
+            candidates.append(
+                context_budget.Candidate("docs", f"[{label}, chunk {chunk_index}]", doc_text or "", float(dist))
             )
-        if doc_snippets:
-            context_parts.append(
-                "Relevant document excerpts:\n" + "\n\n".join(doc_snippets)
-            )
-
-        memory_results = query_similar_memory_items(
-            project_id=conversation.project_id,
-            query_embedding=user_embedding,
-            n_results=5,
+        stages.lap("retrieve_docs", hits=len(doc_docs))
+
+        # 4c) Similar memory items (archived or expired ones are skipped)
+        memory_results = retrieval_cache.cached_query(
+            "memory_items",
+            conversation.project_id,
+            payload.message,
+            n_fetch,
+            lambda: query_similar_memory_items(
+                project_id=conversation.project_id,
+                query_embedding=query_vector("memory_items"),
+                n_results=n_fetch,
+            ),
         )
         mem_ids_nested = memory_results.get("ids", [[]])
         mem_docs_nested = memory_results.get("documents", [[]])
         mem_metas_nested = memory_results.get("metadatas", [[]])
+        mem_dists_nested = memory_results.get("distances", [[]])
         mem_ids = mem_ids_nested[0] if mem_ids_nested else []
         mem_docs = mem_docs_nested[0] if mem_docs_nested else []
         mem_metas = mem_metas_nested[0] if mem_metas_nested else []
+        mem_dists = mem_dists_nested[0] if mem_dists_nested else []
         record_retrieval_event(surface="chat", kind="memory", hits=len(mem_docs))
 
         mem_id_ints = [
@@ -4327,18 +4813,31 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
                 .all()
             }
 
-        memory_snippets: List[str] = []
-        for mid, doc in zip(mem_id_ints, mem_docs):
+        memory_hits = 0
+        for mid, doc, dist in zip(mem_id_ints, mem_docs, mem_dists):
             item = memory_items.get(mid)
             if not item:
                 continue
-            memory_snippets.append(f"[Memory: {item.title}] {doc}")
-
-        if memory_snippets:
-            context_parts.append(
-                "Relevant project memories:\n" + "\n\n".join(memory_snippets)
+            memory_hits += 1
+            candidates.append(
+                context_budget.Candidate("memory", f"[Memory: {item.title}]", doc or "", float(dist))
             )
-
+        stages.lap("retrieve_memory", hits=memory_hits)
+
+        # 4d) Long doc chunks are cut down to the spans that match the query,
+        #     then distance cutoffs, adaptive k, MMR and the token budget.
+        # Compression reuses the docs query vector only when it comes from
+        # its own local model; it never triggers a remote embedding call.
+        docs_spec = vector_registry.active("docs").spec
+        compression = context_compress.compress_candidates(
+            payload.message,
+            candidates,
+            limits,
+            query_vector("docs") if docs_spec.model == HASHED_NGRAM_MODEL else None,
+            docs_spec,
+        )
+        selection = context_budget.assemble(payload.message, candidates, limits)
+        context_parts = selection.sections()
         if context_parts:
             retrieval_context_text = (
                 "You have access to the following retrieved memory and document excerpts.\n"
@@ -4347,17 +4846,27 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
                 "follow the user.\n\n"
                 + "\n\n---\n\n".join(context_parts)
             )
+        retrieval_stats = {
+            **selection.stats,
+            "selected": len(selection.selected),
+            "tokens": selection.tokens,
+            "compressed": compression["compressed"],
+        }
 
     except Exception as e:  # noqa: BLE001
         # Retrieval should never break the chat flow
         print(f"[WARN] Retrieval failed: {e!r}")
         user_embedding = None
+    stages.lap("retrieval_context", chars=len(retrieval_context_text), **retrieval_stats)
 
-    # 5) Build the message list for OpenAI
-    chat_history: List[Dict[str, str]] = []
+    # 5) Build the message list for OpenAI. Segments are laid out stable
+    #    first so the provider's prompt cache can reuse the prefix across
+    #    turns (app.llm.prompt_layout).
+    layout = prompt_layout.PromptLayout()
 
     # System prompt to define behavior
-    chat_history.append(
+    layout.append(
+        "system",
         {
             "role": "system",
             "content": (
@@ -4460,7 +4969,8 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
                 "That folder is archived, so treat this thread as historical "
                 "context unless the user says otherwise. "
             )
-        chat_history.append(
+        layout.append(
+            "folder",
             {
                 "role": "system",
                 "content": folder_desc
@@ -4479,7 +4989,8 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
     if project.instruction_text:
         instructions = project.instruction_text.strip()
         if instructions:
-            chat_history.append(
+            layout.append(
+                "instructions",
                 {
                     "role": "system",
                     "content": (
@@ -4492,11 +5003,13 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
             )
 
     if pinned_memories:
+        # Id order: editing a pinned memory must not reshuffle the prefix.
         pinned_lines = "\n".join(
             f"- {item.title}: {item.content}"
-            for item in pinned_memories
+            for item in sorted(pinned_memories, key=lambda item: item.id)
         )
-        chat_history.append(
+        layout.append(
+            "pinned",
             {
                 "role": "system",
                 "content": (
@@ -4508,26 +5021,32 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
             }
         )
 
-    # Optional retrieval context as an additional system message
-    if retrieval_context_text:
-        chat_history.append(
-            {
-                "role": "system",
-                "content": retrieval_context_text,
-            }
-        )
-
     # Previous messages
     for m in existing_messages:
-        chat_history.append(
+        layout.append(
+            "history",
             {
                 "role": m.role,
                 "content": m.content,
-            }
+            },
+        )
+
+    # Optional retrieval context as an additional system message; it changes
+    # every turn, so it goes after the history.
+    if retrieval_context_text:
+        layout.append(
+            "retrieval",
+            {
+                "role": "system",
+                "content": retrieval_context_text,
+            },
         )
 
     # Current user message
-    chat_history.append({"role": "user", "content": payload.message})
+    layout.append("user", {"role": "user", "content": payload.message})
+    chat_history = layout.messages()
+
+    stages.lap("prompt", messages=len(chat_history), **layout.prefix_stats())
 
     # 6) Call OpenAI to generate a reply, capturing usage metadata if available
     usage_info: Dict[str, object] = {}
@@ -4537,7 +5056,11 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
             model=payload.model,
             mode=payload.mode or "auto",
             usage_out=usage_info,  # filled by openai_client if supported
+            routing=_routing_policy_for_project(db, project),
+            project_id=project.id,
         )
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:  # noqa: BLE001
         # If the chosen model is not available, attempt a safe fallback.
         msg = str(e).lower()
@@ -4547,6 +5070,7 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
                 model=None,
                 mode=payload.mode or "auto",
                 usage_out=usage_info,
+                project_id=project.id,
             )
         else:
             raise
@@ -4564,6 +5088,13 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
         if "mode" in raw_reply and not payload.mode:
             usage_info["mode"] = raw_reply["mode"]
 
+    stages.lap(
+        "llm",
+        model=usage_info.get("model") or chosen_model,
+        tokens_in=_safe_int(usage_info.get("tokens_in")),
+        tokens_out=_safe_int(usage_info.get("tokens_out")),
+    )
+
     # 6b) Look for any AI_FILE_EDIT blocks in the reply and strip them from the visible text
     clean_reply_text, file_edit_requests = _extract_ai_file_edits(raw_reply_text)
     reply_text = clean_reply_text or raw_reply_text
@@ -4575,7 +5106,8 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
         content=reply_text,
     )
     db.add(assistant_message)
-    db.flush()  # ensure assistant_message.id exists
+    db.commit()  # persist the exchange; both messages now have ids
+    stages.lap("persist")
 
     # 7b) If the model requested AI file edits, run them now (best-effort)
     project_root = None
@@ -4628,6 +5160,8 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
                     f"{file_path!r}: {e!r}"
                 )
 
+    stages.lap("file_edits", requested=len(file_edit_requests))
+
     # 8) Create embeddings and index in Chroma
     try:
         # Reuse user embedding if we have it, otherwise compute now
@@ -4659,14 +5193,16 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
         # Do not fail the request if indexing fails
         print(f"[WARN] Failed to index messages in Chroma: {e!r}")
 
-    # 9) Persist an approximate usage record (best-effort)
-    try:
-        model_name = str(
-            usage_info.get("model")
-            or chosen_model
-            or (payload.model or (payload.mode or "auto"))
-        )
+    stages.lap("index")
 
+    # 9) Persist an approximate usage record (best-effort). It is an
+    #    independent write unit, group-committed with other pending ones.
+    model_name = str(
+        usage_info.get("model")
+        or chosen_model
+        or (payload.model or (payload.mode or "auto"))
+    )
+    try:
         tokens_in = usage_info.get("tokens_in")
         tokens_out = usage_info.get("tokens_out")
 
@@ -4680,6 +5216,7 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
                     model=model_name,
                     tokens_in=ti or 0,
                     tokens_out=to or 0,
+                    cached_tokens_in=_safe_int(usage_info.get("cached_tokens_in")) or 0,
                 )
         except Exception as e:  # noqa: BLE001
             print(
@@ -4693,18 +5230,23 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
             model=model_name,
             tokens_in=ti,
             tokens_out=to,
+            cached_tokens_in=_safe_int(usage_info.get("cached_tokens_in")),
             cost_estimate=cost_estimate,
         )
-        db.add(usage_record)
+        run_write(lambda session: record_usage(session, usage_record), session=db)
     except Exception as e:  # noqa: BLE001
         print(f"[WARN] Failed to create usage record: {e!r}")
 
+    stages.lap("usage")
+
     # 10) Auto‑title the conversation (best‑effort, doesn't block)
     try:
         auto_title_conversation(db, conversation)
     except Exception as e:  # noqa: BLE001
         print(f"[WARN] auto_title_conversation outer failed: {e!r}")
 
+    stages.lap("auto_title")
+
     # 11) AI‑assist the project TODO list (best‑effort, doesn't block)
     if _AUTO_UPDATE_TASKS_AFTER_CHAT:
         ok, err = _run_auto_update_with_retry(
@@ -4720,13 +5262,16 @@ def chat(payload: ChatRequest, db: Session = Depends(get_db)):
             "[Tasks] Skipping auto-update after chat "
             "(AUTO_UPDATE_TASKS_AFTER_CHAT disabled)."
         )
+    stages.lap("auto_tasks")
     try:
         auto_capture_decisions_from_conversation(db, conversation)
     except Exception as e:  # noqa: BLE001
         print(f"[WARN] auto_capture_decisions_from_conversation failed: {e!r}")
+    stages.lap("auto_decisions")
 
     # 12) Commit everything
     db.commit()
+    stages.lap("commit")
 
     return ChatResponse(
         conversation_id=conversation.id,
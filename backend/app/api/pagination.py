@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Type
+
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+
+# Keyset ("cursor") pagination shared by the list endpoints.
+#
+# List endpoints keep returning a plain JSON array. Pagination metadata rides
+# in headers so existing clients that ignore them keep working:
+#   X-Next-Cursor  - opaque cursor for the next page (absent on the last page)
+#   X-Total-Count  - total matching rows, only when include_total=true
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+MAX_PAGE_SIZE = 1000
+
+
+@dataclass(frozen=True)
+class SortKey:
+    """
+    One ORDER BY term. `expr` must also be selected by the query (see
+    paginate) so the cursor can be built from the last row; `is_datetime`
+    round-trips values through ISO strings.
+    """
+
+    expr: Any
+    descending: bool = False
+    is_datetime: bool = False
+
+    def order_by(self):
+        return self.expr.desc() if self.descending else self.expr.asc()
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(
+        [v.isoformat() if isinstance(v, datetime) else v for v in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, keys: Sequence[SortKey]) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("cursor shape mismatch")
+        return [
+            datetime.fromisoformat(v) if key.is_datetime and v is not None else v
+            for key, v in zip(keys, values)
+        ]
+    except (ValueError, TypeError, json.JSONDecodeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor.") from exc
+
+
+def keyset_after(keys: Sequence[SortKey], values: Sequence[Any]):
+    """
+    Rows strictly after `values` in the (mixed-direction) key order:
+    (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+    """
+    clauses = []
+    for i, key in enumerate(keys):
+        prefix = [keys[j].expr == values[j] for j in range(i)]
+        step = key.expr < values[i] if key.descending else key.expr > values[i]
+        clauses.append(and_(*prefix, step))
+    return or_(*clauses)
+
+
+def check_limit(limit: Optional[int]) -> Optional[int]:
+    if limit is None:
+        return None
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit must be between 1 and {MAX_PAGE_SIZE}.",
+        )
+    return limit
+
+
+def paginate(
+    query: Query,
+    keys: Sequence[SortKey],
+    response: Response,
+    *,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    include_total: bool = False,
+) -> List[Any]:
+    """
+    Apply keyset pagination to an ORM query whose first entity is the row
+    model and whose remaining columns are the sort key expressions.
+
+    Returns the page of row objects and sets the pagination headers.
+    """
+    limit = check_limit(limit)
+    if include_total:
+        response.headers[TOTAL_COUNT_HEADER] = str(query.order_by(None).count())
+    if cursor:
+        query = query.filter(keyset_after(keys, decode_cursor(cursor, keys)))
+    query = query.order_by(*(key.order_by() for key in keys))
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = query.all()
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(list(rows[-1])[1:])
+    return [row[0] for row in rows]
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[Set[str]]:
+    """
+    Parse a comma-separated `fields` projection and validate it against the
+    read model. Returns None when no projection was requested.
+    """
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}.",
+        )
+    return requested
+
+
+def project_rows(items: Iterable[Any], fields: Set[str]) -> List[Dict[str, Any]]:
+    """
+    Serialize only the requested fields, skipping per-row response_model
+    validation.
+    """
+    payload: List[Dict[str, Any]] = []
+    for item in items:
+        if isinstance(item, BaseModel):
+            payload.append(item.model_dump(include=fields, mode="json"))
+        else:
+            payload.append(
+                jsonable_encoder({field: getattr(item, field, None) for field in fields})
+            )
+    return payload
+
+
+def pagination_headers(response: Response) -> Dict[str, str]:
+    wanted = {NEXT_CURSOR_HEADER.lower(), TOTAL_COUNT_HEADER.lower()}
+    return {key: value for key, value in response.headers.items() if key.lower() in wanted}
+
+
+def project_items(
+    items: Iterable[Any], fields: Set[str], response: Response
+) -> JSONResponse:
+    """
+    JSON array of projected rows, carrying over any pagination headers.
+    """
+    return JSONResponse(content=project_rows(items, fields), headers=pagination_headers(response))
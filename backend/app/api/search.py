@@ -8,7 +8,9 @@ from sqlalchemy.orm import Session
 
 from app.db.session import get_db
 from app.db import models
+from app.ingestion.chunk_dedupe import collapse_duplicate_hits
 from app.llm.embeddings import get_embedding
+from app.vectorstore import retrieval_cache
 from app.vectorstore.chroma_store import (
     query_similar_messages,
     query_similar_document_chunks,
@@ -103,16 +105,22 @@ def search_messages(
                 detail="Conversation folder not found for this project.",
             )
 
-    # 3) Create embedding for the query
-    query_emb = get_embedding(payload.query)
-
-    # 4) Query Chroma
-    results = query_similar_messages(
-        project_id=payload.project_id,
-        query_embedding=query_emb,
+    # 3) Embed the query and query Chroma; repeated queries are served from
+    #    the retrieval cache until the project's messages change.
+    results = retrieval_cache.cached_query(
+        "messages",
+        payload.project_id,
+        payload.query,
+        payload.limit,
+        lambda: query_similar_messages(
+            project_id=payload.project_id,
+            query_embedding=get_embedding(payload.query),
+            conversation_id=payload.conversation_id,
+            folder_id=payload.folder_id,
+            n_results=payload.limit,
+        ),
         conversation_id=payload.conversation_id,
         folder_id=payload.folder_id,
-        n_results=payload.limit,
     )
 
     # Chroma response structure:
@@ -209,6 +217,8 @@ class DocSearchHit(BaseModel):
     chunk_index: int
     content: str
     distance: float
+    # Other documents holding (near-)identical copies of this chunk.
+    duplicate_document_ids: List[int] = []
 
 
 class DocSearchResponse(BaseModel):
@@ -246,15 +256,39 @@ def search_docs(
                 detail="Document does not belong to the given project.",
             )
 
-    # 3) Create embedding for the query
-    query_emb = get_embedding(payload.query)
-
-    # 4) Query Chroma
-    results = query_similar_document_chunks(
-        project_id=payload.project_id,
-        query_embedding=query_emb,
+    # 2b) Duplicate chunks have no vector of their own; a document-scoped
+    #     search targets the canonical chunks of the document's duplicates
+    #     (which live under other documents) by chunk id.
+    scoped_chunk_ids: Optional[List[int]] = None
+    local_chunks: Dict[int, models.DocumentChunk] = {}
+    if payload.document_id is not None:
+        chunks = (
+            db.query(models.DocumentChunk)
+            .filter(models.DocumentChunk.document_id == payload.document_id)
+            .order_by(models.DocumentChunk.index.asc(), models.DocumentChunk.id.asc())
+            .all()
+        )
+        if any(chunk.duplicate_of_id is not None for chunk in chunks):
+            for chunk in chunks:
+                local_chunks.setdefault(chunk.duplicate_of_id or chunk.id, chunk)
+            scoped_chunk_ids = sorted(local_chunks)
+
+    # 3) Embed the query and query Chroma (cached like messages).
+    # Over-fetch a little so collapsing duplicate hits still fills the page.
+    n_results = min(payload.limit * 2, payload.limit + 20)
+    results = retrieval_cache.cached_query(
+        "docs",
+        payload.project_id,
+        payload.query,
+        n_results,
+        lambda: query_similar_document_chunks(
+            project_id=payload.project_id,
+            query_embedding=get_embedding(payload.query, collection="docs"),
+            document_id=payload.document_id if scoped_chunk_ids is None else None,
+            n_results=n_results,
+            chunk_ids=scoped_chunk_ids,
+        ),
         document_id=payload.document_id,
-        n_results=payload.limit,
     )
 
     ids_nested = results.get("ids", [[]])
@@ -267,18 +301,48 @@ def search_docs(
     metas = metas_nested[0] if metas_nested else []
     dists = dists_nested[0] if dists_nested else []
 
+    ids, docs, metas, dists = collapse_duplicate_hits(
+        ids, docs, metas, dists, limit=payload.limit
+    )
+
+    # Duplicate chunks share their canonical chunk's vector; surface the
+    # documents they live in without returning them as separate hits.
+    chunk_ids = [int(meta["chunk_id"]) for meta in metas]
+    duplicate_docs: Dict[int, List[int]] = {}
+    if chunk_ids:
+        rows = (
+            db.query(
+                models.DocumentChunk.duplicate_of_id,
+                models.DocumentChunk.document_id,
+            )
+            .filter(models.DocumentChunk.duplicate_of_id.in_(chunk_ids))
+            .distinct()
+            .all()
+        )
+        for canonical_id, document_id in rows:
+            duplicate_docs.setdefault(int(canonical_id), []).append(int(document_id))
+
     hits: List[DocSearchHit] = []
 
     for _id, doc, meta, dist in zip(ids, docs, metas, dists):
         # meta contains: document_id, project_id, chunk_id, chunk_index
+        canonical_id = int(meta["chunk_id"])
+        holders = set(duplicate_docs.get(canonical_id, []))
+        holders.add(int(meta["document_id"]))
+        local = local_chunks.get(canonical_id)
+        # Scoped hits are reported as the requested document's own chunk.
+        chunk_id = local.id if local is not None else canonical_id
+        document_id = local.document_id if local is not None else int(meta["document_id"])
+        chunk_index = local.index if local is not None else int(meta["chunk_index"])
         hits.append(
             DocSearchHit(
-                chunk_id=int(meta["chunk_id"]),
-                document_id=int(meta["document_id"]),
+                chunk_id=chunk_id,
+                document_id=document_id,
                 project_id=int(meta["project_id"]),
-                chunk_index=int(meta["chunk_index"]),
+                chunk_index=chunk_index,
                 content=doc,
                 distance=float(dist),
+                duplicate_document_ids=sorted(d for d in holders if d != document_id),
             )
         )
 
@@ -344,11 +408,16 @@ def search_memory(
     if project is None:
         raise HTTPException(status_code=404, detail="Project not found.")
 
-    query_emb = get_embedding(payload.query)
-    results = query_similar_memory_items(
-        project_id=payload.project_id,
-        query_embedding=query_emb,
-        n_results=payload.limit,
+    results = retrieval_cache.cached_query(
+        "memory_items",
+        payload.project_id,
+        payload.query,
+        payload.limit,
+        lambda: query_similar_memory_items(
+            project_id=payload.project_id,
+            query_embedding=get_embedding(payload.query, collection="memory_items"),
+            n_results=payload.limit,
+        ),
     )
 
     ids_nested = results.get("ids", [[]])
@@ -0,0 +1,473 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    JSON,
+    MetaData,
+    String,
+    Table,
+    Text,
+    UniqueConstraint,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from . import models  # noqa: F401  (registers every table on Base.metadata)
+from .base import Base
+
+# Single-column indexes superseded by the composite indexes migration 2 adds.
+OBSOLETE_INDEXES = (
+    "ix_messages_conversation_id",
+    "ix_tasks_project_id",
+    "ix_task_suggestions_project_id",
+    "ix_usage_records_conversation_id",
+    "ix_memory_items_project_id",
+)
+
+
+# ---------------------------------------------------------------------------
+# Versioned migrations
+# ---------------------------------------------------------------------------
+#
+# Each migration runs once per database, in order, and records its version in
+# the one-row schema_version table. Migrations must be idempotent: two workers
+# starting against the same fresh database may both apply them.
+#
+# Migrations are frozen: each one, the baseline included, spells out its own
+# DDL and data SQL below instead of reading app.db.models, so replaying it
+# against a database pinned at an older version does what it did when it
+# shipped. A model change therefore needs a new migration. A database with no
+# tables is created from the models in one step and stamped with the latest
+# version.
+
+_version_metadata = MetaData()
+schema_version_table = Table(
+    "schema_version",
+    _version_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("version", Integer, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str) -> None:
+    inspector = inspect(conn)
+    if table not in inspector.get_table_names():
+        return
+    if column in {col["name"] for col in inspector.get_columns(table)}:
+        return
+    conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl}'))
+
+
+def _create_index(conn: Connection, name: str, table: str, *columns: str) -> None:
+    quoted = ", ".join(f'"{column}"' for column in columns)
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({quoted})'))
+
+
+# The version 1 schema as it shipped, including the single-column indexes
+# migration 2 replaces.
+_baseline_v1 = MetaData()
+Table(
+    "projects",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(255), index=True, unique=True, nullable=False),
+    Column("description", Text),
+    Column("local_root_path", String(1024)),
+    Column("instruction_text", Text),
+    Column("instruction_updated_at", DateTime),
+    Column("pinned_note_text", Text),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+Table(
+    "conversation_folders",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("name", String(255), nullable=False),
+    Column("color", String(32)),
+    Column("sort_order", Integer, nullable=False),
+    Column("is_default", Boolean, nullable=False),
+    Column("is_archived", Boolean, nullable=False),
+    Column("created_at", DateTime, index=True, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+Table(
+    "documents",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("name", String(255), index=True, nullable=False),
+    Column("description", Text),
+    Column("created_at", DateTime, nullable=False),
+)
+Table(
+    "file_ingestion_state",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("relative_path", String(512), nullable=False),
+    Column("sha256", String(64), nullable=False),
+    Column("last_ingested_at", DateTime, nullable=False),
+    UniqueConstraint("project_id", "relative_path", name="uq_file_ingestion_state_project_path"),
+)
+Table(
+    "ingestion_jobs",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("kind", String(32), nullable=False),
+    Column("source", Text, nullable=False),
+    Column("status", String(32), index=True, nullable=False),
+    Column("total_items", Integer, nullable=False),
+    Column("processed_items", Integer, nullable=False),
+    Column("error_message", Text),
+    Column("meta", JSON),
+    Column("cancel_requested", Boolean, nullable=False),
+    Column("total_bytes", Integer, nullable=False),
+    Column("processed_bytes", Integer, nullable=False),
+    Column("started_at", DateTime),
+    Column("finished_at", DateTime),
+    Column("created_at", DateTime, index=True, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+Table(
+    "tasks",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("description", Text, nullable=False),
+    Column("status", String(20), nullable=False),
+    Column("priority", String(20), nullable=False),
+    Column("blocked_reason", Text),
+    Column("auto_notes", Text),
+    Column("created_at", DateTime, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+Table(
+    "conversations",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("title", String(255)),
+    Column("folder_id", Integer, ForeignKey("conversation_folders.id"), index=True),
+    Column("created_at", DateTime, nullable=False),
+)
+Table(
+    "document_sections",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("document_id", Integer, ForeignKey("documents.id"), index=True, nullable=False),
+    Column("title", String(255)),
+    Column("index", Integer, nullable=False),
+    Column("path", String(1024)),
+)
+Table(
+    "document_chunks",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("document_id", Integer, ForeignKey("documents.id"), index=True, nullable=False),
+    Column("section_id", Integer, ForeignKey("document_sections.id")),
+    Column("index", Integer, nullable=False),
+    Column("content", Text, nullable=False),
+)
+Table(
+    "messages",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("conversation_id", Integer, ForeignKey("conversations.id"), index=True, nullable=False),
+    Column("role", String(50), nullable=False),
+    Column("content", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+)
+Table(
+    "project_decisions",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("title", String(255), nullable=False),
+    Column("details", Text),
+    Column("category", String(100)),
+    Column("status", String(50), nullable=False),
+    Column("tags_raw", Text),
+    Column("source_conversation_id", Integer, ForeignKey("conversations.id"), index=True),
+    Column("follow_up_task_id", Integer, ForeignKey("tasks.id")),
+    Column("is_draft", Boolean, nullable=False),
+    Column("auto_detected", Boolean, nullable=False),
+    Column("created_at", DateTime, index=True, nullable=False),
+    Column("updated_at", DateTime, index=True, nullable=False),
+)
+Table(
+    "task_suggestions",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("conversation_id", Integer, ForeignKey("conversations.id"), index=True),
+    Column("target_task_id", Integer, ForeignKey("tasks.id"), index=True),
+    Column("action_type", String(32), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("confidence", Float, nullable=False),
+    Column("status", String(20), index=True, nullable=False),
+    Column("created_at", DateTime, index=True, nullable=False),
+    Column("updated_at", DateTime, index=True, nullable=False),
+)
+Table(
+    "memory_items",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("title", String(255), nullable=False),
+    Column("content", Text, nullable=False),
+    Column("tags_raw", Text),
+    Column("pinned", Boolean, nullable=False),
+    Column("expires_at", DateTime),
+    Column("source_conversation_id", Integer, ForeignKey("conversations.id"), index=True),
+    Column("source_message_id", Integer, ForeignKey("messages.id"), index=True),
+    Column("superseded_by_id", Integer, ForeignKey("memory_items.id")),
+    Column("created_at", DateTime, index=True, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+Table(
+    "usage_records",
+    _baseline_v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True, nullable=False),
+    Column("conversation_id", Integer, ForeignKey("conversations.id"), index=True),
+    Column("message_id", Integer, ForeignKey("messages.id"), index=True),
+    Column("model", String(255), nullable=False),
+    Column("tokens_in", Integer),
+    Column("tokens_out", Integer),
+    Column("cost_estimate", Float),
+    Column("created_at", DateTime, index=True, nullable=False),
+)
+
+
+def _baseline(conn: Connection) -> None:
+    # Databases created before versioning only gain the tables they are
+    # missing.
+    _baseline_v1.create_all(bind=conn)
+
+
+def _dedupe_columns_and_hot_path_indexes(conn: Connection) -> None:
+    _add_column(conn, "document_chunks", "content_hash", "VARCHAR(64)")
+    _add_column(conn, "document_chunks", "simhash", "BIGINT")
+    _add_column(conn, "document_chunks", "duplicate_of_id", "INTEGER")
+    _create_index(conn, "ix_document_chunks_content_hash", "document_chunks", "content_hash")
+    _create_index(conn, "ix_document_chunks_duplicate_of_id", "document_chunks", "duplicate_of_id")
+    _create_index(conn, "ix_messages_conversation_id_id", "messages", "conversation_id", "id")
+    _create_index(
+        conn, "ix_tasks_project_id_status_updated_at", "tasks", "project_id", "status", "updated_at"
+    )
+    _create_index(
+        conn,
+        "ix_task_suggestions_project_id_action_type_status",
+        "task_suggestions",
+        "project_id",
+        "action_type",
+        "status",
+    )
+    _create_index(
+        conn,
+        "ix_usage_records_conversation_id_created_at",
+        "usage_records",
+        "conversation_id",
+        "created_at",
+    )
+    _create_index(
+        conn,
+        "ix_memory_items_project_id_superseded_by_id_expires_at",
+        "memory_items",
+        "project_id",
+        "superseded_by_id",
+        "expires_at",
+    )
+    for name in OBSOLETE_INDEXES:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+
+
+# Tables as their migration created them.
+_frozen_metadata = MetaData()
+Table("projects", _frozen_metadata, Column("id", Integer, primary_key=True))
+_usage_rollups_v3 = Table(
+    "usage_rollups",
+    _frozen_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, ForeignKey("projects.id"), nullable=False),
+    Column("conversation_id", Integer, nullable=False),
+    Column("model", String(255), nullable=False),
+    Column("day", Date, nullable=False),
+    Column("calls", Integer, nullable=False),
+    Column("tokens_in", BigInteger, nullable=False),
+    Column("tokens_out", BigInteger, nullable=False),
+    Column("cost_estimate", Float, nullable=False),
+    UniqueConstraint("project_id", "conversation_id", "model", "day", name="uq_usage_rollups_bucket"),
+    Index("ix_usage_rollups_project_id_day", "project_id", "day"),
+)
+_llm_budget_checkpoints_v5 = Table(
+    "llm_budget_checkpoints",
+    _frozen_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("project_id", Integer, nullable=False),
+    Column("mode", String(32), nullable=False),
+    Column("day", Date, nullable=False),
+    Column("tokens", BigInteger, nullable=False),
+    Column("cost_usd", Float, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+    UniqueConstraint("project_id", "mode", "day", name="uq_llm_budget_checkpoints_key"),
+)
+_vector_collections_v6 = Table(
+    "vector_collections",
+    _frozen_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(64), index=True, nullable=False),
+    Column("physical_name", String(128), unique=True, nullable=False),
+    Column("embedding_model", String(128), nullable=False),
+    Column("dimensions", Integer, nullable=True),
+    Column("state", String(16), index=True, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("activated_at", DateTime, nullable=True),
+)
+
+
+def _backfill_usage_rollups(conn: Connection, *, cached_tokens: bool) -> None:
+    cached_column = ", cached_tokens_in" if cached_tokens else ""
+    cached_sum = ", SUM(COALESCE(cached_tokens_in, 0))" if cached_tokens else ""
+    conn.execute(text("DELETE FROM usage_rollups"))
+    conn.execute(
+        text(
+            "INSERT INTO usage_rollups (project_id, conversation_id, model, day, calls, "
+            f"tokens_in, tokens_out{cached_column}, cost_estimate) "
+            "SELECT project_id, COALESCE(conversation_id, 0), model, DATE(created_at), COUNT(id), "
+            f"SUM(COALESCE(tokens_in, 0)), SUM(COALESCE(tokens_out, 0)){cached_sum}, "
+            "SUM(COALESCE(cost_estimate, 0.0)) FROM usage_records "
+            "GROUP BY project_id, COALESCE(conversation_id, 0), model, DATE(created_at)"
+        )
+    )
+
+
+def _usage_rollups(conn: Connection) -> None:
+    # Creates usage_rollups and backfills it from the existing usage records.
+    _usage_rollups_v3.create(bind=conn, checkfirst=True)
+    _backfill_usage_rollups(conn, cached_tokens=False)
+
+
+def _project_routing_policy(conn: Connection) -> None:
+    _add_column(conn, "projects", "latency_slo_ms", "INTEGER")
+    _add_column(conn, "projects", "daily_budget_usd", "FLOAT")
+
+
+def _llm_budget_checkpoints(conn: Connection) -> None:
+    _llm_budget_checkpoints_v5.create(bind=conn, checkfirst=True)
+
+
+def _vector_collections(conn: Connection) -> None:
+    _vector_collections_v6.create(bind=conn, checkfirst=True)
+
+
+def _vector_collection_partitions(conn: Connection) -> None:
+    # NULL reads as the shared layout.
+    _add_column(conn, "vector_collections", "partitioned", "BOOLEAN")
+
+
+def _usage_cached_tokens(conn: Connection) -> None:
+    # The backfill fills the new rollup column (older records count as uncached).
+    _add_column(conn, "usage_records", "cached_tokens_in", "INTEGER")
+    _add_column(conn, "usage_rollups", "cached_tokens_in", "BIGINT DEFAULT 0")
+    _backfill_usage_rollups(conn, cached_tokens=True)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", _baseline),
+    Migration(2, "dedupe_columns_and_hot_path_indexes", _dedupe_columns_and_hot_path_indexes),
+    Migration(3, "usage_rollups", _usage_rollups),
+    Migration(4, "project_routing_policy", _project_routing_policy),
+    Migration(5, "llm_budget_checkpoints", _llm_budget_checkpoints),
+    Migration(6, "vector_collections", _vector_collections),
+    Migration(7, "vector_collection_partitions", _vector_collection_partitions),
+    Migration(8, "usage_cached_tokens", _usage_cached_tokens),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(conn: Connection) -> int:
+    """
+    Read the applied schema version (0 for databases that predate versioning).
+    """
+    try:
+        version = conn.execute(
+            select(schema_version_table.c.version).where(schema_version_table.c.id == 1)
+        ).scalar()
+    except (OperationalError, ProgrammingError):
+        conn.rollback()
+        return 0
+    return int(version or 0)
+
+
+def _set_version(conn: Connection, version: int) -> None:
+    values = {"version": version, "applied_at": datetime.utcnow()}
+    updated = conn.execute(
+        schema_version_table.update().where(schema_version_table.c.id == 1).values(**values)
+    )
+    if updated.rowcount == 0:
+        conn.execute(schema_version_table.insert().values(id=1, **values))
+
+
+def _is_empty(conn: Connection) -> bool:
+    return not set(inspect(conn).get_table_names()) & set(Base.metadata.tables)
+
+
+def run_migrations(engine: Engine, target: Optional[int] = None) -> int:
+    """
+    Apply pending migrations (up to `target`, default the latest) and return
+    the resulting schema version.
+
+    An up-to-date database costs a single read of schema_version.
+    """
+    target = LATEST_VERSION if target is None else target
+    with engine.connect() as conn:
+        version = current_version(conn)
+        fresh = version == 0 and target == LATEST_VERSION and _is_empty(conn)
+    if version >= target:
+        return version
+
+    if fresh:
+        with engine.begin() as conn:
+            _version_metadata.create_all(bind=conn)
+            Base.metadata.create_all(bind=conn)
+            _set_version(conn, LATEST_VERSION)
+        print(f"[INFO] Created schema at version {LATEST_VERSION:04d}")
+        return LATEST_VERSION
+
+    for migration in MIGRATIONS:
+        if migration.version <= version or migration.version > target:
+            continue
+        with engine.begin() as conn:
+            _version_metadata.create_all(bind=conn)
+            migration.apply(conn)
+            _set_version(conn, migration.version)
+        print(f"[INFO] Applied schema migration {migration.version:04d} ({migration.name})")
+        version = migration.version
+    return version
@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Optional
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
+    Date,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
@@ -38,6 +41,9 @@ class Project(Base):
     pinned_note_text: Mapped[Optional[str]] = mapped_column(
         Text, nullable=True
     )
+    # Auto-mode routing constraints (app.llm.router); NULL = unconstrained.
+    latency_slo_ms: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    daily_budget_usd: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.utcnow
     )
@@ -57,6 +63,9 @@ class Project(Base):
     usage_records: Mapped[List["UsageRecord"]] = relationship(
         "UsageRecord", back_populates="project", cascade="all, delete-orphan"
     )
+    usage_rollups: Mapped[List["UsageRollup"]] = relationship(
+        "UsageRollup", back_populates="project", cascade="all, delete-orphan"
+    )
     decisions: Mapped[List["ProjectDecision"]] = relationship(
         "ProjectDecision",
         back_populates="project",
@@ -120,10 +129,14 @@ class Conversation(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # History loads: WHERE conversation_id = ? ORDER BY id
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     conversation_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("conversations.id"), index=True
+        Integer, ForeignKey("conversations.id")
     )
     # "user" | "assistant" | "system"
     role: Mapped[str] = mapped_column(String(50))
@@ -210,6 +223,16 @@ class DocumentChunk(Base):
     # Order of this chunk within its section or document
     index: Mapped[int] = mapped_column(Integer, default=0)
     content: Mapped[str] = mapped_column(Text)
+    # Fingerprints used for exact / near-duplicate suppression
+    # (see app.ingestion.chunk_dedupe). simhash is stored as a signed 64-bit int.
+    content_hash: Mapped[Optional[str]] = mapped_column(
+        String(64), nullable=True, index=True
+    )
+    simhash: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    # Set on duplicates: the canonical chunk whose embedding/vector they share.
+    duplicate_of_id: Mapped[Optional[int]] = mapped_column(
+        Integer, ForeignKey("document_chunks.id"), nullable=True, index=True
+    )
 
     document: Mapped["Document"] = relationship(
         "Document", back_populates="chunks"
@@ -217,14 +240,21 @@ class DocumentChunk(Base):
     section: Mapped[Optional["DocumentSection"]] = relationship(
         "DocumentSection", back_populates="chunks"
     )
+    duplicate_of: Mapped[Optional["DocumentChunk"]] = relationship(
+        "DocumentChunk", remote_side=[id]
+    )
 
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        # Open-task lookups: WHERE project_id = ? AND status = ? ORDER BY updated_at
+        Index("ix_tasks_project_id_status_updated_at", "project_id", "status", "updated_at"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     project_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("projects.id"), index=True
+        Integer, ForeignKey("projects.id")
     )
     description: Mapped[str] = mapped_column(Text)
     status: Mapped[str] = mapped_column(String(20), default="open")
@@ -245,10 +275,18 @@ class Task(Base):
 
 class TaskSuggestion(Base):
     __tablename__ = "task_suggestions"
+    __table_args__ = (
+        Index(
+            "ix_task_suggestions_project_id_action_type_status",
+            "project_id",
+            "action_type",
+            "status",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     project_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("projects.id"), index=True
+        Integer, ForeignKey("projects.id")
     )
     conversation_id: Mapped[Optional[int]] = mapped_column(
         Integer, ForeignKey("conversations.id"), nullable=True, index=True
@@ -274,13 +312,21 @@ class TaskSuggestion(Base):
 
 class UsageRecord(Base):
     __tablename__ = "usage_records"
+    __table_args__ = (
+        # Per-conversation usage: WHERE conversation_id = ? ORDER BY created_at
+        Index(
+            "ix_usage_records_conversation_id_created_at",
+            "conversation_id",
+            "created_at",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     project_id: Mapped[int] = mapped_column(
         Integer, ForeignKey("projects.id"), index=True
     )
     conversation_id: Mapped[Optional[int]] = mapped_column(
-        Integer, ForeignKey("conversations.id"), nullable=True, index=True
+        Integer, ForeignKey("conversations.id"), nullable=True
     )
     message_id: Mapped[Optional[int]] = mapped_column(
         Integer, ForeignKey("messages.id"), nullable=True, index=True
@@ -288,6 +334,8 @@ class UsageRecord(Base):
     model: Mapped[str] = mapped_column(String(255))
     tokens_in: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     tokens_out: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # Part of tokens_in served from the provider's prompt cache.
+    cached_tokens_in: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     cost_estimate: Mapped[Optional[float]] = mapped_column(
         Float, nullable=True
     )
@@ -306,6 +354,62 @@ class UsageRecord(Base):
     )
 
 
+class UsageRollup(Base):
+    """
+    Usage totals per (project, conversation, model, UTC day), maintained
+    incrementally as usage records are written (app.db.usage_rollups).
+    """
+
+    __tablename__ = "usage_rollups"
+    __table_args__ = (
+        UniqueConstraint(
+            "project_id",
+            "conversation_id",
+            "model",
+            "day",
+            name="uq_usage_rollups_bucket",
+        ),
+        # Dashboards: WHERE project_id = ? AND day BETWEEN ? AND ?
+        Index("ix_usage_rollups_project_id_day", "project_id", "day"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    project_id: Mapped[int] = mapped_column(Integer, ForeignKey("projects.id"))
+    # 0 for usage not tied to a conversation (NULL would defeat the unique key).
+    conversation_id: Mapped[int] = mapped_column(Integer, default=0)
+    model: Mapped[str] = mapped_column(String(255))
+    day: Mapped[date] = mapped_column(Date)
+    calls: Mapped[int] = mapped_column(Integer, default=0)
+    tokens_in: Mapped[int] = mapped_column(BigInteger, default=0)
+    tokens_out: Mapped[int] = mapped_column(BigInteger, default=0)
+    cached_tokens_in: Mapped[int] = mapped_column(BigInteger, default=0)
+    cost_estimate: Mapped[float] = mapped_column(Float, default=0.0)
+
+    project: Mapped["Project"] = relationship("Project", back_populates="usage_rollups")
+
+
+class LlmBudgetCheckpoint(Base):
+    """
+    Daily LLM token/dollar counters per (project, mode), checkpointed from the
+    in-memory budget gateway (app.llm.budgets) so restarts keep the day's spend.
+    """
+
+    __tablename__ = "llm_budget_checkpoints"
+    __table_args__ = (
+        UniqueConstraint("project_id", "mode", "day", name="uq_llm_budget_checkpoints_key"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    # 0 for calls made outside any project; no FK so checkpoints never block
+    # project deletion.
+    project_id: Mapped[int] = mapped_column(Integer, default=0)
+    mode: Mapped[str] = mapped_column(String(32))
+    day: Mapped[date] = mapped_column(Date)
+    tokens: Mapped[int] = mapped_column(BigInteger, default=0)
+    cost_usd: Mapped[float] = mapped_column(Float, default=0.0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
 class ProjectDecision(Base):
     __tablename__ = "project_decisions"
 
@@ -373,10 +477,20 @@ class ConversationFolder(Base):
 
 class MemoryItem(Base):
     __tablename__ = "memory_items"
+    __table_args__ = (
+        # Active memory: WHERE project_id = ? AND superseded_by_id IS NULL
+        # AND (expires_at IS NULL OR expires_at > ?)
+        Index(
+            "ix_memory_items_project_id_superseded_by_id_expires_at",
+            "project_id",
+            "superseded_by_id",
+            "expires_at",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     project_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("projects.id"), index=True
+        Integer, ForeignKey("projects.id")
     )
     title: Mapped[str] = mapped_column(String(255))
     content: Mapped[str] = mapped_column(Text)
@@ -471,3 +585,29 @@ class FileIngestionState(Base):
     project: Mapped["Project"] = relationship(
         "Project", back_populates="file_ingestion_states"
     )
+
+
+class VectorCollection(Base):
+    """
+    One physical vector collection and the embedding spec it was built with.
+
+    `name` is the logical collection (messages/docs/memory_items). Each name
+    has one `active` version; a re-index adds a `building` version that
+    replaces it on swap (the old one becomes `retired` and its data is
+    dropped later).
+
+    A `partitioned` version keeps one physical collection per project,
+    named `<physical_name>__p<project_id>` and created on first write.
+    """
+
+    __tablename__ = "vector_collections"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    name: Mapped[str] = mapped_column(String(64), index=True)
+    physical_name: Mapped[str] = mapped_column(String(128), unique=True)
+    embedding_model: Mapped[str] = mapped_column(String(128))
+    dimensions: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    partitioned: Mapped[bool] = mapped_column(Boolean, default=False)
+    state: Mapped[str] = mapped_column(String(16), default="active", index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    activated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Usage dashboards read the usage_rollups table, which holds one row per
+# (project, conversation, model, UTC day) bucket. Every usage write goes
+# through record_usage so the bucket is bumped in the same transaction as the
+# raw UsageRecord; rebuild_usage_rollups recomputes the table, or one
+# project's rows, from scratch (after usage records are edited in bulk, e.g.
+# re-pricing).
+
+NO_CONVERSATION = 0
+GROUP_BY_CHOICES = ("model", "day", "conversation")
+
+_rollups = models.UsageRollup.__table__
+_BUCKET_COLUMNS = ("project_id", "conversation_id", "model", "day")
+
+
+def _bucket_values(record: models.UsageRecord) -> Dict[str, Any]:
+    return {
+        "project_id": record.project_id,
+        "conversation_id": record.conversation_id or NO_CONVERSATION,
+        "model": record.model,
+        "day": record.created_at.date(),
+        "calls": 1,
+        "tokens_in": record.tokens_in or 0,
+        "tokens_out": record.tokens_out or 0,
+        "cached_tokens_in": record.cached_tokens_in or 0,
+        "cost_estimate": record.cost_estimate or 0.0,
+    }
+
+
+def _upsert_bucket(session: Session, values: Dict[str, Any]) -> None:
+    # SQLite and PostgreSQL share the ON CONFLICT ... DO UPDATE syntax.
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(_rollups).values(**values)
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=list(_BUCKET_COLUMNS),
+            set_={
+                "calls": _rollups.c.calls + stmt.excluded.calls,
+                "tokens_in": _rollups.c.tokens_in + stmt.excluded.tokens_in,
+                "tokens_out": _rollups.c.tokens_out + stmt.excluded.tokens_out,
+                "cached_tokens_in": _rollups.c.cached_tokens_in + stmt.excluded.cached_tokens_in,
+                "cost_estimate": _rollups.c.cost_estimate + stmt.excluded.cost_estimate,
+            },
+        )
+    )
+
+
+def record_usage(session: Session, record: models.UsageRecord) -> models.UsageRecord:
+    """
+    Add a UsageRecord and fold it into its rollup bucket. The caller commits.
+    """
+    if record.created_at is None:
+        record.created_at = datetime.utcnow()
+    session.add(record)
+    _upsert_bucket(session, _bucket_values(record))
+    return record
+
+
+def rebuild_usage_rollups(conn: Connection, project_id: Optional[int] = None) -> int:
+    """
+    Recompute usage_rollups from usage_records, for every project or just
+    `project_id`. Returns the number of buckets rebuilt.
+    """
+    records = models.UsageRecord.__table__
+    day = func.date(records.c.created_at)
+    conversation = func.coalesce(records.c.conversation_id, NO_CONVERSATION)
+    source = select(
+        records.c.project_id,
+        conversation,
+        records.c.model,
+        day,
+        func.count(records.c.id),
+        func.sum(func.coalesce(records.c.tokens_in, 0)),
+        func.sum(func.coalesce(records.c.tokens_out, 0)),
+        func.sum(func.coalesce(records.c.cached_tokens_in, 0)),
+        func.sum(func.coalesce(records.c.cost_estimate, 0.0)),
+    ).group_by(records.c.project_id, conversation, records.c.model, day)
+    clear = delete(_rollups)
+    count = select(func.count()).select_from(_rollups)
+    if project_id is not None:
+        source = source.where(records.c.project_id == project_id)
+        clear = clear.where(_rollups.c.project_id == project_id)
+        count = count.where(_rollups.c.project_id == project_id)
+    conn.execute(clear)
+    conn.execute(
+        insert(_rollups).from_select(
+            [
+                "project_id",
+                "conversation_id",
+                "model",
+                "day",
+                "calls",
+                "tokens_in",
+                "tokens_out",
+                "cached_tokens_in",
+                "cost_estimate",
+            ],
+            source,
+        )
+    )
+    return int(conn.execute(count).scalar() or 0)
+
+
+def usage_breakdown(
+    db: Session,
+    project_id: int,
+    group_by: str = "model",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    model: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Totals plus one bucket per model, day or conversation for a project,
+    optionally limited to [start, end] (inclusive UTC days) and one model.
+
+    Reads only rollup rows, so cost is O(buckets) regardless of how many
+    usage records the project has.
+    """
+    if group_by not in GROUP_BY_CHOICES:
+        raise ValueError(f"group_by must be one of: {', '.join(GROUP_BY_CHOICES)}")
+    key = {
+        "model": models.UsageRollup.model,
+        "day": models.UsageRollup.day,
+        "conversation": models.UsageRollup.conversation_id,
+    }[group_by]
+
+    query = db.query(
+        key,
+        func.sum(models.UsageRollup.calls),
+        func.sum(models.UsageRollup.tokens_in),
+        func.sum(models.UsageRollup.tokens_out),
+        func.sum(models.UsageRollup.cached_tokens_in),
+        func.sum(models.UsageRollup.cost_estimate),
+    ).filter(models.UsageRollup.project_id == project_id)
+    if start is not None:
+        query = query.filter(models.UsageRollup.day >= start)
+    if end is not None:
+        query = query.filter(models.UsageRollup.day <= end)
+    if model:
+        query = query.filter(models.UsageRollup.model == model)
+    rows = query.group_by(key).order_by(key).all()
+
+    buckets: List[Dict[str, Any]] = []
+    for bucket_key, calls, tokens_in, tokens_out, cached_in, cost in rows:
+        if group_by == "day":
+            bucket_key = bucket_key.isoformat()
+        elif group_by == "conversation":
+            bucket_key = None if bucket_key == NO_CONVERSATION else bucket_key
+        buckets.append(
+            {
+                "key": bucket_key,
+                "calls": int(calls or 0),
+                "tokens_in": int(tokens_in or 0),
+                "tokens_out": int(tokens_out or 0),
+                "cached_tokens_in": int(cached_in or 0),
+                "cost_estimate": float(cost or 0.0),
+            }
+        )
+    return {
+        "project_id": project_id,
+        "group_by": group_by,
+        "start": start,
+        "end": end,
+        "model": model,
+        "total_calls": sum(b["calls"] for b in buckets),
+        "total_tokens_in": sum(b["tokens_in"] for b in buckets),
+        "total_tokens_out": sum(b["tokens_out"] for b in buckets),
+        "total_cached_tokens_in": sum(b["cached_tokens_in"] for b in buckets),
+        "total_cost_estimate": sum(b["cost_estimate"] for b in buckets),
+        "buckets": buckets,
+    }
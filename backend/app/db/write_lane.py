@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.observability.metrics import (
+    WRITE_GROUP_COMMIT,
+    WRITE_GROUP_SIZE,
+    WRITE_LANE_QUEUED,
+    WRITE_LANE_WAIT,
+)
+
+# SQLite allows a single writer. Instead of letting concurrent sessions collide
+# on the file lock (and sleep-retry), every SQLite write transaction in this
+# process queues on one FIFO lane: a session joins the lane at its first flush
+# or DML statement and leaves it when its top-level transaction ends. Readers
+# never touch the lane and keep using pooled connections.
+#
+# Small independent writes can also be submitted as write units (run_write);
+# whichever caller holds the lane commits every queued unit in one transaction.
+# A thread whose own session already holds the lane cannot queue a unit: the
+# group would commit on a second connection that waits on that session's
+# uncommitted write. Such callers pass their session so the unit runs inside
+# the open transaction instead.
+
+_DEFAULT_ACQUIRE_TIMEOUT = 30.0
+_MAX_GROUP_SIZE = 64
+
+# Session.info keys
+_HELD = "write_lane_held"
+_SKIP = "write_lane_skip"
+
+
+def _acquire_timeout() -> float:
+    raw = os.getenv("IW_SQLITE_WRITE_LANE_TIMEOUT")
+    if raw:
+        try:
+            return max(0.1, float(raw))
+        except ValueError:
+            pass
+    return _DEFAULT_ACQUIRE_TIMEOUT
+
+
+class WriteLane:
+    """
+    FIFO, per-thread reentrant single-writer lane.
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._owner_thread: Optional[int] = None
+        self._holders = 0
+        self._waiters: Deque[object] = deque()
+        self._stats: Dict[str, float] = {
+            "acquired": 0,
+            "contended": 0,
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "groups_committed": 0,
+            "units_committed": 0,
+            "units_failed": 0,
+        }
+
+    def _grant(self, waited: float) -> None:
+        self._owner_thread = threading.get_ident()
+        self._holders = 1
+        self._stats["acquired"] += 1
+        self._stats["wait_seconds_total"] += waited
+        if waited > self._stats["wait_seconds_max"]:
+            self._stats["wait_seconds_max"] = waited
+        WRITE_LANE_WAIT.observe(waited)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait (FIFO) for the lane. Returns False if the timeout expires.
+        """
+        me = threading.get_ident()
+        start = time.perf_counter()
+        with self._cond:
+            if self._holders and self._owner_thread == me:
+                # Nested session on the same thread: waiting would deadlock.
+                # Its writes still wait on SQLite's lock if the outer session
+                # has written, so run_write refuses this case.
+                self._holders += 1
+                return True
+            if not self._holders and not self._waiters:
+                self._grant(0.0)
+                return True
+            self._stats["contended"] += 1
+            ticket = object()
+            self._waiters.append(ticket)
+            WRITE_LANE_QUEUED.set(len(self._waiters))
+            deadline = None if timeout is None else start + timeout
+            while self._holders or self._waiters[0] is not ticket:
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    self._waiters.remove(ticket)
+                    WRITE_LANE_QUEUED.set(len(self._waiters))
+                    self._stats["timeouts"] += 1
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+            self._waiters.popleft()
+            WRITE_LANE_QUEUED.set(len(self._waiters))
+            self._grant(time.perf_counter() - start)
+            return True
+
+    def held_by_current_thread(self) -> bool:
+        with self._cond:
+            return bool(self._holders) and self._owner_thread == threading.get_ident()
+
+    def release(self) -> None:
+        # May be called from another thread than acquire (e.g. a request
+        # session closed by the dependency teardown).
+        with self._cond:
+            if not self._holders:
+                return
+            self._holders -= 1
+            if not self._holders:
+                self._owner_thread = None
+                self._cond.notify_all()
+
+    def record_group(self, committed: int, failed: int) -> None:
+        with self._cond:
+            if committed:
+                self._stats["groups_committed"] += 1
+                self._stats["units_committed"] += committed
+            self._stats["units_failed"] += failed
+
+    def stats(self, reset: bool = False) -> Dict[str, Any]:
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot["queued"] = len(self._waiters)
+            snapshot["held"] = bool(self._holders)
+            if reset:
+                for key in self._stats:
+                    self._stats[key] = 0.0 if isinstance(self._stats[key], float) else 0
+        return snapshot
+
+
+WRITE_LANE = WriteLane()
+
+
+# ---------------------------------------------------------------------------
+# Session integration
+# ---------------------------------------------------------------------------
+
+
+def _uses_sqlite(session: Session) -> bool:
+    try:
+        return session.get_bind().dialect.name == "sqlite"
+    except Exception:  # noqa: BLE001
+        return False
+
+
+def _enter_lane(session: Session) -> None:
+    info = session.info
+    if info.get(_HELD) or info.get(_SKIP) or not _uses_sqlite(session):
+        return
+    if WRITE_LANE.acquire(timeout=_acquire_timeout()):
+        info[_HELD] = True
+    else:
+        # Fall back to SQLite's own busy_timeout rather than failing the write.
+        print("[WARN] SQLite write lane timed out; writing without it")
+
+
+def _before_flush(session: Session, flush_context, instances) -> None:
+    _enter_lane(session)
+
+
+def _do_orm_execute(orm_execute_state) -> None:
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _enter_lane(orm_execute_state.session)
+
+
+def _after_transaction_end(session: Session, transaction) -> None:
+    if transaction.parent is None and session.info.pop(_HELD, False):
+        WRITE_LANE.release()
+
+
+_INSTALLED = False
+
+
+def install_session_hooks() -> None:
+    """
+    Route every SQLite write transaction through WRITE_LANE (idempotent).
+    """
+    global _INSTALLED
+    if _INSTALLED:
+        return
+    event.listen(Session, "before_flush", _before_flush)
+    event.listen(Session, "do_orm_execute", _do_orm_execute)
+    event.listen(Session, "after_transaction_end", _after_transaction_end)
+    _INSTALLED = True
+
+
+# ---------------------------------------------------------------------------
+# Group-committed write units
+# ---------------------------------------------------------------------------
+
+
+class _WriteUnit:
+    __slots__ = ("fn", "done", "result", "error")
+
+    def __init__(self, fn: Callable[[Session], Any]) -> None:
+        self.fn = fn
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_PENDING: Deque[_WriteUnit] = deque()
+_PENDING_LOCK = threading.Lock()
+
+
+def _default_session_factory() -> Session:
+    from app.db import session as db_session
+
+    return db_session.SessionLocal()
+
+
+def _commit_group(
+    batch: List[_WriteUnit], session_factory: Callable[[], Session]
+) -> None:
+    session = session_factory()
+    session.info[_SKIP] = True  # the caller already holds the lane
+    started = time.perf_counter()
+    try:
+        for unit in batch:
+            unit.result = unit.fn(session)
+            session.flush()
+        session.commit()
+    except Exception as exc:  # noqa: BLE001
+        session.rollback()
+        if len(batch) == 1:
+            batch[0].error = exc
+            batch[0].done.set()
+            WRITE_LANE.record_group(0, 1)
+            return
+        # Isolate the failing unit: commit the rest one by one.
+        for unit in batch:
+            unit.result = None
+            _commit_group([unit], session_factory)
+        return
+    finally:
+        session.close()
+    WRITE_LANE.record_group(len(batch), 0)
+    WRITE_GROUP_COMMIT.observe(time.perf_counter() - started)
+    WRITE_GROUP_SIZE.observe(len(batch))
+    for unit in batch:
+        unit.done.set()
+
+
+def run_write(
+    fn: Callable[[Session], Any],
+    session_factory: Optional[Callable[[], Session]] = None,
+    session: Optional[Session] = None,
+) -> Any:
+    """
+    Run a small write unit and return once it is committed.
+
+    fn receives a Session, adds/updates rows and must not commit. Units queued
+    while another caller holds the lane are committed together in one
+    transaction (group commit); a failing unit is retried alone so it cannot
+    sink the others, and its exception is re-raised here. Return plain values:
+    ORM objects are detached once the group commits.
+
+    `session` is the caller's open session: if this thread already holds the
+    lane, fn runs (and is flushed) in that session and commits with it. With
+    the lane held and no session this raises RuntimeError.
+    """
+    if WRITE_LANE.held_by_current_thread():
+        if session is None:
+            raise RuntimeError(
+                "run_write called while this thread holds the SQLite write lane; "
+                "pass session= to write inside the open transaction"
+            )
+        result = fn(session)
+        session.flush()
+        return result
+    factory = session_factory or _default_session_factory
+    unit = _WriteUnit(fn)
+    with _PENDING_LOCK:
+        _PENDING.append(unit)
+    while not unit.done.is_set():
+        acquired = WRITE_LANE.acquire(timeout=_acquire_timeout())
+        try:
+            with _PENDING_LOCK:
+                batch = [
+                    _PENDING.popleft()
+                    for _ in range(min(len(_PENDING), _MAX_GROUP_SIZE))
+                ]
+            if batch:
+                _commit_group(batch, factory)
+        finally:
+            if acquired:
+                WRITE_LANE.release()
+    if unit.error is not None:
+        raise unit.error
+    return unit.result
+
+
+def get_write_lane_stats(reset: bool = False) -> Dict[str, Any]:
+    return WRITE_LANE.stats(reset=reset)
@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.db import models
+
+# 64-bit SimHash split into 4 bands of 16 bits: any two fingerprints within
+# Hamming distance 3 share at least one band exactly (pigeonhole), so a band
+# lookup finds every near-duplicate candidate.
+_SIMHASH_BITS = 64
+_BAND_BITS = 16
+_NUM_BANDS = _SIMHASH_BITS // _BAND_BITS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+NEAR_DUPLICATE_MAX_DISTANCE = 3
+# Near-duplicate matching on very short chunks is too eager (headers, one-liners);
+# those only collapse on exact matches.
+NEAR_DUPLICATE_MIN_CHARS = 256
+_SHINGLE_SIZE = 3
+_BIT_POSITIONS = np.arange(_SIMHASH_BITS, dtype=np.uint64)
+
+_WHITESPACE = re.compile(r"\s+")
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", (text or "").strip().lower())
+
+
+def content_fingerprint(text: str) -> str:
+    """
+    Exact-duplicate key: sha256 over whitespace/case-normalized text.
+    """
+    return hashlib.sha256(_normalize(text).encode("utf-8")).hexdigest()
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def simhash64(text: str) -> int:
+    """
+    64-bit SimHash over word shingles (unsigned).
+    """
+    tokens = _TOKEN.findall(_normalize(text))
+    if not tokens:
+        return 0
+    if len(tokens) < _SHINGLE_SIZE:
+        features = [" ".join(tokens)]
+    else:
+        features = [
+            " ".join(tokens[i:i + _SHINGLE_SIZE])
+            for i in range(len(tokens) - _SHINGLE_SIZE + 1)
+        ]
+    hashes = np.fromiter(
+        (_feature_hash(feature) for feature in features),
+        dtype=np.uint64,
+        count=len(features),
+    )
+    bits = (hashes[:, None] >> _BIT_POSITIONS) & np.uint64(1)
+    # Each bit votes +1 when set and -1 when clear across all features.
+    weights = bits.sum(axis=0, dtype=np.int64) * 2 - len(features)
+    value = 0
+    for bit in np.nonzero(weights > 0)[0]:
+        value |= 1 << int(bit)
+    return value
+
+
+def to_signed64(value: int) -> int:
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(to_unsigned64(a) ^ to_unsigned64(b)).count("1")
+
+
+class FingerprintIndex:
+    """
+    In-memory exact + SimHash-banded index of canonical chunks for one project.
+    """
+
+    def __init__(self) -> None:
+        self._by_hash: Dict[str, int] = {}
+        self._hash_of: Dict[int, str] = {}
+        self._simhash: Dict[int, int] = {}
+        self._bands: List[Dict[int, Set[int]]] = [
+            defaultdict(set) for _ in range(_NUM_BANDS)
+        ]
+
+    def __len__(self) -> int:
+        return len(self._simhash)
+
+    def hash_of(self, chunk_id: int) -> Optional[str]:
+        return self._hash_of.get(chunk_id)
+
+    def add(self, chunk_id: int, content_hash: str, simhash: Optional[int]) -> None:
+        self._by_hash.setdefault(content_hash, chunk_id)
+        self._hash_of[chunk_id] = content_hash
+        if simhash is None:
+            return
+        value = to_unsigned64(simhash)
+        self._simhash[chunk_id] = value
+        for band in range(_NUM_BANDS):
+            self._bands[band][(value >> (band * _BAND_BITS)) & _BAND_MASK].add(chunk_id)
+
+    def remove(self, chunk_id: int) -> None:
+        content_hash = self._hash_of.pop(chunk_id, None)
+        if content_hash is not None and self._by_hash.get(content_hash) == chunk_id:
+            del self._by_hash[content_hash]
+        value = self._simhash.pop(chunk_id, None)
+        if value is None:
+            return
+        for band in range(_NUM_BANDS):
+            bucket = self._bands[band].get((value >> (band * _BAND_BITS)) & _BAND_MASK)
+            if bucket is not None:
+                bucket.discard(chunk_id)
+
+    def find(
+        self,
+        content_hash: str,
+        simhash: Optional[int],
+        *,
+        allow_near: bool = True,
+    ) -> Optional[int]:
+        exact = self._by_hash.get(content_hash)
+        if exact is not None or simhash is None or not allow_near:
+            return exact
+        value = to_unsigned64(simhash)
+        best: Optional[Tuple[int, int]] = None
+        seen: Set[int] = set()
+        for band in range(_NUM_BANDS):
+            for candidate in self._bands[band].get(
+                (value >> (band * _BAND_BITS)) & _BAND_MASK, ()
+            ):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = bin(value ^ self._simhash[candidate]).count("1")
+                if distance <= NEAR_DUPLICATE_MAX_DISTANCE and (
+                    best is None or distance < best[0]
+                ):
+                    best = (distance, candidate)
+        return best[1] if best else None
+
+
+_PROJECT_INDEXES: Dict[int, FingerprintIndex] = {}
+_INDEX_LOCK = threading.RLock()
+
+
+def _load_project_index(db: Session, project_id: int) -> FingerprintIndex:
+    index = FingerprintIndex()
+    rows = (
+        db.query(
+            models.DocumentChunk.id,
+            models.DocumentChunk.content_hash,
+            models.DocumentChunk.simhash,
+        )
+        .join(models.Document, models.Document.id == models.DocumentChunk.document_id)
+        .filter(
+            models.Document.project_id == project_id,
+            models.DocumentChunk.duplicate_of_id.is_(None),
+            models.DocumentChunk.content_hash.isnot(None),
+        )
+        .order_by(models.DocumentChunk.id.asc())
+    )
+    for chunk_id, content_hash, simhash in rows:
+        index.add(chunk_id, content_hash, simhash)
+    return index
+
+
+def get_project_index(db: Session, project_id: int) -> FingerprintIndex:
+    """
+    Return the cached fingerprint index for a project, loading it in one query
+    on first use.
+    """
+    with _INDEX_LOCK:
+        index = _PROJECT_INDEXES.get(project_id)
+        if index is None:
+            index = _load_project_index(db, project_id)
+            _PROJECT_INDEXES[project_id] = index
+        return index
+
+
+def forget_project_index(project_id: Optional[int] = None) -> None:
+    with _INDEX_LOCK:
+        if project_id is None:
+            _PROJECT_INDEXES.clear()
+        else:
+            _PROJECT_INDEXES.pop(project_id, None)
+
+
+def _is_live_canonical(db: Session, index: FingerprintIndex, chunk_id: int) -> bool:
+    chunk = db.get(models.DocumentChunk, chunk_id)
+    return (
+        chunk is not None
+        and chunk.duplicate_of_id is None
+        and chunk.content_hash == index.hash_of(chunk_id)
+    )
+
+
+def assign_canonical_chunks(
+    db: Session,
+    project_id: int,
+    texts: Sequence[str],
+) -> List[Tuple[str, int, Optional[int], Optional[int]]]:
+    """
+    Fingerprint each chunk text and resolve its canonical chunk.
+
+    Returns one (content_hash, signed_simhash, canonical_chunk_id, batch_index)
+    tuple per text. canonical_chunk_id points at an existing chunk in the
+    project; batch_index points at an earlier text in this same batch. Both are
+    None for chunks that need their own embedding.
+    """
+    index = get_project_index(db, project_id)
+    batch = FingerprintIndex()
+    results: List[Tuple[str, int, Optional[int], Optional[int]]] = []
+    for position, text in enumerate(texts):
+        content_hash = content_fingerprint(text)
+        simhash = simhash64(text)
+        allow_near = len(text) >= NEAR_DUPLICATE_MIN_CHARS
+        with _INDEX_LOCK:
+            canonical = index.find(content_hash, simhash, allow_near=allow_near)
+            # Chunks deleted (or ids reused) since the index was loaded must
+            # not be reused as canonicals.
+            while canonical is not None and not _is_live_canonical(db, index, canonical):
+                index.remove(canonical)
+                canonical = index.find(content_hash, simhash, allow_near=allow_near)
+        batch_match: Optional[int] = None
+        if canonical is None:
+            batch_match = batch.find(content_hash, simhash, allow_near=allow_near)
+            if batch_match is None:
+                batch.add(position, content_hash, simhash)
+        results.append((content_hash, to_signed64(simhash), canonical, batch_match))
+    return results
+
+
+def register_canonical_chunks(
+    project_id: int, chunks: Sequence[models.DocumentChunk]
+) -> None:
+    """
+    Add freshly flushed canonical chunks to the cached project index.
+    """
+    with _INDEX_LOCK:
+        index = _PROJECT_INDEXES.get(project_id)
+        if index is None:
+            return
+        for chunk in chunks:
+            if chunk.duplicate_of_id is None and chunk.content_hash:
+                index.add(chunk.id, chunk.content_hash, chunk.simhash)
+
+
+def promote_duplicates(
+    db: Session, project_id: int, doomed_chunk_ids: Sequence[int]
+) -> List[models.DocumentChunk]:
+    """
+    Before canonical chunks are deleted, make the first surviving duplicate of
+    each the new canonical and re-point the remaining duplicates at it.
+
+    Returns the promoted chunks; the caller must index their vectors.
+    """
+    doomed = set(doomed_chunk_ids)
+    if not doomed:
+        return []
+    survivors = (
+        db.query(models.DocumentChunk)
+        .filter(
+            models.DocumentChunk.duplicate_of_id.in_(doomed),
+            models.DocumentChunk.id.notin_(doomed),
+        )
+        .order_by(models.DocumentChunk.id.asc())
+        .all()
+    )
+    promoted: Dict[int, models.DocumentChunk] = {}
+    for chunk in survivors:
+        old_canonical = chunk.duplicate_of_id
+        if old_canonical not in promoted:
+            chunk.duplicate_of_id = None
+            promoted[old_canonical] = chunk
+        else:
+            chunk.duplicate_of_id = promoted[old_canonical].id
+    with _INDEX_LOCK:
+        index = _PROJECT_INDEXES.get(project_id)
+        if index is not None:
+            for chunk_id in doomed:
+                index.remove(chunk_id)
+            for chunk in promoted.values():
+                if chunk.content_hash:
+                    index.add(chunk.id, chunk.content_hash, chunk.simhash)
+    return list(promoted.values())
+
+
+def collapse_duplicate_hits(
+    ids: Sequence[Any],
+    documents: Sequence[str],
+    metadatas: Sequence[Dict[str, Any]],
+    distances: Sequence[float],
+    limit: Optional[int] = None,
+) -> Tuple[List[Any], List[str], List[Dict[str, Any]], List[float]]:
+    """
+    Drop retrieval hits whose content duplicates (exactly or nearly) a better
+    ranked hit, so copies of the same boilerplate do not crowd the top-k.
+    """
+    kept = FingerprintIndex()
+    out_ids: List[Any] = []
+    out_docs: List[str] = []
+    out_metas: List[Dict[str, Any]] = []
+    out_dists: List[float] = []
+    for position, (rid, doc, meta, dist) in enumerate(
+        zip(ids, documents, metadatas, distances)
+    ):
+        text = doc or ""
+        content_hash = content_fingerprint(text)
+        simhash = simhash64(text)
+        if kept.find(
+            content_hash, simhash, allow_near=len(text) >= NEAR_DUPLICATE_MIN_CHARS
+        ) is not None:
+            continue
+        kept.add(position, content_hash, simhash)
+        out_ids.append(rid)
+        out_docs.append(doc)
+        out_metas.append(meta)
+        out_dists.append(dist)
+        if limit is not None and len(out_ids) >= limit:
+            break
+    return out_ids, out_docs, out_metas, out_dists
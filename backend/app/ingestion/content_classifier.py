@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+from collections import Counter
+from typing import Optional
+
+# Reasons recorded in IngestionJob.meta["skipped_by_reason"].
+SKIP_TOO_LARGE = "too_large"
+SKIP_BINARY = "binary"
+SKIP_LOCKFILE = "lockfile"
+SKIP_MINIFIED = "minified"
+SKIP_GENERATED = "generated"
+SKIP_VENDORED = "vendored"
+SKIP_HIGH_ENTROPY = "high_entropy"
+
+_DEFAULT_MAX_FILE_BYTES = 1_000_000
+_SNIFF_BYTES = 8192
+_SAMPLE_BYTES = 65536
+_HEADER_BYTES = 2048
+
+_LOCKFILE_NAMES = {
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "yarn.lock",
+    "pnpm-lock.yaml",
+    "poetry.lock",
+    "pipfile.lock",
+    "cargo.lock",
+    "composer.lock",
+    "gemfile.lock",
+    "go.sum",
+    "uv.lock",
+}
+_MINIFIED_SUFFIXES = (".min.js", ".min.css", ".min.mjs", ".bundle.js", ".map")
+_GENERATED_SUFFIXES = ("_pb2.py", "_pb2_grpc.py", ".pb.go", ".g.dart", ".designer.cs")
+_VENDORED_DIRS = {"vendor", "vendors", "third_party", "thirdparty", "third-party", "vendored"}
+# Generator banners, matched only on comment lines of the (lowercased) file
+# header so prose that merely mentions "do not edit" is not skipped.
+_GENERATED_HEADER = re.compile(
+    rb"^[ \t]*(?:#|//|/\*|\*|<!--|--|;)[^\n]*?(?:"
+    rb"@generated"
+    rb"|code generated\b[^\n]*\bdo not edit"
+    rb"|auto-?generated by"
+    rb"|this file (?:was|is) (?:automatically|auto-?) ?generated"
+    rb")",
+    re.MULTILINE,
+)
+
+
+def max_file_bytes() -> int:
+    raw = os.getenv("IW_INGEST_MAX_FILE_BYTES")
+    if raw:
+        try:
+            return max(1, int(raw))
+        except ValueError:
+            pass
+    return _DEFAULT_MAX_FILE_BYTES
+
+
+def classify_path(relative_path: str, size_bytes: int) -> Optional[str]:
+    """
+    Cheap checks that only need the path and size (no read).
+
+    Returns a skip reason, or None if the file should be read and sniffed.
+    """
+    parts = relative_path.lower().split("/")
+    name = parts[-1]
+    if size_bytes > max_file_bytes():
+        return SKIP_TOO_LARGE
+    if name in _LOCKFILE_NAMES:
+        return SKIP_LOCKFILE
+    if name.endswith(_MINIFIED_SUFFIXES):
+        return SKIP_MINIFIED
+    if name.endswith(_GENERATED_SUFFIXES):
+        return SKIP_GENERATED
+    if any(part in _VENDORED_DIRS for part in parts[:-1]):
+        return SKIP_VENDORED
+    return None
+
+
+def _shannon_entropy(data: bytes) -> float:
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(
+        (count / total) * math.log2(count / total)
+        for count in Counter(data).values()
+    )
+
+
+def _looks_binary(head: bytes) -> bool:
+    if b"\x00" in head:
+        return True
+    if not head:
+        return False
+    # Control characters other than tab/newline/carriage-return/form-feed.
+    control = sum(1 for b in head if b < 32 and b not in (9, 10, 12, 13))
+    return control / len(head) > 0.1
+
+
+def _looks_minified(sample: bytes) -> bool:
+    lines = sample.splitlines()
+    if not lines:
+        return False
+    longest = max(len(line) for line in lines)
+    average = len(sample) / len(lines)
+    return longest > 5000 or (average > 500 and len(sample) > 2000)
+
+
+def _looks_high_entropy(sample: bytes) -> bool:
+    """
+    True when most of the sample sits on long, whitespace-free, high-entropy
+    lines (base64 blobs, embedded certificates, data URIs, hashes).
+    """
+    if len(sample) < 2000:
+        return False
+    flagged = 0
+    for line in sample.splitlines():
+        if len(line) < 120:
+            continue
+        if line.count(b" ") > len(line) // 40:
+            continue
+        if _shannon_entropy(line) > 5.0:
+            flagged += len(line)
+    return flagged > len(sample) // 2
+
+
+def classify_content(relative_path: str, data: bytes) -> Optional[str]:
+    """
+    Sniff file contents for binary, generated, minified or high-entropy data.
+
+    Returns a skip reason, or None if the file is worth chunking and embedding.
+    """
+    if _looks_binary(data[:_SNIFF_BYTES]):
+        return SKIP_BINARY
+    header = data[:_HEADER_BYTES].lower()
+    if _GENERATED_HEADER.search(header):
+        return SKIP_GENERATED
+    sample = data[:_SAMPLE_BYTES]
+    if _looks_minified(sample):
+        return SKIP_MINIFIED
+    if _looks_high_entropy(sample):
+        return SKIP_HIGH_ENTROPY
+    return None
@@ -1,13 +1,18 @@
 from __future__ import annotations
 
-import time
-from typing import Optional, List, Tuple
+from collections import defaultdict
+from typing import Dict, Optional, List, Tuple
 
 from sqlalchemy.orm import Session
 
 from app.db import models
+from app.ingestion.chunk_dedupe import (
+    assign_canonical_chunks,
+    promote_duplicates,
+    register_canonical_chunks,
+)
 from app.llm.embeddings import embed_texts_batched
-from app.vectorstore.chroma_store import add_document_chunks
+from app.vectorstore.chroma_store import add_document_chunks, delete_document_chunks
 
 
 def _chunk_text(
@@ -41,45 +46,6 @@ def _chunk_text(
     return chunks
 
 
-def _flush_with_retry(db: Session, attempts: int = 6, base_delay: float = 0.3) -> None:
-    """
-    Flush pending objects with retries to tolerate SQLite locks.
-    """
-    last_exc: Exception | None = None
-    for i in range(attempts):
-        try:
-            db.flush()
-            return
-        except Exception as exc:  # noqa: BLE001
-            # SQLite lock errors surface as OperationalError -> generic here
-            db.rollback()
-            last_exc = exc
-            if "locked" not in str(exc).lower():
-                raise
-            time.sleep(base_delay * (i + 1))
-    if last_exc:
-        raise last_exc
-
-
-def _commit_with_retry(db: Session, attempts: int = 6, base_delay: float = 0.3) -> None:
-    """
-    Commit with retries to ride out transient SQLite locks.
-    """
-    last_exc: Exception | None = None
-    for i in range(attempts):
-        try:
-            db.commit()
-            return
-        except Exception as exc:  # noqa: BLE001
-            db.rollback()
-            last_exc = exc
-            if "locked" not in str(exc).lower():
-                raise
-            time.sleep(base_delay * (i + 1))
-    if last_exc:
-        raise last_exc
-
-
 def ingest_text_document(
     db: Session,
     project_id: int,
@@ -94,11 +60,14 @@ def ingest_text_document(
 
     Steps:
       1. Verify the project exists.
-      2. Create a Document row.
-      3. Create a single DocumentSection representing the whole doc.
-      4. Chunk the text.
-      5. Embed all chunks with OpenAI.
-      6. Create DocumentChunk rows and index them in Chroma.
+      2. Chunk the text.
+      3. Fingerprint chunks and resolve exact/near-duplicates.
+      4. Embed the unique chunks with OpenAI.
+      5. Create the Document, a single DocumentSection and the DocumentChunk
+         rows in one flush, then index the unique chunks in Chroma.
+
+    All model calls happen before the first flush, so the write transaction
+    (and the SQLite write lane) is only held for the inserts.
 
     Returns:
       (Document instance, number of chunks)
@@ -108,63 +77,110 @@ def ingest_text_document(
     if project is None:
         raise ValueError(f"Project {project_id} not found")
 
-    # 2) Create the Document
+    # 2) Chunk the text
+    chunks: List[str] = _chunk_text(text, max_chars=max_chars, overlap=overlap)
+
+    # 3) Fingerprint chunks. Exact and near-duplicates (within this document or
+    #    anywhere else in the project) share the canonical chunk's embedding
+    #    and vector instead of being embedded and indexed again.
+    fingerprints = assign_canonical_chunks(db, project_id, chunks) if chunks else []
+    unique_positions: List[int] = [
+        pos
+        for pos, (_, _, canonical_id, batch_match) in enumerate(fingerprints)
+        if canonical_id is None and batch_match is None
+    ]
+
+    # 4) Embed the unique chunks in batches to respect token limits
+    embeddings: List[List[float]] = (
+        embed_texts_batched([chunks[pos] for pos in unique_positions], collection="docs")
+        if unique_positions
+        else []
+    )
+
+    # 5) Create the Document, its single section and the chunk rows
+    #    (duplicates keep a back-reference to their canonical chunk)
     document = models.Document(
         project_id=project_id,
         name=name,
         description=description,
     )
-    db.add(document)
-    _flush_with_retry(db)  # document.id is now available
-
-    # 3) Create a single section for the whole document
     section = models.DocumentSection(
-        document_id=document.id,
+        document=document,
         title=name,
         index=0,
         path=name,
     )
-    db.add(section)
-    _flush_with_retry(db)  # section.id is now available
-
-    # 4) Chunk the text
-    chunks: List[str] = _chunk_text(text, max_chars=max_chars, overlap=overlap)
-    if not chunks:
-        # No content; just commit the empty document + section
-        _commit_with_retry(db)
-        db.refresh(document)
-        return document, 0
-
-    # 5) Embed chunks in batches to respect token limits
-    embeddings: List[List[float]] = embed_texts_batched(chunks)
-
-    # 6) Create DocumentChunk rows and collect IDs
-    chunk_ids: List[int] = []
-    chunk_indexes: List[int] = list(range(len(chunks)))
-
-    for idx, chunk_text in enumerate(chunks):
+    chunk_rows: List[models.DocumentChunk] = []
+    for idx, (chunk_text, (content_hash, simhash, canonical_id, batch_match)) in enumerate(
+        zip(chunks, fingerprints)
+    ):
         chunk = models.DocumentChunk(
-            document_id=document.id,
-            section_id=section.id,
+            document=document,
+            section=section,
             index=idx,
             content=chunk_text,
+            content_hash=content_hash,
+            simhash=simhash,
+            duplicate_of_id=canonical_id,
         )
-        db.add(chunk)
-        _flush_with_retry(db)  # chunk.id is now available
-        chunk_ids.append(chunk.id)
+        if batch_match is not None:
+            chunk.duplicate_of = chunk_rows[batch_match]
+        chunk_rows.append(chunk)
+    db.add(document)
+    db.flush()  # document, section and chunk ids are now available
 
-    # Index in Chroma using the batch helper
-    add_document_chunks(
-        document_id=document.id,
-        project_id=project_id,
-        chunk_ids=chunk_ids,
-        chunk_indexes=chunk_indexes,
-        contents=chunks,
-        embeddings=embeddings,
-    )
+    unique_rows = [chunk_rows[pos] for pos in unique_positions]
+    register_canonical_chunks(project_id, unique_rows)
+
+    # Index only canonical chunks in Chroma using the batch helper
+    if unique_rows:
+        add_document_chunks(
+            document_id=document.id,
+            project_id=project_id,
+            chunk_ids=[chunk.id for chunk in unique_rows],
+            chunk_indexes=unique_positions,
+            contents=[chunks[pos] for pos in unique_positions],
+            embeddings=embeddings,
+        )
 
     # Final commit
-    _commit_with_retry(db)
+    db.commit()
     db.refresh(document)
 
     return document, len(chunks)
+
+
+def remove_document(db: Session, document: models.Document) -> int:
+    """
+    Delete a document's rows and its chunks' vectors. The caller commits.
+
+    Duplicates elsewhere in the project that relied on this document's chunks
+    for their vector are promoted to canonical and indexed first. If the
+    transaction is later rolled back, the vector reconciler
+    (app.vectorstore.reconcile) re-adds whatever was removed here.
+
+    Returns the number of vectors removed.
+    """
+    chunks = list(document.chunks)
+    promoted = promote_duplicates(db, document.project_id, [chunk.id for chunk in chunks])
+    if promoted:
+        embeddings = embed_texts_batched([chunk.content for chunk in promoted], collection="docs")
+        by_document: Dict[int, List[int]] = defaultdict(list)
+        for position, chunk in enumerate(promoted):
+            by_document[chunk.document_id].append(position)
+        for document_id, positions in by_document.items():
+            add_document_chunks(
+                document_id=document_id,
+                project_id=document.project_id,
+                chunk_ids=[promoted[p].id for p in positions],
+                chunk_indexes=[promoted[p].index for p in positions],
+                contents=[promoted[p].content for p in positions],
+                embeddings=[embeddings[p] for p in positions],
+            )
+
+    # Only canonical chunks were ever indexed.
+    indexed = [chunk.id for chunk in chunks if chunk.duplicate_of_id is None]
+    db.delete(document)
+    db.flush()
+    delete_document_chunks(indexed, document.project_id)
+    return len(indexed)
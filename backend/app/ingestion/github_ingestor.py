@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import os
 from pathlib import Path
 import hashlib
 from datetime import datetime, timezone
@@ -9,7 +8,12 @@ from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
 
 from app.db import models
-from app.ingestion.docs_ingestor import ingest_text_document
+from app.ingestion.content_classifier import classify_content, classify_path
+from app.ingestion.docs_ingestor import ingest_text_document, remove_document
+from app.ingestion.repo_discovery import (
+    DEFAULT_EXCLUDE_DIRS,  # noqa: F401 - re-exported for existing callers
+    discover_repo,
+)
 
 # Default patterns for files we consider "text/code" in a repo
 DEFAULT_INCLUDE_GLOBS: List[str] = [
@@ -26,25 +30,8 @@ DEFAULT_INCLUDE_GLOBS: List[str] = [
     "*.html",
 ]
 
-# Directories we usually want to skip in repos
-DEFAULT_EXCLUDE_DIRS = {
-    ".git",
-    ".idea",
-    ".vscode",
-    "__pycache__",
-    "node_modules",
-    "dist",
-    "build",
-}
-
-
-def _should_include_file(filename: str, include_globs: List[str]) -> bool:
-    """
-    Return True if the filename matches any of the glob patterns.
-    """
-    from fnmatch import fnmatch
-
-    return any(fnmatch(filename, pattern) for pattern in include_globs)
+# Cap on per-file skip entries kept in job meta; counts are always complete.
+_MAX_SKIPPED_FILES_IN_META = 200
 
 
 def discover_repo_files(
@@ -52,29 +39,15 @@ def discover_repo_files(
     include_globs: Optional[List[str]] = None,
 ) -> List[Path]:
     """
-    Walk the directory tree under root_path and collect files that match
-    the include_globs patterns, skipping typical junk directories.
+    Collect files under root_path that match the include_globs patterns,
+    honouring .gitignore/.ignore files and skipping typical junk directories.
+
+    See app.ingestion.repo_discovery.discover_repo for the git-index and
+    parallel scandir strategies.
     """
     if include_globs is None:
         include_globs = DEFAULT_INCLUDE_GLOBS
-
-    files: List[Path] = []
-
-    for dirpath, dirnames, filenames in os.walk(root_path):
-        # Remove excluded directories in-place (so os.walk won't descend into them)
-        dirnames[:] = [
-            d for d in dirnames
-            if d not in DEFAULT_EXCLUDE_DIRS and not d.startswith(".")
-        ]
-
-        for filename in filenames:
-            if not _should_include_file(filename, include_globs):
-                continue
-
-            full_path = Path(dirpath) / filename
-            files.append(full_path)
-
-    return files
+    return discover_repo(root_path, include_globs).files
 
 
 _INGEST_TELEMETRY: Dict[str, float] = {
@@ -199,7 +172,8 @@ def ingest_repo_job(
         raise ValueError(job.error_message)
 
     include_patterns = include_globs or DEFAULT_INCLUDE_GLOBS
-    all_files = discover_repo_files(root, include_patterns)
+    discovery = discover_repo(root, include_patterns)
+    all_files = discovery.files
     total_discovered = len(all_files)
 
     job.meta = {
@@ -207,6 +181,11 @@ def ingest_repo_job(
         "include_globs": include_patterns,
         "name_prefix": name_prefix,
         "num_files_discovered": total_discovered,
+        "discovery": {
+            "method": discovery.method,
+            "duration_ms": round(discovery.duration_seconds * 1000.0, 1),
+            "ignored_entries": discovery.ignored_entries,
+        },
     }
     db.commit()
 
@@ -219,18 +198,41 @@ def ingest_repo_job(
 
     files_to_process: List[Dict[str, Any]] = []
     total_bytes = 0
+    skipped_by_reason: Dict[str, int] = {}
+    skipped_samples: List[Dict[str, str]] = []
+
+    def _record_skip(rel_path: str, reason: str) -> None:
+        skipped_by_reason[reason] = skipped_by_reason.get(reason, 0) + 1
+        if len(skipped_samples) < _MAX_SKIPPED_FILES_IN_META:
+            skipped_samples.append({"path": rel_path, "reason": reason})
+
     for file_path in all_files:
+        rel_path = file_path.relative_to(root).as_posix()
         try:
-            text = file_path.read_text(encoding="utf-8", errors="ignore")
-        except Exception:
+            file_size = file_path.stat().st_size
+        except OSError:
             continue
 
-        rel_path = file_path.relative_to(root).as_posix()
+        # Classify before reading/embedding so binaries, lockfiles, bundles and
+        # generated code never cost embedding tokens or index space.
+        reason = classify_path(rel_path, file_size)
+        if reason is None:
+            try:
+                data = file_path.read_bytes()
+            except Exception:
+                continue
+            reason = classify_content(rel_path, data)
+        if reason is not None:
+            _record_skip(rel_path, reason)
+            continue
+
+        # Same newline normalization as read_text(): hashes stay stable across
+        # runs and chunks carry no stray carriage returns.
+        text = data.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
         sha = hashlib.sha256(text.encode("utf-8")).hexdigest()
         state = existing_states.get(rel_path)
         if state and state.sha256 == sha:
             continue
-        file_size = file_path.stat().st_size
         files_to_process.append(
             {
                 "relative_path": rel_path,
@@ -244,6 +246,12 @@ def ingest_repo_job(
     skipped_files = total_discovered - len(files_to_process)
     job.total_items = len(files_to_process)
     job.total_bytes = total_bytes
+    job.meta = {
+        **(job.meta or {}),
+        "files_filtered": sum(skipped_by_reason.values()),
+        "skipped_by_reason": skipped_by_reason,
+        "skipped_files": skipped_samples,
+    }
     db.commit()
 
     num_documents = 0
@@ -274,6 +282,19 @@ def ingest_repo_job(
             doc_name = f"{name_prefix}{rel_path}" if name_prefix else rel_path
             description = f"File from repo {root}: {rel_path}"
 
+            if rel_path in existing_states:
+                # The file changed since it was last ingested: drop the
+                # superseded document (and its vectors) before re-ingesting.
+                for stale_doc in (
+                    db.query(models.Document)
+                    .filter(
+                        models.Document.project_id == job.project_id,
+                        models.Document.name == doc_name,
+                    )
+                    .all()
+                ):
+                    remove_document(db, stale_doc)
+
             _, num_chunks = ingest_text_document(
                 db=db,
                 project_id=job.project_id,
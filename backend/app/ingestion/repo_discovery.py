@@ -0,0 +1,511 @@
+from __future__ import annotations
+
+import fnmatch
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Directories we usually want to skip in repos, even without ignore files.
+DEFAULT_EXCLUDE_DIRS = {
+    ".git",
+    ".idea",
+    ".vscode",
+    "__pycache__",
+    "node_modules",
+    "dist",
+    "build",
+    "venv",
+    "coverage",
+    "htmlcov",
+}
+
+# Ignore files honoured per directory, in increasing order of precedence.
+# `.ignore` follows the ripgrep/fd convention and overrides `.gitignore`.
+IGNORE_FILE_NAMES: Tuple[str, ...] = (".gitignore", ".ignore")
+
+_GIT_LS_FILES_TIMEOUT_SECONDS = 30
+
+
+def _default_max_workers() -> int:
+    raw = os.getenv("IW_INGEST_DISCOVERY_WORKERS")
+    if raw:
+        try:
+            return max(1, int(raw))
+        except ValueError:
+            pass
+    return min(16, (os.cpu_count() or 4) * 2)
+
+
+# --------------------------------------------------------------------
+# Include globs
+# --------------------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class IncludeMatcher:
+    """
+    All include globs compiled into (at most) two regexes.
+
+    Globs without a slash match the file name (the historical behaviour);
+    globs containing a slash match the repo-relative POSIX path.
+    """
+
+    name_regex: Optional[re.Pattern]
+    path_regex: Optional[re.Pattern]
+
+    def matches(self, filename: str, rel_path: str) -> bool:
+        if self.name_regex is not None and self.name_regex.match(filename):
+            return True
+        if self.path_regex is not None and self.path_regex.match(rel_path):
+            return True
+        return False
+
+
+def compile_include_globs(include_globs: Sequence[str]) -> IncludeMatcher:
+    """
+    Compile include globs into a single alternation per match target so each
+    file costs one regex match instead of one fnmatch call per glob.
+    """
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    name_parts: List[str] = []
+    path_parts: List[str] = []
+    for glob in include_globs:
+        glob = (glob or "").strip()
+        if not glob:
+            continue
+        target = path_parts if "/" in glob else name_parts
+        target.append(f"(?:{fnmatch.translate(glob.lstrip('/'))})")
+    return IncludeMatcher(
+        name_regex=re.compile("|".join(name_parts), flags) if name_parts else None,
+        path_regex=re.compile("|".join(path_parts), flags) if path_parts else None,
+    )
+
+
+# --------------------------------------------------------------------
+# .gitignore / .ignore rules
+# --------------------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class IgnoreRule:
+    regex: re.Pattern
+    negated: bool
+    dir_only: bool
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """
+    Translate a gitignore glob (already stripped of anchors/negation) into a
+    regex body matched against a path relative to the ignore file's folder.
+    """
+    out: List[str] = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        ch = pattern[i]
+        if ch == "*":
+            if pattern.startswith("**", i):
+                at_start = i == 0 or pattern[i - 1] == "/"
+                after = pattern[i + 2] if i + 2 < n else ""
+                if at_start and after == "/":
+                    out.append("(?:.*/)?")
+                    i += 3
+                    continue
+                if at_start and after == "":
+                    out.append(".*")
+                    i += 2
+                    continue
+            out.append("[^/]*")
+        elif ch == "?":
+            out.append("[^/]")
+        elif ch == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append(re.escape(ch))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end
+        elif ch == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(ch))
+        i += 1
+    return "".join(out)
+
+
+def parse_ignore_lines(lines: Iterable[str]) -> List[IgnoreRule]:
+    """
+    Parse gitignore-syntax lines into rules (blank lines and comments dropped).
+    """
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    rules: List[IgnoreRule] = []
+    for raw in lines:
+        line = raw.rstrip("\n").rstrip("\r")
+        if not line.endswith("\\ "):
+            line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negated = False
+        if line.startswith("!"):
+            negated = True
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        anchored = "/" in line
+        line = line.lstrip("/")
+        body = _glob_to_regex(line)
+        if not anchored:
+            body = "(?:.*/)?" + body
+        rules.append(
+            IgnoreRule(
+                regex=re.compile(f"^{body}$", flags),
+                negated=negated,
+                dir_only=dir_only,
+            )
+        )
+    return rules
+
+
+def load_ignore_rules(
+    directory: Path, file_names: Sequence[str] = IGNORE_FILE_NAMES
+) -> List[IgnoreRule]:
+    rules: List[IgnoreRule] = []
+    for name in file_names:
+        path = directory / name
+        try:
+            with path.open("r", encoding="utf-8", errors="ignore") as handle:
+                rules.extend(parse_ignore_lines(handle))
+        except OSError:
+            continue
+    return rules
+
+
+# A chain is the ordered list of (relative_dir, rules) that apply to one
+# directory, from the repo root down. Deeper files and later lines win.
+IgnoreChain = Tuple[Tuple[str, Tuple[IgnoreRule, ...]], ...]
+
+
+def is_ignored(chain: IgnoreChain, rel_path: str, is_dir: bool) -> bool:
+    """
+    Evaluate gitignore semantics for rel_path (POSIX, relative to repo root).
+    """
+    verdict = False
+    for base, rules in chain:
+        if base:
+            prefix = base + "/"
+            if not rel_path.startswith(prefix):
+                continue
+            local = rel_path[len(prefix):]
+        else:
+            local = rel_path
+        for rule in rules:
+            if rule.dir_only and not is_dir:
+                continue
+            if rule.regex.match(local):
+                verdict = not rule.negated
+    return verdict
+
+
+# --------------------------------------------------------------------
+# Discovery
+# --------------------------------------------------------------------
+
+
+@dataclass
+class RepoDiscovery:
+    """
+    Result of a discovery pass: matched files plus how they were found.
+    """
+
+    files: List[Path]
+    method: str
+    duration_seconds: float = 0.0
+    ignored_entries: int = 0
+    directories_scanned: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+def _is_excluded_dir_name(name: str) -> bool:
+    return name in DEFAULT_EXCLUDE_DIRS or name.startswith(".")
+
+
+def _scan_one_directory(
+    root: Path,
+    rel_dir: str,
+    parent_chain: IgnoreChain,
+    include: IncludeMatcher,
+    respect_ignore_files: bool,
+) -> Tuple[List[Path], List[Tuple[str, IgnoreChain]], int]:
+    """
+    Scan a single directory with os.scandir.
+
+    Returns (matched files, subdirectories to visit with their ignore chain,
+    number of ignored entries).
+    """
+    abs_dir = root / rel_dir if rel_dir else root
+    chain = parent_chain
+    if respect_ignore_files:
+        rules = load_ignore_rules(abs_dir)
+        if rules:
+            chain = parent_chain + ((rel_dir, tuple(rules)),)
+
+    files: List[Path] = []
+    subdirs: List[Tuple[str, IgnoreChain]] = []
+    ignored = 0
+    with os.scandir(abs_dir) as entries:
+        for entry in entries:
+            name = entry.name
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if _is_excluded_dir_name(name):
+                    ignored += 1
+                    continue
+                if chain and is_ignored(chain, rel_path, True):
+                    ignored += 1
+                    continue
+                subdirs.append((rel_path, chain))
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if not include.matches(name, rel_path):
+                continue
+            if chain and is_ignored(chain, rel_path, False):
+                ignored += 1
+                continue
+            files.append(Path(entry.path))
+    return files, subdirs, ignored
+
+
+def _root_chain(root: Path, respect_ignore_files: bool) -> IgnoreChain:
+    if not respect_ignore_files:
+        return ()
+    # Repo-local excludes behave like a root-level .gitignore.
+    info_rules = load_ignore_rules(root / ".git" / "info", ("exclude",))
+    return (("", tuple(info_rules)),) if info_rules else ()
+
+
+def _scan_tree(
+    root: Path,
+    include: IncludeMatcher,
+    respect_ignore_files: bool,
+    max_workers: int,
+) -> RepoDiscovery:
+    files: List[Path] = []
+    errors: List[str] = []
+    ignored_total = 0
+    scanned = 0
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="repo-discovery"
+    ) as pool:
+        pending: Dict[Future, str] = {
+            pool.submit(
+                _scan_one_directory,
+                root,
+                "",
+                _root_chain(root, respect_ignore_files),
+                include,
+                respect_ignore_files,
+            ): ""
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir = pending.pop(future)
+                scanned += 1
+                try:
+                    dir_files, subdirs, ignored = future.result()
+                except OSError as exc:
+                    errors.append(f"{rel_dir or '.'}: {exc}")
+                    continue
+                files.extend(dir_files)
+                ignored_total += ignored
+                for sub_rel, sub_chain in subdirs:
+                    pending[
+                        pool.submit(
+                            _scan_one_directory,
+                            root,
+                            sub_rel,
+                            sub_chain,
+                            include,
+                            respect_ignore_files,
+                        )
+                    ] = sub_rel
+
+    files.sort()
+    return RepoDiscovery(
+        files=files,
+        method="scan",
+        ignored_entries=ignored_total,
+        directories_scanned=scanned,
+        errors=errors,
+    )
+
+
+def _run_git(root: Path, *args: str) -> Optional[bytes]:
+    """
+    Run a git command in root; stdout on success, None on any failure.
+    """
+    try:
+        proc = subprocess.run(
+            ["git", "-C", str(root), *args],
+            capture_output=True,
+            timeout=_GIT_LS_FILES_TIMEOUT_SECONDS,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if proc.returncode != 0:
+        return None
+    return proc.stdout
+
+
+def _ignored_by_enclosing_repo(root: Path, toplevel: Path) -> bool:
+    try:
+        rel = root.resolve().relative_to(toplevel).as_posix()
+    except ValueError:
+        return False
+    # check-ignore exits 0 when the path is ignored, 1 when it is not.
+    return _run_git(toplevel, "check-ignore", "-q", "--", rel + "/") is not None
+
+
+def _git_ls_files(root: Path) -> Optional[List[str]]:
+    """
+    List tracked plus untracked-but-not-ignored files from the git index,
+    with the files of checked-out submodules in place of their gitlinks.
+
+    Returns None when git is unavailable, root is not inside a work tree, or
+    root is a directory the enclosing repository ignores (its index knows
+    nothing about those files; the caller scans instead).
+    """
+    if shutil.which("git") is None:
+        return None
+    top = _run_git(root, "rev-parse", "--show-toplevel")
+    if top is None:
+        return None
+    toplevel = Path(top.decode("utf-8", errors="surrogateescape").strip()).resolve()
+    if toplevel != root.resolve() and _ignored_by_enclosing_repo(root, toplevel):
+        return None
+    listed = _run_git(root, "ls-files", "-z", "--cached", "--others", "--exclude-standard")
+    if listed is None:
+        return None
+    raw = listed.decode("utf-8", errors="surrogateescape")
+    paths = {p for p in raw.split("\0") if p}
+    # ls-files lists a submodule as one gitlink entry (and --recurse-submodules
+    # cannot be combined with --others), so expand checked-out ones here.
+    for gitlink in [p for p in paths if (root / p / ".git").exists()]:
+        nested = _git_ls_files(root / gitlink)
+        if nested:
+            paths.discard(gitlink)
+            paths.update(f"{gitlink}/{p}" for p in nested)
+    return sorted(paths)
+
+
+def _filter_git_paths(
+    root: Path,
+    rel_paths: List[str],
+    include: IncludeMatcher,
+    respect_ignore_files: bool,
+) -> RepoDiscovery:
+    """
+    Apply the directory excludes, include globs and `.ignore` files (which git
+    itself does not know about) to a git-provided file list.
+    """
+    chain_cache: Dict[str, IgnoreChain] = {}
+
+    def chain_for(rel_dir: str) -> IgnoreChain:
+        cached = chain_cache.get(rel_dir)
+        if cached is not None:
+            return cached
+        if rel_dir:
+            parent_dir = rel_dir.rsplit("/", 1)[0] if "/" in rel_dir else ""
+            parent = chain_for(parent_dir)
+        else:
+            parent = ()
+        rules = load_ignore_rules(root / rel_dir, (".ignore",)) if respect_ignore_files else []
+        chain = parent + ((rel_dir, tuple(rules)),) if rules else parent
+        chain_cache[rel_dir] = chain
+        return chain
+
+    files: List[Path] = []
+    ignored = 0
+    for rel_path in rel_paths:
+        parts = rel_path.split("/")
+        if any(_is_excluded_dir_name(part) for part in parts[:-1]):
+            ignored += 1
+            continue
+        if not include.matches(parts[-1], rel_path):
+            continue
+        rel_dir = "/".join(parts[:-1])
+        chain = chain_for(rel_dir)
+        if chain:
+            ancestors = ["/".join(parts[:i]) for i in range(1, len(parts))]
+            if any(is_ignored(chain, a, True) for a in ancestors) or is_ignored(
+                chain, rel_path, False
+            ):
+                ignored += 1
+                continue
+        full_path = root / rel_path
+        if not full_path.is_file():
+            # Deleted from the work tree but still staged, or a submodule.
+            continue
+        files.append(full_path)
+    return RepoDiscovery(files=files, method="git", ignored_entries=ignored)
+
+
+def discover_repo(
+    root_path: Path,
+    include_globs: Sequence[str],
+    *,
+    respect_ignore_files: bool = True,
+    use_git_index: bool = True,
+    max_workers: Optional[int] = None,
+) -> RepoDiscovery:
+    """
+    Discover ingestible files under root_path.
+
+    When root_path is inside a git work tree, the file list comes from the git
+    index (tracked + untracked-not-ignored, including checked-out
+    submodules), which is both fast and exactly gitignore-correct. Otherwise
+    (including a root the enclosing repo ignores) the tree is scanned in
+    parallel with
+    os.scandir, honouring `.gitignore`/`.ignore` files hierarchically.
+    """
+    started = time.perf_counter()
+    root = Path(root_path)
+    include = compile_include_globs(include_globs)
+
+    result: Optional[RepoDiscovery] = None
+    if use_git_index and respect_ignore_files:
+        git_paths = _git_ls_files(root)
+        if git_paths is not None:
+            result = _filter_git_paths(root, git_paths, include, respect_ignore_files)
+    if result is None:
+        result = _scan_tree(
+            root,
+            include,
+            respect_ignore_files,
+            max_workers or _default_max_workers(),
+        )
+    result.duration_seconds = time.perf_counter() - started
+    return result
@@ -0,0 +1,418 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# Per-project LLM budgets enforced in front of every model call.
+#
+# Each (project, mode) pair gets a token bucket (tokens per minute) and a
+# concurrency cap; each project gets a dollars-per-day cap across all modes.
+# Over-budget work degrades instead of failing outright:
+#   - optional automations (auto-title, task upkeep) are skipped;
+#   - required calls wait for tokens / a free slot up to IW_LLM_QUEUE_TIMEOUT,
+#     then fall back to the budget-mode model (and, for concurrency, give up).
+#
+# Counters live in memory; today's per-(project, mode) token and dollar totals
+# are checkpointed to llm_budget_checkpoints so a restart does not hand out a
+# fresh daily budget.
+
+NO_PROJECT = 0
+BUDGET_MODE = "budget"
+
+_DEFAULT_QUEUE_TIMEOUT = 10.0
+_DEFAULT_CHECKPOINT_SECONDS = 30.0
+
+
+class BudgetExceeded(RuntimeError):
+    """
+    Raised when a call is skipped (optional work) or cannot be admitted.
+    """
+
+    def __init__(self, reason: str, project_id: Optional[int], mode: str) -> None:
+        super().__init__(f"LLM budget exceeded for project {project_id} ({mode}): {reason}")
+        self.reason = reason
+        self.project_id = project_id
+        self.mode = mode
+
+
+def _limit_env(name: str, mode: str, cast: Callable[[str], Any]) -> Optional[Any]:
+    # IW_LLM_TPM_FAST overrides IW_LLM_TPM; unset / 0 means unlimited.
+    for key in (f"{name}_{mode.upper()}", name):
+        raw = os.getenv(key)
+        if raw:
+            try:
+                value = cast(raw)
+            except ValueError:
+                print(f"[WARN] Ignoring invalid {key}={raw!r}")
+                continue
+            return value if value > 0 else None
+    return None
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+@dataclass(frozen=True)
+class BudgetLimits:
+    tokens_per_minute: Optional[int] = None
+    max_concurrency: Optional[int] = None
+    daily_usd: Optional[float] = None
+
+
+def env_limits(mode: str) -> BudgetLimits:
+    return BudgetLimits(
+        tokens_per_minute=_limit_env("IW_LLM_TPM", mode, int),
+        max_concurrency=_limit_env("IW_LLM_CONCURRENCY", mode, int),
+        daily_usd=_limit_env("IW_LLM_DAILY_USD", mode, float),
+    )
+
+
+class _TokenBucket:
+    def __init__(self, per_minute: int, now: float) -> None:
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.stamp = now
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_for(self, tokens: int, now: float) -> float:
+        """
+        Seconds until `tokens` are available (0 when they are now).
+        """
+        self._refill(now)
+        needed = min(float(tokens), self.capacity) - self.level
+        return 0.0 if needed <= 0 else needed / self.rate
+
+    def take(self, tokens: int, now: float) -> None:
+        # May go negative: admitted overdraft is paid back by later callers.
+        self._refill(now)
+        self.level -= tokens
+
+
+class _Usage:
+    __slots__ = ("bucket", "inflight", "day", "tokens", "cost", "dirty")
+
+    def __init__(self, day: date) -> None:
+        self.bucket: Optional[_TokenBucket] = None
+        self.inflight = 0
+        self.day = day
+        self.tokens = 0
+        self.cost = 0.0
+        self.dirty = False
+
+
+@dataclass
+class Lease:
+    project_id: int
+    mode: str
+    est_tokens: int
+    downgraded: bool = False
+    reason: Optional[str] = None
+
+
+class BudgetGateway:
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.monotonic,
+        today: Callable[[], date] = lambda: datetime.utcnow().date(),
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self._clock = clock
+        self._today = today
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._usage: Dict[Tuple[int, str], _Usage] = {}
+        self._project_daily: Dict[int, Optional[float]] = {}
+        self._last_checkpoint = clock()
+        self._stats = {"admitted": 0, "queued": 0, "downgraded": 0, "skipped": 0, "rejected": 0}
+        self.limits_for: Callable[[str], BudgetLimits] = env_limits
+        self._restored: Set[Tuple[int, date]] = set()
+        self.load_checkpoint: Optional[
+            Callable[[int, date], Dict[str, Tuple[int, float]]]
+        ] = None
+        self.save_checkpoint: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+
+    def _restore(self, project_id: int) -> None:
+        # First touch of a project (per day): pick up every mode's counters
+        # so the daily cap covers spend from before a restart. Call without
+        # self._cond held: the checkpoint read runs outside the lock so other
+        # admissions never wait on it, and is applied only if no other
+        # thread restored the project meanwhile.
+        today = self._today()
+        with self._cond:
+            if (project_id, today) in self._restored:
+                return
+        saved: Dict[str, Tuple[int, float]] = {}
+        if self.load_checkpoint is not None:
+            try:
+                saved = self.load_checkpoint(project_id, today)
+            except Exception as exc:  # noqa: BLE001
+                print(f"[WARN] Failed to load LLM budget checkpoint: {exc!r}")
+        with self._cond:
+            if (project_id, today) in self._restored:
+                return
+            self._restored.add((project_id, today))
+            for mode, (tokens, cost) in saved.items():
+                usage = self._usage.setdefault((project_id, mode), _Usage(today))
+                if usage.day == today and not usage.dirty and not usage.tokens:
+                    usage.tokens, usage.cost = tokens, cost
+
+    # -- bookkeeping (call with self._cond held) --------------------------
+
+    def _get(self, project_id: int, mode: str) -> _Usage:
+        today = self._today()
+        usage = self._usage.get((project_id, mode))
+        if usage is None:
+            usage = self._usage[(project_id, mode)] = _Usage(today)
+        elif usage.day != today:
+            usage.day, usage.tokens, usage.cost, usage.dirty = today, 0, 0.0, False
+        limits = self.limits_for(mode)
+        if limits.tokens_per_minute and (
+            usage.bucket is None or usage.bucket.capacity != limits.tokens_per_minute
+        ):
+            usage.bucket = _TokenBucket(limits.tokens_per_minute, self._clock())
+        elif not limits.tokens_per_minute:
+            usage.bucket = None
+        return usage
+
+    def _spent_today(self, project_id: int) -> float:
+        today = self._today()
+        return sum(
+            u.cost for (pid, _), u in self._usage.items() if pid == project_id and u.day == today
+        )
+
+    def set_project_daily_usd(self, project_id: Optional[int], daily_usd: Optional[float]) -> None:
+        """
+        Per-project $/day cap (overrides IW_LLM_DAILY_USD when set).
+        """
+        with self._cond:
+            self._project_daily[project_id or NO_PROJECT] = daily_usd or None
+
+    def _daily_limit(self, project_id: int, mode: str) -> Optional[float]:
+        return self._project_daily.get(project_id) or self.limits_for(mode).daily_usd
+
+    # -- admission ---------------------------------------------------------
+
+    def acquire(
+        self,
+        project_id: Optional[int],
+        mode: str,
+        est_tokens: int,
+        optional: bool = False,
+    ) -> Lease:
+        """
+        Admit one model call, waiting (queueing) when allowed.
+
+        Returns a Lease that must be passed to release(); `downgraded` tells
+        the caller to switch to the budget-mode model.
+        """
+        pid = project_id or NO_PROJECT
+        lease = Lease(project_id=pid, mode=mode, est_tokens=max(0, int(est_tokens)))
+        deadline = self._clock() + _float_env("IW_LLM_QUEUE_TIMEOUT", _DEFAULT_QUEUE_TIMEOUT)
+        self._restore(pid)
+        with self._cond:
+            daily = self._daily_limit(pid, mode)
+            if daily is not None and self._spent_today(pid) >= daily:
+                if optional:
+                    self._stats["skipped"] += 1
+                    raise BudgetExceeded("daily budget spent", project_id, mode)
+                lease.mode, lease.downgraded, lease.reason = BUDGET_MODE, True, "daily budget spent"
+
+            # Concurrency: queue for a slot.
+            while True:
+                usage = self._get(pid, lease.mode)
+                cap = self.limits_for(lease.mode).max_concurrency
+                if not cap or usage.inflight < cap:
+                    break
+                remaining = deadline - self._clock()
+                if optional or remaining <= 0:
+                    self._stats["skipped" if optional else "rejected"] += 1
+                    raise BudgetExceeded("too many concurrent calls", project_id, mode)
+                self._stats["queued"] += 1
+                self._cond.wait(remaining)
+            usage.inflight += 1
+
+        # Tokens per minute: wait for refill outside the lock.
+        try:
+            while True:
+                with self._cond:
+                    usage = self._get(pid, lease.mode)
+                    wait = 0.0
+                    if usage.bucket is not None:
+                        wait = usage.bucket.wait_for(lease.est_tokens, self._clock())
+                    if wait <= 0:
+                        if usage.bucket is not None:
+                            usage.bucket.take(lease.est_tokens, self._clock())
+                        break
+                    if optional:
+                        self._stats["skipped"] += 1
+                        raise BudgetExceeded("tokens per minute", project_id, mode)
+                    if self._clock() + wait > deadline:
+                        if lease.mode == BUDGET_MODE:
+                            # Already on the cheapest tier: admit on overdraft.
+                            if usage.bucket is not None:
+                                usage.bucket.take(lease.est_tokens, self._clock())
+                            break
+                        usage.inflight -= 1
+                        self._get(pid, BUDGET_MODE).inflight += 1
+                        lease.mode, lease.downgraded = BUDGET_MODE, True
+                        lease.reason = "tokens per minute"
+                        self._cond.notify_all()
+                        continue
+                    self._stats["queued"] += 1
+                self._sleep(wait)
+        except BaseException:
+            with self._cond:
+                self._get(pid, lease.mode).inflight -= 1
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            self._stats["admitted"] += 1
+            if lease.downgraded:
+                self._stats["downgraded"] += 1
+        return lease
+
+    def release(self, lease: Lease, tokens: Optional[int] = None, cost: float = 0.0) -> None:
+        """
+        Return the slot and settle the actual usage of the call.
+        """
+        actual = lease.est_tokens if tokens is None else max(0, int(tokens))
+        self._restore(lease.project_id)
+        with self._cond:
+            usage = self._get(lease.project_id, lease.mode)
+            usage.inflight = max(0, usage.inflight - 1)
+            if usage.bucket is not None:
+                usage.bucket.take(actual - lease.est_tokens, self._clock())
+            usage.tokens += actual
+            usage.cost += float(cost or 0.0)
+            usage.dirty = True
+            self._cond.notify_all()
+        interval = _float_env("IW_LLM_BUDGET_CHECKPOINT_SECONDS", _DEFAULT_CHECKPOINT_SECONDS)
+        if self._clock() - self._last_checkpoint >= interval:
+            self.checkpoint()
+
+    # -- persistence / introspection --------------------------------------
+
+    def checkpoint(self) -> int:
+        """
+        Persist today's dirty counters; returns the number of rows written.
+        """
+        with self._cond:
+            self._last_checkpoint = self._clock()
+            rows = [
+                {"project_id": pid, "mode": mode, "day": u.day, "tokens": u.tokens, "cost_usd": u.cost}
+                for (pid, mode), u in self._usage.items()
+                if u.dirty
+            ]
+            for u in self._usage.values():
+                u.dirty = False
+        if rows and self.save_checkpoint is not None:
+            try:
+                self.save_checkpoint(rows)
+            except Exception as exc:  # noqa: BLE001
+                print(f"[WARN] Failed to checkpoint LLM budgets: {exc!r}")
+                with self._cond:
+                    for row in rows:
+                        usage = self._usage.get((row["project_id"], row["mode"]))
+                        if usage is not None:
+                            usage.dirty = True
+                return 0
+        return len(rows)
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Any]:
+        with self._cond:
+            usage = [
+                {
+                    "project_id": pid,
+                    "mode": mode,
+                    "day": u.day.isoformat(),
+                    "tokens": u.tokens,
+                    "cost_usd": u.cost,
+                    "inflight": u.inflight,
+                    "bucket_tokens": None if u.bucket is None else max(0.0, u.bucket.level),
+                }
+                for (pid, mode), u in self._usage.items()
+            ]
+            snapshot = {**self._stats, "usage": usage}
+            if reset:
+                for key in self._stats:
+                    self._stats[key] = 0
+        return snapshot
+
+    def reset(self) -> None:
+        with self._cond:
+            self._usage.clear()
+            self._project_daily.clear()
+            self._restored.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+
+
+# ---------------------------------------------------------------------------
+# DB checkpoint wiring
+# ---------------------------------------------------------------------------
+
+
+def _load_from_db(project_id: int, day: date) -> Dict[str, Tuple[int, float]]:
+    from app.db import models
+    from app.db import session as db_session
+
+    db = db_session.SessionLocal()
+    try:
+        rows = (
+            db.query(models.LlmBudgetCheckpoint)
+            .filter_by(project_id=project_id, day=day)
+            .all()
+        )
+        return {row.mode: (row.tokens, row.cost_usd) for row in rows}
+    finally:
+        db.close()
+
+
+def _save_to_db(rows: List[Dict[str, Any]]) -> None:
+    from app.db import models
+    from app.db.write_lane import run_write
+
+    table = models.LlmBudgetCheckpoint.__table__
+
+    def _write(session) -> None:
+        if session.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        now = datetime.utcnow()
+        for row in rows:
+            stmt = dialect_insert(table).values(**row, updated_at=now)
+            session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["project_id", "mode", "day"],
+                    set_={
+                        "tokens": stmt.excluded.tokens,
+                        "cost_usd": stmt.excluded.cost_usd,
+                        "updated_at": stmt.excluded.updated_at,
+                    },
+                )
+            )
+
+    run_write(_write)
+
+
+BUDGETS = BudgetGateway()
+BUDGETS.load_checkpoint = _load_from_db
+BUDGETS.save_checkpoint = _save_to_db
+
+
+def get_budget_stats(reset: bool = False) -> Dict[str, Any]:
+    return BUDGETS.snapshot(reset=reset)
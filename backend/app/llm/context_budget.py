@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional
+
+from app.observability.metrics import CONTEXT_SNIPPETS
+
+# Retrieval context assembly for /chat.
+#
+# Candidates from the messages, docs and memory collections go through:
+#   1. a per-source distance cutoff (IW_CONTEXT_MAX_DISTANCE_<SOURCE>).
+#      Distances are squared L2; every built-in embedding provider returns
+#      unit vectors, for which d = 2 - 2*cos, so 1.4 means cos >= 0.3.
+#      Relevance is 1 - d / cutoff, which puts the sources on one scale;
+#   2. a per-source cap that scales with the query (a greeting gets two
+#      snippets per source, a long multi-part question up to
+#      IW_CONTEXT_MAX_K);
+#   3. maximal marginal relevance: the next snippet is the one with the best
+#      lambda * relevance - (1 - lambda) * similarity to what is already
+#      selected (word-set Jaccard; vectors are not fetched back), and
+#      near-copies of a selected snippet are dropped;
+#   4. packing into IW_CONTEXT_TOKEN_BUDGET estimated tokens in that order;
+#      a snippet that does not fit is cut to the space left, or skipped when
+#      too little is left to be useful.
+# Every snippet is first capped at IW_CONTEXT_SNIPPET_TOKENS.
+
+SOURCES = ("messages", "docs", "memory")
+_HEADINGS = {
+    "messages": "Relevant past messages:",
+    "docs": "Relevant document excerpts:",
+    "memory": "Relevant project memories:",
+}
+_DEFAULT_MAX_DISTANCE = {"messages": 1.2, "docs": 1.4, "memory": 1.4}
+_DEFAULT_TOKEN_BUDGET = 1200
+_DEFAULT_SNIPPET_TOKENS = 300
+_DEFAULT_MAX_K = 8
+_DEFAULT_MMR_LAMBDA = 0.7
+_MIN_K = 2
+_WORDS_PER_EXTRA_HIT = 6
+_REDUNDANT_SIMILARITY = 0.8
+_MIN_FIT_TOKENS = 48
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+@dataclass(frozen=True)
+class ContextLimits:
+    token_budget: int
+    snippet_tokens: int
+    max_k: int
+    mmr_lambda: float
+    max_distance: Dict[str, float]
+
+
+def env_limits() -> ContextLimits:
+    return ContextLimits(
+        token_budget=max(0, _env_int("IW_CONTEXT_TOKEN_BUDGET", _DEFAULT_TOKEN_BUDGET)),
+        snippet_tokens=max(_MIN_FIT_TOKENS, _env_int("IW_CONTEXT_SNIPPET_TOKENS", _DEFAULT_SNIPPET_TOKENS)),
+        max_k=max(_MIN_K, _env_int("IW_CONTEXT_MAX_K", _DEFAULT_MAX_K)),
+        mmr_lambda=min(1.0, max(0.0, _env_float("IW_CONTEXT_MMR_LAMBDA", _DEFAULT_MMR_LAMBDA))),
+        max_distance={
+            source: _env_float(f"IW_CONTEXT_MAX_DISTANCE_{source.upper()}", default)
+            for source, default in _DEFAULT_MAX_DISTANCE.items()
+        },
+    )
+
+
+def fetch_k(limits: Optional[ContextLimits] = None) -> int:
+    """
+    How many hits to ask each collection for: the largest adaptive k plus
+    headroom for the cutoff and redundancy filters.
+    """
+    limits = limits or env_limits()
+    return limits.max_k + 4
+
+
+def adaptive_k(query: str, limits: Optional[ContextLimits] = None) -> int:
+    limits = limits or env_limits()
+    words = len(_WORD.findall(query or ""))
+    return max(_MIN_K, min(limits.max_k, _MIN_K + words // _WORDS_PER_EXTRA_HIT))
+
+
+@dataclass
+class Candidate:
+    source: str
+    label: str
+    text: str
+    distance: float
+    relevance: float = 0.0
+    words: FrozenSet[str] = field(default_factory=frozenset)
+
+    def render(self) -> str:
+        return f"{self.label} {self.text}"
+
+
+@dataclass
+class ContextSelection:
+    selected: List[Candidate]
+    stats: Dict[str, int]
+
+    @property
+    def tokens(self) -> int:
+        return sum(estimate_tokens(c.render()) for c in self.selected)
+
+    def sections(self) -> List[str]:
+        """
+        One block per source, in SOURCES order, best snippet first.
+        """
+        out: List[str] = []
+        for source in SOURCES:
+            snippets = [c.render() for c in self.selected if c.source == source]
+            if snippets:
+                out.append(_HEADINGS[source] + "\n" + "\n\n".join(snippets))
+        return out
+
+
+def _truncate(text: str, tokens: int) -> str:
+    limit = max(0, tokens * 4 - 4)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    space = cut.rfind(" ")
+    if space > limit // 2:
+        cut = cut[:space]
+    return cut.rstrip() + " …"
+
+
+def _similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def assemble(
+    query: str,
+    candidates: List[Candidate],
+    limits: Optional[ContextLimits] = None,
+) -> ContextSelection:
+    """
+    Pick and order the snippets that go into the prompt (see module comment).
+    """
+    limits = limits or env_limits()
+    stats = {"candidates": len(candidates), "below_threshold": 0, "redundant": 0, "over_k": 0, "over_budget": 0}
+    pool: List[Candidate] = []
+    for candidate in candidates:
+        cutoff = limits.max_distance.get(candidate.source, 0.0)
+        if cutoff <= 0 or candidate.distance > cutoff:
+            stats["below_threshold"] += 1
+            CONTEXT_SNIPPETS.inc(source=candidate.source, outcome="below_threshold")
+            continue
+        candidate.relevance = 1.0 - max(0.0, candidate.distance) / cutoff
+        candidate.text = _truncate(candidate.text, limits.snippet_tokens)
+        candidate.words = frozenset(w.lower() for w in _WORD.findall(candidate.text) if len(w) > 2)
+        pool.append(candidate)
+
+    k = adaptive_k(query, limits)
+    per_source: Dict[str, int] = {}
+    selected: List[Candidate] = []
+    tokens_left = limits.token_budget
+    while pool:
+        best_index, best_score, best_overlap = 0, float("-inf"), 0.0
+        for index, candidate in enumerate(pool):
+            overlap = max((_similarity(candidate.words, s.words) for s in selected), default=0.0)
+            score = limits.mmr_lambda * candidate.relevance - (1.0 - limits.mmr_lambda) * overlap
+            if score > best_score:
+                best_index, best_score, best_overlap = index, score, overlap
+        candidate = pool.pop(best_index)
+        if best_overlap >= _REDUNDANT_SIMILARITY:
+            outcome = "redundant"
+        elif per_source.get(candidate.source, 0) >= k:
+            outcome = "over_k"
+        else:
+            cost = estimate_tokens(candidate.render())
+            if cost > tokens_left:
+                room = tokens_left - estimate_tokens(candidate.label + " ")
+                if room >= _MIN_FIT_TOKENS:
+                    candidate.text = _truncate(candidate.text, room)
+                    cost = estimate_tokens(candidate.render())
+            if cost > tokens_left:
+                outcome = "over_budget"
+            else:
+                outcome = "selected"
+                tokens_left -= cost
+                per_source[candidate.source] = per_source.get(candidate.source, 0) + 1
+                selected.append(candidate)
+        if outcome != "selected":
+            stats[outcome] += 1
+        CONTEXT_SNIPPETS.inc(source=candidate.source, outcome=outcome)
+
+    return ContextSelection(selected=selected, stats=stats)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Set
+
+from app.llm.context_budget import Candidate, ContextLimits
+from app.llm.embedding_providers import HASHED_NGRAM_MODEL, provider_for
+from app.llm.embeddings import EmbeddingSpec
+from app.observability.metrics import CONTEXT_COMPRESSION
+
+# Query-focused extractive compression of retrieved document chunks, run
+# before the context budgeter (app.llm.context_budget).
+#
+# A chunk is split into spans: fenced code blocks stay whole (or split at
+# blank lines when long), code-like text splits into blank-line blocks of a
+# few lines, prose into sentences and list items. Each span is scored as
+#
+#   0.5 * cosine(query, span) + 0.5 * idf-weighted share of query terms
+#
+# with span vectors from the local hashed n-gram model (no network, no LLM
+# call). When the docs collection itself uses that model the query vector
+# /chat already computed is reused; otherwise the query is hashed once. The
+# top IW_CONTEXT_COMPRESS_SPANS spans are kept with
+# IW_CONTEXT_COMPRESS_NEIGHBOURS spans of context on each side, in their
+# original order, with "…" marking the gaps. Chunks shorter than
+# IW_CONTEXT_COMPRESS_MIN_CHARS, or that would not shrink by a fifth, are
+# left alone.
+
+_DEFAULT_SPANS = 3
+_DEFAULT_NEIGHBOURS = 1
+_DEFAULT_MIN_CHARS = 600
+_MIN_SAVING = 0.2
+_SEMANTIC_WEIGHT = 0.5
+_CODE_BLOCK_LINES = 6
+_LONG_SPAN_CHARS = 600
+_GAP = "…"
+
+_FENCE = re.compile(r"```.*?(?:```|\Z)", re.DOTALL)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(\[`*_-])")
+_LIST_ITEM = re.compile(r"\n(?=\s*(?:[-*+]|\d+[.)])\s)")
+_BLANK_LINES = re.compile(r"\n\s*\n")
+_TERM = re.compile(r"[A-Za-z_][A-Za-z0-9_]{2,}")
+_CODE_HINT = re.compile(r"[{};=]|^\s*(?:def|class|import|from|return|function|const|let|var|if|for)\b", re.MULTILINE)
+_STOP_TERMS = frozenset(
+    "and are but can did does for from had has have how into its not our she that the their them then "
+    "there these they this was were what when where which who why will with you your".split()
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _enabled() -> bool:
+    return os.getenv("IW_CONTEXT_COMPRESS", "1").strip().lower() not in {"0", "false", "no", "off"}
+
+
+def _terms(text: str) -> Set[str]:
+    return {t.lower() for t in _TERM.findall(text)} - _STOP_TERMS
+
+
+def _looks_like_code(text: str) -> bool:
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) < 4:
+        return False
+    return len(_CODE_HINT.findall(text)) >= len(lines) // 3
+
+
+def _line_groups(text: str) -> List[str]:
+    lines = text.splitlines()
+    return [
+        "\n".join(lines[i:i + _CODE_BLOCK_LINES])
+        for i in range(0, len(lines), _CODE_BLOCK_LINES)
+    ]
+
+
+def _split_code(text: str) -> List[str]:
+    spans: List[str] = []
+    for block in _BLANK_LINES.split(text):
+        if not block.strip():
+            continue
+        spans.extend(_line_groups(block) if len(block) > _LONG_SPAN_CHARS else [block])
+    return spans
+
+
+def _split_prose(text: str) -> List[str]:
+    spans: List[str] = []
+    for paragraph in _BLANK_LINES.split(text):
+        for item in _LIST_ITEM.split(paragraph):
+            spans.extend(s for s in _SENTENCE_END.split(item) if s.strip())
+    return spans
+
+
+def _split_text(text: str) -> List[str]:
+    if not text.strip():
+        return []
+    return _split_code(text) if _looks_like_code(text) else _split_prose(text)
+
+
+def split_spans(text: str) -> List[str]:
+    """
+    Sentences, list items and code blocks of `text`, in order.
+    """
+    spans: List[str] = []
+    position = 0
+    for fence in _FENCE.finditer(text):
+        spans.extend(_split_text(text[position:fence.start()]))
+        block = fence.group(0)
+        spans.extend(_split_code(block) if len(block) > _LONG_SPAN_CHARS else [block])
+        position = fence.end()
+    spans.extend(_split_text(text[position:]))
+    return [span.strip() for span in spans if span.strip()]
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _select(scores: List[float], keep: int, neighbours: int) -> List[int]:
+    top = sorted(range(len(scores)), key=lambda i: (-scores[i], i))[:keep]
+    chosen: Set[int] = set()
+    for index in top:
+        chosen.update(range(max(0, index - neighbours), min(len(scores), index + neighbours + 1)))
+    return sorted(chosen)
+
+
+def _join(spans: List[str], indexes: List[int]) -> str:
+    parts = [_GAP] if indexes[0] > 0 else []
+    for position, index in enumerate(indexes):
+        if position and index != indexes[position - 1] + 1:
+            parts.append(_GAP)
+        parts.append(spans[index])
+    if indexes[-1] < len(spans) - 1:
+        parts.append(_GAP)
+    # Code keeps its line structure; sentences run on.
+    separator = "\n" if any("\n" in spans[i] for i in indexes) else " "
+    return separator.join(parts)
+
+
+def compress_candidates(
+    query: str,
+    candidates: List[Candidate],
+    limits: ContextLimits,
+    query_vector: Optional[List[float]] = None,
+    spec: Optional[EmbeddingSpec] = None,
+) -> Dict[str, int]:
+    """
+    Shrink the docs candidates that pass the distance cutoff in place.
+    `query_vector` / `spec` are the query embedding /chat computed for the
+    docs collection and the spec it was made with.
+    """
+    stats = {"compressed": 0, "chars_before": 0, "chars_after": 0}
+    if not _enabled():
+        return stats
+    min_chars = _env_int("IW_CONTEXT_COMPRESS_MIN_CHARS", _DEFAULT_MIN_CHARS)
+    cutoff = limits.max_distance.get("docs", 0.0)
+    chunks = [
+        c for c in candidates
+        if c.source == "docs" and c.distance <= cutoff and len(c.text) >= min_chars
+    ]
+    if not chunks:
+        return stats
+
+    split = [split_spans(c.text) for c in chunks]
+    all_spans = [span for spans in split for span in spans]
+    if not all_spans:
+        return stats
+    hashed = provider_for(HASHED_NGRAM_MODEL)
+    dimensions = spec.dimensions if spec is not None and spec.model == HASHED_NGRAM_MODEL else None
+    if query_vector is None or spec is None or spec.model != HASHED_NGRAM_MODEL:
+        query_vector = hashed.embed(HASHED_NGRAM_MODEL, [query], None)[0]
+    span_vectors = hashed.embed(HASHED_NGRAM_MODEL, all_spans, dimensions)
+
+    query_terms = _terms(query)
+    span_terms = [_terms(span) for span in all_spans]
+    idf = {
+        term: math.log(1.0 + len(all_spans) / (1 + sum(term in terms for terms in span_terms)))
+        for term in query_terms
+    }
+    total_idf = sum(idf.values()) or 1.0
+    keep = max(1, _env_int("IW_CONTEXT_COMPRESS_SPANS", _DEFAULT_SPANS))
+    neighbours = max(0, _env_int("IW_CONTEXT_COMPRESS_NEIGHBOURS", _DEFAULT_NEIGHBOURS))
+
+    offset = 0
+    for candidate, spans in zip(chunks, split):
+        scores = [
+            _SEMANTIC_WEIGHT * _cosine(query_vector, span_vectors[offset + i])
+            + (1.0 - _SEMANTIC_WEIGHT) * sum(idf[t] for t in query_terms & span_terms[offset + i]) / total_idf
+            for i in range(len(spans))
+        ]
+        offset += len(spans)
+        if len(spans) <= keep:
+            continue
+        compressed = _join(spans, _select(scores, keep, neighbours))
+        if len(compressed) > (1.0 - _MIN_SAVING) * len(candidate.text):
+            continue
+        stats["compressed"] += 1
+        stats["chars_before"] += len(candidate.text)
+        stats["chars_after"] += len(compressed)
+        candidate.text = compressed
+
+    CONTEXT_COMPRESSION.inc(stats["chars_before"], stage="before")
+    CONTEXT_COMPRESSION.inc(stats["chars_after"], stage="after")
+    return stats
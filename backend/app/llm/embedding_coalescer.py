@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.observability.metrics import EMBED_COALESCED
+
+# Coalescing of single-text embedding requests (query embeddings from /chat
+# and /search/*).
+#
+#   - Single flight: a text already being embedded with the same model and
+#     dimensions is not sent again; the caller waits for the in-flight result.
+#   - Micro-batching: the first request for a model opens a batch and, if
+#     other requests are in flight, holds it open for up to
+#     IW_EMBED_COALESCE_WINDOW_MS (or until IW_EMBED_COALESCE_MAX_BATCH texts
+#     joined), then sends one API call for everything that joined. A request
+#     arriving while nothing else is in flight is sent at once, so idle and
+#     low-traffic servers pay no extra latency.
+#
+# The thread that opened a batch makes the call; there is no background
+# worker.
+
+_DEFAULT_WINDOW_MS = 2.0
+_DEFAULT_MAX_BATCH = 64
+
+_Key = Tuple[str, Optional[int]]
+EmbedBatch = Callable[[str, Optional[int], List[str]], List[List[float]]]
+
+
+def _window_seconds() -> float:
+    try:
+        return max(0.0, float(os.getenv("IW_EMBED_COALESCE_WINDOW_MS", _DEFAULT_WINDOW_MS))) / 1000.0
+    except (TypeError, ValueError):
+        return _DEFAULT_WINDOW_MS / 1000.0
+
+
+def _max_batch() -> int:
+    try:
+        return max(1, int(os.getenv("IW_EMBED_COALESCE_MAX_BATCH", _DEFAULT_MAX_BATCH)))
+    except (TypeError, ValueError):
+        return _DEFAULT_MAX_BATCH
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.futures: Dict[str, Future] = {}
+        self.full = threading.Event()
+
+
+class EmbeddingCoalescer:
+    """
+    Single-flight plus micro-batching in front of an embed(model, dimensions,
+    texts) function.
+    """
+
+    def __init__(self, embed_batch: EmbedBatch) -> None:
+        self._embed_batch = embed_batch
+        self._lock = threading.Lock()
+        self._open: Dict[_Key, _Batch] = {}
+        self._inflight: Dict[Tuple[str, Optional[int], str], Future] = {}
+        self._active = 0
+
+    def embed(self, model: str, dimensions: Optional[int], text: str) -> List[float]:
+        key: _Key = (model, dimensions)
+        batch: Optional[_Batch] = None
+        wait = 0.0
+        with self._lock:
+            future = self._inflight.get((model, dimensions, text))
+            if future is not None:
+                EMBED_COALESCED.inc(outcome="shared")
+            else:
+                future = Future()
+                self._inflight[(model, dimensions, text)] = future
+                joined = self._open.get(key)
+                if joined is None:
+                    batch = joined = _Batch()
+                    if self._active > 0:
+                        wait = _window_seconds()
+                        if wait > 0:
+                            self._open[key] = joined
+                joined.futures[text] = future
+                if len(joined.futures) >= _max_batch():
+                    if self._open.get(key) is joined:
+                        del self._open[key]
+                    joined.full.set()
+            self._active += 1
+        try:
+            if batch is not None:
+                if wait > 0:
+                    batch.full.wait(wait)
+                with self._lock:
+                    if self._open.get(key) is batch:
+                        del self._open[key]
+                    texts = list(batch.futures)
+                self._dispatch(key, batch, texts)
+            return list(future.result())
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _dispatch(self, key: _Key, batch: _Batch, texts: List[str]) -> None:
+        model, dimensions = key
+        EMBED_COALESCED.inc(len(texts), outcome="batched" if len(texts) > 1 else "direct")
+        try:
+            vectors = self._embed_batch(model, dimensions, texts)
+            if len(vectors) != len(texts):
+                raise RuntimeError(f"Expected {len(texts)} embeddings, got {len(vectors)}.")
+            for text, vector in zip(texts, vectors):
+                batch.futures[text].set_result(vector)
+        except BaseException as exc:  # noqa: BLE001
+            for future in batch.futures.values():
+                if not future.done():
+                    future.set_exception(exc)
+        finally:
+            with self._lock:
+                for text in texts:
+                    self._inflight.pop((model, dimensions, text), None)
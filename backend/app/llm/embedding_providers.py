@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from app.llm.openai_client import get_client
+
+# Embedding providers. An embedding model name picks its provider:
+#
+#   local-hashed-ngram   built in, CPU only, no network: hashed word,
+#                        word-bigram and character n-gram features with
+#                        sublinear TF weighting, projected to `dimensions`
+#                        (default 384) by signed feature hashing, a fixed
+#                        sparse random projection. About a millisecond per
+#                        query; lexical rather than semantic similarity.
+#   local:<path>         a sentence-transformers model loaded from a local
+#                        directory (optional dependency), run on CPU.
+#   anything else        the OpenAI embeddings API (or the LLM_MODE=stub
+#                        client).
+#
+# Which model each vector collection uses is recorded per collection in
+# app.vectorstore.registry; app.llm.embeddings routes every call here.
+
+HASHED_NGRAM_MODEL = "local-hashed-ngram"
+LOCAL_MODEL_PREFIX = "local:"
+
+# Native output sizes; text-embedding-3 models can be shortened with the
+# API's `dimensions` parameter.
+_OPENAI_DIMENSIONS: Dict[str, int] = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+_REDUCIBLE_PREFIX = "text-embedding-3"
+
+_HASHED_DEFAULT_DIMENSIONS = 384
+_HASHED_MIN_DIMENSIONS = 16
+_HASHED_MAX_DIMENSIONS = 8192
+_WORD = re.compile(r"\w+", re.UNICODE)
+_STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the "
+    "this to was were will with".split()
+)
+_CHAR_NGRAMS = (3, 4)
+_CHAR_WEIGHT = 0.5
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into vectors for the models it handles.
+    """
+
+    name = "base"
+    # Worth micro-batching concurrent single-text requests (network calls).
+    coalesce = False
+
+    def handles(self, model: str) -> bool:
+        raise NotImplementedError
+
+    def native_dimensions(self, model: str) -> Optional[int]:
+        return None
+
+    def validate(self, model: str, dimensions: Optional[int]) -> Optional[int]:
+        """
+        Check that `model` can produce `dimensions`; returns the normalized
+        value (None for the native size). Raises ValueError.
+        """
+        if dimensions is not None:
+            raise ValueError(f"{model} does not support the dimensions parameter.")
+        return None
+
+    def embed(self, model: str, texts: List[str], dimensions: Optional[int]) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+    coalesce = True
+
+    def handles(self, model: str) -> bool:
+        return True
+
+    def native_dimensions(self, model: str) -> Optional[int]:
+        return _OPENAI_DIMENSIONS.get(model)
+
+    def validate(self, model: str, dimensions: Optional[int]) -> Optional[int]:
+        if dimensions is None:
+            return None
+        native = _OPENAI_DIMENSIONS.get(model)
+        if dimensions <= 0:
+            raise ValueError("dimensions must be positive.")
+        if not model.startswith(_REDUCIBLE_PREFIX):
+            raise ValueError(f"{model} does not support the dimensions parameter.")
+        if native is not None and dimensions > native:
+            raise ValueError(f"{model} produces at most {native} dimensions.")
+        return None if dimensions == native else dimensions
+
+    def embed(self, model: str, texts: List[str], dimensions: Optional[int]) -> List[List[float]]:
+        kwargs: Dict[str, Any] = {"model": model, "input": texts}
+        if dimensions is not None:
+            kwargs["dimensions"] = dimensions
+        response = get_client().embeddings.create(**kwargs)
+        return [item.embedding for item in response.data]
+
+
+class HashedNgramEmbeddingProvider(EmbeddingProvider):
+    name = "hashed-ngram"
+
+    def handles(self, model: str) -> bool:
+        return model == HASHED_NGRAM_MODEL
+
+    def native_dimensions(self, model: str) -> Optional[int]:
+        return _HASHED_DEFAULT_DIMENSIONS
+
+    def validate(self, model: str, dimensions: Optional[int]) -> Optional[int]:
+        if dimensions is None:
+            return None
+        if not _HASHED_MIN_DIMENSIONS <= dimensions <= _HASHED_MAX_DIMENSIONS:
+            raise ValueError(
+                f"{model} supports {_HASHED_MIN_DIMENSIONS}..{_HASHED_MAX_DIMENSIONS} dimensions."
+            )
+        return None if dimensions == _HASHED_DEFAULT_DIMENSIONS else dimensions
+
+    def embed(self, model: str, texts: List[str], dimensions: Optional[int]) -> List[List[float]]:
+        size = dimensions or _HASHED_DEFAULT_DIMENSIONS
+        return [_hashed_vector(text, size) for text in texts]
+
+
+def _features(text: str) -> Counter:
+    words = [w for w in _WORD.findall((text or "").lower()) if w not in _STOP_WORDS]
+    features: Counter = Counter()
+    for word in words:
+        features["w " + word] += 1.0
+        padded = f"<{word}>"
+        for n in _CHAR_NGRAMS:
+            for start in range(len(padded) - n + 1):
+                features["c " + padded[start:start + n]] += _CHAR_WEIGHT
+    for first, second in zip(words, words[1:]):
+        features[f"b {first} {second}"] += 1.0
+    return features
+
+
+def _hashed_vector(text: str, size: int) -> List[float]:
+    vector = [0.0] * size
+    for feature, count in _features(text).items():
+        digest = zlib.crc32(feature.encode("utf-8"))
+        weight = 1.0 + math.log(count) if count >= 1.0 else count
+        if digest & 0x80000000:
+            weight = -weight
+        vector[digest % size] += weight
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm == 0.0:
+        return vector
+    return [value / norm for value in vector]
+
+
+class LocalModelEmbeddingProvider(EmbeddingProvider):
+    """
+    sentence-transformers models loaded from a local path ("local:/models/x").
+    """
+
+    name = "local-model"
+
+    def __init__(self) -> None:
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def handles(self, model: str) -> bool:
+        return model.startswith(LOCAL_MODEL_PREFIX)
+
+    def validate(self, model: str, dimensions: Optional[int]) -> Optional[int]:
+        path = model[len(LOCAL_MODEL_PREFIX):]
+        if not os.path.exists(path):
+            raise ValueError(f"Local embedding model not found at {path!r}.")
+        return super().validate(model, dimensions)
+
+    def _load(self, model: str) -> Any:
+        with self._lock:
+            loaded = self._models.get(model)
+            if loaded is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError as exc:
+                    raise RuntimeError(
+                        "Local embedding models need sentence-transformers "
+                        "(pip install sentence-transformers)."
+                    ) from exc
+                loaded = SentenceTransformer(model[len(LOCAL_MODEL_PREFIX):], device="cpu")
+                self._models[model] = loaded
+            return loaded
+
+    def embed(self, model: str, texts: List[str], dimensions: Optional[int]) -> List[List[float]]:
+        vectors = self._load(model).encode(texts, normalize_embeddings=True)
+        return [list(map(float, vector)) for vector in vectors]
+
+
+_providers: List[EmbeddingProvider] = [
+    HashedNgramEmbeddingProvider(),
+    LocalModelEmbeddingProvider(),
+    OpenAIEmbeddingProvider(),
+]
+
+
+def register_provider(provider: EmbeddingProvider) -> None:
+    """
+    Add a provider; it takes precedence over the built-in ones.
+    """
+    _providers.insert(0, provider)
+
+
+def provider_for(model: str) -> EmbeddingProvider:
+    for provider in _providers:
+        if provider.handles(model):
+            return provider
+    raise ValueError(f"No embedding provider handles {model!r}.")
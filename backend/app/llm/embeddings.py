@@ -1,49 +1,189 @@
 from __future__ import annotations
 
 import os
-from typing import List, Optional
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
 
 from dotenv import load_dotenv
 
-from app.llm.openai_client import get_client
+from app.llm.embedding_coalescer import EmbeddingCoalescer
+from app.llm.embedding_providers import provider_for
+from app.observability.metrics import EMBED_BATCH_LATENCY, EMBED_BATCH_SIZE
+from app.observability.tracing import span
 
 load_dotenv()
 
 
-# Default to text-embedding-3-small, which matches the 1536‑dimensional
-# Chroma collections you've already created.
+# Default to text-embedding-3-small (1536 dimensions). Each vector collection
+# records the model and dimension it was built with (app.vectorstore.registry);
+# queries and writes embed with that collection's recorded spec, so changing
+# OPENAI_EMBEDDING_MODEL / OPENAI_EMBEDDING_DIMENSIONS (or the per-collection
+# IW_EMBEDDING_MODEL_<NAME> / IW_EMBEDDING_DIMENSIONS_<NAME>) only takes
+# effect once POST /vectors/reindex has migrated the collections. The model
+# name picks the provider (app.llm.embedding_providers), e.g. the offline
+# "local-hashed-ngram".
 _DEFAULT_EMBED_MODEL = "text-embedding-3-small"
 _DEFAULT_MAX_TOKENS_PER_BATCH = 50000
 _DEFAULT_MAX_ITEMS_PER_BATCH = 256
 
 
-def _get_embedding_model_name() -> str:
+@dataclass(frozen=True)
+class EmbeddingSpec:
+    """
+    Embedding model plus optional reduced output dimension.
+    """
+
+    model: str
+    dimensions: Optional[int] = None
+
+    @property
+    def vector_size(self) -> Optional[int]:
+        return self.dimensions or provider_for(self.model).native_dimensions(self.model)
+
+    @property
+    def provider(self) -> str:
+        return provider_for(self.model).name
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "provider": self.provider,
+            "dimensions": self.dimensions,
+            "vector_size": self.vector_size,
+        }
+
+
+def embedding_spec(model: str, dimensions: Optional[int] = None) -> EmbeddingSpec:
+    """
+    Validated EmbeddingSpec; raises ValueError for dimensions the model
+    cannot produce.
+    """
+    model = (model or "").strip()
+    if not model:
+        raise ValueError("Embedding model must not be empty.")
+    return EmbeddingSpec(model, provider_for(model).validate(model, dimensions))
+
+
+def _collection_env_key(collection: str) -> str:
+    return collection.upper().replace("-", "_")
+
+
+def _get_embedding_model_name(collection: Optional[str] = None) -> str:
     """
     Resolve which embedding model to use.
 
-    Environment variable OPENAI_EMBEDDING_MODEL (if set) wins,
-    otherwise we fall back to a safe default.
+    IW_EMBEDDING_MODEL_<COLLECTION> (if set) wins, then
+    OPENAI_EMBEDDING_MODEL, otherwise we fall back to a safe default.
     """
+    if collection:
+        override = (os.getenv(f"IW_EMBEDDING_MODEL_{_collection_env_key(collection)}") or "").strip()
+        if override:
+            return override
     return os.getenv("OPENAI_EMBEDDING_MODEL", _DEFAULT_EMBED_MODEL)
 
 
-def get_embedding(text: str) -> List[float]:
+def configured_embedding_spec(collection: Optional[str] = None) -> EmbeddingSpec:
     """
-    Get an embedding vector for the given text using the configured
-    OpenAI embedding model.
+    The spec requested for `collection` by IW_EMBEDDING_MODEL_<NAME> /
+    IW_EMBEDDING_DIMENSIONS_<NAME>, falling back to OPENAI_EMBEDDING_MODEL /
+    OPENAI_EMBEDDING_DIMENSIONS. A per-collection model only inherits the
+    global dimensions when it is the global model.
     """
-    client = get_client()
-    model = _get_embedding_model_name()
+    model = _get_embedding_model_name(collection)
+    key = "OPENAI_EMBEDDING_DIMENSIONS"
+    if collection:
+        scoped = f"IW_EMBEDDING_DIMENSIONS_{_collection_env_key(collection)}"
+        if os.getenv(scoped) is not None or model != _get_embedding_model_name():
+            key = scoped
+    raw = (os.getenv(key) or "").strip()
+    try:
+        return embedding_spec(model, int(raw) if raw else None)
+    except ValueError as exc:
+        print(f"[WARN] Ignoring {key}={raw!r} for {model}: {exc}")
+        return EmbeddingSpec(model)
 
-    response = client.embeddings.create(
-        model=model,
-        input=text,
-    )
 
-    return response.data[0].embedding
+def active_embedding_spec(collection: Optional[str] = None) -> EmbeddingSpec:
+    """
+    The spec a live vector collection was built with (default: messages).
+    """
+    # Deferred: the registry imports this module.
+    from app.vectorstore import registry
 
+    return registry.active(collection or registry.LOGICAL_NAMES[0]).spec
+
+
+def _resolve_spec(
+    model: Optional[str], dimensions: Optional[int], collection: Optional[str] = None
+) -> EmbeddingSpec:
+    if model is None and dimensions is None:
+        return active_embedding_spec(collection)
+    return EmbeddingSpec(model or active_embedding_spec(collection).model, dimensions)
+
+
+def _create_embeddings(
+    model: str,
+    inputs: List[str],
+    dimensions: Optional[int] = None,
+) -> List[List[float]]:
+    provider = provider_for(model)
+    size = len(inputs)
+    started = time.perf_counter()
+    with span(
+        "embedding.batch", model=model, provider=provider.name, inputs=size, dimensions=dimensions
+    ):
+        vectors = provider.embed(model, inputs, dimensions)
+    EMBED_BATCH_LATENCY.observe(time.perf_counter() - started, model=model)
+    EMBED_BATCH_SIZE.observe(size, model=model)
+    return vectors
 
-def get_embeddings(texts: List[str]) -> List[List[float]]:
+
+_COALESCER = EmbeddingCoalescer(lambda model, dimensions, texts: _create_embeddings(model, texts, dimensions))
+
+
+def _embed_one(spec: EmbeddingSpec, text: str) -> List[float]:
+    """
+    Embed a single text; concurrent requests to remote providers are
+    coalesced (app.llm.embedding_coalescer).
+    """
+    if provider_for(spec.model).coalesce:
+        return _COALESCER.embed(spec.model, spec.dimensions, text)
+    return _create_embeddings(spec.model, [text], spec.dimensions)[0]
+
+
+def get_embedding(
+    text: str,
+    model: Optional[str] = None,
+    dimensions: Optional[int] = None,
+    collection: Optional[str] = None,
+) -> List[float]:
+    """
+    Get an embedding vector for the given text, by default with the spec of
+    the live `collection` (messages when omitted).
+    """
+    spec = _resolve_spec(model, dimensions, collection)
+    return _embed_one(spec, text)
+
+
+def query_embedder(text: str) -> Callable[[str], List[float]]:
+    """
+    Lazy per-collection query vectors for `text`: each distinct spec is
+    embedded on first use, so a collection served from the retrieval cache
+    costs no embedding call unless another collection shares its spec.
+    """
+    by_spec: Dict[EmbeddingSpec, List[float]] = {}
+
+    def vector(collection: str) -> List[float]:
+        spec = active_embedding_spec(collection)
+        if spec not in by_spec:
+            by_spec[spec] = _embed_one(spec, text)
+        return by_spec[spec]
+
+    return vector
+
+
+def get_embeddings(texts: List[str], collection: Optional[str] = None) -> List[List[float]]:
     """
     Helper used by the document ingestor.
 
@@ -54,15 +194,8 @@ def get_embeddings(texts: List[str]) -> List[List[float]]:
     if not texts:
         return []
 
-    client = get_client()
-    model = _get_embedding_model_name()
-
-    response = client.embeddings.create(
-        model=model,
-        input=texts,
-    )
-
-    return [item.embedding for item in response.data]
+    spec = active_embedding_spec(collection)
+    return _create_embeddings(spec.model, texts, spec.dimensions)
 
 
 def _estimated_token_count(text: str) -> int:
@@ -95,11 +228,15 @@ def embed_texts_batched(
     max_tokens_per_batch: Optional[int] = None,
     max_items_per_batch: Optional[int] = None,
     model: Optional[str] = None,
+    dimensions: Optional[int] = None,
+    collection: Optional[str] = None,
 ) -> List[List[float]]:
     """
     Embed a list of texts by splitting them into smaller batches that satisfy
     both token-count and item-count limits. This prevents gigantic ingestion
     jobs from exceeding OpenAI's per-request caps.
+
+    model/dimensions default to the spec of the live `collection`.
     """
     if not texts:
         return []
@@ -111,8 +248,7 @@ def embed_texts_batched(
         "MAX_EMBED_ITEMS_PER_BATCH", _DEFAULT_MAX_ITEMS_PER_BATCH
     )
 
-    client = get_client()
-    model_name = model or _get_embedding_model_name()
+    spec = _resolve_spec(model, dimensions, collection)
 
     # Pre-allocate results to preserve ordering even though we process batches.
     results: List[Optional[List[float]]] = [None] * len(texts)
@@ -124,11 +260,7 @@ def embed_texts_batched(
         nonlocal batch_inputs, batch_indices, batch_tokens
         if not batch_inputs:
             return
-        response = client.embeddings.create(
-            model=model_name,
-            input=batch_inputs,
-        )
-        embeddings = [item.embedding for item in response.data]
+        embeddings = _create_embeddings(spec.model, batch_inputs, spec.dimensions)
         for idx, embedding in zip(batch_indices, embeddings):
             results[idx] = embedding
         batch_inputs = []
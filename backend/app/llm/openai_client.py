@@ -2,12 +2,24 @@ from __future__ import annotations
 
 import os
 import re
+import time
 from collections import defaultdict
 from typing import Dict, List, Optional, Tuple, Any
 
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from app.llm.budgets import BUDGETS, BudgetExceeded  # noqa: F401  (re-exported)
+from app.llm.pricing import estimate_call_cost
+from app.llm.router import (
+    RoutingPolicy,
+    estimate_prompt_tokens,
+    record_model_call,
+    route_auto,
+)
+from app.observability.metrics import LLM_CALL_LATENCY, LLM_TOKENS
+from app.observability.tracing import span
+
 load_dotenv()
 
 # Singleton OpenAI client
@@ -26,10 +38,12 @@ def _make_stub_client() -> object:
             self.embedding = value
 
     class _StubEmbeddings:
-        def create(self, model: str, input):
+        def create(self, model: str, input, dimensions: Optional[int] = None):
             texts = input if isinstance(input, list) else [input]
             data = [
-                _StubEmbeddingItem([float(len(str(t))) % 7, 0.0, 1.0])
+                _StubEmbeddingItem(
+                    ([float(len(str(t))) % 7, 0.0, 1.0] * (dimensions or 1))[: dimensions or 3]
+                )
                 for t in texts
             ]
             return type("Resp", (), {"data": data})
@@ -159,6 +173,9 @@ _PLANNING_HINTS = (
     "plan for",
 )
 
+# Output size assumed when reserving budget for a call without max_output_tokens.
+_ASSUMED_OUTPUT_TOKENS = 500
+
 _LLM_TELEMETRY_AUTO_ROUTES: Dict[str, int] = defaultdict(int)
 _LLM_TELEMETRY: Dict[str, Any] = {
     "auto_routes": _LLM_TELEMETRY_AUTO_ROUTES,
@@ -322,68 +339,22 @@ def _extract_text_from_responses(resp: Any) -> str:
 # Pricing (cost estimation)
 # ---------------------------------------------------------------------------
 
-# Pricing per 1K tokens for common models (in USD).
-# Derived from the official OpenAI API pricing table for GPT‑5.* models. 
-#
-# NOTE: These are *inference* prices (not fine‑tuning).
-#       If you use different models, unknown models will show $0 cost unless
-#       you extend the mapping or add env‑based overrides.
-_MODEL_PRICING_PER_1K: Dict[str, Tuple[float, float]] = {
-    # canonical_name: (input_price_per_1k, output_price_per_1k)
-    "gpt-5.1": (1.250 / 1000.0, 10.000 / 1000.0),       # $1.25 in / $10 out per 1M
-    "gpt-5-mini": (0.250 / 1000.0, 2.000 / 1000.0),     # $0.25 in / $2.00 out per 1M
-    "gpt-5-nano": (0.050 / 1000.0, 0.400 / 1000.0),     # $0.05 in / $0.40 out per 1M
-    "gpt-5-pro": (15.000 / 1000.0, 120.000 / 1000.0),   # $15 in / $120 out per 1M
-    # You can extend this dict for other models (4.1, 4o, etc.) if desired.
-}
+# Prices live in app.llm.pricing (single registry shared with usage records
+# and dashboards); this wrapper keeps the historical name.
 
 
-def _canonical_model_for_pricing(model: str) -> Optional[str]:
-    """
-    Map raw model ids to a canonical key in _MODEL_PRICING_PER_1K.
-    """
-    m = model.lower()
-
-    # Direct matches first
-    for key in _MODEL_PRICING_PER_1K.keys():
-        if m == key:
-            return key
-
-    # Handle common prefixes/variants
-    if m.startswith("gpt-5.1") or m.startswith("gpt-5-codex"):
-        return "gpt-5.1"
-    if "nano" in m or m.startswith("gpt-5-nano"):
-        return "gpt-5-nano"
-    if "mini" in m or m.startswith("gpt-5-mini"):
-        return "gpt-5-mini"
-    if "pro" in m or m.startswith("gpt-5-pro"):
-        return "gpt-5-pro"
-
-    # Unknown -> no pricing
-    return None
-
-
-def estimate_cost_usd(model: str, tokens_in: int, tokens_out: int) -> float:
+def estimate_cost_usd(
+    model: str, tokens_in: int, tokens_out: int, cached_tokens_in: int = 0
+) -> float:
     """
     Estimate USD cost for a call based on model + token usage.
 
-    - Uses per‑1K token pricing from _MODEL_PRICING_PER_1K.
-    - Returns 0.0 if the model is unknown or usage is missing.
+    Returns 0.0 if usage is missing; unknown models are reported by the
+    pricing registry.
     """
     if (tokens_in or 0) <= 0 and (tokens_out or 0) <= 0:
         return 0.0
-
-    canonical = _canonical_model_for_pricing(model)
-    if canonical is None:
-        # Unknown model family: treat as 0 cost unless you extend the mapping.
-        return 0.0
-
-    price_in_per_1k, price_out_per_1k = _MODEL_PRICING_PER_1K[canonical]
-
-    # Convert tokens to 1K‑token units
-    cost_in = (tokens_in / 1000.0) * price_in_per_1k
-    cost_out = (tokens_out / 1000.0) * price_out_per_1k
-    return float(cost_in + cost_out)
+    return estimate_call_cost(model, tokens_in, tokens_out, cached_tokens_in)
 
 
 # ---------------------------------------------------------------------------
@@ -417,6 +388,7 @@ def _call_model(
     # We'll fill these from resp.usage when available
     tokens_in = 0
     tokens_out = 0
+    cached_tokens_in = 0
     total_tokens = 0
 
     if use_responses:
@@ -437,6 +409,8 @@ def _call_model(
             if usage is not None:
                 tokens_in = int(getattr(usage, "input_tokens", 0) or 0)
                 tokens_out = int(getattr(usage, "output_tokens", 0) or 0)
+                details = getattr(usage, "input_tokens_details", None)
+                cached_tokens_in = int(getattr(details, "cached_tokens", 0) or 0)
                 total_tokens = int(
                     getattr(usage, "total_tokens", 0)
                     or (tokens_in + tokens_out)
@@ -450,11 +424,13 @@ def _call_model(
             usage_out["model"] = model
             usage_out["tokens_in"] = tokens_in
             usage_out["tokens_out"] = tokens_out
+            usage_out["cached_tokens_in"] = cached_tokens_in
             usage_out["total_tokens"] = total_tokens
             usage_out["cost_estimate"] = estimate_cost_usd(
                 model=model,
                 tokens_in=tokens_in,
                 tokens_out=tokens_out,
+                cached_tokens_in=cached_tokens_in,
             )
 
         return text
@@ -480,6 +456,8 @@ def _call_model(
         if usage is not None:
             tokens_in = int(getattr(usage, "prompt_tokens", 0) or 0)
             tokens_out = int(getattr(usage, "completion_tokens", 0) or 0)
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_tokens_in = int(getattr(details, "cached_tokens", 0) or 0)
             total_tokens = int(
                 getattr(usage, "total_tokens", 0)
                 or (tokens_in + tokens_out)
@@ -492,11 +470,13 @@ def _call_model(
         usage_out["model"] = model
         usage_out["tokens_in"] = tokens_in
         usage_out["tokens_out"] = tokens_out
+        usage_out["cached_tokens_in"] = cached_tokens_in
         usage_out["total_tokens"] = total_tokens
         usage_out["cost_estimate"] = estimate_cost_usd(
             model=model,
             tokens_in=tokens_in,
             tokens_out=tokens_out,
+            cached_tokens_in=cached_tokens_in,
         )
 
     return content
@@ -514,6 +494,9 @@ def generate_reply_from_history(
     temperature: float = 0.4,
     max_output_tokens: Optional[int] = None,
     usage_out: Optional[Dict[str, Any]] = None,
+    routing: Optional[RoutingPolicy] = None,
+    project_id: Optional[int] = None,
+    optional: bool = False,
 ) -> str:
     """
     Call OpenAI with the full chat history and return the assistant's reply.
@@ -530,6 +513,15 @@ def generate_reply_from_history(
       - research -> OPENAI_MODEL_RESEARCH
       - code     -> OPENAI_MODEL_CODE
 
+    Every call is admitted by the per-project budget gateway
+    (app.llm.budgets): 'optional' work (auto-title, task upkeep) is skipped
+    with BudgetExceeded when over budget, required work queues or is
+    downgraded to the budget-mode model.
+
+    In auto mode the heuristics only set a prior; app.llm.router picks the
+    model using observed latency/error/cost stats and the optional per-project
+    'routing' policy (latency SLO, daily budget).
+
     If 'usage_out' is provided, it will be populated with:
       {
         "model": <model name>,
@@ -544,17 +536,42 @@ def generate_reply_from_history(
 
     if model is None and normalized_mode == "auto":
         inferred_mode, inferred_reason = _infer_auto_submode(messages)
-        routed_mode = inferred_mode or "deep"
+        decision = route_auto(
+            inferred_mode or "deep",
+            inferred_reason,
+            _extract_last_user_prompt(messages),
+            estimate_prompt_tokens(messages),
+            _get_model_for_mode,
+            routing,
+        )
+        routed_mode = decision.mode
         _record_auto_route(routed_mode)
         print(
-            f"[LLM] Auto mode heuristics routed this prompt to '{routed_mode}' ({inferred_reason})."
+            f"[LLM] Auto mode routed this prompt to '{routed_mode}' ({decision.model}): "
+            f"heuristics said '{decision.prior_mode}' ({inferred_reason}); {decision.reason}."
         )
         if usage_out is not None:
             usage_out["auto_mode"] = routed_mode
-            usage_out["auto_reason"] = inferred_reason
+            usage_out["auto_reason"] = f"{inferred_reason}; {decision.reason}"
 
     chosen_model = (model or _get_model_for_mode(routed_mode)).strip()
 
+    if routing is not None:
+        BUDGETS.set_project_daily_usd(project_id, routing.daily_budget_usd)
+    lease = BUDGETS.acquire(
+        project_id,
+        routed_mode if model is None else normalized_mode,
+        estimate_prompt_tokens(messages) + (max_output_tokens or _ASSUMED_OUTPUT_TOKENS),
+        optional=optional,
+    )
+    if lease.downgraded:
+        budget_model = _get_model_for_mode("budget").strip()
+        print(
+            f"[LLM] Budget gateway downgraded '{chosen_model}' to '{budget_model}' "
+            f"for project {project_id} ({lease.reason})."
+        )
+        chosen_model = budget_model
+
     candidate_models: List[str] = [chosen_model]
     if model is None:
         # Allow graceful fallback if the primary mode-specific model is unavailable.
@@ -569,21 +586,65 @@ def generate_reply_from_history(
         if safety_net and safety_net not in candidate_models:
             candidate_models.append(safety_net)
 
+    call_usage: Dict[str, Any] = usage_out if usage_out is not None else {}
+    try:
+        return _call_candidates(messages, candidate_models, temperature, max_output_tokens, call_usage)
+    finally:
+        BUDGETS.release(
+            lease,
+            tokens=(call_usage.get("tokens_in") or 0) + (call_usage.get("tokens_out") or 0),
+            cost=call_usage.get("cost_estimate") or 0.0,
+        )
+
+
+def _call_candidates(
+    messages: List[Dict[str, str]],
+    candidate_models: List[str],
+    temperature: Optional[float],
+    max_output_tokens: Optional[int],
+    call_usage: Dict[str, Any],
+) -> str:
+    """
+    Try each candidate model in order; returns the first successful reply.
+    """
     last_error: Optional[Exception] = None
     fallback_used_in_this_call = False
     for idx, candidate in enumerate(candidate_models):
+        started = time.perf_counter()
         try:
-            result = _call_model(
-                messages=messages,
-                model=candidate,
-                temperature=temperature,
-                max_output_tokens=max_output_tokens,
-                usage_out=usage_out,
+            with span("llm.call", model=candidate, attempt=idx + 1) as call_span:
+                result = _call_model(
+                    messages=messages,
+                    model=candidate,
+                    temperature=temperature,
+                    max_output_tokens=max_output_tokens,
+                    usage_out=call_usage,
+                )
+                call_span.set_attributes(
+                    tokens_in=call_usage.get("tokens_in"),
+                    tokens_out=call_usage.get("tokens_out"),
+                    cached_tokens_in=call_usage.get("cached_tokens_in"),
+                )
+            elapsed = time.perf_counter() - started
+            LLM_CALL_LATENCY.observe(elapsed, model=candidate, outcome="ok")
+            LLM_TOKENS.inc(call_usage.get("tokens_in") or 0, model=candidate, direction="in")
+            LLM_TOKENS.inc(call_usage.get("tokens_out") or 0, model=candidate, direction="out")
+            LLM_TOKENS.inc(call_usage.get("cached_tokens_in") or 0, model=candidate, direction="cached_in")
+            record_model_call(
+                candidate,
+                elapsed * 1000.0,
+                True,
+                tokens_in=call_usage.get("tokens_in") or 0,
+                tokens_out=call_usage.get("tokens_out") or 0,
+                cost=call_usage.get("cost_estimate") or 0.0,
             )
             if fallback_used_in_this_call and idx > 0:
                 _LLM_TELEMETRY["fallback_success"] += 1
             return result
         except Exception as err:  # noqa: BLE001
+            elapsed = time.perf_counter() - started
+            LLM_CALL_LATENCY.observe(elapsed, model=candidate, outcome="error")
+            record_model_call(candidate, elapsed * 1000.0, False)
             last_error = err
             if idx < len(candidate_models) - 1:
                 fallback_used_in_this_call = True
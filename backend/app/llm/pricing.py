@@ -1,56 +1,240 @@
 from __future__ import annotations
 
+import json
+import os
+import threading
 from dataclasses import dataclass
-from typing import Dict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 
+from sqlalchemy import case, func, update
+from sqlalchemy.orm import Session
 
-@dataclass
+
+@dataclass(frozen=True)
 class ModelPricing:
     """Pricing in USD per 1M tokens."""
     input_per_million: float
     output_per_million: float
+    # Prompt tokens served from the provider's prompt cache; None = no discount.
+    cached_input_per_million: Optional[float] = None
+
+    def cost(self, tokens_in: int, tokens_out: int, cached_tokens_in: int = 0) -> float:
+        # cached_tokens_in is the cached subset of tokens_in.
+        cached = min(max(cached_tokens_in, 0), max(tokens_in, 0))
+        cached_rate = (
+            self.input_per_million
+            if self.cached_input_per_million is None
+            else self.cached_input_per_million
+        )
+        return (
+            (tokens_in - cached) * self.input_per_million
+            + cached * cached_rate
+            + tokens_out * self.output_per_million
+        ) / 1_000_000.0
 
 
 # Approximate prices – tweak as needed. Values are USD per 1M tokens.
-# Add/adjust to match your billing; unknown models return 0.0.
+#
+# Keys are model-id prefixes: a model resolves to the longest key it starts
+# with at a "-" boundary, so dated snapshots ("gpt-5.1-2025-11-13") and
+# variants ("gpt-5-codex") share their family price. Override or extend the
+# table without a code change via IW_MODEL_PRICING (inline JSON) or
+# IW_MODEL_PRICING_FILE (path to a JSON file), e.g.
+#   {"gpt-5.1": {"input": 1.25, "output": 10.0, "cached_input": 0.125}}
 PRICING: Dict[str, ModelPricing] = {
-    "gpt-5.1": ModelPricing(
-        input_per_million=1.25,
-        output_per_million=10.00,
-    ),
-    "gpt-5-pro": ModelPricing(
-        input_per_million=2.50,
-        output_per_million=18.00,
-    ),
-    "gpt-5-nano": ModelPricing(
-        input_per_million=0.05,
-        output_per_million=0.20,
-    ),
-    "gpt-5.1-codex": ModelPricing(
-        input_per_million=1.50,
-        output_per_million=12.00,
-    ),
-    "gpt-4.1": ModelPricing(
-        input_per_million=5.00,
-        output_per_million=15.00,
-    ),
-    "gpt-4.1-mini": ModelPricing(
-        input_per_million=0.15,
-        output_per_million=0.60,
-    ),
+    "gpt-5": ModelPricing(1.25, 10.00, 0.125),
+    "gpt-5.1": ModelPricing(1.25, 10.00, 0.125),
+    "gpt-5.1-codex": ModelPricing(1.50, 12.00, 0.15),
+    "gpt-5-mini": ModelPricing(0.25, 2.00, 0.025),
+    "gpt-5-nano": ModelPricing(0.05, 0.40, 0.005),
+    "gpt-5-pro": ModelPricing(15.00, 120.00),
+    "gpt-4.1": ModelPricing(5.00, 15.00, 1.25),
+    "gpt-4.1-mini": ModelPricing(0.15, 0.60, 0.0375),
+    "gpt-4.1-nano": ModelPricing(0.10, 0.40, 0.025),
+    "gpt-4o": ModelPricing(2.50, 10.00, 1.25),
+    "gpt-4o-mini": ModelPricing(0.15, 0.60, 0.075),
+    "o3": ModelPricing(2.00, 8.00, 0.50),
+    "o3-deep-research": ModelPricing(10.00, 40.00, 2.50),
 }
 
+_BOUNDARY = "-"
+_END = object()
+
+_lock = threading.Lock()
+_trie: Optional[Dict[Any, Any]] = None
+_unpriced: Dict[str, int] = {}
+
+
+def _parse_overrides(raw: Any, source: str) -> Dict[str, ModelPricing]:
+    overrides: Dict[str, ModelPricing] = {}
+    if not isinstance(raw, dict):
+        print(f"[WARN] Ignoring {source}: expected a JSON object of model prices")
+        return overrides
+    for model, spec in raw.items():
+        try:
+            cached = spec.get("cached_input")
+            overrides[str(model).lower()] = ModelPricing(
+                input_per_million=float(spec["input"]),
+                output_per_million=float(spec["output"]),
+                cached_input_per_million=None if cached is None else float(cached),
+            )
+        except (AttributeError, KeyError, TypeError, ValueError):
+            print(f"[WARN] Ignoring invalid price for {model!r} in {source}")
+    return overrides
+
+
+def _load_overrides() -> Dict[str, ModelPricing]:
+    overrides: Dict[str, ModelPricing] = {}
+    path = os.getenv("IW_MODEL_PRICING_FILE")
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                overrides.update(_parse_overrides(json.load(fh), path))
+        except (OSError, ValueError) as exc:
+            print(f"[WARN] Failed to read IW_MODEL_PRICING_FILE {path!r}: {exc!r}")
+    inline = os.getenv("IW_MODEL_PRICING")
+    if inline:
+        try:
+            overrides.update(_parse_overrides(json.loads(inline), "IW_MODEL_PRICING"))
+        except ValueError as exc:
+            print(f"[WARN] Failed to parse IW_MODEL_PRICING: {exc!r}")
+    return overrides
+
+
+def _build_trie(table: Dict[str, ModelPricing]) -> Dict[Any, Any]:
+    root: Dict[Any, Any] = {}
+    for key, pricing in table.items():
+        node = root
+        for ch in key.lower():
+            node = node.setdefault(ch, {})
+        node[_END] = (key, pricing)
+    return root
 
-def estimate_call_cost(model: str, tokens_in: int, tokens_out: int) -> float:
+
+def _get_trie() -> Dict[Any, Any]:
+    global _trie
+    if _trie is None:
+        with _lock:
+            if _trie is None:
+                _trie = _build_trie({**PRICING, **_load_overrides()})
+    return _trie
+
+
+def reload_pricing() -> None:
+    """
+    Drop the compiled table so the next lookup re-reads PRICING and overrides.
+    """
+    global _trie
+    with _lock:
+        _trie = None
+        _unpriced.clear()
+    resolve_pricing.cache_clear()
+
+
+@lru_cache(maxsize=512)
+def resolve_pricing(model: str) -> Optional[Tuple[str, ModelPricing]]:
+    """
+    Longest registry key that `model` starts with at a "-" boundary, with its
+    price; None for unknown models.
+    """
+    name = (model or "").strip().lower()
+    node = _get_trie()
+    match = None
+    for i, ch in enumerate(name):
+        node = node.get(ch)
+        if node is None:
+            break
+        if _END in node and (i + 1 == len(name) or name[i + 1] == _BOUNDARY):
+            match = node[_END]
+    return match
+
+
+def _note_unpriced(model: str) -> None:
+    with _lock:
+        seen = _unpriced.get(model, 0)
+        _unpriced[model] = seen + 1
+    if not seen:
+        print(
+            f"[WARN] No pricing for model {model!r}; its usage is costed at $0. "
+            "Add it to PRICING or IW_MODEL_PRICING."
+        )
+
+
+def unpriced_models() -> Dict[str, int]:
+    """
+    Models that were costed at $0 for lack of a price, with call counts.
+    """
+    with _lock:
+        return dict(_unpriced)
+
+
+def estimate_call_cost(
+    model: str,
+    tokens_in: int,
+    tokens_out: int,
+    cached_tokens_in: int = 0,
+) -> float:
     """
     Estimate USD cost for a single LLM call given a model + token counts.
 
-    If the model is unknown, we return 0.0 rather than raising.
+    `cached_tokens_in` is the part of `tokens_in` served from the provider's
+    prompt cache. Unknown models cost 0.0 and are reported once with a
+    [WARN] (see unpriced_models()).
     """
-    info = PRICING.get(model)
-    if not info:
+    resolved = resolve_pricing(model)
+    if resolved is None:
+        if (tokens_in or 0) > 0 or (tokens_out or 0) > 0:
+            _note_unpriced(model)
         return 0.0
+    return resolved[1].cost(tokens_in or 0, tokens_out or 0, cached_tokens_in or 0)
+
+
+def recompute_usage_costs(db: Session, project_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Re-price stored UsageRecord.cost_estimate with the current registry.
+
+    Issues one UPDATE per distinct model rather than touching rows one by one,
+    then rebuilds the usage rollups so dashboards agree. The caller commits.
+    """
+    from app.db import models
+    from app.db.usage_rollups import rebuild_usage_rollups
+
+    records = models.UsageRecord
+    model_query = db.query(records.model).distinct()
+    if project_id is not None:
+        model_query = model_query.filter(records.project_id == project_id)
+
+    updated = 0
+    unpriced: List[str] = []
+    for (model,) in model_query.all():
+        resolved = resolve_pricing(model)
+        if resolved is None:
+            unpriced.append(model)
+            cost_expr: Any = 0.0
+        else:
+            pricing = resolved[1]
+            cached_rate = (
+                pricing.input_per_million
+                if pricing.cached_input_per_million is None
+                else pricing.cached_input_per_million
+            )
+            # Mirrors ModelPricing.cost: cached tokens are a subset of tokens_in.
+            tokens_in = func.coalesce(records.tokens_in, 0)
+            cached_in = func.coalesce(records.cached_tokens_in, 0)
+            cached = case((cached_in > tokens_in, tokens_in), else_=cached_in)
+            cost_expr = (
+                (tokens_in - cached) * pricing.input_per_million
+                + cached * cached_rate
+                + func.coalesce(records.tokens_out, 0) * pricing.output_per_million
+            ) / 1_000_000.0
+        stmt = update(records).where(records.model == model)
+        if project_id is not None:
+            stmt = stmt.where(records.project_id == project_id)
+        result = db.execute(
+            stmt.values(cost_estimate=cost_expr).execution_options(synchronize_session=False)
+        )
+        updated += result.rowcount or 0
 
-    cost_in = (tokens_in / 1_000_000.0) * info.input_per_million
-    cost_out = (tokens_out / 1_000_000.0) * info.output_per_million
-    return cost_in + cost_out
+    rebuild_usage_rollups(db.connection(), project_id)
+    return {"updated": updated, "unpriced_models": sorted(unpriced)}
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Dict, List
+
+# Prompt layout for provider-side prompt caching.
+#
+# Providers reuse the longest prompt prefix they have already processed
+# (OpenAI does this automatically for prompts of 1024+ tokens, in 128-token
+# steps, and reports the hit as cached input tokens at a discount). A prefix
+# only matches up to the first byte that differs, so /chat emits segments
+# from most to least stable:
+#
+#   system        the static assistant prompt
+#   instructions  project instructions (project-wide, rarely edited)
+#   pinned        pinned memories, in id order so edits do not reshuffle them
+#   folder        the conversation's folder
+#   history       earlier turns; append-only, so the next turn extends it
+#   retrieval     retrieved context, different on every turn
+#   user          the new message
+#
+# Turn N+1 therefore shares everything up to the end of turn N's history with
+# turn N, instead of diverging at the retrieval block.
+
+SEGMENTS = ("system", "instructions", "pinned", "folder", "history", "retrieval", "user")
+_STABLE = SEGMENTS[: SEGMENTS.index("history") + 1]
+
+
+class PromptLayout:
+    """
+    Collects chat messages per segment and emits them in SEGMENTS order.
+    """
+
+    def __init__(self) -> None:
+        self._segments: Dict[str, List[Dict[str, str]]] = {name: [] for name in SEGMENTS}
+
+    def append(self, segment: str, message: Dict[str, str]) -> None:
+        if segment not in self._segments:
+            raise ValueError(f"Unknown prompt segment {segment!r}.")
+        self._segments[segment].append(message)
+
+    def messages(self) -> List[Dict[str, str]]:
+        return [message for name in SEGMENTS for message in self._segments[name]]
+
+    def stable_prefix(self) -> List[Dict[str, str]]:
+        """
+        The messages a later turn of the same conversation starts with.
+        """
+        return [message for name in _STABLE for message in self._segments[name]]
+
+    def prefix_stats(self) -> Dict[str, object]:
+        prefix = self.stable_prefix()
+        digest = hashlib.sha256()
+        for message in prefix:
+            digest.update(f"{message['role']}\0{message['content']}\0".encode("utf-8"))
+        return {
+            "prefix_messages": len(prefix),
+            "prefix_tokens": sum(len(m["content"]) for m in prefix) // 4,
+            "prefix_hash": digest.hexdigest()[:12],
+        }
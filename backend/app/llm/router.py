@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from app.llm.pricing import estimate_call_cost
+
+# Auto-mode router.
+#
+# The keyword/length heuristics in openai_client._infer_auto_submode give a
+# prior (which logical mode the prompt looks like). The router turns that into
+# a short ladder of candidate modes, cheapest acceptable first, and walks it
+# using rolling per-model stats recorded from real calls: a model is skipped
+# when its p95 latency breaks the project's SLO, its recent error rate is too
+# high, or its expected cost would overrun the project's daily budget.
+#
+# Until a model has IW_ROUTER_MIN_SAMPLES calls the stats are not trusted and
+# the ladder order (i.e. the heuristics) decides.
+
+_DEFAULT_WINDOW = 200
+_DEFAULT_MIN_SAMPLES = 5
+_DEFAULT_MAX_ERROR_RATE = 0.25
+# Once this share of the daily budget is spent, prefer the cheapest candidate.
+_BUDGET_PRESSURE = 0.8
+# Output size assumed when a model has no history yet.
+_PRIOR_TOKENS_OUT = 500
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+@dataclass
+class _Call:
+    latency_ms: float
+    ok: bool
+    tokens_in: int
+    tokens_out: int
+    cost: float
+
+
+class ModelStats:
+    """
+    Rolling window of the most recent calls to one model.
+    """
+
+    def __init__(self, window: int) -> None:
+        self._calls: Deque[_Call] = deque(maxlen=window)
+
+    def add(self, call: _Call) -> None:
+        self._calls.append(call)
+
+    def snapshot(self) -> Dict[str, Any]:
+        calls = list(self._calls)
+        ok_calls = [c for c in calls if c.ok]
+        latencies = sorted(c.latency_ms for c in ok_calls)
+        count = len(calls)
+        ok_count = len(ok_calls)
+        return {
+            "calls": count,
+            "error_rate": (count - ok_count) / count if count else 0.0,
+            "p50_latency_ms": _percentile(latencies, 0.50),
+            "p95_latency_ms": _percentile(latencies, 0.95),
+            "avg_tokens_in": sum(c.tokens_in for c in ok_calls) / ok_count if ok_count else 0.0,
+            "avg_tokens_out": sum(c.tokens_out for c in ok_calls) / ok_count if ok_count else 0.0,
+            "avg_cost_usd": sum(c.cost for c in ok_calls) / ok_count if ok_count else 0.0,
+        }
+
+
+_lock = threading.Lock()
+_STATS: Dict[str, ModelStats] = {}
+
+
+def record_model_call(
+    model: str,
+    latency_ms: float,
+    ok: bool,
+    tokens_in: int = 0,
+    tokens_out: int = 0,
+    cost: float = 0.0,
+) -> None:
+    """
+    Feed one _call_model outcome into the rolling stats.
+    """
+    with _lock:
+        stats = _STATS.get(model)
+        if stats is None:
+            stats = _STATS[model] = ModelStats(_int_env("IW_ROUTER_WINDOW", _DEFAULT_WINDOW))
+        stats.add(_Call(latency_ms, ok, int(tokens_in or 0), int(tokens_out or 0), float(cost or 0.0)))
+
+
+def get_router_stats(reset: bool = False) -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        snapshot = {model: stats.snapshot() for model, stats in _STATS.items()}
+        if reset:
+            _STATS.clear()
+    return snapshot
+
+
+@dataclass(frozen=True)
+class RoutingPolicy:
+    """
+    Per-project routing constraints (None = unconstrained).
+    """
+
+    latency_slo_ms: Optional[int] = None
+    daily_budget_usd: Optional[float] = None
+    spent_today_usd: float = 0.0
+
+
+@dataclass
+class RouteDecision:
+    mode: str
+    model: str
+    reason: str
+    prior_mode: str
+    candidates: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def candidate_modes(prior_mode: str, prior_reason: str, prompt: str) -> List[str]:
+    """
+    Modes worth trying for a heuristic prior, in order of preference.
+    """
+    if prior_mode == "code":
+        # Only real code (fenced blocks, longer snippets) needs the codex tier;
+        # a short question that merely mentions `def` or has a semicolon does not.
+        if "```" in prompt or len(prompt) > 600:
+            return ["code", "deep"]
+        return ["auto", "code"]
+    if prior_mode == "research":
+        return ["research", "deep"]
+    if prior_mode == "fast":
+        return ["fast", "budget"]
+    if prior_mode == "deep" and prior_reason == "default":
+        # Nothing in the prompt asks for the deep tier: start one step down.
+        return ["auto", "deep"]
+    return [prior_mode, "auto"]
+
+
+def _estimate_cost(model: str, stats: Dict[str, Any], trusted: bool, prompt_tokens: int) -> float:
+    if trusted and stats["avg_cost_usd"] > 0:
+        return float(stats["avg_cost_usd"])
+    tokens_out = int(stats["avg_tokens_out"]) if trusted and stats["avg_tokens_out"] else _PRIOR_TOKENS_OUT
+    return estimate_call_cost(model, prompt_tokens, tokens_out)
+
+
+def route_auto(
+    prior_mode: str,
+    prior_reason: str,
+    prompt: str,
+    prompt_tokens: int,
+    model_for_mode: Callable[[str], str],
+    policy: Optional[RoutingPolicy] = None,
+) -> RouteDecision:
+    """
+    Pick the mode/model for an auto-mode request.
+    """
+    policy = policy or RoutingPolicy()
+    min_samples = _int_env("IW_ROUTER_MIN_SAMPLES", _DEFAULT_MIN_SAMPLES)
+    max_error_rate = _float_env("IW_ROUTER_MAX_ERROR_RATE", _DEFAULT_MAX_ERROR_RATE)
+    stats_by_model = get_router_stats()
+    remaining_budget = (
+        None
+        if policy.daily_budget_usd is None
+        else policy.daily_budget_usd - policy.spent_today_usd
+    )
+
+    seen = set()
+    candidates: List[Dict[str, Any]] = []
+    for mode in candidate_modes(prior_mode, prior_reason, prompt):
+        model = model_for_mode(mode).strip()
+        if model in seen:
+            continue
+        seen.add(model)
+        stats = stats_by_model.get(model) or ModelStats(1).snapshot()
+        trusted = stats["calls"] >= min_samples
+        est_cost = _estimate_cost(model, stats, trusted, prompt_tokens)
+        rejected: Optional[str] = None
+        if trusted and stats["error_rate"] > max_error_rate:
+            rejected = f"error rate {stats['error_rate']:.0%}"
+        elif (
+            trusted
+            and policy.latency_slo_ms is not None
+            and stats["p95_latency_ms"] > policy.latency_slo_ms
+        ):
+            rejected = f"p95 {stats['p95_latency_ms']:.0f}ms over SLO"
+        elif remaining_budget is not None and est_cost > remaining_budget:
+            rejected = "over daily budget"
+        candidates.append(
+            {
+                "mode": mode,
+                "model": model,
+                "est_cost_usd": est_cost,
+                "calls": stats["calls"],
+                "p95_latency_ms": stats["p95_latency_ms"],
+                "error_rate": stats["error_rate"],
+                "rejected": rejected,
+            }
+        )
+
+    eligible = [c for c in candidates if c["rejected"] is None]
+    under_pressure = (
+        policy.daily_budget_usd is not None
+        and policy.spent_today_usd >= _BUDGET_PRESSURE * policy.daily_budget_usd
+    )
+    if not eligible:
+        pick = min(candidates, key=lambda c: c["est_cost_usd"])
+        reason = "no candidate met constraints; cheapest"
+    elif under_pressure:
+        pick = min(eligible, key=lambda c: c["est_cost_usd"])
+        reason = "budget pressure; cheapest eligible"
+    else:
+        pick = eligible[0]
+        first = candidates[0]
+        reason = (
+            "preferred"
+            if pick is first
+            else f"skipped {first['model']} ({first['rejected']})"
+        )
+    return RouteDecision(
+        mode=pick["mode"],
+        model=pick["model"],
+        reason=reason,
+        prior_mode=prior_mode,
+        candidates=candidates,
+    )
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    # ~4 characters per token is close enough for routing.
+    return sum(len(str(m.get("content") or "")) for m in messages) // 4
+
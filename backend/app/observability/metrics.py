@@ -0,0 +1,479 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.observability import tracing
+
+# In-process metrics with Prometheus text exposition.
+#
+# Counters, gauges and fixed-bucket histograms are keyed by a tuple of label
+# values and guarded by one lock per metric, so request threads, the write
+# lane and background jobs can record concurrently. Nothing resets on read:
+# /metrics is scraped, and rates/percentiles are derived by the scraper (or
+# approximately by quantile() for /debug/telemetry).
+
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+SIZE_BUCKETS: Tuple[float, ...] = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+_LabelKey = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> _LabelKey:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(sorted(labels))}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count per label set.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[_LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if amount < 0:
+            raise ValueError("counters only go up")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down per label set.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[_LabelKey, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class _Series:
+    __slots__ = ("buckets", "count", "total")
+
+    def __init__(self, size: int) -> None:
+        self.buckets = [0] * size  # non-cumulative; +Inf is the last slot
+        self.count = 0
+        self.total = 0.0
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket histogram per label set (seconds unless noted).
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        bounds = sorted(float(b) for b in buckets)
+        if not bounds or bounds[-1] != math.inf:
+            bounds.append(math.inf)
+        self.bounds: Tuple[float, ...] = tuple(bounds)
+        self._series: Dict[_LabelKey, _Series] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = len(self.bounds) - 1
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(len(self.bounds))
+            series.buckets[index] += 1
+            series.count += 1
+            series.total += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series.count if series else 0
+
+    def quantile(self, q: float, **labels: Any) -> Optional[float]:
+        """
+        Estimate the q-quantile by linear interpolation inside its bucket
+        (the same approximation as PromQL's histogram_quantile).
+        """
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            if series is None or not series.count:
+                return None
+            counts = list(series.buckets)
+            total = series.count
+        return self._interpolate(counts, total, q)
+
+    def _interpolate(self, counts: List[int], total: int, q: float) -> float:
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for bound, in_bucket in zip(self.bounds, counts):
+            if in_bucket and cumulative + in_bucket >= rank:
+                if bound == math.inf:
+                    # Past the last finite bound: report that bound.
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / in_bucket
+            cumulative += in_bucket
+            if bound != math.inf:
+                lower = bound
+        return lower
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        count / mean / p50 / p95 / p99 per label set, keyed "a=x,b=y".
+        """
+        with self._lock:
+            items = [
+                (key, list(series.buckets), series.count, series.total)
+                for key, series in self._series.items()
+            ]
+        out: Dict[str, Dict[str, Any]] = {}
+        for key, counts, total, value_sum in sorted(items):
+            label = ",".join(f"{n}={v}" for n, v in zip(self.labelnames, key))
+            out[label] = {
+                "count": total,
+                "mean": value_sum / total if total else 0.0,
+                "p50": self._interpolate(counts, total, 0.50),
+                "p95": self._interpolate(counts, total, 0.95),
+                "p99": self._interpolate(counts, total, 0.99),
+            }
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [
+                (key, list(series.buckets), series.count, series.total)
+                for key, series in sorted(self._series.items())
+            ]
+        lines = self._header()
+        for key, counts, total, value_sum in items:
+            cumulative = 0
+            for bound, in_bucket in zip(self.bounds, counts):
+                cumulative += in_bucket
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(value_sum)}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class Registry:
+    """
+    Named collection of metrics rendered together at /metrics.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))  # type: ignore[return-value]
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def latency_summary(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        with self._lock:
+            metrics = [m for m in self._metrics.values() if isinstance(m, Histogram)]
+        return {m.name: m.summary() for m in sorted(metrics, key=lambda m: m.name)}
+
+    def reset(self) -> None:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+
+REGISTRY = Registry()
+
+# ---------------------------------------------------------------------------
+# Application metrics
+# ---------------------------------------------------------------------------
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "iw_http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status")
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    "iw_http_request_duration_seconds", "HTTP handler latency by route template.", ("method", "route")
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge("iw_http_requests_in_flight", "HTTP requests being served.")
+
+CHAT_STAGE_LATENCY = REGISTRY.histogram(
+    "iw_chat_stage_duration_seconds", "Time spent in each /chat stage.", ("stage",)
+)
+
+LLM_CALL_LATENCY = REGISTRY.histogram(
+    "iw_llm_call_duration_seconds", "Model API call latency.", ("model", "outcome")
+)
+LLM_TOKENS = REGISTRY.counter(
+    "iw_llm_tokens_total", "Tokens reported by the model API.", ("model", "direction")
+)
+
+EMBED_BATCH_LATENCY = REGISTRY.histogram(
+    "iw_embedding_batch_duration_seconds", "Embedding API call latency per batch.", ("model",)
+)
+EMBED_BATCH_SIZE = REGISTRY.histogram(
+    "iw_embedding_batch_size", "Inputs per embedding API call.", ("model",), buckets=SIZE_BUCKETS
+)
+EMBED_COALESCED = REGISTRY.counter(
+    "iw_embedding_requests_total",
+    "Single-text embedding requests by how they were served (direct, batched, shared).",
+    ("outcome",),
+)
+
+VECTOR_QUERY_LATENCY = REGISTRY.histogram(
+    "iw_vector_query_duration_seconds", "Vector store similarity query latency.", ("collection",)
+)
+
+VECTOR_DRIFT = REGISTRY.gauge(
+    "iw_vector_drift",
+    "Vector/SQL mismatches found by the last reconcile pass.",
+    ("collection", "kind"),
+)
+VECTOR_REPAIRS = REGISTRY.counter(
+    "iw_vector_reconcile_repairs_total", "Vectors deleted or re-added by reconcile.", ("collection", "action")
+)
+
+RETRIEVAL_HITS = REGISTRY.counter(
+    "iw_retrieval_hits_total", "Retrieved items by surface and kind.", ("surface", "kind")
+)
+CONTEXT_SNIPPETS = REGISTRY.counter(
+    "iw_context_snippets_total",
+    "Retrieved /chat snippets by what the context budgeter did with them.",
+    ("source", "outcome"),
+)
+CONTEXT_COMPRESSION = REGISTRY.counter(
+    "iw_context_compression_chars_total",
+    "Characters of compressed /chat doc chunks before and after extraction.",
+    ("stage",),
+)
+RETRIEVAL_CACHE = REGISTRY.counter(
+    "iw_retrieval_cache_total", "Retrieval result cache lookups.", ("collection", "outcome")
+)
+
+WRITE_LANE_WAIT = REGISTRY.histogram(
+    "iw_sqlite_write_lane_wait_seconds", "Time spent queued for the SQLite write lane."
+)
+WRITE_LANE_QUEUED = REGISTRY.gauge(
+    "iw_sqlite_write_lane_queued", "Sessions currently queued for the SQLite write lane."
+)
+WRITE_GROUP_COMMIT = REGISTRY.histogram(
+    "iw_sqlite_group_commit_duration_seconds", "Duration of one group-committed write transaction."
+)
+WRITE_GROUP_SIZE = REGISTRY.histogram(
+    "iw_sqlite_group_commit_units", "Write units per group commit.", buckets=SIZE_BUCKETS
+)
+
+
+class StageTimer:
+    """
+    Record consecutive stages of one request into a histogram and trace.
+
+    Each lap(stage) observes the time since the previous lap (or creation)
+    under that stage label, so a handler only marks stage boundaries. Inside
+    a traced request every lap also becomes a span (with the given
+    attributes); spans opened during a stage nest under it.
+    """
+
+    def __init__(self, histogram: Histogram) -> None:
+        self._histogram = histogram
+        self._last = time.perf_counter()
+        self._span = tracing.open_stage()
+
+    def lap(self, stage: str, **attributes: Any) -> float:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self._histogram.observe(elapsed, stage=stage)
+        if self._span is not None:
+            end_ns = self._span.start_ns + int(elapsed * 1e9)
+            tracing.close_stage(self._span, stage, end_ns, **attributes)
+            self._span = tracing.open_stage()
+            if self._span is not None:
+                self._span.start_ns = end_ns
+        return elapsed
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+def get_latency_summary() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    return REGISTRY.latency_summary()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing handlers per route template.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def _send(message: Dict[str, Any]) -> None:
+            if message.get("type") == "http.response.start":
+                status["code"] = message.get("status", 500)
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            # Route templates ("/projects/{project_id}") keep label cardinality bounded.
+            route_label = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=method, route=route_label)
+            HTTP_REQUESTS.inc(method=method, route=route_label, status=str(status["code"]))
@@ -0,0 +1,384 @@
+from __future__ import annotations
+
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+# Lightweight in-process request tracing.
+#
+# TracingMiddleware opens a root span per HTTP request. Handlers add child
+# spans either with `span(name)` (nested work such as a model call) or by
+# lapping a StageTimer (consecutive stages of /chat). Only traces that picked
+# up at least one child span are kept: they go to a ring buffer served at
+# /debug/traces and, when IW_TRACE_EXPORT_FILE is set, are appended to that
+# file as OTLP/JSON lines (one ExportTraceServiceRequest per trace).
+
+_DEFAULT_BUFFER = 200
+_SERVICE_NAME = "infinitywindow-backend"
+TRACE_ID_HEADER = "X-Trace-Id"
+
+_ATTR_TYPES = (str, bool, int, float)
+
+
+def _buffer_size() -> int:
+    try:
+        return max(1, int(os.getenv("IW_TRACE_BUFFER", _DEFAULT_BUFFER)))
+    except (TypeError, ValueError):
+        return _DEFAULT_BUFFER
+
+
+def _clean(value: Any) -> Any:
+    return value if isinstance(value, _ATTR_TYPES) or value is None else str(value)
+
+
+class Span:
+    """
+    One timed operation inside a trace.
+    """
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], start_ns: Optional[int] = None) -> None:
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+
+    def set_attributes(self, **attributes: Any) -> None:
+        for key, value in attributes.items():
+            if value is not None:
+                self.attributes[key] = _clean(value)
+
+    def finish(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is None:
+            self.end_ns = end_ns if end_ns is not None else time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+
+class _NoopSpan:
+    """
+    Returned by span() outside a traced request; swallows attributes.
+    """
+
+    span_id = None
+
+    def set_attributes(self, **attributes: Any) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+class Trace:
+    """
+    Root span plus the child spans recorded while serving one request.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(name, None)
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def children(self) -> List[Span]:
+        with self._lock:
+            return list(self.spans)
+
+    def to_dict(self) -> Dict[str, Any]:
+        root = self.root
+        spans = sorted(self.children(), key=lambda s: s.start_ns)
+        slowest = max(
+            (s for s in spans if s.parent_id == root.span_id),
+            key=lambda s: s.duration_ms,
+            default=None,
+        )
+        return {
+            "trace_id": self.trace_id,
+            "name": root.name,
+            "start": root.start_ns / 1e9,
+            "duration_ms": round(root.duration_ms, 3),
+            "error": root.error,
+            "attributes": dict(root.attributes),
+            "slowest_stage": slowest.name if slowest else None,
+            "spans": [
+                {
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "name": s.name,
+                    "offset_ms": round((s.start_ns - root.start_ns) / 1e6, 3),
+                    "duration_ms": round(s.duration_ms, 3),
+                    "error": s.error,
+                    "attributes": dict(s.attributes),
+                }
+                for s in spans
+            ],
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("iw_current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("iw_current_span", default=None)
+
+_lock = threading.Lock()
+_RECENT: Deque[Trace] = deque(maxlen=_buffer_size())
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def _parent_id(trace: Trace) -> str:
+    parent = _current_span.get()
+    return parent.span_id if parent is not None else trace.root.span_id
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """
+    Time a block as a child of the current span. A no-op outside a trace.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP
+        return
+    child = Span(name, _parent_id(trace))
+    child.set_attributes(**attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.error = type(exc).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+        trace.add(child)
+
+
+def open_stage() -> Optional[Span]:
+    """
+    Start an unnamed span that becomes the parent of nested spans until it is
+    closed with close_stage(). Used by StageTimer.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    stage = Span("", trace.root.span_id)
+    _current_span.set(stage)
+    return stage
+
+
+def close_stage(stage: Span, name: str, end_ns: int, **attributes: Any) -> None:
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    stage.name = name
+    stage.set_attributes(**attributes)
+    stage.finish(end_ns)
+    trace.add(stage)
+
+
+def set_trace_attributes(**attributes: Any) -> None:
+    """
+    Attach attributes (ids, mode, model) to the current request's root span.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.root.set_attributes(**attributes)
+
+
+def start_trace(name: str) -> Trace:
+    trace = Trace(name)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def end_trace(trace: Trace, error: Optional[str] = None) -> bool:
+    """
+    Close the root span; keep and export the trace if it has child spans.
+    """
+    trace.root.finish()
+    if error:
+        trace.root.error = error
+    _current_trace.set(None)
+    if not trace.children():
+        return False
+    with _lock:
+        _RECENT.append(trace)
+    _export(trace)
+    return True
+
+
+def recent_traces(
+    limit: int = 20,
+    name: Optional[str] = None,
+    min_duration_ms: float = 0.0,
+) -> List[Dict[str, Any]]:
+    """
+    Most recent retained traces first, optionally filtered.
+    """
+    with _lock:
+        traces = list(_RECENT)
+    out: List[Dict[str, Any]] = []
+    for trace in reversed(traces):
+        if name and trace.root.name != name:
+            continue
+        if trace.root.duration_ms < min_duration_ms:
+            continue
+        out.append(trace.to_dict())
+        if len(out) >= limit:
+            break
+    return out
+
+
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        traces = list(_RECENT)
+    for trace in traces:
+        if trace.trace_id == trace_id:
+            return trace.to_dict()
+    return None
+
+
+def reset_traces() -> None:
+    global _RECENT
+    with _lock:
+        _RECENT = deque(maxlen=_buffer_size())
+
+
+# ---------------------------------------------------------------------------
+# OTLP/JSON file export
+# ---------------------------------------------------------------------------
+
+_export_lock = threading.Lock()
+_export_warned = False
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(trace_id: str, s: Span) -> Dict[str, Any]:
+    out: Dict[str, Any] = {
+        "traceId": trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 2 if s.parent_id is None else 1,  # SERVER for the root, INTERNAL otherwise
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns or s.start_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent_id:
+        out["parentSpanId"] = s.parent_id
+    return out
+
+
+def to_otlp(trace: Trace) -> Dict[str, Any]:
+    """
+    The trace as an OTLP/JSON ExportTraceServiceRequest.
+    """
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": _SERVICE_NAME}}
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "app.observability.tracing"},
+                        "spans": [
+                            _otlp_span(trace.trace_id, s)
+                            for s in [trace.root, *trace.children()]
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def _export(trace: Trace) -> None:
+    global _export_warned
+    path = os.getenv("IW_TRACE_EXPORT_FILE")
+    if not path:
+        return
+    line = json.dumps(to_otlp(trace), separators=(",", ":"))
+    try:
+        with _export_lock:
+            with open(path, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+    except OSError as exc:
+        if not _export_warned:
+            _export_warned = True
+            print(f"[WARN] Failed to export trace to {path!r}: {exc!r}")
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening one trace per HTTP request.
+
+    Retained traces are announced in an X-Trace-Id response header.
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope.get("method", "")
+        trace = start_trace(f"{method} {scope.get('path', '')}")
+        status = {"code": 500}
+
+        async def _send(message: Dict[str, Any]) -> None:
+            if message.get("type") == "http.response.start":
+                status["code"] = message.get("status", 500)
+                if trace.children():
+                    headers = list(message.get("headers") or [])
+                    headers.append((TRACE_ID_HEADER.lower().encode("ascii"), trace.trace_id.encode("ascii")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        error: Optional[str] = None
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                trace.root.name = f"{method} {route}"
+            trace.root.set_attributes(
+                **{"http.method": method, "http.route": route, "http.status_code": status["code"]}
+            )
+            if error is None and status["code"] >= 500:
+                error = f"HTTP {status['code']}"
+            end_trace(trace, error)
@@ -10,12 +10,21 @@ import os
 import shutil
 from pathlib import Path
 
+from app.llm import embeddings as embeddings_module
+from app.observability.metrics import VECTOR_QUERY_LATENCY
+from app.observability.tracing import span
+from app.vectorstore import registry, retrieval_cache
+
 # We'll store Chroma data in ./chroma_data relative to the backend folder.
 # This will create a "chroma_data" directory next to infinitywindow.db.
 _CHROMA_CLIENT: chromadb.PersistentClient | _StubClient | None = None
 _CHROMA_PATH = Path("chroma_data")
 
-# Collection names
+# Logical collection names; the physical collection serving each one comes
+# from app.vectorstore.registry (it changes when a re-index swaps in a new
+# embedding model, dimension or layout). With per-project partitions every
+# helper below routes to the project's own collection. Every add and delete
+# bumps the app.vectorstore.retrieval_cache generation of what it touched.
 _MESSAGES_COLLECTION_NAME = "messages"
 _DOCS_COLLECTION_NAME = "docs"
 _MEMORY_COLLECTION_NAME = "memory_items"
@@ -30,6 +39,7 @@ class _StubCollection:
 
     Only implements the subset of the API that the app uses in tests:
     - add
+    - get
     - query
     - delete
     """
@@ -69,6 +79,34 @@ class _StubCollection:
         target_ids = {str(_id) for _id in ids}
         self._records = [rec for rec in self._records if rec["id"] not in target_ids]
 
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None,
+        **_: Any,
+    ) -> Dict[str, Any]:
+        include = include if include is not None else ["documents", "metadatas"]
+        records = [rec for rec in self._records if self._matches_where(rec["metadata"], where)]
+        if ids is not None:
+            wanted = {str(_id) for _id in ids}
+            records = [rec for rec in records if rec["id"] in wanted]
+        start = offset or 0
+        records = records[start:] if limit is None else records[start:start + limit]
+        result = {
+            "ids": [rec["id"] for rec in records],
+            "documents": [rec["document"] for rec in records] if "documents" in include else None,
+            "metadatas": [dict(rec["metadata"]) for rec in records] if "metadatas" in include else None,
+        }
+        if "embeddings" in include:
+            result["embeddings"] = [list(rec["embedding"]) for rec in records]
+        return result
+
+    def count(self) -> int:
+        return len(self._records)
+
     def _matches_where(self, meta: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
         if not where:
             return True
@@ -78,6 +116,9 @@ class _StubCollection:
             if isinstance(cond, dict) and "$eq" in cond:
                 if meta.get(key) != cond["$eq"]:
                     return False
+            elif isinstance(cond, dict) and "$in" in cond:
+                if meta.get(key) not in cond["$in"]:
+                    return False
             else:
                 if meta.get(key) != cond:
                     return False
@@ -138,6 +179,9 @@ class _StubClient:
             self._collections[name] = _StubCollection(name)
         return self._collections[name]
 
+    def delete_collection(self, name: str) -> None:
+        self._collections.pop(name, None)
+
     def reset(self) -> None:
         for collection in self._collections.values():
             collection.reset()
@@ -146,7 +190,7 @@ class _StubClient:
 
 def _vectorstore_mode() -> str:
     mode = os.getenv("VECTORSTORE_MODE", "persistent").lower()
-    return mode if mode in {"persistent", "stub"} else "persistent"
+    return mode if mode in {"persistent", "stub", "pgvector", "quantized"} else "persistent"
 
 
 def _is_stub_mode() -> bool:
@@ -156,6 +200,15 @@ def _is_stub_mode() -> bool:
 def _create_client() -> chromadb.PersistentClient | _StubClient:
     if _is_stub_mode():
         return _StubClient()
+    if _vectorstore_mode() == "pgvector":
+        # Imported lazily so SQLite/Chroma deployments never need a postgres driver.
+        from app.vectorstore.pgvector_store import PgVectorClient
+
+        return PgVectorClient()
+    if _vectorstore_mode() == "quantized":
+        from app.vectorstore.quantized_store import QuantizedClient
+
+        return QuantizedClient()
     _CHROMA_PATH.mkdir(parents=True, exist_ok=True)
     return chromadb.PersistentClient(path=str(_CHROMA_PATH))
 
@@ -176,6 +229,13 @@ def _reset_chroma_persistence(clear_data: bool = False) -> None:
     compaction/database errors.
     """
     global _CHROMA_CLIENT
+    retrieval_cache.clear()
+    if _vectorstore_mode() in {"pgvector", "quantized"}:
+        # Postgres-backed and quantized vectors are never wiped by Chroma recovery.
+        if _CHROMA_CLIENT is not None:
+            _CHROMA_CLIENT.reset()
+        _CHROMA_CLIENT = None
+        return
     if isinstance(_CHROMA_CLIENT, _StubClient):
         if clear_data:
             _CHROMA_CLIENT.reset()
@@ -201,7 +261,7 @@ def _with_chroma_retry(action: str, func, attempts: int = 2):
     store for the compaction case) and try again. This keeps the API responsive even if
     Chroma's metadata segment becomes inconsistent.
     """
-    if _is_stub_mode():
+    if _vectorstore_mode() != "persistent":
         return func()
 
     last_exc: Exception | None = None
@@ -228,22 +288,133 @@ def _with_chroma_retry(action: str, func, attempts: int = 2):
 
 
 # --------------------------------------------------------------------
-# Message collection helpers
+# Collection versions
 # --------------------------------------------------------------------
 
+_DESCRIPTIONS = {
+    _MESSAGES_COLLECTION_NAME: "InfinityWindow conversation messages",
+    _DOCS_COLLECTION_NAME: "InfinityWindow document chunks",
+    _MEMORY_COLLECTION_NAME: "InfinityWindow project memory items",
+}
+
+
+def get_collection_by_name(physical_name: str) -> Collection:
+    """
+    Get or create a physical collection (e.g. "docs", "docs__v4" or
+    "docs__v4__p12").
+    """
+    logical = physical_name.split("__", 1)[0]
+    return get_client().get_or_create_collection(
+        name=physical_name,
+        metadata={"description": _DESCRIPTIONS.get(logical, "InfinityWindow vectors")},
+    )
+
+
+def drop_collection(physical_name: str) -> None:
+    """
+    Delete a physical collection and its data; missing collections are ignored.
+    """
+
+    def _drop():
+        try:
+            get_client().delete_collection(name=physical_name)
+        except (ValueError, chroma_errors.NotFoundError):
+            pass
+
+    _with_chroma_retry("drop collection", _drop)
+
 
-def get_messages_collection() -> Collection:
+def _fit_to_active(name: str, embeddings: List[List[float]], contents: List[str]) -> List[List[float]]:
     """
-    Get or create the collection used for conversation message embeddings.
+    Re-embed vectors whose size does not match the active collection's spec:
+    the caller embedded them just before a re-index swapped in a new one.
     """
-    client = get_client()
-    collection = client.get_or_create_collection(
-        name=_MESSAGES_COLLECTION_NAME,
-        metadata={
-            "description": "InfinityWindow conversation messages"
-        },
+    spec = registry.active(name).spec
+    size = spec.vector_size
+    if size is None or all(len(vector) == size for vector in embeddings):
+        return embeddings
+    return embeddings_module.embed_texts_batched(
+        contents, model=spec.model, dimensions=spec.dimensions
     )
-    return collection
+
+
+def _collection(version: registry.CollectionVersion, project_id: Optional[int]) -> Collection:
+    return get_collection_by_name(version.collection_name(project_id))
+
+
+def _where(version: registry.CollectionVersion, project_id: int, *filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Combine metadata filters; the project filter is only needed when the
+    collection is shared between projects.
+    """
+    clauses = list(filters)
+    if not version.partitioned:
+        clauses.insert(0, {"project_id": {"$eq": project_id}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _mirror_add(
+    name: str,
+    project_id: int,
+    ids: List[str],
+    contents: List[str],
+    metadatas: List[Dict[str, Any]],
+) -> None:
+    """
+    While a re-index builds a new version of `name`, write to it as well,
+    embedded with its spec. Failures only warn: the re-index catch-up pass
+    re-adds anything missing before the swap.
+    """
+    version = registry.building(name)
+    if version is None or not ids:
+        return
+    try:
+        vectors = embeddings_module.embed_texts_batched(
+            contents, model=version.spec.model, dimensions=version.spec.dimensions
+        )
+        _with_chroma_retry(
+            f"mirror {name} vectors",
+            lambda: _collection(version, project_id).add(
+                ids=ids, embeddings=vectors, documents=contents, metadatas=metadatas
+            ),
+        )
+    except Exception as exc:  # noqa: BLE001
+        print(f"[WARN] Failed to mirror {len(ids)} {name} vector(s) into {version.physical_name}: {exc!r}")
+
+
+def _delete_everywhere(name: str, project_id: Optional[int], ids: List[str]) -> None:
+    """
+    Delete ids from the active version of `name` and from a building one.
+    `project_id` is required once either is partitioned.
+    """
+    try:
+        _with_chroma_retry(
+            f"delete {name} vectors",
+            lambda: _collection(registry.active(name), project_id).delete(ids=ids),
+        )
+    finally:
+        retrieval_cache.bump(name, project_id)
+    version = registry.building(name)
+    if version is not None:
+        _with_chroma_retry(
+            f"delete {name} vectors",
+            lambda: _collection(version, project_id).delete(ids=ids),
+        )
+
+
+# --------------------------------------------------------------------
+# Message collection helpers
+# --------------------------------------------------------------------
+
+
+def get_messages_collection(project_id: Optional[int] = None) -> Collection:
+    """
+    Get or create the collection used for conversation message embeddings
+    (the project's partition when collections are partitioned).
+    """
+    return _collection(registry.active(_MESSAGES_COLLECTION_NAME), project_id)
 
 
 def add_message_embedding(
@@ -258,7 +429,6 @@ def add_message_embedding(
     """
     Add a single message embedding to the Chroma 'messages' collection.
     """
-    collection = get_messages_collection()
     metadata = {
         "message_id": message_id,
         "conversation_id": conversation_id,
@@ -269,15 +439,19 @@ def add_message_embedding(
         metadata["folder_id"] = folder_id
 
     def _add():
-        collection = get_messages_collection()
+        collection = get_messages_collection(project_id)
         collection.add(
             ids=[str(message_id)],
-            embeddings=[embedding],
+            embeddings=_fit_to_active(_MESSAGES_COLLECTION_NAME, [embedding], [content]),
             documents=[content],
             metadatas=[metadata],
         )
 
-    _with_chroma_retry("add message embedding", _add)
+    try:
+        _with_chroma_retry("add message embedding", _add)
+    finally:
+        retrieval_cache.bump(_MESSAGES_COLLECTION_NAME, project_id)
+    _mirror_add(_MESSAGES_COLLECTION_NAME, project_id, [str(message_id)], [content], [metadata])
 
 
 def query_similar_messages(
@@ -290,34 +464,33 @@ def query_similar_messages(
     """
     Query messages similar to the query_embedding.
 
-    - Always filters by project_id.
+    - Always scoped to project_id (its partition, or a filter on a shared
+      collection).
     - If conversation_id is provided, also filters by that conversation.
 
     Uses Chroma's newer filter syntax:
       - Single-field filter: {"field": {"$eq": value}}
       - Multi-field filter: {"$and": [ {...}, {...} ]}
     """
-    collection = get_messages_collection()
+    version = registry.active(_MESSAGES_COLLECTION_NAME)
+    collection = _collection(version, project_id)
 
     # Build the "where" filter in the format Chroma expects
-    filters: List[Dict[str, Any]] = [
-        {"project_id": {"$eq": project_id}},
-    ]
+    filters: List[Dict[str, Any]] = []
     if conversation_id is not None:
         filters.append({"conversation_id": {"$eq": conversation_id}})
     if folder_id is not None:
         filters.append({"folder_id": {"$eq": folder_id}})
+    where = _where(version, project_id, *filters)
 
-    if len(filters) == 1:
-        where: Dict[str, Any] = filters[0]
-    else:
-        where = {"$and": filters}
-
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results,
-        where=where,
-    )
+    with VECTOR_QUERY_LATENCY.time(collection=_MESSAGES_COLLECTION_NAME), span(
+        "vector.query", collection=_MESSAGES_COLLECTION_NAME, n_results=n_results
+    ):
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=where,
+        )
     return results
 
 
@@ -326,18 +499,12 @@ def query_similar_messages(
 # --------------------------------------------------------------------
 
 
-def get_docs_collection() -> Collection:
+def get_docs_collection(project_id: Optional[int] = None) -> Collection:
     """
-    Get or create the collection used for document chunk embeddings.
+    Get or create the collection used for document chunk embeddings (the
+    project's partition when collections are partitioned).
     """
-    client = get_client()
-    collection = client.get_or_create_collection(
-        name=_DOCS_COLLECTION_NAME,
-        metadata={
-            "description": "InfinityWindow document chunks"
-        },
-    )
-    return collection
+    return _collection(registry.active(_DOCS_COLLECTION_NAME), project_id)
 
 
 def add_document_chunks(
@@ -384,15 +551,40 @@ def add_document_chunks(
             )
 
         def _add_slice():
-            collection = get_docs_collection()
+            collection = get_docs_collection(project_id)
             collection.add(
                 ids=[str(cid) for cid in slice_ids],
-                embeddings=slice_embeddings,
+                embeddings=_fit_to_active(_DOCS_COLLECTION_NAME, slice_embeddings, slice_contents),
                 documents=slice_contents,
                 metadatas=metadatas,
             )
 
-        _with_chroma_retry("add document chunks", _add_slice)
+        try:
+            _with_chroma_retry("add document chunks", _add_slice)
+        finally:
+            retrieval_cache.bump(_DOCS_COLLECTION_NAME, project_id)
+        _mirror_add(
+            _DOCS_COLLECTION_NAME,
+            project_id,
+            [str(cid) for cid in slice_ids],
+            slice_contents,
+            metadatas,
+        )
+
+
+def delete_document_chunks(chunk_ids: List[int], project_id: Optional[int] = None) -> None:
+    """
+    Remove the vectors of the given (canonical) chunk ids from 'docs'.
+    `project_id` is required once the collection is partitioned.
+    """
+    if not chunk_ids:
+        return
+    for start in range(0, len(chunk_ids), _CHROMA_MAX_BATCH):
+        _delete_everywhere(
+            _DOCS_COLLECTION_NAME,
+            project_id,
+            [str(cid) for cid in chunk_ids[start:start + _CHROMA_MAX_BATCH]],
+        )
 
 
 def query_similar_document_chunks(
@@ -400,34 +592,38 @@ def query_similar_document_chunks(
     query_embedding: List[float],
     document_id: Optional[int] = None,
     n_results: int = 5,
+    chunk_ids: Optional[List[int]] = None,
 ) -> Dict[str, Any]:
     """
     Query document chunks similar to the query_embedding.
 
-    - Always filters by project_id.
+    - Always scoped to project_id (its partition, or a filter on a shared
+      collection).
     - If document_id is provided, also filters by that document.
+    - If chunk_ids is provided, only those chunks' vectors are searched
+      (used to scope to a document whose chunks are deduplicated into
+      canonical chunks of other documents).
 
-    Uses Chroma's filter syntax with $eq and $and.
+    Uses Chroma's filter syntax with $eq, $in and $and.
     """
-    collection = get_docs_collection()
-
-    if document_id is None:
-        where: Dict[str, Any] = {
-            "project_id": {"$eq": project_id}
-        }
-    else:
-        where = {
-            "$and": [
-                {"project_id": {"$eq": project_id}},
-                {"document_id": {"$eq": document_id}},
-            ]
-        }
-
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results,
-        where=where,
-    )
+    version = registry.active(_DOCS_COLLECTION_NAME)
+    collection = _collection(version, project_id)
+
+    filters: List[Dict[str, Any]] = []
+    if document_id is not None:
+        filters.append({"document_id": {"$eq": document_id}})
+    if chunk_ids is not None:
+        filters.append({"chunk_id": {"$in": [int(c) for c in chunk_ids]}})
+    where = _where(version, project_id, *filters)
+
+    with VECTOR_QUERY_LATENCY.time(collection=_DOCS_COLLECTION_NAME), span(
+        "vector.query", collection=_DOCS_COLLECTION_NAME, n_results=n_results
+    ):
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=where,
+        )
     return results
 
 
@@ -436,15 +632,8 @@ def query_similar_document_chunks(
 # --------------------------------------------------------------------
 
 
-def get_memory_collection() -> Collection:
-    client = get_client()
-    collection = client.get_or_create_collection(
-        name=_MEMORY_COLLECTION_NAME,
-        metadata={
-            "description": "InfinityWindow project memory items"
-        },
-    )
-    return collection
+def get_memory_collection(project_id: Optional[int] = None) -> Collection:
+    return _collection(registry.active(_MEMORY_COLLECTION_NAME), project_id)
 
 
 def add_memory_embedding(
@@ -454,31 +643,36 @@ def add_memory_embedding(
     embedding: List[float],
     title: str | None = None,
 ) -> None:
+    metadata = {
+        "memory_id": memory_id,
+        "project_id": project_id,
+        "title": title,
+    }
+
     def _add():
-        collection = get_memory_collection()
+        collection = get_memory_collection(project_id)
         collection.add(
             ids=[str(memory_id)],
-            embeddings=[embedding],
+            embeddings=_fit_to_active(_MEMORY_COLLECTION_NAME, [embedding], [content]),
             documents=[content],
-            metadatas=[
-                {
-                    "memory_id": memory_id,
-                    "project_id": project_id,
-                    "title": title,
-                }
-            ],
+            metadatas=[metadata],
         )
 
-    _with_chroma_retry("add memory embedding", _add)
+    try:
+        _with_chroma_retry("add memory embedding", _add)
+    finally:
+        retrieval_cache.bump(_MEMORY_COLLECTION_NAME, project_id)
+    _mirror_add(_MEMORY_COLLECTION_NAME, project_id, [str(memory_id)], [content], [metadata])
 
 
-def delete_memory_embedding(memory_id: int) -> None:
-    collection = get_memory_collection()
-    try:
-        collection.delete(ids=[str(memory_id)])
-    except Exception:
-        # Missing embeddings are not fatal
-        pass
+def delete_memory_embedding(memory_id: int, project_id: Optional[int] = None) -> None:
+    """
+    Remove a memory item's vector. Deleting an id that is not indexed is a
+    no-op; real vector store failures propagate to the caller. `project_id`
+    is required once the collection is partitioned.
+    """
+
+    _delete_everywhere(_MEMORY_COLLECTION_NAME, project_id, [str(memory_id)])
 
 
 def query_similar_memory_items(
@@ -486,9 +680,13 @@ def query_similar_memory_items(
     query_embedding: List[float],
     n_results: int = 5,
 ) -> Dict[str, Any]:
-    collection = get_memory_collection()
-    return collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results,
-        where={"project_id": {"$eq": project_id}},
-    )
+    version = registry.active(_MEMORY_COLLECTION_NAME)
+    collection = _collection(version, project_id)
+    with VECTOR_QUERY_LATENCY.time(collection=_MEMORY_COLLECTION_NAME), span(
+        "vector.query", collection=_MEMORY_COLLECTION_NAME, n_results=n_results
+    ):
+        return collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=_where(version, project_id),
+        )
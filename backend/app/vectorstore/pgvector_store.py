@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+# Chroma-compatible client/collection backed by PostgreSQL + pgvector, selected
+# with VECTORSTORE_MODE=pgvector. Each collection is one table; metadata lives
+# in a JSONB column so the project/document/conversation filters and the
+# similarity ordering run as a single SQL query.
+#
+# The store connects to PGVECTOR_DATABASE_URL, falling back to DATABASE_URL.
+# Embeddings are passed as pgvector text literals, so only a PostgreSQL driver
+# (e.g. psycopg) is needed, not the pgvector Python package.
+#
+# An HNSW scan hands back its hnsw.ef_search nearest candidates and the
+# metadata filter is applied afterwards, so a selective filter (one project in
+# a shared collection, one conversation) could return fewer than k rows. A
+# filtered query therefore raises ef_search with k and, on pgvector >= 0.8,
+# enables iterative scans (hnsw.iterative_scan = relaxed_order), which keep
+# scanning until k rows pass the filter; rows are re-sorted by distance since
+# relaxed order may return them slightly out of order. Older pgvector versions
+# only get the larger ef_search and can still fall short on very selective
+# filters; the per-project partitioned layout (IW_VECTOR_PARTITIONING=project)
+# avoids the project filter altogether.
+
+_TABLE_PREFIX = "iw_vectors_"
+_MIN_EF_SEARCH = 40
+_MAX_EF_SEARCH = 1000
+_EF_SEARCH_PER_RESULT = 10
+_ITERATIVE_SCAN_VERSION = (0, 8)
+_SAFE_NAME = re.compile(r"[^a-z0-9_]")
+
+
+def _database_url() -> str:
+    url = os.getenv("PGVECTOR_DATABASE_URL") or os.getenv("DATABASE_URL") or ""
+    if not url.startswith("postgresql"):
+        raise RuntimeError(
+            "VECTORSTORE_MODE=pgvector requires PGVECTOR_DATABASE_URL or "
+            "DATABASE_URL to point at a PostgreSQL database."
+        )
+    return url
+
+
+def _vector_literal(embedding: List[float]) -> str:
+    return "[" + ",".join(repr(float(x)) for x in embedding) + "]"
+
+
+def _version_tuple(version: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+
+
+def _where_to_containment(where: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, List[Any]]]:
+    """
+    Translate the Chroma filter subset the app uses ({"k": v}, {"k": {"$eq": v}},
+    {"k": {"$in": [...]}}, {"$and": [...]}) into one JSONB containment document
+    plus the per-key value lists of the $in terms.
+    """
+    merged: Dict[str, Any] = {}
+    any_of: Dict[str, List[Any]] = {}
+    if not where:
+        return merged, any_of
+    if "$and" in where:
+        for clause in where["$and"]:
+            contained, listed = _where_to_containment(clause)
+            merged.update(contained)
+            any_of.update(listed)
+        return merged, any_of
+    for key, cond in where.items():
+        if isinstance(cond, dict):
+            if set(cond) == {"$eq"}:
+                merged[key] = cond["$eq"]
+            elif set(cond) == {"$in"}:
+                any_of[key] = list(cond["$in"])
+            else:
+                raise ValueError(f"Unsupported pgvector filter for '{key}': {cond!r}")
+        else:
+            merged[key] = cond
+    return merged, any_of
+
+
+def _filter_clauses(where: Optional[Dict[str, Any]], params: Dict[str, Any]) -> List[str]:
+    """
+    SQL conditions for `where`, adding their bind parameters to `params`.
+    """
+    contained, any_of = _where_to_containment(where)
+    clauses: List[str] = []
+    if contained:
+        clauses.append("metadata @> CAST(:filter AS jsonb)")
+        params["filter"] = json.dumps(contained)
+    for position, (key, values) in enumerate(any_of.items()):
+        # Compare the JSON text form so ints and strings match as stored.
+        clauses.append(f"metadata ->> CAST(:in_key_{position} AS text) = ANY(:in_values_{position})")
+        params[f"in_key_{position}"] = key
+        params[f"in_values_{position}"] = [
+            value if isinstance(value, str) else json.dumps(value) for value in values
+        ]
+    return clauses
+
+
+class PgVectorCollection:
+    """
+    One pgvector table exposing the Chroma collection methods the app uses.
+    """
+
+    def __init__(self, engine: Engine, name: str):
+        self.name = name
+        self._engine = engine
+        self._table = _TABLE_PREFIX + _SAFE_NAME.sub("_", name.lower())
+        self._ready = False
+        self._lock = threading.Lock()
+        self._iterative_scan: Optional[bool] = None
+
+    def _table_exists(self, conn) -> bool:
+        return bool(
+            conn.execute(text("SELECT to_regclass(:name)"), {"name": self._table}).scalar()
+        )
+
+    def _ensure_table(self, dim: int) -> None:
+        if self._ready:
+            return
+        with self._lock, self._engine.begin() as conn:
+            if self._ready:
+                return
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {self._table} ("
+                    "id TEXT PRIMARY KEY, "
+                    f"embedding vector({int(dim)}) NOT NULL, "
+                    "document TEXT NOT NULL DEFAULT '', "
+                    "metadata JSONB NOT NULL DEFAULT '{}'::jsonb)"
+                )
+            )
+            conn.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {self._table}_embedding_hnsw "
+                    f"ON {self._table} USING hnsw (embedding vector_l2_ops)"
+                )
+            )
+            conn.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {self._table}_metadata_gin "
+                    f"ON {self._table} USING gin (metadata jsonb_path_ops)"
+                )
+            )
+            self._ready = True
+
+    def _supports_iterative_scan(self, conn) -> bool:
+        if self._iterative_scan is None:
+            version = conn.execute(
+                text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            ).scalar()
+            self._iterative_scan = _version_tuple(version or "") >= _ITERATIVE_SCAN_VERSION
+        return self._iterative_scan
+
+    def _exists(self) -> bool:
+        if self._ready:
+            return True
+        with self._engine.connect() as conn:
+            self._ready = self._table_exists(conn)
+        return self._ready
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        if not ids:
+            return
+        self._ensure_table(len(embeddings[0]))
+        docs = documents or [""] * len(ids)
+        metas = metadatas or [{} for _ in ids]
+        rows = [
+            {
+                "id": str(rid),
+                "embedding": _vector_literal(embedding),
+                "document": doc or "",
+                "metadata": json.dumps(
+                    {k: v for k, v in (meta or {}).items() if v is not None}
+                ),
+            }
+            for rid, embedding, doc, meta in zip(ids, embeddings, docs, metas)
+        ]
+        with self._engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"INSERT INTO {self._table} (id, embedding, document, metadata) "
+                    "VALUES (:id, CAST(:embedding AS vector), :document, CAST(:metadata AS jsonb)) "
+                    "ON CONFLICT (id) DO UPDATE SET embedding = EXCLUDED.embedding, "
+                    "document = EXCLUDED.document, metadata = EXCLUDED.metadata"
+                ),
+                rows,
+            )
+
+    def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        **_: Any,
+    ) -> None:
+        if not ids and not where:
+            return
+        if not self._exists():
+            return
+        clauses: List[str] = []
+        params: Dict[str, Any] = {}
+        if ids:
+            clauses.append("id = ANY(:ids)")
+            params["ids"] = [str(rid) for rid in ids]
+        if where:
+            clauses.extend(_filter_clauses(where, params))
+        if not clauses:
+            return
+        with self._engine.begin() as conn:
+            conn.execute(
+                text(f"DELETE FROM {self._table} WHERE {' AND '.join(clauses)}"), params
+            )
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None,
+        **_: Any,
+    ) -> Dict[str, Any]:
+        include = include if include is not None else ["documents", "metadatas"]
+        empty: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": []}
+        if not self._exists():
+            return empty
+        clauses = ["TRUE"]
+        params: Dict[str, Any] = {}
+        if ids is not None:
+            clauses.append("id = ANY(:ids)")
+            params["ids"] = [str(rid) for rid in ids]
+        clauses.extend(_filter_clauses(where, params))
+        with_embeddings = "embeddings" in include
+        columns = "id, document, metadata" + (", CAST(embedding AS text)" if with_embeddings else "")
+        sql = (
+            f"SELECT {columns} FROM {self._table} "
+            f"WHERE {' AND '.join(clauses)} ORDER BY id"
+        )
+        if limit is not None:
+            sql += " LIMIT :limit"
+            params["limit"] = int(limit)
+        if offset:
+            sql += " OFFSET :offset"
+            params["offset"] = int(offset)
+        with self._engine.connect() as conn:
+            rows = conn.execute(text(sql), params).fetchall()
+        result: Dict[str, Any] = {"ids": [row[0] for row in rows]}
+        result["documents"] = [row[1] for row in rows] if "documents" in include else None
+        result["metadatas"] = [dict(row[2] or {}) for row in rows] if "metadatas" in include else None
+        if with_embeddings:
+            # pgvector's text form is a JSON array: "[0.1,0.2,...]".
+            result["embeddings"] = [json.loads(row[3]) for row in rows]
+        return result
+
+    def count(self) -> int:
+        if not self._exists():
+            return 0
+        with self._engine.connect() as conn:
+            return int(conn.execute(text(f"SELECT COUNT(*) FROM {self._table}")).scalar() or 0)
+
+    def query(
+        self,
+        query_embeddings: Optional[List[List[float]]] = None,
+        n_results: int = 5,
+        where: Optional[Dict[str, Any]] = None,
+        **_: Any,
+    ) -> Dict[str, Any]:
+        empty: Dict[str, Any] = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+        if not query_embeddings or not self._exists():
+            return empty
+        params: Dict[str, Any] = {
+            "query": _vector_literal(query_embeddings[0]),
+            "limit": int(n_results),
+        }
+        clauses = _filter_clauses(where, params)
+        filter_sql = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        # Squared L2, matching Chroma's default "l2" space.
+        sql = (
+            "WITH nearest AS MATERIALIZED ("
+            "SELECT id, document, metadata, "
+            "power(embedding <-> CAST(:query AS vector), 2) AS distance "
+            f"FROM {self._table} {filter_sql}"
+            "ORDER BY embedding <-> CAST(:query AS vector) LIMIT :limit"
+            ") SELECT id, document, metadata, distance FROM nearest ORDER BY distance"
+        )
+        with self._engine.begin() as conn:
+            if clauses:
+                # SET LOCAL: the settings end with this transaction (see module comment).
+                ef_search = min(_MAX_EF_SEARCH, max(_MIN_EF_SEARCH, int(n_results) * _EF_SEARCH_PER_RESULT))
+                conn.execute(text(f"SET LOCAL hnsw.ef_search = {ef_search}"))
+                if self._supports_iterative_scan(conn):
+                    conn.execute(text("SET LOCAL hnsw.iterative_scan = relaxed_order"))
+            rows = conn.execute(text(sql), params).fetchall()
+        return {
+            "ids": [[row[0] for row in rows]],
+            "documents": [[row[1] for row in rows]],
+            "metadatas": [[dict(row[2] or {}) for row in rows]],
+            "distances": [[float(row[3]) for row in rows]],
+        }
+
+
+class PgVectorClient:
+    def __init__(self, engine: Optional[Engine] = None):
+        self._engine = engine or create_engine(_database_url(), pool_pre_ping=True)
+        self._collections: Dict[str, PgVectorCollection] = {}
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict[str, Any]] = None):
+        del metadata  # table-per-collection; descriptive metadata is not stored
+        if name not in self._collections:
+            self._collections[name] = PgVectorCollection(self._engine, name)
+        return self._collections[name]
+
+    def delete_collection(self, name: str) -> None:
+        collection = self.get_or_create_collection(name)
+        with self._engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {collection._table}"))
+        del self._collections[name]
+
+    def reset(self, drop_tables: bool = False) -> None:
+        if drop_tables:
+            with self._engine.begin() as conn:
+                for collection in self._collections.values():
+                    conn.execute(text(f"DROP TABLE IF EXISTS {collection._table}"))
+        self._collections = {}
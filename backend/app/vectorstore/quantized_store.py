@@ -0,0 +1,646 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Chroma-compatible embedded vector store that keeps only compressed codes in
+# RAM, selected with VECTORSTORE_MODE=quantized.
+#
+# Each collection lives in its own directory: exact float32 vectors go to an
+# append-only slot file (vectors.f32) that is only memory-mapped at query
+# time, while ids, metadata, documents and the codes sit in a small SQLite
+# file. Queries score every candidate on its code, keep a pool of the best
+# few, and re-rank that pool with the exact vectors read back from disk, so
+# returned distances are exact squared L2 (Chroma's default space).
+#
+# Codecs:
+# - int8: per-vector symmetric scalar quantization (dim bytes + 8, ~4x).
+# - pq: product quantization, 256 centroids per subvector of
+#   IW_PQ_SUBVECTOR_DIM floats (16x at the default of 4). Codebooks are trained
+#   once, when the collection first reaches IW_PQ_TRAIN_MIN vectors; until then
+#   the collection uses int8 codes.
+
+_DEFAULT_PATH = "quantized_vectors"
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]")
+_SCALAR = "int8"
+_PRODUCT = "pq"
+_CODECS = {_SCALAR, _PRODUCT}
+_DEFAULT_CODECS = {"docs": _PRODUCT}
+_PQ_CENTROIDS = 256
+_MIN_RERANK_POOL = 32
+_SCORE_BLOCK = 8192  # candidates decoded per numpy block
+_SQL_CHUNK = 500  # ids per "IN (...)" lookup
+_INDEXABLE = (str, int, float, bool)
+
+
+def _env_int(name: str, default: int, minimum: int = 0) -> int:
+    try:
+        return max(minimum, int(os.getenv(name, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def quantization_for(name: str) -> str:
+    """
+    Codec for a collection: IW_VECTOR_QUANTIZATION_<NAME>, then
+    IW_VECTOR_QUANTIZATION, then pq for docs and int8 for everything else.
+    Re-indexed versions and project partitions ("docs__v4__p12") follow
+    their logical name.
+    """
+    name = name.split("__", 1)[0]
+    key = _SAFE_NAME.sub("_", name).upper()
+    for value in (
+        os.getenv(f"IW_VECTOR_QUANTIZATION_{key}"),
+        os.getenv("IW_VECTOR_QUANTIZATION"),
+    ):
+        if value and value.strip().lower() in _CODECS:
+            return value.strip().lower()
+    return _DEFAULT_CODECS.get(name, _SCALAR)
+
+
+def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    scores = (centroids * centroids).sum(axis=1)[None, :] - 2.0 * (data @ centroids.T)
+    return scores.argmin(axis=1)
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    width = data.shape[1]
+    for _ in range(iterations):
+        assign = _nearest(data, centroids)
+        counts = np.bincount(assign, minlength=k)
+        filled = counts > 0
+        sums = np.stack(
+            [np.bincount(assign, weights=data[:, col], minlength=k) for col in range(width)],
+            axis=1,
+        )
+        centroids[filled] = (sums[filled] / counts[filled, None]).astype(np.float32)
+    return centroids
+
+
+class _ScalarCodec:
+    """
+    int8 codes with a per-vector scale; keeps the exact squared norm so the
+    approximate L2 only errs on the dot product.
+    """
+
+    name = _SCALAR
+    dtype = np.int8
+    extra_width = 2  # scale, squared norm
+
+    def __init__(self, dim: int) -> None:
+        self.code_size = dim
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        peak = np.abs(vectors).max(axis=1)
+        scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        norms = np.einsum("ij,ij->i", vectors, vectors)
+        return codes, np.stack([scales, norms], axis=1).astype(np.float32)
+
+    def scorer(self, query: np.ndarray) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        query_norm = float(query @ query)
+
+        def _score(codes: np.ndarray, extras: np.ndarray) -> np.ndarray:
+            dots = codes.astype(np.float32) @ query
+            return extras[:, 1] - 2.0 * extras[:, 0] * dots + query_norm
+
+        return _score
+
+
+class _ProductCodec:
+    """
+    Product quantization: one byte per subvector, scored with a per-query
+    distance table (asymmetric distance computation).
+    """
+
+    name = _PRODUCT
+    dtype = np.uint8
+    extra_width = 0
+
+    def __init__(self, codebooks: np.ndarray) -> None:
+        self.codebooks = np.ascontiguousarray(codebooks, dtype=np.float32)
+        self.code_size, _, self.subvector_dim = self.codebooks.shape
+        self._columns = np.arange(self.code_size)
+
+    @classmethod
+    def train(cls, sample: np.ndarray, subvector_dim: int, iterations: int) -> "_ProductCodec":
+        dim = sample.shape[1]
+        # Largest subvector width <= the configured one that divides dim.
+        width = next(w for w in range(min(subvector_dim, dim), 0, -1) if dim % w == 0)
+        parts = sample.reshape(len(sample), dim // width, width)
+        rng = np.random.default_rng(0)
+        codebooks = np.stack(
+            [
+                _kmeans(np.ascontiguousarray(parts[:, j, :]), _PQ_CENTROIDS, iterations, rng)
+                for j in range(dim // width)
+            ]
+        )
+        return cls(codebooks)
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        parts = vectors.reshape(len(vectors), self.code_size, self.subvector_dim)
+        codes = np.empty((len(vectors), self.code_size), dtype=np.uint8)
+        for j in range(self.code_size):
+            codes[:, j] = _nearest(np.ascontiguousarray(parts[:, j, :]), self.codebooks[j])
+        return codes, np.zeros((len(vectors), 0), dtype=np.float32)
+
+    def scorer(self, query: np.ndarray) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        sub = query.reshape(self.code_size, 1, self.subvector_dim)
+        table = ((self.codebooks - sub) ** 2).sum(axis=2)
+
+        def _score(codes: np.ndarray, extras: np.ndarray) -> np.ndarray:
+            del extras
+            return table[self._columns, codes].sum(axis=1)
+
+        return _score
+
+
+def _where_terms(where: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Flatten the Chroma filter subset the app uses ({"k": v}, {"k": {"$eq": v}},
+    {"k": {"$in": [...]}}, {"$and": [...]}) into key/value terms; an $in term
+    maps its key to a tuple of accepted values.
+    """
+    if not where:
+        return {}
+    terms: Dict[str, Any] = {}
+    if "$and" in where:
+        for clause in where["$and"]:
+            terms.update(_where_terms(clause))
+        return terms
+    for key, cond in where.items():
+        if isinstance(cond, dict):
+            if set(cond) == {"$eq"}:
+                terms[key] = cond["$eq"]
+            elif set(cond) == {"$in"}:
+                terms[key] = tuple(cond["$in"])
+            else:
+                raise ValueError(f"Unsupported quantized-store filter for '{key}': {cond!r}")
+        else:
+            terms[key] = cond
+    return terms
+
+
+class QuantizedCollection:
+    """
+    One on-disk collection exposing the Chroma collection methods the app uses.
+    """
+
+    def __init__(self, root: Path, name: str) -> None:
+        self.name = name
+        self.quantization = quantization_for(name)
+        self._dir = root / _SAFE_NAME.sub("_", name)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self._dir / "vectors.f32"
+        self._codebooks_path = self._dir / "pq_codebooks.npy"
+        self._lock = threading.RLock()
+        self._training = False
+        self._db = sqlite3.connect(str(self._dir / "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "id TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, "
+            "document TEXT NOT NULL DEFAULT '', metadata TEXT NOT NULL DEFAULT '{}', "
+            "code BLOB NOT NULL, extra BLOB NOT NULL)"
+        )
+        self._db.commit()
+        self._load()
+
+    # ------------------------------------------------------------------
+    # State
+    # ------------------------------------------------------------------
+
+    def _reset_state(self, capacity: int = 0) -> None:
+        self._ids: List[Optional[str]] = []
+        self._slot_of: Dict[str, int] = {}
+        self._metas: List[Optional[Dict[str, Any]]] = []
+        self._free: List[int] = []
+        self._postings: Dict[str, Dict[Any, Set[int]]] = {}
+        codec = self._codec or _ScalarCodec(0)
+        self._live = np.zeros(capacity, dtype=bool)
+        self._codes = np.zeros((capacity, codec.code_size), dtype=codec.dtype)
+        self._extras = np.zeros((capacity, codec.extra_width), dtype=np.float32)
+
+    def _meta_value(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def _load(self) -> None:
+        dim = self._meta_value("dim")
+        self.dim: Optional[int] = int(dim) if dim else None
+        self._codec: _ScalarCodec | _ProductCodec | None = None
+        if self.dim is not None:
+            if self._meta_value("codec") == _PRODUCT and self._codebooks_path.exists():
+                self._codec = _ProductCodec(np.load(self._codebooks_path))
+            else:
+                self._codec = _ScalarCodec(self.dim)
+        rows = self._db.execute(
+            "SELECT id, slot, metadata, code, extra FROM vectors ORDER BY slot"
+        ).fetchall()
+        capacity = (rows[-1][1] + 1) if rows else 0
+        self._reset_state(capacity)
+        if not rows:
+            return
+        self._ids = [None] * capacity
+        self._metas = [None] * capacity
+        for rid, slot, metadata, code, extra in rows:
+            self._ids[slot] = rid
+            self._slot_of[rid] = slot
+            self._metas[slot] = json.loads(metadata)
+            self._codes[slot] = np.frombuffer(code, dtype=self._codec.dtype)
+            self._extras[slot] = np.frombuffer(extra, dtype=np.float32)
+            self._live[slot] = True
+            self._index(slot)
+        self._free = [slot for slot in range(capacity) if self._ids[slot] is None]
+
+    def _ensure_dim(self, dim: int) -> None:
+        if self.dim is None:
+            self.dim = dim
+            self._codec = _ScalarCodec(dim)
+            self._set_meta("dim", str(dim))
+            self._set_meta("codec", _SCALAR)
+            self._reset_state()
+        elif dim != self.dim:
+            raise ValueError(
+                f"Embedding dimension {dim} does not match collection '{self.name}' "
+                f"dimension {self.dim}"
+            )
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self._live)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        live = np.zeros(capacity, dtype=bool)
+        live[: len(self._live)] = self._live
+        codes = np.zeros((capacity, self._codes.shape[1]), dtype=self._codes.dtype)
+        codes[: len(self._codes)] = self._codes
+        extras = np.zeros((capacity, self._extras.shape[1]), dtype=np.float32)
+        extras[: len(self._extras)] = self._extras
+        self._live, self._codes, self._extras = live, codes, extras
+
+    def _index(self, slot: int) -> None:
+        for key, value in (self._metas[slot] or {}).items():
+            if isinstance(value, _INDEXABLE):
+                self._postings.setdefault(key, {}).setdefault(value, set()).add(slot)
+
+    def _unindex(self, slot: int) -> None:
+        for key, value in (self._metas[slot] or {}).items():
+            if isinstance(value, _INDEXABLE):
+                self._postings.get(key, {}).get(value, set()).discard(slot)
+
+    def _term_slots(self, key: str, value: Any) -> Set[int]:
+        by_value = self._postings.get(key, {})
+        if isinstance(value, tuple):
+            return set().union(*(by_value.get(v, set()) for v in value))
+        return by_value.get(value, set())
+
+    def _matching_slots(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        terms = _where_terms(where)
+        if not terms:
+            return np.flatnonzero(self._live[: len(self._ids)])
+        postings = sorted((self._term_slots(key, value) for key, value in terms.items()), key=len)
+        slots = set(postings[0])
+        for other in postings[1:]:
+            slots &= other
+        return np.fromiter(sorted(slots), dtype=np.int64, count=len(slots))
+
+    # ------------------------------------------------------------------
+    # Exact vectors on disk
+    # ------------------------------------------------------------------
+
+    def _write_vectors(self, slots: List[int], vectors: np.ndarray) -> None:
+        mode = "r+b" if self._vectors_path.exists() else "w+b"
+        row_bytes = self.dim * 4
+        with open(self._vectors_path, mode) as fh:
+            for slot, vector in zip(slots, vectors):
+                fh.seek(slot * row_bytes)
+                fh.write(vector.tobytes())
+
+    def _read_vectors(self, slots: np.ndarray) -> np.ndarray:
+        if not len(slots):
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        rows = self._vectors_path.stat().st_size // (self.dim * 4)
+        mapped = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return np.asarray(mapped[slots])
+
+    def _documents(self, slots: Iterable[int]) -> List[str]:
+        ids = [self._ids[slot] for slot in slots]
+        found: Dict[str, str] = {}
+        for start in range(0, len(ids), _SQL_CHUNK):
+            chunk = ids[start:start + _SQL_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            found.update(
+                self._db.execute(f"SELECT id, document FROM vectors WHERE id IN ({marks})", chunk)
+            )
+        return [found.get(rid, "") for rid in ids]
+
+    # ------------------------------------------------------------------
+    # Chroma collection API
+    # ------------------------------------------------------------------
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        **_: Any,
+    ) -> None:
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("ids and embeddings must have the same length")
+        docs = documents or [""] * len(ids)
+        metas = [
+            {k: v for k, v in (meta or {}).items() if v is not None}
+            for meta in (metadatas or [{} for _ in ids])
+        ]
+        with self._lock:
+            self._ensure_dim(vectors.shape[1])
+            slots: List[int] = []
+            for rid in ids:
+                rid = str(rid)
+                slot = self._slot_of.get(rid)
+                if slot is None:
+                    slot = self._free.pop() if self._free else len(self._ids)
+                    if slot == len(self._ids):
+                        self._ids.append(None)
+                        self._metas.append(None)
+                else:
+                    self._unindex(slot)
+                slots.append(slot)
+                self._slot_of[rid] = slot
+                self._ids[slot] = rid
+            codes, extras = self._codec.encode(vectors)
+            self._write_vectors(slots, vectors)
+            self._grow(len(self._ids))
+            rows = []
+            for i, slot in enumerate(slots):
+                self._metas[slot] = metas[i]
+                self._codes[slot] = codes[i]
+                self._extras[slot] = extras[i]
+                self._live[slot] = True
+                self._index(slot)
+                rows.append(
+                    (
+                        self._ids[slot],
+                        slot,
+                        docs[i] or "",
+                        json.dumps(metas[i]),
+                        codes[i].tobytes(),
+                        extras[i].tobytes(),
+                    )
+                )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO vectors (id, slot, document, metadata, code, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.commit()
+            should_train = self._should_train()
+        if should_train:
+            self.train()
+
+    def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        **_: Any,
+    ) -> None:
+        if not ids and not where:
+            return
+        with self._lock:
+            if ids:
+                slots = {self._slot_of[str(rid)] for rid in ids if str(rid) in self._slot_of}
+                if where:
+                    slots &= set(self._matching_slots(where).tolist())
+            else:
+                slots = set(self._matching_slots(where).tolist())
+            if not slots:
+                return
+            doomed = []
+            for slot in slots:
+                self._unindex(slot)
+                rid = self._ids[slot]
+                doomed.append(rid)
+                del self._slot_of[rid]
+                self._ids[slot] = None
+                self._metas[slot] = None
+                self._live[slot] = False
+                self._free.append(slot)
+            for start in range(0, len(doomed), _SQL_CHUNK):
+                chunk = doomed[start:start + _SQL_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                self._db.execute(f"DELETE FROM vectors WHERE id IN ({marks})", chunk)
+            self._db.commit()
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None,
+        **_: Any,
+    ) -> Dict[str, Any]:
+        include = include if include is not None else ["documents", "metadatas"]
+        with self._lock:
+            slots = self._matching_slots(where)
+            if ids is not None:
+                wanted = {self._slot_of[str(rid)] for rid in ids if str(rid) in self._slot_of}
+                slots = slots[np.isin(slots, list(wanted))]
+            start = offset or 0
+            slots = slots[start:] if limit is None else slots[start:start + limit]
+            result: Dict[str, Any] = {"ids": [self._ids[slot] for slot in slots]}
+            result["documents"] = self._documents(slots) if "documents" in include else None
+            result["metadatas"] = (
+                [dict(self._metas[slot]) for slot in slots] if "metadatas" in include else None
+            )
+            if "embeddings" in include:
+                result["embeddings"] = self._read_vectors(slots).tolist()
+        return result
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._slot_of)
+
+    def query(
+        self,
+        query_embeddings: Optional[List[List[float]]] = None,
+        n_results: int = 5,
+        where: Optional[Dict[str, Any]] = None,
+        **_: Any,
+    ) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        factor = _env_int("IW_VECTOR_RERANK_FACTOR", 8, minimum=1)
+        with self._lock:
+            slots = self._matching_slots(where) if self.dim is not None else np.zeros(0, np.int64)
+            for embedding in query_embeddings or []:
+                query = np.asarray(embedding, dtype=np.float32)
+                if len(slots) and query.shape != (self.dim,):
+                    raise ValueError(
+                        f"Query dimension {query.shape[-1]} does not match collection "
+                        f"'{self.name}' dimension {self.dim}"
+                    )
+                top = self._search(query, slots, n_results, max(n_results * factor, _MIN_RERANK_POOL))
+                out["ids"].append([self._ids[slot] for slot, _ in top])
+                out["documents"].append(self._documents(slot for slot, _ in top))
+                out["metadatas"].append([dict(self._metas[slot]) for slot, _ in top])
+                out["distances"].append([distance for _, distance in top])
+        if not query_embeddings:
+            out = {key: [[]] for key in out}
+        return out
+
+    def _search(
+        self, query: np.ndarray, slots: np.ndarray, n_results: int, pool: int
+    ) -> List[Tuple[int, float]]:
+        if not len(slots) or n_results <= 0:
+            return []
+        score = self._codec.scorer(query)
+        approx = np.empty(len(slots), dtype=np.float32)
+        for start in range(0, len(slots), _SCORE_BLOCK):
+            block = slots[start:start + _SCORE_BLOCK]
+            approx[start:start + len(block)] = score(self._codes[block], self._extras[block])
+        if len(slots) > pool:
+            keep = np.argpartition(approx, pool - 1)[:pool]
+            slots = slots[keep]
+        exact = self._read_vectors(slots) - query
+        distances = np.einsum("ij,ij->i", exact, exact)
+        order = np.argsort(distances, kind="stable")[:n_results]
+        return [(int(slots[i]), float(distances[i])) for i in order]
+
+    # ------------------------------------------------------------------
+    # Product quantization
+    # ------------------------------------------------------------------
+
+    def _should_train(self) -> bool:
+        return (
+            self.quantization == _PRODUCT
+            and not isinstance(self._codec, _ProductCodec)
+            and not self._training
+            and len(self._slot_of) >= max(_PQ_CENTROIDS, _env_int("IW_PQ_TRAIN_MIN", 4096))
+        )
+
+    def train(self) -> bool:
+        """
+        Train PQ codebooks on a sample of the stored vectors and re-encode the
+        collection. k-means runs outside the lock; writes keep using the old
+        codes until the swap. Returns False if there is too little data.
+        """
+        with self._lock:
+            if self._training or self.dim is None or len(self._slot_of) < _PQ_CENTROIDS:
+                return False
+            self._training = True
+            live = np.flatnonzero(self._live[: len(self._ids)])
+            cap = _env_int("IW_PQ_TRAIN_SAMPLE", 8192, minimum=_PQ_CENTROIDS)
+            if len(live) > cap:
+                live = np.sort(np.random.default_rng(0).choice(live, size=cap, replace=False))
+            sample = self._read_vectors(live)
+        try:
+            codec = _ProductCodec.train(
+                sample,
+                _env_int("IW_PQ_SUBVECTOR_DIM", 4, minimum=1),
+                _env_int("IW_PQ_TRAIN_ITERATIONS", 8, minimum=1),
+            )
+            with self._lock:
+                self._recode(codec)
+        finally:
+            with self._lock:
+                self._training = False
+        return True
+
+    def _recode(self, codec: _ProductCodec) -> None:
+        live = np.flatnonzero(self._live[: len(self._ids)])
+        codes = np.zeros((len(self._live), codec.code_size), dtype=codec.dtype)
+        rows = []
+        for start in range(0, len(live), _SCORE_BLOCK):
+            block = live[start:start + _SCORE_BLOCK]
+            block_codes, _ = codec.encode(self._read_vectors(block))
+            codes[block] = block_codes
+            rows.extend((block_codes[i].tobytes(), b"", int(slot)) for i, slot in enumerate(block))
+        np.save(self._codebooks_path, codec.codebooks)
+        self._db.executemany("UPDATE vectors SET code = ?, extra = ? WHERE slot = ?", rows)
+        self._set_meta("codec", _PRODUCT)
+        self._db.commit()
+        self._codec = codec
+        self._codes = codes
+        self._extras = np.zeros((len(self._live), 0), dtype=np.float32)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Resident bytes per vector for the active codec vs. exact float32.
+        """
+        with self._lock:
+            codec = self._codec
+            count = len(self._slot_of)
+            if codec is None:
+                return {"collection": self.name, "count": 0, "codec": None, "dim": None}
+            code_bytes = codec.code_size * np.dtype(codec.dtype).itemsize + codec.extra_width * 4
+            float_bytes = self.dim * 4
+            return {
+                "collection": self.name,
+                "count": count,
+                "dim": self.dim,
+                "codec": codec.name,
+                "configured_codec": self.quantization,
+                "bytes_per_vector": code_bytes,
+                "float_bytes_per_vector": float_bytes,
+                "compression": round(float_bytes / code_bytes, 2),
+                "resident_code_bytes": code_bytes * count,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def destroy(self) -> None:
+        self.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+class QuantizedClient:
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._root = Path(path or os.getenv("IW_QUANTIZED_VECTOR_DIR", _DEFAULT_PATH))
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._collections: Dict[str, QuantizedCollection] = {}
+        self._lock = threading.Lock()
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict[str, Any]] = None):
+        del metadata  # descriptive metadata is not stored
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = QuantizedCollection(self._root, name)
+            return self._collections[name]
+
+    def delete_collection(self, name: str) -> None:
+        with self._lock:
+            collection = self._collections.pop(name, None)
+            if collection is None:
+                collection = QuantizedCollection(self._root, name)
+            collection.destroy()
+
+    def reset(self) -> None:
+        with self._lock:
+            for collection in self._collections.values():
+                collection.close()
+            self._collections = {}
@@ -0,0 +1,482 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Query, Session
+
+from app.db import models
+from app.db.write_lane import WRITE_LANE
+from app.llm import embeddings as embeddings_module
+from app.llm.embeddings import EmbeddingSpec
+from app.observability.metrics import VECTOR_DRIFT, VECTOR_REPAIRS
+from app.vectorstore import chroma_store, registry, retrieval_cache
+
+# Vector/SQL reconciliation.
+#
+# SQL is the source of truth. For each collection a pass
+#   1. pages through the collection's ids (with metadata) and, per page, asks
+#      SQL which ids are live; vectors with no live row are orphans and
+#      vectors whose identifying metadata no longer matches the row
+#      (project, conversation, folder, document) are stale. Both are deleted
+#      in one bulk call per page;
+#   2. pages through the live SQL ids (keyset on id) and, per page, asks the
+#      collection which ids exist; missing ones (including stale vectors just
+#      deleted) are embedded and re-added in bulk.
+# Partitioned versions run both steps once per project partition, where a
+# vector filed under another project counts as stale. Memory stays O(batch). Ingestion and memory writes add vectors before they
+# commit, so on SQLite each orphan check holds the write lane (no writer is
+# mid-transaction); elsewhere vectors with ids above the snapshot taken when
+# the pass starts are left alone instead.
+
+_DEFAULT_BATCH = 500
+_DEFAULT_INTERVAL_SECONDS = 24 * 3600
+_LANE_TIMEOUT = 30.0
+
+_LiveMeta = Dict[int, Dict[str, Any]]
+
+
+def _batch_size() -> int:
+    try:
+        return max(1, int(os.getenv("IW_VECTOR_RECONCILE_BATCH", _DEFAULT_BATCH)))
+    except (TypeError, ValueError):
+        return _DEFAULT_BATCH
+
+
+def _interval_seconds() -> float:
+    try:
+        return max(0.0, float(os.getenv("IW_VECTOR_RECONCILE_INTERVAL_SECONDS", _DEFAULT_INTERVAL_SECONDS)))
+    except (TypeError, ValueError):
+        return float(_DEFAULT_INTERVAL_SECONDS)
+
+
+# ---------------------------------------------------------------------------
+# Collection sources
+# ---------------------------------------------------------------------------
+
+
+def _messages_query(db: Session) -> Query:
+    return db.query(
+        models.Message.id,
+        models.Message.role,
+        models.Message.content,
+        models.Message.conversation_id,
+        models.Conversation.project_id,
+        models.Conversation.folder_id,
+    ).join(models.Conversation, models.Conversation.id == models.Message.conversation_id)
+
+
+def _message_row(row: Any) -> Tuple[str, Dict[str, Any]]:
+    meta = {
+        "message_id": row.id,
+        "conversation_id": row.conversation_id,
+        "project_id": row.project_id,
+        "role": row.role,
+    }
+    if row.folder_id is not None:
+        meta["folder_id"] = row.folder_id
+    return row.content or "", meta
+
+
+def _chunks_query(db: Session) -> Query:
+    # Duplicate chunks share their canonical chunk's vector and have none of
+    # their own.
+    return db.query(
+        models.DocumentChunk.id,
+        models.DocumentChunk.index,
+        models.DocumentChunk.content,
+        models.DocumentChunk.document_id,
+        models.Document.project_id,
+    ).join(models.Document, models.Document.id == models.DocumentChunk.document_id).filter(
+        models.DocumentChunk.duplicate_of_id.is_(None)
+    )
+
+
+def _chunk_row(row: Any) -> Tuple[str, Dict[str, Any]]:
+    return row.content or "", {
+        "document_id": row.document_id,
+        "project_id": row.project_id,
+        "chunk_id": row.id,
+        "chunk_index": row.index,
+    }
+
+
+def _memory_query(db: Session) -> Query:
+    return db.query(
+        models.MemoryItem.id,
+        models.MemoryItem.content,
+        models.MemoryItem.title,
+        models.MemoryItem.project_id,
+    )
+
+
+def _memory_row(row: Any) -> Tuple[str, Dict[str, Any]]:
+    meta = {"memory_id": row.id, "project_id": row.project_id}
+    if row.title is not None:
+        meta["title"] = row.title
+    return row.content or "", meta
+
+
+@dataclass(frozen=True)
+class _Source:
+    collection: str
+    id_column: Any
+    project_column: Any
+    query: Callable[[Session], Query]
+    to_payload: Callable[[Any], Tuple[str, Dict[str, Any]]]
+    # Metadata that must match SQL for a vector to be served correctly.
+    identity_keys: Tuple[str, ...]
+
+
+SOURCES: Dict[str, _Source] = {
+    "messages": _Source(
+        collection="messages",
+        id_column=models.Message.id,
+        project_column=models.Conversation.project_id,
+        query=_messages_query,
+        to_payload=_message_row,
+        identity_keys=("conversation_id", "project_id", "folder_id"),
+    ),
+    "docs": _Source(
+        collection="docs",
+        id_column=models.DocumentChunk.id,
+        project_column=models.Document.project_id,
+        query=_chunks_query,
+        to_payload=_chunk_row,
+        identity_keys=("document_id", "project_id"),
+    ),
+    "memory_items": _Source(
+        collection="memory_items",
+        id_column=models.MemoryItem.id,
+        project_column=models.MemoryItem.project_id,
+        query=_memory_query,
+        to_payload=_memory_row,
+        identity_keys=("project_id",),
+    ),
+}
+
+
+def _live_metadata(db: Session, source: _Source, ids: Sequence[int]) -> _LiveMeta:
+    if not ids:
+        return {}
+    rows = source.query(db).filter(source.id_column.in_(list(ids))).all()
+    return {row.id: source.to_payload(row)[1] for row in rows}
+
+
+def _live_id_pages(
+    db: Session, source: _Source, max_id: int, batch: int, project_id: Optional[int]
+) -> Iterator[List[int]]:
+    last = 0
+    query = source.query(db)
+    if project_id is not None:
+        query = query.filter(source.project_column == project_id)
+    while True:
+        page = [
+            row.id
+            for row in query
+            .filter(source.id_column > last, source.id_column <= max_id)
+            .order_by(source.id_column.asc())
+            .limit(batch)
+            .all()
+        ]
+        if not page:
+            return
+        yield page
+        last = page[-1]
+
+
+def _as_int(raw_id: Any) -> Optional[int]:
+    try:
+        return int(raw_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_stale(meta: Optional[Dict[str, Any]], expected: Dict[str, Any], keys: Sequence[str]) -> bool:
+    meta = meta or {}
+    return any(meta.get(key) != expected.get(key) for key in keys)
+
+
+def _readd(
+    db: Session,
+    source: _Source,
+    ids: List[int],
+    get_collection: Callable[[], Any],
+    spec: EmbeddingSpec,
+) -> int:
+    rows = source.query(db).filter(source.id_column.in_(ids)).order_by(source.id_column.asc()).all()
+    if not rows:
+        return 0
+    payloads = [source.to_payload(row) for row in rows]
+    texts = [content for content, _ in payloads]
+    vectors = embeddings_module.embed_texts_batched(
+        texts, model=spec.model, dimensions=spec.dimensions
+    )
+    chroma_store._with_chroma_retry(
+        f"re-add {source.collection} vectors",
+        lambda: get_collection().add(
+            ids=[str(row.id) for row in rows],
+            embeddings=vectors,
+            documents=[content for content, _ in payloads],
+            metadatas=[meta for _, meta in payloads],
+        ),
+    )
+    return len(rows)
+
+
+@contextmanager
+def _writes_quiesced(db: Session) -> Iterator[bool]:
+    """
+    On SQLite, hold the write lane so no transaction is between adding
+    vectors and committing its rows; yields True when that holds.
+    """
+    if db.get_bind().dialect.name != "sqlite" or not WRITE_LANE.acquire(timeout=_LANE_TIMEOUT):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        WRITE_LANE.release()
+
+
+def _partitions(
+    db: Session, version: registry.CollectionVersion
+) -> List[Tuple[Optional[int], Callable[[], Any]]]:
+    """
+    (project_id, collection getter) for every physical collection of a version.
+    """
+    project_ids: List[Optional[int]] = [None]
+    if version.partitioned:
+        project_ids = [pid for (pid,) in db.query(models.Project.id).order_by(models.Project.id)]
+    return [
+        (pid, lambda pid=pid: chroma_store.get_collection_by_name(version.collection_name(pid)))
+        for pid in project_ids
+    ]
+
+
+def _reconcile_partition(
+    db: Session,
+    source: _Source,
+    get_collection: Callable[[], Any],
+    project_id: Optional[int],
+    report: Dict[str, Any],
+    *,
+    dry_run: bool,
+    batch: int,
+    max_id: int,
+    spec: EmbeddingSpec,
+) -> None:
+    name = source.collection
+    collection = get_collection()
+
+    # 1) Orphaned and stale vectors.
+    offset = 0
+    while True:
+        page = collection.get(limit=batch, offset=offset, include=["metadatas"])
+        raw_ids = list(page.get("ids") or [])
+        if not raw_ids:
+            break
+        metas = page.get("metadatas") or [None] * len(raw_ids)
+        report["vectors_scanned"] += len(raw_ids)
+        int_ids = [i for i in (_as_int(r) for r in raw_ids) if i is not None]
+        deleted = 0
+        with _writes_quiesced(db) as exclusive:
+            live = _live_metadata(db, source, int_ids)
+            doomed: List[str] = []
+            for raw_id, meta in zip(raw_ids, metas):
+                vid = _as_int(raw_id)
+                if not exclusive and vid is not None and vid > max_id:
+                    continue
+                if vid is None or vid not in live:
+                    report["orphans"] += 1
+                    doomed.append(str(raw_id))
+                elif _is_stale(meta, live[vid], source.identity_keys) or (
+                    project_id is not None and live[vid].get("project_id") != project_id
+                ):
+                    report["stale"] += 1
+                    doomed.append(str(raw_id))
+            if doomed and not dry_run:
+                try:
+                    chroma_store._with_chroma_retry(
+                        f"delete {name} orphans",
+                        lambda: get_collection().delete(ids=doomed),
+                    )
+                    deleted = len(doomed)
+                except Exception as exc:  # noqa: BLE001
+                    report["errors"].append(f"delete: {exc!r}")
+        report["deleted"] += deleted
+        # Deleted vectors shift later pages down.
+        offset += len(raw_ids) - deleted
+
+    # 2) Live rows without a vector.
+    for ids in _live_id_pages(db, source, max_id, batch, project_id):
+        report["live_rows"] += len(ids)
+        present = set(collection.get(ids=[str(i) for i in ids], include=[]).get("ids") or [])
+        missing = [i for i in ids if str(i) not in present]
+        if not missing:
+            continue
+        report["missing"] += len(missing)
+        if dry_run:
+            continue
+        try:
+            report["readded"] += _readd(db, source, missing, get_collection, spec)
+        except Exception as exc:  # noqa: BLE001
+            report["errors"].append(f"re-add: {exc!r}")
+
+
+def reconcile_collection(
+    db: Session,
+    name: str,
+    *,
+    dry_run: bool = False,
+    batch: Optional[int] = None,
+    version: Optional[registry.CollectionVersion] = None,
+) -> Dict[str, Any]:
+    """
+    Diff one collection against SQL and repair it (unless dry_run).
+
+    Missing vectors are embedded with the collection's recorded spec.
+    `version` points the pass at another version of the collection (a
+    re-index shadow); such passes leave the drift metrics alone.
+    """
+    source = SOURCES[name]
+    target = version or registry.active(name)
+    batch = batch or _batch_size()
+    started = time.perf_counter()
+    # Live rows are only paged up to this snapshot; on backends without the
+    # write lane, vectors above it may belong to uncommitted rows.
+    max_id = int(db.query(func.max(source.id_column)).scalar() or 0)
+    report: Dict[str, Any] = {
+        "collection": name,
+        "dry_run": dry_run,
+        "partitions": 0,
+        "vectors_scanned": 0,
+        "live_rows": 0,
+        "orphans": 0,
+        "stale": 0,
+        "missing": 0,
+        "deleted": 0,
+        "readded": 0,
+        "errors": [],
+    }
+    for project_id, get_collection in _partitions(db, target):
+        report["partitions"] += 1
+        repairs = report["deleted"] + report["readded"]
+        _reconcile_partition(
+            db,
+            source,
+            get_collection,
+            project_id,
+            report,
+            dry_run=dry_run,
+            batch=batch,
+            max_id=max_id,
+            spec=target.spec,
+        )
+        if report["deleted"] + report["readded"] != repairs:
+            retrieval_cache.bump(name, project_id)
+
+    if version is None:
+        VECTOR_DRIFT.set(report["orphans"], collection=name, kind="orphan")
+        VECTOR_DRIFT.set(report["stale"], collection=name, kind="stale")
+        VECTOR_DRIFT.set(report["missing"], collection=name, kind="missing")
+        VECTOR_REPAIRS.inc(report["deleted"], collection=name, action="deleted")
+        VECTOR_REPAIRS.inc(report["readded"], collection=name, action="readded")
+    report["duration_ms"] = round((time.perf_counter() - started) * 1000.0, 1)
+    return report
+
+
+_run_lock = threading.Lock()
+_last_report: Optional[Dict[str, Any]] = None
+
+
+class ReconcileInProgress(RuntimeError):
+    pass
+
+
+def reconcile_vectors(
+    db: Session,
+    collections: Optional[Sequence[str]] = None,
+    *,
+    dry_run: bool = False,
+    trigger: str = "manual",
+) -> Dict[str, Any]:
+    """
+    Reconcile the given collections (default: all). One pass at a time;
+    raises ReconcileInProgress if another pass is running.
+    """
+    global _last_report
+    names = list(collections or SOURCES)
+    unknown = [n for n in names if n not in SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown collection(s): {', '.join(unknown)}")
+    if not _run_lock.acquire(blocking=False):
+        raise ReconcileInProgress("A vector reconcile pass is already running.")
+    try:
+        started_at = datetime.now(timezone.utc)
+        results = [reconcile_collection(db, name, dry_run=dry_run) for name in names]
+        report = {
+            "trigger": trigger,
+            "dry_run": dry_run,
+            "started_at": started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "collections": results,
+        }
+        if not dry_run:
+            _last_report = report
+        return report
+    finally:
+        _run_lock.release()
+
+
+def last_reconcile_report() -> Optional[Dict[str, Any]]:
+    return _last_report
+
+
+class ReconcileScheduler:
+    """
+    Background thread running reconcile_vectors every
+    IW_VECTOR_RECONCILE_INTERVAL_SECONDS (0 disables it).
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]) -> None:
+        self._session_factory = session_factory
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        interval = _interval_seconds()
+        if interval <= 0 or self._thread is not None:
+            return False
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="vector-reconcile", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            db = self._session_factory()
+            try:
+                report = reconcile_vectors(db, trigger="schedule")
+                repaired = sum(c["deleted"] + c["readded"] for c in report["collections"])
+                if repaired:
+                    print(f"[INFO] Vector reconcile repaired {repaired} vector(s)")
+            except ReconcileInProgress:
+                pass
+            except Exception as exc:  # noqa: BLE001
+                print(f"[WARN] Scheduled vector reconcile failed: {exc!r}")
+            finally:
+                db.close()
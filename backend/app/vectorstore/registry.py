@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.db import models
+from app.db import session as db_session_module
+from app.llm.embeddings import EmbeddingSpec, configured_embedding_spec
+
+# Which physical collection serves each logical vector collection, with
+# which embedding spec (model + dimensions) it was built, and whether it is
+# partitioned by project.
+#
+# Rows live in vector_collections. A logical name without a row is served by
+# the shared physical collection of the same name with the configured spec,
+# which is how every deployment started; startup records the version in use
+# so later changes to OPENAI_EMBEDDING_MODEL / OPENAI_EMBEDDING_DIMENSIONS
+# cannot silently mix vector spaces. Fresh deployments are recorded with the
+# layout IW_VECTOR_PARTITIONING asks for; shared collections that already
+# hold vectors are migrated by a re-index (app.vectorstore.reindex). Each
+# logical collection has its own spec (IW_EMBEDDING_MODEL_<NAME>), but all
+# share one layout: a re-index rebuilds them together and swaps them in a
+# single transaction.
+#
+# A partitioned version keeps one collection per project
+# ("<physical_name>__p<project_id>"), created on first use, so a project's
+# searches only scan its own vectors.
+#
+# Lookups are served from an in-process snapshot, reloaded after every change
+# made here and at most _REFRESH_SECONDS old otherwise (other workers).
+
+LOGICAL_NAMES = ("messages", "docs", "memory_items")
+_REFRESH_SECONDS = 30.0
+
+ACTIVE = "active"
+BUILDING = "building"
+RETIRED = "retired"
+FAILED = "failed"
+DROPPED = "dropped"
+
+
+def configured_partitioned() -> bool:
+    """
+    IW_VECTOR_PARTITIONING: "project" (default) or "shared".
+    """
+    return os.getenv("IW_VECTOR_PARTITIONING", "project").strip().lower() != "shared"
+
+
+@dataclass(frozen=True)
+class CollectionVersion:
+    name: str
+    physical_name: str
+    spec: EmbeddingSpec
+    partitioned: bool = False
+    state: str = ACTIVE
+    id: Optional[int] = None
+
+    def collection_name(self, project_id: Optional[int]) -> str:
+        """
+        Physical collection holding `project_id`'s vectors.
+        """
+        if not self.partitioned:
+            return self.physical_name
+        if project_id is None:
+            raise ValueError(f"{self.physical_name} is partitioned by project; a project_id is required.")
+        return f"{self.physical_name}__p{int(project_id)}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "physical_name": self.physical_name,
+            "state": self.state,
+            "partitioning": "project" if self.partitioned else "shared",
+            **self.spec.to_dict(),
+        }
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    active: Dict[str, CollectionVersion]
+    building: Dict[str, CollectionVersion]
+    loaded_at: float
+
+
+_lock = threading.Lock()
+_snapshot: Optional[_Snapshot] = None
+_load_warned = False
+
+
+def _version(row: models.VectorCollection) -> CollectionVersion:
+    return CollectionVersion(
+        name=row.name,
+        physical_name=row.physical_name,
+        spec=EmbeddingSpec(row.embedding_model, row.dimensions),
+        partitioned=bool(row.partitioned),
+        state=row.state,
+        id=row.id,
+    )
+
+
+def _implicit(name: str) -> CollectionVersion:
+    return CollectionVersion(name=name, physical_name=name, spec=configured_embedding_spec(name))
+
+
+def _load() -> _Snapshot:
+    global _load_warned
+    rows: List[models.VectorCollection] = []
+    session = db_session_module.SessionLocal()
+    try:
+        rows = (
+            session.query(models.VectorCollection)
+            .filter(models.VectorCollection.state.in_((ACTIVE, BUILDING)))
+            .all()
+        )
+    except Exception as exc:  # noqa: BLE001
+        if not _load_warned:
+            _load_warned = True
+            print(f"[WARN] Vector collection registry unavailable, using defaults: {exc!r}")
+    finally:
+        session.close()
+    active = {name: _implicit(name) for name in LOGICAL_NAMES}
+    building: Dict[str, CollectionVersion] = {}
+    for row in rows:
+        (active if row.state == ACTIVE else building)[row.name] = _version(row)
+    return _Snapshot(active=active, building=building, loaded_at=time.monotonic())
+
+
+def _current() -> _Snapshot:
+    global _snapshot
+    snap = _snapshot
+    if snap is None or time.monotonic() - snap.loaded_at > _REFRESH_SECONDS:
+        with _lock:
+            snap = _snapshot
+            if snap is None or time.monotonic() - snap.loaded_at > _REFRESH_SECONDS:
+                snap = _snapshot = _load()
+    return snap
+
+
+def refresh() -> None:
+    global _snapshot
+    with _lock:
+        _snapshot = _load()
+
+
+def reset_registry() -> None:
+    global _snapshot
+    with _lock:
+        _snapshot = None
+
+
+def active(name: str) -> CollectionVersion:
+    return _current().active.get(name) or _implicit(name)
+
+
+def building(name: str) -> Optional[CollectionVersion]:
+    return _current().building.get(name)
+
+
+def active_specs() -> Dict[str, EmbeddingSpec]:
+    return {name: active(name).spec for name in LOGICAL_NAMES}
+
+
+def active_partitioned() -> bool:
+    return active(LOGICAL_NAMES[0]).partitioned
+
+
+def _has_vectors(physical_name: str) -> bool:
+    from app.vectorstore import chroma_store
+
+    try:
+        return chroma_store.get_collection_by_name(physical_name).count() > 0
+    except Exception:  # noqa: BLE001
+        # Unknown: keep the layout the data may be in.
+        return True
+
+
+def record_active(db: Session) -> List[str]:
+    """
+    Persist the implicit version of every logical collection that has no
+    active row yet. Run at startup.
+
+    Empty collections are recorded with the configured layout; shared ones
+    that already hold vectors stay shared until a re-index migrates them.
+    """
+    recorded: List[str] = []
+    existing = {
+        name
+        for (name,) in db.query(models.VectorCollection.name).filter(
+            models.VectorCollection.state == ACTIVE
+        )
+    }
+    for name in LOGICAL_NAMES:
+        if name in existing:
+            continue
+        version = _implicit(name)
+        db.add(
+            models.VectorCollection(
+                name=name,
+                physical_name=version.physical_name,
+                embedding_model=version.spec.model,
+                dimensions=version.spec.dimensions,
+                partitioned=configured_partitioned() and not _has_vectors(version.physical_name),
+                state=ACTIVE,
+                activated_at=datetime.utcnow(),
+            )
+        )
+        recorded.append(name)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker recorded them first.
+        db.rollback()
+        recorded = []
+    refresh()
+    return recorded
+
+
+def begin_building(
+    db: Session, specs: Dict[str, EmbeddingSpec], partitioned: bool
+) -> Dict[str, CollectionVersion]:
+    """
+    Add a `building` version of every logical collection with its spec from
+    `specs` and the given layout. From here on writes are mirrored into them
+    (see chroma_store).
+    """
+    record_active(db)
+    if db.query(models.VectorCollection).filter(models.VectorCollection.state == BUILDING).count():
+        raise ValueError("A re-index is already building new collections.")
+    rows = []
+    for name in LOGICAL_NAMES:
+        row = models.VectorCollection(
+            name=name,
+            physical_name=f"{name}__pending",
+            embedding_model=specs[name].model,
+            dimensions=specs[name].dimensions,
+            partitioned=partitioned,
+            state=BUILDING,
+        )
+        db.add(row)
+        db.flush()
+        row.physical_name = f"{name}__v{row.id}"
+        rows.append(row)
+    db.commit()
+    refresh()
+    return {row.name: _version(row) for row in rows}
+
+
+def activate_building(db: Session) -> List[CollectionVersion]:
+    """
+    Swap every `building` version in, retiring the versions it replaces, in
+    one transaction. Returns the retired versions.
+    """
+    rows = (
+        db.query(models.VectorCollection)
+        .filter(models.VectorCollection.state.in_((ACTIVE, BUILDING)))
+        .all()
+    )
+    names = {row.name for row in rows if row.state == BUILDING}
+    retired: List[CollectionVersion] = []
+    now = datetime.utcnow()
+    for row in rows:
+        if row.name not in names:
+            continue
+        if row.state == ACTIVE:
+            row.state = RETIRED
+            retired.append(_version(row))
+        else:
+            row.state = ACTIVE
+            row.activated_at = now
+    db.commit()
+    refresh()
+    return retired
+
+
+def abandon_building(db: Session) -> List[CollectionVersion]:
+    """
+    Mark `building` versions failed; returns them so their data can be dropped.
+    """
+    rows = db.query(models.VectorCollection).filter(models.VectorCollection.state == BUILDING).all()
+    for row in rows:
+        row.state = FAILED
+    db.commit()
+    refresh()
+    return [_version(row) for row in rows]
+
+
+def retired_versions(db: Session) -> List[CollectionVersion]:
+    """
+    Retired or failed versions whose data has not been dropped yet.
+    """
+    rows = db.query(models.VectorCollection).filter(
+        models.VectorCollection.state.in_((RETIRED, FAILED))
+    )
+    return [_version(row) for row in rows]
+
+
+def mark_dropped(db: Session, version_ids: List[int]) -> None:
+    if not version_ids:
+        return
+    db.query(models.VectorCollection).filter(models.VectorCollection.id.in_(version_ids)).update(
+        {models.VectorCollection.state: DROPPED}, synchronize_session=False
+    )
+    db.commit()
+
+
+def describe(db: Session) -> List[Dict[str, Any]]:
+    """
+    Every recorded version (newest first) plus implicit active ones.
+    """
+    rows = db.query(models.VectorCollection).order_by(models.VectorCollection.id.desc()).all()
+    out = [
+        {
+            **_version(row).to_dict(),
+            "id": row.id,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "activated_at": row.activated_at.isoformat() if row.activated_at else None,
+        }
+        for row in rows
+    ]
+    recorded = {row.name for row in rows if row.state == ACTIVE}
+    out.extend(
+        {**_implicit(name).to_dict(), "id": None, "created_at": None, "activated_at": None}
+        for name in LOGICAL_NAMES
+        if name not in recorded
+    )
+    return out
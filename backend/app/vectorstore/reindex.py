@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.db import models
+from app.llm import embeddings as embeddings_module
+from app.llm.embeddings import EmbeddingSpec
+from app.vectorstore import chroma_store, reconcile, registry
+
+# Online re-index into a new embedding model, dimension or layout (shared vs
+# per-project partitions).
+#
+#   1. registry.begin_building() records a shadow version of every logical
+#      collection; from then on chroma_store mirrors every write into it,
+#      embedded with the new spec.
+#   2. Backfill: when only the layout changes, the live vectors are copied
+#      into the shadow as they are. Then a reconcile pass against each shadow
+#      streams the live SQL rows by keyset and embeds the ones still missing
+#      in batches.
+#   3. Dual read: sampled rows are searched in the live collection (old spec)
+#      and in the shadow (new spec); the top-k overlap is reported and can
+#      gate the swap (IW_REINDEX_MIN_OVERLAP).
+#   4. Swap: with the write lane held (SQLite) and scheduled reconcile paused,
+#      a catch-up pass fixes anything the mirror missed and
+#      registry.activate_building() flips every collection in one
+#      transaction. Reads keep hitting the old collections until then.
+# Retired collections are dropped by the next re-index or at startup.
+
+_DEFAULT_VERIFY_SAMPLES = 20
+_VERIFY_TOP_K = 5
+_RECONCILE_LOCK_TIMEOUT = 300.0
+_COPY_BATCH = 500
+
+_job_lock = threading.Lock()
+_status_lock = threading.Lock()
+_status: Dict[str, Any] = {"state": "idle"}
+
+
+class ReindexInProgress(RuntimeError):
+    pass
+
+
+def _verify_samples() -> int:
+    try:
+        return max(0, int(os.getenv("IW_REINDEX_VERIFY_SAMPLES", _DEFAULT_VERIFY_SAMPLES)))
+    except (TypeError, ValueError):
+        return _DEFAULT_VERIFY_SAMPLES
+
+
+def _min_overlap() -> float:
+    try:
+        return float(os.getenv("IW_REINDEX_MIN_OVERLAP", "0") or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _update_status(**fields: Any) -> None:
+    with _status_lock:
+        _status.update(fields)
+
+
+def _update_collection(name: str, **fields: Any) -> None:
+    with _status_lock:
+        _status.setdefault("collections", {}).setdefault(name, {}).update(fields)
+
+
+def reindex_status() -> Dict[str, Any]:
+    with _status_lock:
+        status = dict(_status)
+        if "collections" in status:
+            status["collections"] = {k: dict(v) for k, v in status["collections"].items()}
+        return status
+
+
+def reset_reindex_status() -> None:
+    with _status_lock:
+        _status.clear()
+        _status["state"] = "idle"
+
+
+def _project_ids(db: Session) -> List[int]:
+    return [pid for (pid,) in db.query(models.Project.id).order_by(models.Project.id)]
+
+
+def _drop_version(db: Session, version: registry.CollectionVersion) -> None:
+    if not version.partitioned:
+        chroma_store.drop_collection(version.physical_name)
+        return
+    for project_id in _project_ids(db):
+        chroma_store.drop_collection(version.collection_name(project_id))
+
+
+def _layout(partitioned: bool) -> Dict[str, Any]:
+    return {"partitioning": "project" if partitioned else "shared"}
+
+
+def _describe(specs: Dict[str, EmbeddingSpec], partitioned: bool) -> Dict[str, Any]:
+    return {**_layout(partitioned), "specs": {name: spec.to_dict() for name, spec in specs.items()}}
+
+
+def _target_specs(specs: Union[EmbeddingSpec, Dict[str, EmbeddingSpec]]) -> Dict[str, EmbeddingSpec]:
+    """
+    One spec for every logical collection: a single spec applies to all of
+    them; collections missing from a dict keep their active spec.
+    """
+    if isinstance(specs, EmbeddingSpec):
+        return {name: specs for name in registry.LOGICAL_NAMES}
+    unknown = set(specs) - set(registry.LOGICAL_NAMES)
+    if unknown:
+        raise ValueError(f"Unknown collection(s): {', '.join(sorted(unknown))}")
+    return {name: specs.get(name) or registry.active(name).spec for name in registry.LOGICAL_NAMES}
+
+
+def purge_retired(db: Session) -> List[str]:
+    """
+    Drop the data of retired and abandoned collection versions.
+    """
+    dropped: List[str] = []
+    versions = registry.retired_versions(db)
+    for version in versions:
+        try:
+            _drop_version(db, version)
+            dropped.append(version.physical_name)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[WARN] Failed to drop retired collection {version.physical_name}: {exc!r}")
+    registry.mark_dropped(
+        db, [v.id for v in versions if v.id is not None and v.physical_name in dropped]
+    )
+    return dropped
+
+
+def _embed(texts: List[str], spec: EmbeddingSpec) -> List[List[float]]:
+    return embeddings_module.embed_texts_batched(
+        texts, model=spec.model, dimensions=spec.dimensions
+    )
+
+
+def _verify(
+    db: Session,
+    name: str,
+    live: registry.CollectionVersion,
+    shadow: registry.CollectionVersion,
+) -> Dict[str, Any]:
+    """
+    Search sampled rows in both versions and report how much the top-k agree.
+    """
+    source = reconcile.SOURCES[name]
+    rows = source.query(db).order_by(func.random()).limit(_verify_samples()).all()
+    payloads = [source.to_payload(row) for row in rows]
+    texts = [content for content, _ in payloads]
+    if not texts:
+        return {"samples": 0, "top_k": _VERIFY_TOP_K, "mean_overlap": None}
+    old_vectors = _embed(texts, live.spec)
+    new_vectors = _embed(texts, shadow.spec)
+    overlaps: List[float] = []
+    for (_, meta), old_vector, new_vector in zip(payloads, old_vectors, new_vectors):
+        project_id = meta["project_id"]
+        where = {"project_id": {"$eq": project_id}}
+        old_ids = chroma_store.get_collection_by_name(live.collection_name(project_id)).query(
+            query_embeddings=[old_vector], n_results=_VERIFY_TOP_K, where=where
+        )["ids"][0]
+        new_ids = chroma_store.get_collection_by_name(shadow.collection_name(project_id)).query(
+            query_embeddings=[new_vector], n_results=_VERIFY_TOP_K, where=where
+        )["ids"][0]
+        overlaps.append(len(set(old_ids) & set(new_ids)) / len(old_ids) if old_ids else 1.0)
+    return {
+        "samples": len(overlaps),
+        "top_k": _VERIFY_TOP_K,
+        "mean_overlap": round(sum(overlaps) / len(overlaps), 3),
+    }
+
+
+def _copy(
+    db: Session,
+    name: str,
+    live: registry.CollectionVersion,
+    shadow: registry.CollectionVersion,
+) -> int:
+    """
+    Copy the live version's vectors into a shadow with the same spec,
+    routed by their project_id metadata. Returns the number copied; a store
+    that does not return stored vectors copies nothing and leaves the shadow
+    to the re-embedding backfill.
+    """
+    copied = 0
+    sources = _project_ids(db) if live.partitioned else [None]
+    for source_project in sources:
+        collection = chroma_store.get_collection_by_name(live.collection_name(source_project))
+        offset = 0
+        while True:
+            page = collection.get(
+                limit=_COPY_BATCH,
+                offset=offset,
+                include=["embeddings", "documents", "metadatas"],
+            )
+            ids = list(page.get("ids") or [])
+            if not ids:
+                break
+            if page.get("embeddings") is None:
+                print(
+                    f"[WARN] {live.collection_name(source_project)} does not return stored "
+                    f"vectors; {name} will be re-embedded instead of copied."
+                )
+                return copied
+            offset += len(ids)
+            by_project: Dict[int, List[int]] = {}
+            for position, meta in enumerate(page.get("metadatas") or []):
+                if meta and meta.get("project_id") is not None:
+                    by_project.setdefault(int(meta["project_id"]), []).append(position)
+            # Vectors without a project are left to the reconcile pass.
+            for project_id, positions in by_project.items():
+                chroma_store._with_chroma_retry(
+                    f"copy {name} vectors",
+                    lambda: chroma_store.get_collection_by_name(
+                        shadow.collection_name(project_id)
+                    ).add(
+                        ids=[ids[p] for p in positions],
+                        embeddings=[list(page["embeddings"][p]) for p in positions],
+                        documents=[page["documents"][p] for p in positions],
+                        metadatas=[page["metadatas"][p] for p in positions],
+                    ),
+                )
+                copied += len(positions)
+    return copied
+
+
+def _fill(db: Session, name: str, version: registry.CollectionVersion) -> Dict[str, Any]:
+    report = reconcile.reconcile_collection(db, name, version=version)
+    if report["errors"]:
+        raise RuntimeError(f"{name}: {report['errors'][0]}")
+    return {key: report[key] for key in ("live_rows", "deleted", "readded", "duration_ms")}
+
+
+def _reindex(db: Session, specs: Dict[str, EmbeddingSpec], partitioned: bool) -> Dict[str, Any]:
+    _update_status(
+        state="running",
+        phase="prepare",
+        source=_describe(registry.active_specs(), registry.active_partitioned()),
+        target=_describe(specs, partitioned),
+        started_at=datetime.now(timezone.utc).isoformat(),
+        finished_at=None,
+        error=None,
+        collections={},
+        verification={},
+    )
+    purge_retired(db)
+    shadows = registry.begin_building(db, specs, partitioned)
+    live = {name: registry.active(name) for name in shadows}
+    try:
+        for name, version in shadows.items():
+            _update_status(phase=f"backfill:{name}")
+            _update_collection(name, physical_name=version.physical_name)
+            if live[name].spec == version.spec:
+                _update_collection(name, copied=_copy(db, name, live[name], version))
+            _update_collection(name, backfill=_fill(db, name, version))
+
+        _update_status(phase="verify")
+        verification = {name: _verify(db, name, live[name], shadows[name]) for name in shadows}
+        _update_status(verification=verification)
+        floor = _min_overlap()
+        for name, result in verification.items():
+            if result["mean_overlap"] is not None and result["mean_overlap"] < floor:
+                raise RuntimeError(
+                    f"{name}: top-{_VERIFY_TOP_K} overlap {result['mean_overlap']} is below "
+                    f"IW_REINDEX_MIN_OVERLAP={floor}"
+                )
+
+        _update_status(phase="swap")
+        if not reconcile._run_lock.acquire(timeout=_RECONCILE_LOCK_TIMEOUT):
+            raise RuntimeError("Timed out waiting for a vector reconcile pass to finish.")
+        try:
+            with reconcile._writes_quiesced(db):
+                for name, version in shadows.items():
+                    _update_collection(name, catch_up=_fill(db, name, version))
+                retired = registry.activate_building(db)
+        finally:
+            reconcile._run_lock.release()
+    except Exception as exc:
+        for version in registry.abandon_building(db):
+            try:
+                _drop_version(db, version)
+            except Exception:  # noqa: BLE001
+                pass
+        _update_status(
+            state="failed",
+            error=str(exc),
+            finished_at=datetime.now(timezone.utc).isoformat(),
+        )
+        raise
+    _update_status(
+        state="completed",
+        phase="done",
+        retired=[version.physical_name for version in retired],
+        finished_at=datetime.now(timezone.utc).isoformat(),
+    )
+    models_used = ", ".join(sorted({spec.model for spec in specs.values()}))
+    print(
+        f"[INFO] Vector re-index to {models_used} "
+        f"({_layout(partitioned)['partitioning']} collections) completed"
+    )
+    return reindex_status()
+
+
+def _check_target(specs: Dict[str, EmbeddingSpec], partitioned: bool) -> None:
+    if specs == registry.active_specs() and partitioned == registry.active_partitioned():
+        raise ValueError(
+            "The vector collections already use these embedding models and dimensions "
+            f"with {_layout(partitioned)['partitioning']} collections."
+        )
+
+
+def reindex_collections(
+    db: Session,
+    specs: Union[EmbeddingSpec, Dict[str, EmbeddingSpec]],
+    partitioned: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """
+    Run a re-index synchronously into `specs` (see _target_specs) and the
+    given layout (default: IW_VECTOR_PARTITIONING). Raises
+    ReindexInProgress if one is running and ValueError if that target is
+    already active.
+    """
+    targets = _target_specs(specs)
+    if partitioned is None:
+        partitioned = registry.configured_partitioned()
+    _check_target(targets, partitioned)
+    if not _job_lock.acquire(blocking=False):
+        raise ReindexInProgress("A vector re-index is already running.")
+    try:
+        return _reindex(db, targets, partitioned)
+    finally:
+        _job_lock.release()
+
+
+def start_reindex(
+    session_factory: Callable[[], Session],
+    specs: Union[EmbeddingSpec, Dict[str, EmbeddingSpec]],
+    partitioned: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """
+    Start a re-index on a background thread and return its initial status.
+    """
+    targets = _target_specs(specs)
+    if partitioned is None:
+        partitioned = registry.configured_partitioned()
+    _check_target(targets, partitioned)
+    if not _job_lock.acquire(blocking=False):
+        raise ReindexInProgress("A vector re-index is already running.")
+    _update_status(
+        state="running",
+        phase="queued",
+        target=_describe(targets, partitioned),
+        error=None,
+    )
+
+    def _run() -> None:
+        db = session_factory()
+        try:
+            _reindex(db, targets, partitioned)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[WARN] Vector re-index failed: {exc!r}")
+        finally:
+            db.close()
+            _job_lock.release()
+
+    threading.Thread(target=_run, name="vector-reindex", daemon=True).start()
+    return reindex_status()
+
+
+def wait_for_reindex(timeout: Optional[float] = None) -> bool:
+    """
+    Block until no re-index is running; False if the timeout expires.
+    """
+    if not _job_lock.acquire(timeout=-1 if timeout is None else timeout):
+        return False
+    _job_lock.release()
+    return True
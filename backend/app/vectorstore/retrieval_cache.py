@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from app.observability.metrics import RETRIEVAL_CACHE
+from app.vectorstore import registry
+
+# Retrieval result cache.
+#
+# Every add or delete that goes through app.vectorstore.chroma_store (and
+# every reconcile repair) bumps a generation counter for the collection and
+# project it touched; a delete that does not know its project bumps the
+# collection-wide counter. Similarity-query results are cached in a bounded
+# LRU keyed on
+#
+#   (collection, physical collection and spec, project, filters,
+#    query text hash, n_results, generations)
+#
+# so a change to the index makes the old entries unreachable (they age out
+# of the LRU) and no explicit invalidation is needed. A re-index swap changes
+# the physical name, so it invalidates too. A hit skips the vector search,
+# and the query embedding when the caller embeds lazily inside `run` (the
+# /search endpoints do; /chat embeds per spec on first use, and always needs
+# the messages vector because it indexes the user message with it). SQL
+# enrichment of the hits still runs per request, so renamed folders or
+# archived memories are never served stale.
+#
+# The generation is read before the query runs and writers bump after their
+# write, so a result computed concurrently with a write is filed under the
+# old generation. The cache is per process; IW_RETRIEVAL_CACHE_SIZE=0
+# disables it.
+
+_DEFAULT_SIZE = 1024
+
+_lock = threading.Lock()
+_generations: Dict[Tuple[str, Optional[int]], int] = {}
+_entries: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+_epoch = 0
+
+
+def _max_entries() -> int:
+    try:
+        return max(0, int(os.getenv("IW_RETRIEVAL_CACHE_SIZE", _DEFAULT_SIZE)))
+    except (TypeError, ValueError):
+        return _DEFAULT_SIZE
+
+
+def bump(collection: str, project_id: Optional[int] = None) -> None:
+    """
+    Record a change to `collection` for `project_id` (None: every project).
+    """
+    key = (collection, project_id)
+    with _lock:
+        _generations[key] = _generations.get(key, 0) + 1
+
+
+def generation(collection: str, project_id: Optional[int]) -> Tuple[int, int, int]:
+    with _lock:
+        return (
+            _epoch,
+            _generations.get((collection, None), 0),
+            _generations.get((collection, project_id), 0),
+        )
+
+
+def cached_query(
+    collection: str,
+    project_id: int,
+    query: str,
+    n_results: int,
+    run: Callable[[], Dict[str, Any]],
+    **filters: Any,
+) -> Dict[str, Any]:
+    """
+    Return `run()` (a query_similar_* call for `query`), cached until the
+    project's part of `collection` changes. Results are shared between
+    callers and must not be mutated.
+    """
+    limit = _max_entries()
+    if limit == 0:
+        return run()
+    version = registry.active(collection)
+    key = (
+        collection,
+        version.physical_name,
+        version.spec,
+        version.partitioned,
+        project_id,
+        tuple(sorted(filters.items())),
+        hashlib.sha256(query.encode("utf-8")).hexdigest(),
+        n_results,
+        generation(collection, project_id),
+    )
+    with _lock:
+        hit = _entries.get(key)
+        if hit is not None:
+            _entries.move_to_end(key)
+    if hit is not None:
+        RETRIEVAL_CACHE.inc(collection=collection, outcome="hit")
+        return hit
+    RETRIEVAL_CACHE.inc(collection=collection, outcome="miss")
+    results = run()
+    with _lock:
+        _entries[key] = results
+        _entries.move_to_end(key)
+        while len(_entries) > limit:
+            _entries.popitem(last=False)
+    return results
+
+
+def clear() -> None:
+    """
+    Drop every entry (the vector store was reset); results still being
+    computed are filed under the previous epoch.
+    """
+    global _epoch
+    with _lock:
+        _epoch += 1
+        _entries.clear()
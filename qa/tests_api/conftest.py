@@ -19,10 +19,16 @@ import app.llm.openai_client as openai_client  # noqa: E402
 from app.llm import embeddings  # noqa: E402
 from app.api.main import app  # noqa: E402
 import app.api.main as main  # noqa: E402
-import app.db.session as db_session  # noqa: E402
+import app.db.session as db_session_module  # noqa: E402
 from app.db.base import Base  # noqa: E402
 from app.db import models  # noqa: E402
+from app.ingestion import chunk_dedupe  # noqa: E402
+from app.llm import router as llm_router  # noqa: E402
+from app.llm.budgets import BUDGETS  # noqa: E402
+from app.observability import tracing  # noqa: E402
 from app.vectorstore import chroma_store  # noqa: E402
+from app.vectorstore import registry as vector_registry  # noqa: E402
+from app.vectorstore import reindex as vector_reindex  # noqa: E402
 
 BACKEND_DIR = Path(__file__).resolve().parents[2] / "backend"
 LOCAL_ROOT = str(Path(__file__).resolve().parents[2])
@@ -73,8 +79,9 @@ def _temp_db_and_chroma(tmp_path_factory: pytest.TempPathFactory) -> Iterator[di
     Base.metadata.create_all(bind=engine)
 
     mp = pytest.MonkeyPatch()
-    mp.setattr(db_session, "engine", engine, raising=False)
-    mp.setattr(db_session, "SessionLocal", TestingSessionLocal, raising=False)
+    # Patch the module, not the db_session fixture defined below (same name).
+    mp.setattr(db_session_module, "engine", engine, raising=False)
+    mp.setattr(db_session_module, "SessionLocal", TestingSessionLocal, raising=False)
     mp.setattr(main, "engine", engine, raising=False)
     mp.setattr(main, "SessionLocal", TestingSessionLocal, raising=False)
     mp.setattr(sys.modules[__name__], "SessionLocal", TestingSessionLocal, raising=False)
@@ -105,13 +112,19 @@ def _reset_state(_temp_db_and_chroma: dict) -> Iterator[None]:
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
     chroma_store._reset_chroma_persistence(clear_data=True)
+    vector_registry.reset_registry()
+    vector_reindex.reset_reindex_status()
+    chunk_dedupe.forget_project_index()
     main.reset_task_telemetry()
     main.reset_retrieval_telemetry()
+    llm_router.get_router_stats(reset=True)
+    BUDGETS.reset()
+    tracing.reset_traces()
     yield
 
 
 @pytest.fixture
-def db_session(_temp_db_and_chroma: dict) -> Iterator[db_session.SessionLocal]:
+def db_session(_temp_db_and_chroma: dict) -> Iterator[db_session_module.SessionLocal]:
     session = _temp_db_and_chroma["SessionLocal"]()
     try:
         yield session
@@ -0,0 +1,92 @@
+"""
+Near-duplicate chunk suppression: shared vectors, collapsed hits, promotion on delete.
+"""
+
+from app.db import models
+from app.ingestion.chunk_dedupe import hamming_distance, simhash64
+from app.vectorstore import chroma_store
+
+BOILERPLATE = (
+    "Licensed under the Apache License, Version 2.0 (the License); you may not "
+    "use this file except in compliance with the License. You may obtain a copy "
+    "of the License at the project website. Unless required by applicable law or "
+    "agreed to in writing, software distributed under the License is distributed "
+    "on an AS IS BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either "
+    "express or implied. See the License for the specific language governing "
+    "permissions and limitations under the License."
+)
+
+
+def _ingest(client, project_id: int, name: str, text: str) -> int:
+    resp = client.post(
+        "/docs/text",
+        json={"project_id": project_id, "name": name, "text": text},
+    )
+    assert resp.status_code == 200, resp.text
+    return resp.json()["document"]["id"]
+
+
+def _doc_vector_ids() -> set[str]:
+    return {rec["id"] for rec in chroma_store.get_docs_collection()._records}
+
+
+def test_simhash_is_close_for_near_duplicates():
+    edited = BOILERPLATE.replace("project website", "project web site")
+    assert hamming_distance(simhash64(BOILERPLATE), simhash64(edited)) <= 8
+    assert hamming_distance(simhash64(BOILERPLATE), simhash64("unrelated text " * 40)) > 8
+
+
+def test_duplicate_chunks_share_vector_and_collapse_in_search(client, project, db_session):
+    first = _ingest(client, project["id"], "a.txt", BOILERPLATE)
+    second = _ingest(client, project["id"], "b.txt", BOILERPLATE.upper())
+
+    chunks = {
+        c.document_id: c
+        for c in db_session.query(models.DocumentChunk)
+        .filter(models.DocumentChunk.document_id.in_([first, second]))
+        .all()
+    }
+    canonical, duplicate = chunks[first], chunks[second]
+    assert canonical.duplicate_of_id is None
+    assert duplicate.duplicate_of_id == canonical.id
+    assert _doc_vector_ids() == {str(canonical.id)}
+
+    resp = client.post(
+        "/search/docs",
+        json={"project_id": project["id"], "query": "apache license", "limit": 5},
+    )
+    assert resp.status_code == 200, resp.text
+    hits = resp.json()["hits"]
+    assert len(hits) == 1
+    assert hits[0]["chunk_id"] == canonical.id
+    assert hits[0]["duplicate_document_ids"] == [second]
+
+    # Deleting the canonical's document promotes the duplicate and indexes it.
+    resp = client.delete(f"/docs/{first}")
+    assert resp.status_code == 200, resp.text
+    db_session.expire_all()
+    promoted = db_session.get(models.DocumentChunk, duplicate.id)
+    assert promoted.duplicate_of_id is None
+    assert str(promoted.id) in _doc_vector_ids()
+
+
+def test_document_scoped_search_finds_deduplicated_chunks(client, project, db_session):
+    first = _ingest(client, project["id"], "a.txt", BOILERPLATE)
+    second = _ingest(client, project["id"], "b.txt", BOILERPLATE)
+    duplicate = (
+        db_session.query(models.DocumentChunk)
+        .filter(models.DocumentChunk.document_id == second)
+        .one()
+    )
+    assert duplicate.duplicate_of_id is not None
+
+    resp = client.post(
+        "/search/docs",
+        json={"project_id": project["id"], "query": "apache license", "document_id": second},
+    )
+    assert resp.status_code == 200, resp.text
+    hits = resp.json()["hits"]
+    assert len(hits) == 1
+    assert hits[0]["document_id"] == second
+    assert hits[0]["chunk_id"] == duplicate.id
+    assert hits[0]["duplicate_document_ids"] == [first]
@@ -0,0 +1,90 @@
+"""
+Retrieval context budgeter: distance cutoffs, adaptive k, MMR and token
+packing for /chat.
+"""
+
+from app.api import main
+from app.llm import context_budget
+from app.llm.context_budget import Candidate, ContextLimits
+
+LIMITS = ContextLimits(
+    token_budget=200,
+    snippet_tokens=120,
+    max_k=6,
+    mmr_lambda=0.7,
+    max_distance={"messages": 1.0, "docs": 1.0, "memory": 1.0},
+)
+LONG_QUESTION = (
+    "How are releases cut, who approves the changelog, which branch do hotfixes go to, "
+    "and how do we roll back a bad deploy on a Friday evening?"
+)
+
+
+def _doc(text: str, distance: float, label: str = "[Document 1, chunk 0]") -> Candidate:
+    return Candidate("docs", label, text, distance)
+
+
+def test_cutoffs_redundancy_and_order():
+    selection = context_budget.assemble(
+        "release process",
+        [
+            _doc("Releases are cut from main every Tuesday by the on-call engineer.", 0.2),
+            _doc("Releases are cut from main every Tuesday by the on-call engineer!", 0.25),
+            Candidate("memory", "[Memory: Style]", "Prefer small pull requests.", 0.6),
+            _doc("The office plants are watered on Fridays.", 1.6),
+        ],
+        LIMITS,
+    )
+    assert [c.source for c in selection.selected] == ["docs", "memory"]
+    assert selection.stats["below_threshold"] == 1
+    assert selection.stats["redundant"] == 1
+    sections = selection.sections()
+    assert sections[0].startswith("Relevant document excerpts:")
+    assert sections[1].startswith("Relevant project memories:")
+
+
+def test_k_scales_with_the_query():
+    hits = [_doc(f"Distinct topic number {i} about {word}.", 0.1 + i / 100, f"[Doc {i}]")
+            for i, word in enumerate(["deploys", "rollbacks", "hotfixes", "changelogs", "approvals", "tags"])]
+    assert context_budget.adaptive_k("hi", LIMITS) == 2
+    assert context_budget.adaptive_k(LONG_QUESTION, LIMITS) > 2
+    short = context_budget.assemble("hi", [Candidate(**vars(h)) for h in hits], LIMITS)
+    assert len(short.selected) == 2 and short.stats["over_k"] == 4
+    long = context_budget.assemble(LONG_QUESTION, [Candidate(**vars(h)) for h in hits], LIMITS)
+    assert len(long.selected) == context_budget.adaptive_k(LONG_QUESTION, LIMITS)
+
+
+def test_snippets_are_packed_into_the_token_budget():
+    hits = [_doc(f"Section {i}: " + f"topic{i} details " * 200, 0.1 * i, f"[Doc {i}]") for i in range(5)]
+    selection = context_budget.assemble(LONG_QUESTION, hits, LIMITS)
+    assert 0 < selection.tokens <= LIMITS.token_budget
+    assert all(c.text.endswith("…") for c in selection.selected)
+    assert selection.selected[0].label == "[Doc 0]"  # most relevant first
+    assert selection.stats["over_budget"] >= 1
+
+
+def test_chat_prompt_carries_only_budgeted_context(client, project, monkeypatch):
+    monkeypatch.setenv("IW_CONTEXT_TOKEN_BUDGET", "150")
+    # The suite's stub embeddings are not unit vectors; accept every distance.
+    monkeypatch.setenv("IW_CONTEXT_MAX_DISTANCE_DOCS", "100")
+    for i in range(6):
+        text = f"Runbook {i}. " + "Restart the worker pool before draining the queue. " * 40
+        resp = client.post("/docs/text", json={"project_id": project["id"], "name": f"r{i}.md", "text": text})
+        assert resp.status_code == 200, resp.text
+
+    prompts = []
+    original = main.generate_reply_from_history
+
+    def capturing(messages, *args, **kwargs):
+        prompts.append(messages)
+        return original(messages, *args, **kwargs)
+
+    monkeypatch.setattr(main, "generate_reply_from_history", capturing)
+    resp = client.post("/chat", json={"project_id": project["id"], "message": "How do I restart the worker pool?"})
+    assert resp.status_code == 200, resp.text
+
+    context = [
+        m["content"] for m in prompts[0] if m["role"] == "system" and "Relevant document excerpts" in m["content"]
+    ]
+    assert len(context) == 1
+    assert context_budget.estimate_tokens(context[0]) < 150 + 100  # budget plus the fixed preamble
@@ -0,0 +1,77 @@
+"""
+Query-focused extractive compression of retrieved doc chunks.
+"""
+
+from app.api import main
+from app.llm import context_budget, context_compress
+from app.llm.context_budget import Candidate
+
+RUNBOOK = (
+    "The deployment pipeline has several stages. First, CI builds the container image and runs the unit tests. "
+    "Images are pushed to the internal registry with the commit SHA as the tag. Staging deploys happen "
+    "automatically on merge. Feature flags are managed in a hosted service and cleaned up monthly. "
+    "The office coffee machine is serviced on Mondays. Holiday freeze periods are announced two weeks ahead. "
+    "To roll back a bad production deploy, run deployctl rollback from the ops bastion. "
+    "Rollbacks take about two minutes and do not require approval. The team lunch is on Thursdays. "
+    "Badges are renewed every year by the facilities team. Parking permits are issued at reception."
+)
+
+
+def test_spans_split_prose_lists_and_code():
+    text = "Intro sentence. Second one!\n\n- item one\n- item two\n\n```python\nx = 1\ny = 2\n```\nTail."
+    assert context_compress.split_spans(text) == [
+        "Intro sentence.",
+        "Second one!",
+        "- item one",
+        "- item two",
+        "```python\nx = 1\ny = 2\n```",
+        "Tail.",
+    ]
+
+
+def test_keeps_the_matching_spans_with_context():
+    candidates = [
+        Candidate("docs", "[Runbook]", RUNBOOK, 0.4),
+        Candidate("docs", "[Far]", RUNBOOK, 3.0),
+        Candidate("memory", "[Memory: x]", RUNBOOK, 0.4),
+    ]
+    stats = context_compress.compress_candidates(
+        "how do I roll back a bad deploy?", candidates, context_budget.env_limits()
+    )
+    assert stats["compressed"] == 1
+    text = candidates[0].text
+    assert "deployctl rollback" in text
+    assert "Rollbacks take about two minutes" in text  # neighbouring context
+    assert "Parking permits" not in text and "…" in text
+    assert len(text) < 0.8 * len(RUNBOOK)
+    # Hits past the cutoff and other sources are untouched.
+    assert candidates[1].text == RUNBOOK and candidates[2].text == RUNBOOK
+
+
+def test_short_chunks_and_disabled_compression_are_left_alone(monkeypatch):
+    short = [Candidate("docs", "[Short]", "Roll back with deployctl. It is quick.", 0.1)]
+    assert context_compress.compress_candidates("roll back", short, context_budget.env_limits())["compressed"] == 0
+    monkeypatch.setenv("IW_CONTEXT_COMPRESS", "0")
+    full = [Candidate("docs", "[Runbook]", RUNBOOK, 0.4)]
+    context_compress.compress_candidates("roll back", full, context_budget.env_limits())
+    assert full[0].text == RUNBOOK
+
+
+def test_chat_sends_compressed_chunks(client, project, monkeypatch):
+    monkeypatch.setenv("IW_CONTEXT_MAX_DISTANCE_DOCS", "100")  # stub embeddings
+    resp = client.post("/docs/text", json={"project_id": project["id"], "name": "runbook.md", "text": RUNBOOK})
+    assert resp.status_code == 200, resp.text
+
+    prompts = []
+    original = main.generate_reply_from_history
+
+    def capturing(messages, *args, **kwargs):
+        prompts.append(messages)
+        return original(messages, *args, **kwargs)
+
+    monkeypatch.setattr(main, "generate_reply_from_history", capturing)
+    resp = client.post("/chat", json={"project_id": project["id"], "message": "How do I roll back a deploy?"})
+    assert resp.status_code == 200, resp.text
+    context = next(m["content"] for m in prompts[0] if "Relevant document excerpts" in m["content"])
+    assert "deployctl rollback" in context
+    assert "Parking permits" not in context
@@ -0,0 +1,109 @@
+"""
+Coalescing of concurrent single-text embedding requests: single flight and
+micro-batching.
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.llm import embedding_providers, embeddings
+from app.llm.embedding_coalescer import EmbeddingCoalescer
+from app.llm.embeddings import EmbeddingSpec
+
+
+class _SlowEmbedder:
+    def __init__(self, delay: float = 0.05) -> None:
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, model, dimensions, texts):
+        self.calls.append(list(texts))
+        time.sleep(self.delay)
+        return [[float(len(text)), float(dimensions or 0)] for text in texts]
+
+
+def _run_concurrently(coalescer, texts):
+    barrier = threading.Barrier(len(texts))
+    results = [None] * len(texts)
+    errors = []
+
+    def worker(index, text):
+        barrier.wait()
+        try:
+            results[index] = coalescer.embed("m", 4, text)
+        except Exception as exc:  # noqa: BLE001
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(i, t)) for i, t in enumerate(texts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results, errors
+
+
+def test_lone_request_is_sent_without_waiting(monkeypatch):
+    monkeypatch.setenv("IW_EMBED_COALESCE_WINDOW_MS", "500")
+    embedder = _SlowEmbedder(delay=0)
+    coalescer = EmbeddingCoalescer(embedder)
+    started = time.perf_counter()
+    assert coalescer.embed("m", None, "abc") == [3.0, 0.0]
+    assert time.perf_counter() - started < 0.25
+    assert embedder.calls == [["abc"]]
+
+
+def test_concurrent_requests_share_calls_and_identical_texts_single_flight(monkeypatch):
+    monkeypatch.setenv("IW_EMBED_COALESCE_WINDOW_MS", "20")
+    embedder = _SlowEmbedder()
+    coalescer = EmbeddingCoalescer(embedder)
+    texts = [f"query {i % 6}" + "x" * (i % 6) for i in range(24)]
+
+    results, errors = _run_concurrently(coalescer, texts)
+
+    assert not errors
+    assert results == [[float(len(text)), 4.0] for text in texts]
+    sent = [text for call in embedder.calls for text in call]
+    assert len(embedder.calls) < len(texts)
+    assert len(sent) == len(set(sent))  # no text embedded twice while in flight
+    # Results are copies; callers cannot corrupt each other's vectors.
+    assert results[0] is not results[6]
+
+
+def test_batches_close_at_max_size(monkeypatch):
+    monkeypatch.setenv("IW_EMBED_COALESCE_WINDOW_MS", "200")
+    monkeypatch.setenv("IW_EMBED_COALESCE_MAX_BATCH", "4")
+    embedder = _SlowEmbedder()
+    coalescer = EmbeddingCoalescer(embedder)
+
+    results, errors = _run_concurrently(coalescer, [f"t{i}" for i in range(12)])
+
+    assert not errors and all(results)
+    assert max(len(call) for call in embedder.calls) <= 4
+
+
+def test_errors_reach_every_waiting_caller(monkeypatch):
+    monkeypatch.setenv("IW_EMBED_COALESCE_WINDOW_MS", "20")
+
+    def failing(model, dimensions, texts):
+        time.sleep(0.02)
+        raise RuntimeError("rate limited")
+
+    coalescer = EmbeddingCoalescer(failing)
+    results, errors = _run_concurrently(coalescer, ["same", "same", "other", "third"])
+    assert len(errors) == 4 and all("rate limited" in str(exc) for exc in errors)
+    assert coalescer._inflight == {}
+    # A later request is sent again rather than served the stale failure.
+    with pytest.raises(RuntimeError):
+        coalescer.embed("m", 4, "same")
+
+
+def test_only_remote_providers_are_coalesced(monkeypatch):
+    routed = []
+    monkeypatch.setattr(embeddings._COALESCER, "embed", lambda m, d, t: routed.append(m) or [0.0])
+    assert embeddings._embed_one(EmbeddingSpec("text-embedding-3-small"), "q") == [0.0]
+    assert routed == ["text-embedding-3-small"]
+
+    local = embeddings._embed_one(EmbeddingSpec(embedding_providers.HASHED_NGRAM_MODEL), "q")
+    assert len(local) == 384 and routed == ["text-embedding-3-small"]
@@ -0,0 +1,86 @@
+"""
+Embedding providers: the offline hashed n-gram provider and per-collection
+embedding models.
+"""
+
+import math
+import time
+
+import pytest
+
+from app.ingestion import docs_ingestor
+from app.llm import embeddings
+from app.llm.embedding_providers import HASHED_NGRAM_MODEL, provider_for
+from app.llm.embeddings import EmbeddingSpec, embedding_spec
+from app.vectorstore import chroma_store, registry
+
+
+def _cosine(a, b) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+def test_hashed_ngram_vectors_are_local_deterministic_and_lexical():
+    provider = provider_for(HASHED_NGRAM_MODEL)
+    query, near, far = provider.embed(
+        HASHED_NGRAM_MODEL,
+        [
+            "How do I rotate the database credentials?",
+            "Rotating database credentials is done with the vault CLI.",
+            "The frontend uses React with a custom theme.",
+        ],
+        None,
+    )
+    assert len(query) == 384
+    assert math.isclose(math.sqrt(sum(v * v for v in query)), 1.0, rel_tol=1e-9)
+    assert provider.embed(HASHED_NGRAM_MODEL, ["How do I rotate the database credentials?"], None)[0] == query
+    assert _cosine(query, near) > _cosine(query, far) + 0.1
+    assert len(provider.embed(HASHED_NGRAM_MODEL, ["x"], 64)[0]) == 64
+    assert provider.embed(HASHED_NGRAM_MODEL, [""], None)[0] == [0.0] * 384
+
+    started = time.perf_counter()
+    for _ in range(100):
+        provider.embed(HASHED_NGRAM_MODEL, ["rotate the database credentials"], None)
+    assert (time.perf_counter() - started) / 100 < 0.02
+
+
+def test_embedding_spec_validation_is_provider_specific(tmp_path):
+    assert embedding_spec(HASHED_NGRAM_MODEL, 384).dimensions is None
+    assert embedding_spec(HASHED_NGRAM_MODEL, 128).vector_size == 128
+    assert EmbeddingSpec(HASHED_NGRAM_MODEL).to_dict()["provider"] == "hashed-ngram"
+    with pytest.raises(ValueError):
+        embedding_spec(HASHED_NGRAM_MODEL, 4)
+    with pytest.raises(ValueError):
+        embedding_spec(f"local:{tmp_path / 'missing'}")
+    assert embedding_spec(f"local:{tmp_path}").vector_size is None  # known once loaded
+    with pytest.raises(ValueError):
+        embedding_spec(f"local:{tmp_path}", 256)
+
+
+def test_collection_selects_its_own_provider(client, project, monkeypatch):
+    monkeypatch.setenv("IW_EMBEDDING_MODEL_DOCS", HASHED_NGRAM_MODEL)
+    # Ingestion and reconcile embed for real here, not with the suite's fake.
+    monkeypatch.setattr(embeddings, "embed_texts_batched", docs_ingestor.embed_texts_batched)
+    registry.refresh()
+    assert registry.active("docs").spec == EmbeddingSpec(HASHED_NGRAM_MODEL)
+    assert registry.active("messages").spec == EmbeddingSpec("text-embedding-3-small")
+
+    for name, text in (
+        ("vault.md", "Rotate database credentials with the vault CLI every quarter."),
+        ("ui.md", "The frontend uses React components with a custom theme."),
+    ):
+        resp = client.post("/docs/text", json={"project_id": project["id"], "name": name, "text": text})
+        assert resp.status_code == 200, resp.text
+
+    stored = chroma_store.get_docs_collection().get(include=["embeddings"])["embeddings"]
+    assert {len(vector) for vector in stored} == {384}
+
+    vector = embeddings.query_embedder("rotate credentials")
+    assert len(vector("docs")) == 384
+    assert vector("messages") is vector("memory_items")  # one call for the shared spec
+
+    hits = client.post(
+        "/search/docs", json={"project_id": project["id"], "query": "rotate database credentials"}
+    ).json()["hits"]
+    by_distance = sorted(hits, key=lambda hit: hit["distance"])
+    assert "vault" in by_distance[0]["content"]
+    assert client.post("/chat", json={"project_id": project["id"], "message": "credentials?"}).status_code == 200
@@ -2,9 +2,12 @@
 Docs ingestion happy path (lightweight) with stubbed embeddings.
 """
 
+import hashlib
 import time
 from pathlib import Path
 
+from app.db import models
+
 POLL_STATUSES = {"completed", "failed", "cancelled"}
 
 
@@ -53,3 +56,90 @@ def test_basic_ingestion_happy_path(client, tmp_path):
     assert job["processed_items"] >= 1
     assert job["total_items"] >= 1
 
+
+
+def test_repo_ingestion_skips_binary_and_generated(db_session, project, tmp_path):
+    """D-Docs-04: Classifier keeps binaries, lockfiles and bundles out of the index."""
+    from app.ingestion.github_ingestor import ingest_local_repo
+
+    repo_root = tmp_path / "classified_repo"
+    repo_root.mkdir()
+    (repo_root / "app.py").write_text("def main():\n    return 1\n", encoding="utf-8")
+    (repo_root / "blob.txt").write_bytes(b"header\x00\x01\x02binary")
+    (repo_root / "package-lock.json").write_text('{"lockfileVersion": 3}', encoding="utf-8")
+    (repo_root / "bundle.js").write_text("var a=1;" * 2000, encoding="utf-8")
+    (repo_root / "schema.py").write_text(
+        "# Code generated by protoc. DO NOT EDIT.\nX = 1\n", encoding="utf-8"
+    )
+
+    result = ingest_local_repo(
+        db=db_session,
+        project_id=project["id"],
+        root_path=str(repo_root),
+        include_globs=["*.py", "*.txt", "*.json", "*.js"],
+    )
+
+    assert result["num_documents"] == 1
+    job = (
+        db_session.query(models.IngestionJob)
+        .filter(models.IngestionJob.project_id == project["id"])
+        .order_by(models.IngestionJob.id.desc())
+        .first()
+    )
+    meta = job.meta or {}
+    assert meta["skipped_by_reason"] == {
+        "binary": 1,
+        "lockfile": 1,
+        "minified": 1,
+        "generated": 1,
+    }
+    assert {entry["path"] for entry in meta["skipped_files"]} == {
+        "blob.txt",
+        "package-lock.json",
+        "bundle.js",
+        "schema.py",
+    }
+
+
+def test_repo_ingestion_normalizes_crlf(db_session, project, tmp_path):
+    """CRLF files hash stably across runs and are chunked without carriage returns."""
+    from app.ingestion.github_ingestor import ingest_local_repo
+
+    repo_root = tmp_path / "crlf_repo"
+    repo_root.mkdir()
+    (repo_root / "app.py").write_bytes(b"def main():\r\n    return 1\r\n")
+
+    def ingest():
+        return ingest_local_repo(
+            db=db_session,
+            project_id=project["id"],
+            root_path=str(repo_root),
+            include_globs=["*.py"],
+        )
+
+    assert ingest()["num_documents"] == 1
+    contents = [c.content for c in db_session.query(models.DocumentChunk).all()]
+    assert contents and not any("\r" in content for content in contents)
+    # Matches the hash earlier read_text()-based runs stored.
+    state = db_session.query(models.FileIngestionState).filter_by(relative_path="app.py").one()
+    assert state.sha256 == hashlib.sha256(b"def main():\n    return 1\n").hexdigest()
+    assert ingest()["num_documents"] == 0
+
+
+def test_generated_markers_only_match_header_comments():
+    """Generator banners are skipped; prose that mentions them is not."""
+    from app.ingestion.content_classifier import SKIP_GENERATED, classify_content
+
+    for banner in (
+        b"# Code generated by protoc-gen-go. DO NOT EDIT.\npackage x\n",
+        b"// @generated by relay-compiler\nexport {}\n",
+        b"/*\n * This file was automatically generated by openapi-generator.\n */\n",
+        b"<!-- Auto-generated by sphinx-apidoc -->\n<h1>API</h1>\n",
+    ):
+        assert classify_content("gen.txt", banner) == SKIP_GENERATED, banner
+    for prose in (
+        b"# Settings\n\nPlease do not edit the config by hand; use the CLI.\n",
+        b"ids = []  # autogenerated ids are reused\n",
+        b"The client is code generated by our tool, so do not edit it directly.\n",
+    ):
+        assert classify_content("README.md", prose) is None, prose
@@ -0,0 +1,120 @@
+"""
+LLM budget gateway: tokens per minute, dollars per day, concurrency, checkpoints.
+"""
+
+from datetime import date
+
+import pytest
+
+from app.llm import budgets
+from app.llm.budgets import BudgetExceeded, BudgetGateway, BudgetLimits
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def _gateway(limits: BudgetLimits, clock: FakeClock) -> BudgetGateway:
+    gateway = BudgetGateway(clock=clock, today=lambda: date(2025, 1, 1), sleep=clock.sleep)
+    gateway.limits_for = lambda mode: limits
+    return gateway
+
+
+def test_tokens_per_minute_queue_then_downgrade(monkeypatch):
+    monkeypatch.setenv("IW_LLM_QUEUE_TIMEOUT", "20")
+    clock = FakeClock()
+    gateway = _gateway(BudgetLimits(tokens_per_minute=600), clock)
+
+    first = gateway.acquire(1, "deep", 500)
+    gateway.release(first, tokens=500)
+    # 400 tokens short at 10 tokens/s: queue ~40s > 20s timeout -> budget model.
+    with pytest.raises(BudgetExceeded):
+        gateway.acquire(1, "deep", 500, optional=True)
+    lease = gateway.acquire(1, "deep", 500)
+    assert lease.downgraded and lease.mode == "budget"
+    gateway.release(lease, tokens=500)
+
+    # A wait within the queue timeout is absorbed by queueing instead.
+    monkeypatch.setenv("IW_LLM_QUEUE_TIMEOUT", "50")
+    clock.now += 60
+    gateway.release(gateway.acquire(1, "deep", 500), tokens=500)
+    start = clock.now
+    queued = gateway.acquire(1, "deep", 550)
+    assert not queued.downgraded
+    assert clock.now - start == pytest.approx(45.0)
+    assert gateway.snapshot()["queued"] >= 1
+
+
+def test_daily_dollars_skip_optional_and_downgrade_required():
+    clock = FakeClock()
+    gateway = _gateway(BudgetLimits(), clock)
+    gateway.set_project_daily_usd(7, 1.0)
+
+    gateway.release(gateway.acquire(7, "deep", 100), tokens=100, cost=1.2)
+    with pytest.raises(BudgetExceeded) as exc:
+        gateway.acquire(7, "fast", 100, optional=True)
+    assert exc.value.reason == "daily budget spent"
+    lease = gateway.acquire(7, "deep", 100)
+    assert lease.downgraded and lease.mode == "budget"
+    # Other projects are unaffected.
+    assert not gateway.acquire(8, "deep", 100).downgraded
+
+
+def test_concurrency_cap(monkeypatch):
+    monkeypatch.setenv("IW_LLM_QUEUE_TIMEOUT", "0")
+    clock = FakeClock()
+    gateway = _gateway(BudgetLimits(max_concurrency=1), clock)
+    held = gateway.acquire(1, "fast", 10)
+    with pytest.raises(BudgetExceeded):
+        gateway.acquire(1, "fast", 10)
+    gateway.release(held)
+    gateway.release(gateway.acquire(1, "fast", 10))
+    assert gateway.snapshot()["rejected"] == 1
+
+
+def test_daily_spend_survives_restart_via_checkpoint(db_session):
+    def fresh() -> BudgetGateway:
+        gateway = _gateway(BudgetLimits(), FakeClock())
+        gateway.load_checkpoint = budgets._load_from_db
+        gateway.save_checkpoint = budgets._save_to_db
+        gateway.set_project_daily_usd(3, 2.0)
+        return gateway
+
+    before = fresh()
+    before.release(before.acquire(3, "deep", 100), tokens=1500, cost=1.5)
+    before.release(before.acquire(3, "fast", 100), tokens=200, cost=0.6)
+    assert before.checkpoint() == 2
+
+    after = fresh()
+    assert after.acquire(3, "auto", 100).downgraded
+    usage = {row["mode"]: row for row in after.snapshot()["usage"] if row["project_id"] == 3}
+    assert usage["deep"]["tokens"] == 1500
+    assert usage["fast"]["cost_usd"] == pytest.approx(0.6)
+
+
+def test_checkpoint_load_runs_outside_the_gateway_lock():
+    import threading
+
+    gateway = _gateway(BudgetLimits(), FakeClock())
+    unblocked = []
+
+    def slow_load(project_id, day):
+        # Another thread must still get through the gateway during the read.
+        other = threading.Thread(target=lambda: unblocked.append(gateway.snapshot()))
+        other.start()
+        other.join(timeout=5)
+        return {"deep": (700, 0.7)}
+
+    gateway.load_checkpoint = slow_load
+    gateway.release(gateway.acquire(4, "deep", 100), tokens=100, cost=0.1)
+    assert len(unblocked) == 1
+    usage = {row["mode"]: row for row in gateway.snapshot()["usage"] if row["project_id"] == 4}
+    assert usage["deep"]["tokens"] == 800
+    assert usage["deep"]["cost_usd"] == pytest.approx(0.8)
@@ -0,0 +1,89 @@
+"""
+Metrics registry, /metrics exposition and chat stage latency histograms.
+"""
+
+import threading
+
+import pytest
+
+from app.observability.metrics import Counter, Histogram, Registry, StageTimer
+
+
+def test_histogram_buckets_and_quantiles():
+    hist = Histogram("t_seconds", "test", ("stage",), buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.05, 0.3, 0.3, 0.3, 0.7, 2.0):
+        hist.observe(value, stage="a")
+
+    assert hist.count(stage="a") == 7
+    assert hist.count(stage="b") == 0
+    assert hist.quantile(0.5, stage="b") is None
+    # Rank 3.5 of 7 falls in (0.1, 0.5]: 1.5 of its 3 observations in.
+    assert hist.quantile(0.5, stage="a") == pytest.approx(0.1 + 0.4 * 1.5 / 3)
+    # Overflow observations report the last finite bound.
+    assert hist.quantile(0.99, stage="a") == pytest.approx(1.0)
+
+    lines = hist.render()
+    assert 't_seconds_bucket{stage="a",le="0.1"} 2' in lines
+    assert 't_seconds_bucket{stage="a",le="0.5"} 5' in lines
+    assert 't_seconds_bucket{stage="a",le="+Inf"} 7' in lines
+    assert 't_seconds_count{stage="a"} 7' in lines
+
+    with pytest.raises(ValueError):
+        hist.observe(1.0, other="x")
+
+
+def test_counter_is_thread_safe_and_registry_renders():
+    registry = Registry()
+    counter = registry.counter("t_total", "test", ("kind",))
+    registry.histogram("t_latency_seconds", "test")
+
+    def _bump():
+        for _ in range(1000):
+            counter.inc(kind='q"x')
+
+    threads = [threading.Thread(target=_bump) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert counter.value(kind='q"x') == 8000
+    text = registry.render()
+    assert "# TYPE t_total counter" in text
+    assert 't_total{kind="q\\"x"} 8000' in text
+    with pytest.raises(ValueError):
+        registry.register(Counter("t_total", "dup"))
+    with pytest.raises(ValueError):
+        counter.inc(-1, kind="x")
+
+
+def test_stage_timer_laps_into_histogram():
+    hist = Histogram("t_stage_seconds", "test", ("stage",))
+    stages = StageTimer(hist)
+    stages.lap("one")
+    stages.lap("two")
+    stages.lap("two")
+    assert hist.count(stage="one") == 1
+    assert hist.count(stage="two") == 2
+
+
+def test_metrics_endpoint_reports_chat_stages_and_routes(client, project):
+    resp = client.post("/chat", json={"project_id": project["id"], "message": "hello metrics"})
+    assert resp.status_code == 200, resp.text
+    client.get(f"/projects/{project['id']}")
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    body = metrics.text
+    for stage in ("resolve", "retrieval_context", "llm", "persist", "commit"):
+        assert f'iw_chat_stage_duration_seconds_count{{stage="{stage}"}}' in body
+    # Routes are labelled by template, not by concrete id.
+    assert 'route="/projects/{project_id}"' in body
+    assert 'iw_http_requests_total{method="POST",route="/chat",status="200"}' in body
+    assert "iw_vector_query_duration_seconds_bucket" in body
+
+    latency = client.get("/debug/telemetry").json()["latency"]
+    llm_stage = latency["iw_chat_stage_duration_seconds"]["stage=llm"]
+    assert llm_stage["count"] >= 1
+    assert llm_stage["p95"] >= llm_stage["p50"] >= 0.0
@@ -0,0 +1,85 @@
+"""
+Auto-mode router: heuristic prior, rolling model stats, per-project SLO and budget.
+"""
+
+from app.llm import openai_client
+from app.llm.router import RoutingPolicy, get_router_stats, record_model_call, route_auto
+
+MODELS = {
+    "fast": "fast-model",
+    "budget": "budget-model",
+    "auto": "gpt-4.1",
+    "deep": "gpt-5.1",
+    "code": "gpt-5.1-codex",
+    "research": "o3-deep-research",
+}
+
+
+def _route(prompt: str, policy: RoutingPolicy | None = None):
+    messages = [{"role": "user", "content": prompt}]
+    mode, reason = openai_client._infer_auto_submode(messages)
+    return route_auto(mode, reason, prompt, len(prompt) // 4, MODELS.__getitem__, policy)
+
+
+def _observe(model: str, calls: int, latency_ms: float, ok: bool = True, cost: float = 0.001) -> None:
+    for _ in range(calls):
+        record_model_call(model, latency_ms, ok, tokens_in=100, tokens_out=50, cost=cost)
+
+
+def test_without_history_the_heuristics_decide():
+    assert _route("Fix this:\n```python\nprint('hi')\n```").mode == "code"
+    assert _route("Outline a multi-quarter roadmap with milestones.").mode == "deep"
+    assert _route("Ping?").mode == "fast"
+
+
+def test_cheaper_tiers_serve_unspecific_and_lightly_codey_prompts():
+    # "default" prompts no longer go to the deep tier first.
+    assert _route("Tell me more about how the sync job decides what to re-index. " * 3).mode == "auto"
+    # A question mentioning `def` is not a codex job.
+    assert _route("What does def do in python?").mode == "auto"
+
+
+def test_slow_or_failing_models_are_skipped():
+    prompt = "Outline a multi-quarter roadmap with milestones."
+    _observe("gpt-5.1", 10, latency_ms=9000)
+    _observe("gpt-4.1", 10, latency_ms=800)
+    slo = RoutingPolicy(latency_slo_ms=3000)
+    decision = _route(prompt, slo)
+    assert decision.model == "gpt-4.1"
+    assert "over SLO" in decision.reason
+    # No SLO: the prior still wins.
+    assert _route(prompt).model == "gpt-5.1"
+
+    _observe("gpt-5.1", 10, latency_ms=500, ok=False)
+    assert "error rate" in _route(prompt).reason
+
+    stats = get_router_stats()
+    assert stats["gpt-4.1"]["calls"] == 10
+    assert stats["gpt-4.1"]["p95_latency_ms"] == 800
+
+
+def test_budget_pressure_prefers_cheapest_eligible():
+    prompt = "Outline a multi-quarter roadmap with milestones."
+    _observe("gpt-5.1", 10, latency_ms=1000, cost=0.05)
+    _observe("gpt-4.1", 10, latency_ms=1000, cost=0.01)
+    assert _route(prompt, RoutingPolicy(daily_budget_usd=1.0, spent_today_usd=0.1)).model == "gpt-5.1"
+    assert _route(prompt, RoutingPolicy(daily_budget_usd=1.0, spent_today_usd=0.9)).model == "gpt-4.1"
+    assert _route(prompt, RoutingPolicy(daily_budget_usd=1.0, spent_today_usd=0.97)).model == "gpt-4.1"
+
+
+def test_project_routing_policy_round_trips(client, project):
+    resp = client.patch(
+        f"/projects/{project['id']}",
+        json={"latency_slo_ms": 4000, "daily_budget_usd": 2.5},
+    )
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["latency_slo_ms"] == 4000
+    assert resp.json()["daily_budget_usd"] == 2.5
+
+    cleared = client.patch(f"/projects/{project['id']}", json={"latency_slo_ms": 0})
+    assert cleared.json()["latency_slo_ms"] is None
+    assert client.patch(f"/projects/{project['id']}", json={"daily_budget_usd": -1}).status_code == 422
+
+    chat = client.post("/chat", json={"project_id": project["id"], "message": "hello"})
+    assert chat.status_code == 200, chat.text
+    assert "router" in client.get("/debug/telemetry").json()
@@ -0,0 +1,141 @@
+"""
+Keyset pagination, field projection and total counts on list endpoints.
+"""
+
+from datetime import datetime, timedelta
+
+from app.db import models
+
+
+def _walk(client, url: str, limit: int, **params):
+    pages = []
+    cursor = None
+    while True:
+        query = {"limit": limit, **params}
+        if cursor:
+            query["cursor"] = cursor
+        resp = client.get(url, params=query)
+        assert resp.status_code == 200, resp.text
+        pages.append(resp.json())
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_messages_pages_cover_conversation_once(client, project, db_session):
+    convo = models.Conversation(project_id=project["id"], title="paged")
+    db_session.add(convo)
+    db_session.flush()
+    db_session.add_all(
+        models.Message(conversation_id=convo.id, role="user", content=f"m{i}")
+        for i in range(23)
+    )
+    db_session.commit()
+    url = f"/conversations/{convo.id}/messages"
+
+    pages = _walk(client, url, 10)
+    assert [len(p) for p in pages] == [10, 10, 3]
+    contents = [m["content"] for page in pages for m in page]
+    assert contents == [f"m{i}" for i in range(23)]
+
+    latest = client.get(url, params={"limit": 5, "newest_first": True, "fields": "id,content", "include_total": True})
+    assert latest.status_code == 200, latest.text
+    assert latest.headers["X-Total-Count"] == "23"
+    assert [m["content"] for m in latest.json()] == [f"m{i}" for i in range(22, 17, -1)]
+    assert set(latest.json()[0]) == {"id", "content"}
+
+    # Unpaged requests keep returning everything.
+    assert len(client.get(url).json()) == 23
+    assert client.get(url, params={"cursor": "not-a-cursor", "limit": 5}).status_code == 400
+    assert client.get(url, params={"fields": "id,nope"}).status_code == 400
+
+
+def test_task_pages_follow_mixed_direction_order(client, project, db_session):
+    base = datetime(2025, 1, 1)
+    specs = [
+        ("done", "high", None),
+        ("open", "low", None),
+        ("open", "critical", "waiting on vendor"),
+        ("open", "critical", None),
+        ("open", "normal", None),
+        ("open", "high", None),
+        ("done", "critical", None),
+    ]
+    for i, (status, priority, blocked) in enumerate(specs):
+        db_session.add(
+            models.Task(
+                project_id=project["id"],
+                description=f"task {i}",
+                status=status,
+                priority=priority,
+                blocked_reason=blocked,
+                updated_at=base + timedelta(minutes=i),
+            )
+        )
+    db_session.commit()
+    url = f"/projects/{project['id']}/tasks"
+
+    full = [t["id"] for t in client.get(url).json()]
+    paged = [t["id"] for page in _walk(client, url, 2, fields="id") for t in page]
+    assert paged == full
+    assert len(full) == len(specs)
+
+
+def test_usage_totals_cover_all_pages(client, project, db_session):
+    convo = models.Conversation(project_id=project["id"], title="usage")
+    db_session.add(convo)
+    db_session.flush()
+    db_session.add_all(
+        models.UsageRecord(
+            project_id=project["id"],
+            conversation_id=convo.id,
+            model="gpt-4.1-mini",
+            tokens_in=100,
+            tokens_out=10,
+        )
+        for _ in range(5)
+    )
+    db_session.commit()
+
+    resp = client.get(f"/conversations/{convo.id}/usage", params={"limit": 2, "fields": "id,model"})
+    assert resp.status_code == 200, resp.text
+    body = resp.json()
+    assert len(body["records"]) == 2
+    assert set(body["records"][0]) == {"id", "model"}
+    assert body["total_tokens_in"] == 500
+    assert body["total_tokens_out"] == 50
+    assert resp.headers.get("X-Next-Cursor")
+
+
+def test_conversation_listing_loads_folders_in_one_query(client, project, db_session):
+    from sqlalchemy import event
+
+    import app.db.session as session_module
+
+    folder = models.ConversationFolder(project_id=project["id"], name="Specs", color="#112233")
+    db_session.add(folder)
+    db_session.flush()
+    db_session.add_all(
+        models.Conversation(project_id=project["id"], title=f"c{i}", folder_id=folder.id)
+        for i in range(6)
+    )
+    db_session.commit()
+
+    statements = []
+
+    def _count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session_module.engine
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        resp = client.get(f"/projects/{project['id']}/conversations")
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+
+    assert resp.status_code == 200, resp.text
+    assert {c["folder_name"] for c in resp.json()} == {"Specs"}
+    conversation_selects = [s for s in statements if "FROM conversations" in s]
+    assert len(conversation_selects) == 1
+    # Folders come from the LEFT OUTER JOIN, not one lookup per row.
+    assert not [s for s in statements if "FROM conversation_folders" in s]
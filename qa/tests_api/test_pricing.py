@@ -0,0 +1,73 @@
+"""
+Pricing registry: prefix resolution, cached-input pricing, overrides, recompute.
+"""
+
+import pytest
+
+from app.llm import openai_client
+from app.llm import pricing
+from app.llm.pricing import estimate_call_cost, resolve_pricing
+
+
+@pytest.fixture
+def fresh_pricing(monkeypatch):
+    monkeypatch.delenv("IW_MODEL_PRICING", raising=False)
+    monkeypatch.delenv("IW_MODEL_PRICING_FILE", raising=False)
+    pricing.reload_pricing()
+    yield monkeypatch
+    monkeypatch.undo()
+    pricing.reload_pricing()
+
+
+def test_models_resolve_to_longest_family_prefix(fresh_pricing):
+    assert resolve_pricing("gpt-5.1-2025-11-13")[0] == "gpt-5.1"
+    assert resolve_pricing("gpt-5.1-codex-mini")[0] == "gpt-5.1-codex"
+    assert resolve_pricing("gpt-4.1-nano")[0] == "gpt-4.1-nano"
+    assert resolve_pricing("GPT-4.1")[0] == "gpt-4.1"
+    assert resolve_pricing("gpt-5-codex")[0] == "gpt-5"
+    assert resolve_pricing("gpt-4.10") is None
+    assert resolve_pricing("mystery-model") is None
+
+
+def test_one_price_for_every_caller(fresh_pricing):
+    # $15 in / $120 out per 1M tokens, from both entry points.
+    assert estimate_call_cost("gpt-5-pro", 1_000_000, 1_000_000) == pytest.approx(135.0)
+    assert openai_client.estimate_cost_usd("gpt-5-pro", 1_000_000, 1_000_000) == pytest.approx(135.0)
+
+
+def test_cached_input_tokens_are_discounted(fresh_pricing):
+    full = estimate_call_cost("gpt-5.1", 1_000_000, 0)
+    cached = estimate_call_cost("gpt-5.1", 1_000_000, 0, cached_tokens_in=800_000)
+    assert full == pytest.approx(1.25)
+    assert cached == pytest.approx(0.2 * 1.25 + 0.8 * 0.125)
+
+
+def test_unknown_models_are_reported(fresh_pricing, capsys):
+    assert estimate_call_cost("mystery-model", 10, 10) == 0.0
+    estimate_call_cost("mystery-model", 10, 10)
+    assert pricing.unpriced_models() == {"mystery-model": 2}
+    assert capsys.readouterr().out.count("No pricing for model 'mystery-model'") == 1
+
+
+def test_env_override_and_recompute(fresh_pricing, client, project, db_session):
+    from app.db import models
+
+    resp = client.post("/chat", json={"project_id": project["id"], "message": "Hello"})
+    assert resp.status_code == 200, resp.text
+    record = db_session.query(models.UsageRecord).filter_by(project_id=project["id"]).one()
+    record.tokens_in, record.tokens_out = 2_000_000, 1_000_000
+    db_session.commit()
+
+    fresh_pricing.setenv(
+        "IW_MODEL_PRICING", '{"%s": {"input": 1.0, "output": 3.0}}' % record.model
+    )
+    pricing.reload_pricing()
+
+    result = client.post("/usage/recompute_costs", params={"project_id": project["id"]})
+    assert result.status_code == 200, result.text
+    assert result.json()["updated"] == 1
+    db_session.refresh(record)
+    assert record.cost_estimate == pytest.approx(5.0)
+    usage = client.get(f"/projects/{project['id']}/usage").json()
+    assert usage["total_cost_estimate"] == pytest.approx(5.0)
+    assert usage["total_tokens_in"] == 2_000_000
@@ -0,0 +1,109 @@
+"""
+Quantized embedded vector store: int8 and PQ codes with exact float re-rank.
+"""
+
+import numpy as np
+import pytest
+
+from app.vectorstore import chroma_store
+from app.vectorstore.quantized_store import QuantizedClient
+
+DIM = 32
+
+
+def _vectors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+
+def _exact_top(vectors: np.ndarray, query: np.ndarray, k: int) -> list:
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    return [str(i) for i in np.argsort(distances)[:k]]
+
+
+def test_int8_collection_filters_reranks_and_persists(tmp_path):
+    client = QuantizedClient(str(tmp_path))
+    messages = client.get_or_create_collection("messages")
+    vectors = _vectors(400)
+    messages.add(
+        ids=[str(i) for i in range(400)],
+        embeddings=vectors.tolist(),
+        documents=[f"doc {i}" for i in range(400)],
+        metadatas=[{"project_id": i % 2, "title": None} for i in range(400)],
+    )
+    stats = messages.stats()
+    assert stats["codec"] == "int8"
+    assert stats["bytes_per_vector"] == DIM + 8
+
+    even = vectors[::2]
+    query = vectors[10] + 0.01
+    result = messages.query(query_embeddings=[query.tolist()], n_results=5,
+                            where={"project_id": {"$eq": 0}})
+    expected = [str(int(i) * 2) for i in _exact_top(even, query, 5)]
+    assert result["ids"][0] == expected
+    assert result["documents"][0][0] == "doc 10"
+    assert result["metadatas"][0][0] == {"project_id": 0}
+    assert result["distances"][0][0] == pytest.approx(float(((vectors[10] - query) ** 2).sum()), rel=1e-4)
+
+    # add replaces an existing id; deleted slots are reused.
+    messages.add(ids=["10"], embeddings=[(-vectors[10]).tolist()], metadatas=[{"project_id": 0}])
+    messages.delete(ids=["12"])
+    messages.add(ids=["new"], embeddings=[vectors[12].tolist()], metadatas=[{"project_id": 1}])
+    assert messages.count() == 400
+    with pytest.raises(ValueError):
+        messages.add(ids=["bad"], embeddings=[[0.0] * (DIM + 1)])
+
+    client.reset()
+    reopened = QuantizedClient(str(tmp_path)).get_or_create_collection("messages")
+    assert reopened.count() == 400
+    assert reopened.get(ids=["12"])["ids"] == []
+    assert "new" in reopened.get(where={"project_id": 1}, include=[])["ids"]
+    top = reopened.query(query_embeddings=[query.tolist()], n_results=1,
+                         where={"project_id": {"$eq": 0}})
+    assert top["ids"][0] != ["10"]
+    assert reopened.get(ids=["new"], include=["embeddings"])["embeddings"][0] == pytest.approx(
+        vectors[12].tolist()
+    )
+
+
+def test_docs_collection_trains_product_quantizer(tmp_path, monkeypatch):
+    monkeypatch.setenv("IW_PQ_TRAIN_MIN", "256")
+    monkeypatch.setenv("IW_PQ_TRAIN_ITERATIONS", "4")
+    client = QuantizedClient(str(tmp_path))
+    docs = client.get_or_create_collection("docs")
+    vectors = _vectors(600, seed=1)
+    docs.add(ids=[str(i) for i in range(200)], embeddings=vectors[:200].tolist())
+    assert docs.stats()["codec"] == "int8"  # below the training threshold
+    docs.add(ids=[str(i) for i in range(200, 600)], embeddings=vectors[200:].tolist())
+
+    stats = docs.stats()
+    assert stats["codec"] == "pq"
+    assert stats["bytes_per_vector"] == DIM // 4
+    assert stats["compression"] == 16.0
+
+    for seed in range(10):
+        query = vectors[seed * 37] + np.random.default_rng(seed).normal(0, 0.05, DIM)
+        result = docs.query(query_embeddings=[query.astype(np.float32).tolist()], n_results=3)
+        assert result["ids"][0] == _exact_top(vectors, query, 3)
+
+    client.reset()
+    reopened = QuantizedClient(str(tmp_path)).get_or_create_collection("docs")
+    assert reopened.stats()["codec"] == "pq"
+    assert reopened.query(query_embeddings=[vectors[5].tolist()], n_results=1)["ids"] == [["5"]]
+
+
+def test_chroma_store_uses_quantized_client(tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTORSTORE_MODE", "quantized")
+    monkeypatch.setenv("IW_QUANTIZED_VECTOR_DIR", str(tmp_path))
+    monkeypatch.setenv("OPENAI_EMBEDDING_DIMENSIONS", str(DIM))
+    monkeypatch.setattr(chroma_store, "_CHROMA_CLIENT", None)
+    try:
+        vectors = _vectors(3, seed=2)
+        chroma_store.add_document_chunks(7, 1, [1, 2, 3], [0, 1, 2], ["a", "b", "c"], vectors.tolist())
+        found = chroma_store.query_similar_document_chunks(1, vectors[1].tolist(), n_results=2)
+        assert found["ids"][0][0] == "2"
+        assert found["metadatas"][0][0]["document_id"] == 7
+        chroma_store.delete_document_chunks([2])
+        assert chroma_store.get_docs_collection().count() == 2
+        assert (tmp_path / "docs" / "vectors.f32").exists()
+    finally:
+        chroma_store._reset_chroma_persistence()
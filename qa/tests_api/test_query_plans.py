@@ -0,0 +1,149 @@
+"""
+Hot-path queries must be served by indexes (EXPLAIN QUERY PLAN), and the
+migration runner must bring older databases up to date.
+"""
+
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+
+from app.db import migrations
+from app.db.base import Base
+from app.db.migrations import LATEST_VERSION, OBSOLETE_INDEXES, run_migrations
+
+HOT_QUERIES = {
+    "messages": (
+        "SELECT * FROM messages WHERE conversation_id = 1 ORDER BY id DESC LIMIT 16",
+        "ix_messages_conversation_id_id",
+    ),
+    "tasks": (
+        "SELECT * FROM tasks WHERE project_id = 1 AND status = 'open' "
+        "ORDER BY updated_at DESC",
+        "ix_tasks_project_id_status_updated_at",
+    ),
+    "usage_records": (
+        "SELECT * FROM usage_records WHERE conversation_id = 1 ORDER BY created_at ASC",
+        "ix_usage_records_conversation_id_created_at",
+    ),
+    "task_suggestions": (
+        "SELECT * FROM task_suggestions WHERE project_id = 1 "
+        "AND action_type = 'complete' AND status = 'pending'",
+        "ix_task_suggestions_project_id_action_type_status",
+    ),
+    "memory_items": (
+        "SELECT * FROM memory_items WHERE project_id = 1 AND superseded_by_id IS NULL "
+        "AND (expires_at IS NULL OR expires_at > '2025-01-01')",
+        "ix_memory_items_project_id_superseded_by_id_expires_at",
+    ),
+}
+
+
+@pytest.mark.parametrize("table", sorted(HOT_QUERIES))
+def test_hot_query_uses_composite_index(db_session, table):
+    sql, index_name = HOT_QUERIES[table]
+    rows = db_session.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+    plan = " | ".join(str(row[-1]) for row in rows)
+
+    assert index_name in plan, plan
+    assert "USE TEMP B-TREE FOR ORDER BY" not in plan, plan
+
+
+def test_migrations_upgrade_unversioned_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE messages (id INTEGER PRIMARY KEY, conversation_id INTEGER, "
+                "role VARCHAR(50), content TEXT, created_at DATETIME)"
+            )
+        )
+        conn.execute(text("CREATE INDEX ix_messages_conversation_id ON messages (conversation_id)"))
+        conn.execute(
+            text(
+                "CREATE TABLE document_chunks (id INTEGER PRIMARY KEY, document_id INTEGER, "
+                "section_id INTEGER, \"index\" INTEGER, content TEXT)"
+            )
+        )
+        conn.execute(text("INSERT INTO messages (conversation_id, role, content) VALUES (1, 'user', 'hi')"))
+
+    assert run_migrations(engine) == LATEST_VERSION
+
+    inspector = inspect(engine)
+    message_indexes = {ix["name"] for ix in inspector.get_indexes("messages")}
+    assert "ix_messages_conversation_id_id" in message_indexes
+    assert "ix_messages_conversation_id" not in message_indexes
+    chunk_columns = {col["name"] for col in inspector.get_columns("document_chunks")}
+    assert {"content_hash", "simhash", "duplicate_of_id"} <= chunk_columns
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM messages")).scalar() == 1
+    engine.dispose()
+
+
+def test_current_database_costs_one_version_read(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    assert run_migrations(engine) == LATEST_VERSION
+    assert "messages" in inspect(engine).get_table_names()
+
+    statements = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+    assert run_migrations(engine) == LATEST_VERSION
+    assert len(statements) == 1 and "schema_version" in statements[0]
+    engine.dispose()
+
+
+def _schema(engine) -> dict:
+    inspector = inspect(engine)
+    return {
+        table: (
+            {(col["name"], str(col["type"])) for col in inspector.get_columns(table)},
+            {ix["name"] for ix in inspector.get_indexes(table)},
+            {uc["name"] for uc in inspector.get_unique_constraints(table)},
+        )
+        for table in inspector.get_table_names()
+    }
+
+
+@pytest.mark.parametrize("pinned", range(1, LATEST_VERSION))
+def test_migrations_upgrade_database_pinned_at_each_version(tmp_path, pinned):
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    assert run_migrations(fresh) == LATEST_VERSION
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'pinned.db'}")
+    assert run_migrations(engine, target=pinned) == pinned
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO usage_records (project_id, model, tokens_in, tokens_out, "
+                "cost_estimate, created_at) VALUES (1, 'gpt-5.1', 10, 5, 0.5, '2026-01-02 03:04:05')"
+            )
+        )
+
+    assert run_migrations(engine) == LATEST_VERSION
+    assert _schema(engine) == _schema(fresh)
+    with engine.connect() as conn:
+        rollups = conn.execute(
+            text("SELECT calls, tokens_in, tokens_out, cached_tokens_in FROM usage_rollups")
+        ).fetchall()
+    assert [tuple(row) for row in rollups] == [(1, 10, 5, 0)]
+    engine.dispose()
+    fresh.dispose()
+
+
+def test_unversioned_baseline_database_upgrades_to_the_models_schema(tmp_path):
+    # A database created before versioning holds exactly the version 1 tables.
+    engine = create_engine(f"sqlite:///{tmp_path / 'v0.db'}")
+    migrations._baseline_v1.create_all(bind=engine)
+    baseline_indexes = {name for _, indexes, _ in _schema(engine).values() for name in indexes}
+    assert set(OBSOLETE_INDEXES) <= baseline_indexes
+
+    models = create_engine(f"sqlite:///{tmp_path / 'models.db'}")
+    Base.metadata.create_all(bind=models)
+    assert run_migrations(engine) == LATEST_VERSION
+    upgraded = _schema(engine)
+    assert upgraded.pop("schema_version")
+    assert upgraded == _schema(models)
+    engine.dispose()
+    models.dispose()
@@ -0,0 +1,117 @@
+"""
+Repo discovery: include globs, hierarchical ignore files, git index listing.
+"""
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from app.ingestion.repo_discovery import discover_repo
+
+
+def _write(root: Path, rel: str, text: str = "x\n") -> None:
+    path = root / rel
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+
+
+def _rel(root: Path, files) -> set[str]:
+    return {f.relative_to(root).as_posix() for f in files}
+
+
+def test_scan_honours_nested_gitignore_and_ignore(tmp_path):
+    """D-Docs-03: Scanner applies .gitignore/.ignore hierarchically."""
+    root = tmp_path / "repo"
+    _write(root, ".gitignore", "coverage/\ntarget/\n*.log\n/generated.py\n")
+    _write(root, "app/main.py")
+    _write(root, "app/generated.py")
+    _write(root, "generated.py")
+    _write(root, "coverage/report.json")
+    _write(root, "target/debug/out.txt")
+    _write(root, "notes.log")
+    _write(root, "pkg/.gitignore", "*.md\n!KEEP.md\n")
+    _write(root, "pkg/README.md")
+    _write(root, "pkg/KEEP.md")
+    _write(root, "pkg/.ignore", "secret/\n")
+    _write(root, "pkg/secret/key.txt")
+    _write(root, "node_modules/lib/index.js")
+    _write(root, ".venv/lib/site.py")
+
+    result = discover_repo(root, ["*.py", "*.md", "*.txt", "*.json", "*.js", "*.log"], use_git_index=False)
+
+    assert result.method == "scan"
+    assert _rel(root, result.files) == {
+        "app/main.py",
+        "app/generated.py",
+        "pkg/KEEP.md",
+    }
+
+
+def test_include_globs_with_paths(tmp_path):
+    root = tmp_path / "repo"
+    _write(root, "docs/guide.md")
+    _write(root, "src/readme.md")
+    _write(root, "src/app.ts")
+
+    result = discover_repo(root, ["docs/*.md", "*.ts"], use_git_index=False)
+
+    assert _rel(root, result.files) == {"docs/guide.md", "src/app.ts"}
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git not installed")
+def test_git_index_listing(tmp_path):
+    root = tmp_path / "repo"
+    _write(root, ".gitignore", "build_out/\n")
+    _write(root, "tracked.py")
+    _write(root, "untracked.py")
+    _write(root, "build_out/gen.py")
+    _write(root, ".ignore", "untracked.py\n")
+    subprocess.run(["git", "init", "-q", str(root)], check=True)
+    subprocess.run(["git", "-C", str(root), "add", "tracked.py"], check=True)
+
+    result = discover_repo(root, ["*.py"])
+
+    assert result.method == "git"
+    assert _rel(root, result.files) == {"tracked.py"}
+
+
+def _git(*args: str) -> None:
+    subprocess.run(
+        ["git", "-c", "user.email=qa@example.com", "-c", "user.name=qa", *args],
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git not installed")
+def test_root_ignored_by_enclosing_repo_is_scanned(tmp_path):
+    outer = tmp_path / "outer"
+    _write(outer, ".gitignore", "checkouts/\n")
+    _write(outer, "checkouts/project/main.py")
+    _write(outer, "checkouts/project/.gitignore", "*.log\n")
+    _write(outer, "checkouts/project/debug.log")
+    _git("init", "-q", str(outer))
+
+    result = discover_repo(outer / "checkouts" / "project", ["*.py", "*.log"])
+
+    assert result.method == "scan"
+    assert _rel(outer / "checkouts" / "project", result.files) == {"main.py"}
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git not installed")
+def test_git_listing_expands_submodules(tmp_path):
+    root = tmp_path / "repo"
+    _write(root, "app.py")
+    _write(root, "vendor/lib/lib.py")
+    _git("init", "-q", str(root / "vendor" / "lib"))
+    _git("-C", str(root / "vendor" / "lib"), "add", "lib.py")
+    _git("-C", str(root / "vendor" / "lib"), "commit", "-q", "-m", "lib")
+    _git("init", "-q", str(root))
+    _git("-C", str(root), "add", "app.py", "vendor/lib")
+
+    result = discover_repo(root, ["*.py"])
+
+    assert result.method == "git"
+    assert _rel(root, result.files) == {"app.py", "vendor/lib/lib.py"}
@@ -0,0 +1,121 @@
+"""
+Retrieval result cache keyed on per-project index generations.
+"""
+
+import uuid
+from pathlib import Path
+
+from app.api import search
+from app.vectorstore import chroma_store, reconcile, retrieval_cache
+
+LOCAL_ROOT = str(Path(__file__).resolve().parents[2])
+
+
+def _new_project(client) -> int:
+    resp = client.post(
+        "/projects",
+        json={"name": f"QA_Cache_{uuid.uuid4().hex[:8]}", "local_root_path": LOCAL_ROOT},
+    )
+    assert resp.status_code == 200, resp.text
+    return resp.json()["id"]
+
+
+def _counting_embeddings(monkeypatch) -> list:
+    calls = []
+    original = search.get_embedding
+
+    def counting(text, *args, **kwargs):
+        calls.append(text)
+        return original(text, *args, **kwargs)
+
+    monkeypatch.setattr(search, "get_embedding", counting)
+    return calls
+
+
+def _add_doc(client, project_id: int, name: str, text: str) -> None:
+    resp = client.post("/docs/text", json={"project_id": project_id, "name": name, "text": text})
+    assert resp.status_code == 200, resp.text
+
+
+def test_repeated_searches_hit_until_the_project_index_changes(client, monkeypatch):
+    first, second = _new_project(client), _new_project(client)
+    _add_doc(client, first, "a.md", "Deploys run from the release branch.")
+    calls = _counting_embeddings(monkeypatch)
+    query = {"project_id": first, "query": "how do deploys work", "limit": 5}
+
+    hits = client.post("/search/docs", json=query).json()["hits"]
+    assert client.post("/search/docs", json=query).json()["hits"] == hits
+    assert len(calls) == 1
+    # Different filters or limits are different entries.
+    client.post("/search/docs", json={**query, "limit": 3})
+    assert len(calls) == 2
+
+    # Another project's writes leave this project's entries valid.
+    _add_doc(client, second, "b.md", "Unrelated notes.")
+    client.post("/search/docs", json=query)
+    assert len(calls) == 2
+
+    _add_doc(client, first, "c.md", "Hotfixes skip the release branch.")
+    refreshed = client.post("/search/docs", json=query).json()["hits"]
+    assert len(calls) == 3
+    assert len(refreshed) == len(hits) + 1
+
+
+def test_deletes_and_reconcile_repairs_invalidate(client, db_session, monkeypatch):
+    project_id = _new_project(client)
+    memory = client.post(f"/projects/{project_id}/memory", json={"title": "Style", "content": "Use tabs"})
+    assert memory.status_code == 200, memory.text
+    memory_id = str(memory.json()["id"])
+    calls = _counting_embeddings(monkeypatch)
+    query = {"project_id": project_id, "query": "indentation"}
+
+    assert len(client.post("/search/memory", json=query).json()["hits"]) == 1
+    # Drift behind the store's back; reconcile re-adds the vector and bumps.
+    chroma_store.get_memory_collection(project_id).delete(ids=[memory_id])
+    assert reconcile.reconcile_collection(db_session, "memory_items")["readded"] == 1
+    assert len(client.post("/search/memory", json=query).json()["hits"]) == 1
+    assert len(calls) == 2
+
+    assert client.delete(f"/memory_items/{memory_id}").status_code == 200
+    assert client.post("/search/memory", json=query).json()["hits"] == []
+    assert len(calls) == 3
+
+
+def test_cache_is_bounded_and_can_be_disabled(client, monkeypatch):
+    project_id = _new_project(client)
+    calls = _counting_embeddings(monkeypatch)
+    monkeypatch.setenv("IW_RETRIEVAL_CACHE_SIZE", "2")
+    for text in ("one", "two", "three", "three", "one"):
+        client.post("/search/memory", json={"project_id": project_id, "query": text})
+    assert calls == ["one", "two", "three", "one"]  # "one" was evicted
+    assert len(retrieval_cache._entries) == 2
+
+    monkeypatch.setenv("IW_RETRIEVAL_CACHE_SIZE", "0")
+    client.post("/search/memory", json={"project_id": project_id, "query": "three"})
+    assert calls[-1] == "three"
+
+
+def test_chat_embeds_docs_query_only_on_a_cache_miss(client, monkeypatch):
+    from app.api import main
+
+    project_id = _new_project(client)
+    _add_doc(client, project_id, "a.md", "Deploys run from the release branch.")
+    requested = []
+    original = main.query_embedder
+
+    def recording(text):
+        vector = original(text)
+
+        def tracked(collection):
+            requested.append(collection)
+            return vector(collection)
+
+        return tracked
+
+    monkeypatch.setattr(main, "query_embedder", recording)
+    for _ in range(2):
+        resp = client.post("/chat", json={"project_id": project_id, "message": "How do deploys work?"})
+        assert resp.status_code == 200, resp.text
+    # The messages vector is needed every turn; docs only on the first (miss).
+    assert requested.count("messages") == 2
+    assert requested.count("docs") == 1
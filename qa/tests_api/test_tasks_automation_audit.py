@@ -308,3 +308,30 @@ def test_auto_update_tasks_handles_noisy_conversation_without_wrong_completions(
         for action in telemetry
     )
 
+
+
+def test_stale_completion_suggestions_dismissed_when_task_done(client, project, db_session):
+    from app.db import models
+
+    task = models.Task(project_id=project["id"], description="Ship the beta", status="open")
+    db_session.add(task)
+    db_session.flush()
+    suggestion = models.TaskSuggestion(
+        project_id=project["id"],
+        target_task_id=task.id,
+        action_type="complete",
+        payload="{}",
+        status="pending",
+    )
+    db_session.add(suggestion)
+    db_session.commit()
+
+    # Reading tasks no longer writes.
+    assert client.get(f"/projects/{project['id']}/tasks").status_code == 200
+    db_session.refresh(suggestion)
+    assert suggestion.status == "pending"
+
+    resp = client.patch(f"/tasks/{task.id}", json={"status": "done"})
+    assert resp.status_code == 200, resp.text
+    db_session.refresh(suggestion)
+    assert suggestion.status == "dismissed"
@@ -0,0 +1,89 @@
+"""
+Per-request stage tracing for /chat, /debug/traces and the OTLP/JSON exporter.
+"""
+
+import json
+
+from app.observability import tracing
+
+
+def test_chat_trace_has_stage_spans(client, project):
+    resp = client.post("/chat", json={"project_id": project["id"], "message": "trace me"})
+    assert resp.status_code == 200, resp.text
+    trace_id = resp.headers.get("X-Trace-Id")
+    assert trace_id
+
+    listing = client.get("/debug/traces", params={"name": "POST /chat", "limit": 5})
+    assert listing.status_code == 200, listing.text
+    assert listing.json()["traces"][0]["trace_id"] == trace_id
+
+    trace = client.get(f"/debug/traces/{trace_id}").json()
+    assert trace["name"] == "POST /chat"
+    assert trace["attributes"]["project_id"] == project["id"]
+    assert trace["attributes"]["http.status_code"] == 200
+    stages = [s["name"] for s in trace["spans"] if s["parent_id"] is not None]
+    for stage in (
+        "resolve",
+        "history",
+        "retrieve_messages",
+        "retrieve_docs",
+        "retrieve_memory",
+        "llm",
+        "persist",
+        "usage",
+        "commit",
+    ):
+        assert stage in stages
+    by_name = {s["name"]: s for s in trace["spans"]}
+    assert "hits" in by_name["retrieve_docs"]["attributes"]
+    # Vector queries nest under their retrieval stage.
+    query = next(s for s in trace["spans"] if s["name"] == "vector.query")
+    assert query["parent_id"] == by_name["retrieve_messages"]["span_id"]
+    assert trace["slowest_stage"] in stages
+    offsets = [s["offset_ms"] for s in trace["spans"] if s["parent_id"] is not None]
+    assert all(o >= 0 for o in offsets)
+
+
+def test_untraced_requests_are_not_buffered(client, project):
+    resp = client.get(f"/projects/{project['id']}")
+    assert resp.status_code == 200
+    assert "X-Trace-Id" not in resp.headers
+    assert client.get("/debug/traces/0123").status_code == 404
+
+
+def test_spans_export_as_otlp_json(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setenv("IW_TRACE_EXPORT_FILE", str(path))
+
+    trace = tracing.start_trace("job")
+    with tracing.span("outer", rows=3):
+        with tracing.span("inner", model="gpt-5-nano", ratio=0.5, ok=True):
+            pass
+    try:
+        with tracing.span("failing"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert tracing.end_trace(trace)
+    # Outside a trace, spans are no-ops.
+    with tracing.span("ignored") as noop:
+        noop.set_attributes(x=1)
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 1
+    spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_name = {s["name"]: s for s in spans}
+    assert set(by_name) == {"job", "outer", "inner", "failing"}
+    assert all(s["traceId"] == trace.trace_id for s in spans)
+    assert by_name["inner"]["parentSpanId"] == by_name["outer"]["spanId"]
+    assert by_name["outer"]["parentSpanId"] == by_name["job"]["spanId"]
+    assert "parentSpanId" not in by_name["job"]
+    attrs = {a["key"]: a["value"] for a in by_name["inner"]["attributes"]}
+    assert attrs == {
+        "model": {"stringValue": "gpt-5-nano"},
+        "ratio": {"doubleValue": 0.5},
+        "ok": {"boolValue": True},
+    }
+    assert by_name["outer"]["attributes"] == [{"key": "rows", "value": {"intValue": "3"}}]
+    assert by_name["failing"]["status"] == {"code": 2, "message": "ValueError"}
+    assert int(by_name["job"]["endTimeUnixNano"]) >= int(by_name["job"]["startTimeUnixNano"])
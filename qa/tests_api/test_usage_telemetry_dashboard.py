@@ -72,3 +72,76 @@ def test_conversation_usage_summary_has_records(client: TestClient, project: dic
     assert len(usage["records"]) >= 1
     assert usage["records"][-1]["model"]
 
+
+
+def test_project_usage_rollups_match_usage_records(client: TestClient, project: dict, db_session) -> None:
+    from app.db import models
+    from app.db.usage_rollups import rebuild_usage_rollups
+
+    convo_ids = []
+    for message in ("Hello there", "Another question", "And a third"):
+        resp = client.post("/chat", json={"project_id": project["id"], "message": message})
+        assert resp.status_code == 200, resp.text
+        convo_ids.append(resp.json()["conversation_id"])
+
+    records = db_session.query(models.UsageRecord).filter_by(project_id=project["id"]).all()
+    assert len(records) == 3
+    expected_in = sum(r.tokens_in or 0 for r in records)
+
+    by_model = client.get(f"/projects/{project['id']}/usage")
+    assert by_model.status_code == 200, by_model.text
+    payload = by_model.json()
+    assert payload["total_calls"] == 3
+    assert payload["total_tokens_in"] == expected_in
+    assert {b["key"] for b in payload["buckets"]} == {r.model for r in records}
+
+    by_convo = client.get(f"/projects/{project['id']}/usage", params={"group_by": "conversation"}).json()
+    assert sorted(b["key"] for b in by_convo["buckets"]) == sorted(set(convo_ids))
+
+    by_day = client.get(f"/projects/{project['id']}/usage", params={"group_by": "day"}).json()
+    day = records[0].created_at.date().isoformat()
+    assert [b["key"] for b in by_day["buckets"]] == [day]
+    window = client.get(
+        f"/projects/{project['id']}/usage",
+        params={"start": "2000-01-01", "end": "2000-01-31"},
+    ).json()
+    assert window["total_calls"] == 0 and window["buckets"] == []
+
+    assert client.get(f"/projects/{project['id']}/usage", params={"group_by": "hour"}).status_code == 400
+
+    # The backfill path rebuilds exactly what the incremental upserts produced.
+    incremental = db_session.query(models.UsageRollup).count()
+    with db_session.get_bind().begin() as conn:
+        assert rebuild_usage_rollups(conn) == incremental
+    db_session.expire_all()
+    assert client.get(f"/projects/{project['id']}/usage").json() == payload
+
+
+def test_project_scoped_recompute_rebuilds_only_that_projects_rollups(
+    client: TestClient, project: dict, db_session
+) -> None:
+    import uuid
+
+    from app.db import models
+    from app.db.usage_rollups import rebuild_usage_rollups
+
+    other = client.post(
+        "/projects",
+        json={"name": f"QA_Usage_{uuid.uuid4().hex[:8]}", "local_root_path": project["local_root_path"]},
+    )
+    assert other.status_code == 200, other.text
+    other_id = other.json()["id"]
+    for project_id in (project["id"], other_id):
+        resp = client.post("/chat", json={"project_id": project_id, "message": "Hello rollups"})
+        assert resp.status_code == 200, resp.text
+
+    # Mark the other project's bucket; a project-scoped rebuild leaves it alone.
+    rollups = models.UsageRollup
+    db_session.query(rollups).filter_by(project_id=other_id).update({"calls": 99})
+    db_session.commit()
+    with db_session.get_bind().begin() as conn:
+        assert rebuild_usage_rollups(conn, project["id"]) == 1
+    assert client.post("/usage/recompute_costs", params={"project_id": project["id"]}).status_code == 200
+    db_session.expire_all()
+    assert db_session.query(rollups).filter_by(project_id=other_id).one().calls == 99
+    assert db_session.query(rollups).filter_by(project_id=project["id"]).one().calls == 1
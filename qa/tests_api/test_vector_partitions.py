@@ -0,0 +1,119 @@
+"""
+Per-project vector partitions: routing, the online migration from the shared
+layout and partition-aware reconcile.
+"""
+
+import uuid
+from pathlib import Path
+
+import pytest
+
+from app.api import main
+from app.db import models
+from app.llm import embeddings
+from app.vectorstore import chroma_store, reconcile, registry, reindex
+
+LOCAL_ROOT = str(Path(__file__).resolve().parents[2])
+TEXT = "Partitioned collections keep projects apart. " * 30
+
+
+def _new_project(client) -> int:
+    resp = client.post(
+        "/projects",
+        json={"name": f"QA_Partition_{uuid.uuid4().hex[:8]}", "local_root_path": LOCAL_ROOT},
+    )
+    assert resp.status_code == 200, resp.text
+    return resp.json()["id"]
+
+
+def _populate(client, project_id: int) -> int:
+    doc = client.post("/docs/text", json={"project_id": project_id, "name": "p.md", "text": TEXT})
+    assert doc.status_code == 200, doc.text
+    memory = client.post(f"/projects/{project_id}/memory", json={"title": "T", "content": f"Memo {project_id}"})
+    assert memory.status_code == 200, memory.text
+    assert client.post("/chat", json={"project_id": project_id, "message": "hi"}).status_code == 200
+    return memory.json()["id"]
+
+
+def _ids(collection) -> set:
+    return set(collection.get(include=[])["ids"])
+
+
+def _chunk_ids(db, project_id: int) -> set:
+    rows = (
+        db.query(models.DocumentChunk.id)
+        .join(models.Document)
+        .filter(models.Document.project_id == project_id, models.DocumentChunk.duplicate_of_id.is_(None))
+    )
+    return {str(chunk_id) for (chunk_id,) in rows}
+
+
+def test_fresh_deployment_writes_to_project_partitions(client, db_session):
+    assert registry.record_active(db_session) == list(registry.LOGICAL_NAMES)
+    assert registry.active_partitioned()
+    first, second = _new_project(client), _new_project(client)
+    first_memory = _populate(client, first)
+    _populate(client, second)
+
+    assert _ids(chroma_store.get_docs_collection(first)) == _chunk_ids(db_session, first)
+    assert _ids(chroma_store.get_docs_collection(second)) == _chunk_ids(db_session, second)
+    assert chroma_store.get_collection_by_name("docs").count() == 0
+    with pytest.raises(ValueError):
+        chroma_store.get_docs_collection()
+
+    found = chroma_store.query_similar_memory_items(first, [0.1] * 1536, n_results=10)
+    assert found["ids"][0] == [str(first_memory)]
+
+    assert client.delete(f"/memory_items/{first_memory}").status_code == 200
+    assert _ids(chroma_store.get_memory_collection(first)) == set()
+
+    # A vector filed under another project's partition is stale.
+    stray = sorted(_chunk_ids(db_session, second))[0]
+    chroma_store.get_docs_collection(first).add(
+        ids=[stray], embeddings=[[0.0] * 1536], documents=["x"],
+        metadatas=[{"document_id": 0, "project_id": second, "chunk_id": int(stray), "chunk_index": 0}],
+    )
+    report = reconcile.reconcile_collection(db_session, "docs")
+    assert report["partitions"] == db_session.query(models.Project).count()
+    assert report["stale"] == 1 and report["missing"] == 0
+    assert stray not in _ids(chroma_store.get_docs_collection(first))
+
+
+def test_shared_collections_migrate_online_without_re_embedding(client, db_session, monkeypatch):
+    first, second = _new_project(client), _new_project(client)
+    _populate(client, first)
+    _populate(client, second)
+    shared_docs = chroma_store.get_collection_by_name("docs")
+    assert shared_docs.count() > 0
+
+    embedded = []
+    original = embeddings.embed_texts_batched
+
+    def counting(texts, **kwargs):
+        embedded.extend(texts)
+        return original(texts, **kwargs)
+
+    monkeypatch.setattr(embeddings, "embed_texts_batched", counting)
+    # Startup records the populated collections as shared and migrates them.
+    main._check_vector_collections()
+    assert reindex.wait_for_reindex(timeout=30)
+
+    job = reindex.reindex_status()
+    assert job["state"] == "completed", job
+    assert job["source"]["partitioning"] == "shared"
+    assert job["target"]["partitioning"] == "project"
+    assert job["collections"]["docs"]["copied"] == shared_docs.count()
+    assert job["collections"]["docs"]["backfill"]["readded"] == 0
+    # Vectors are copied; only the verification queries are embedded.
+    assert len(embedded) <= 2 * sum(v["samples"] for v in job["verification"].values())
+
+    assert registry.active_partitioned()
+    for project_id in (first, second):
+        assert _ids(chroma_store.get_docs_collection(project_id)) == _chunk_ids(db_session, project_id)
+        metas = chroma_store.get_messages_collection(project_id).get()["metadatas"]
+        assert metas and {m["project_id"] for m in metas} == {project_id}
+
+    # The shared collections are retired and dropped on the next purge.
+    assert set(reindex.purge_retired(db_session)) == set(registry.LOGICAL_NAMES)
+    with pytest.raises(ValueError):
+        reindex.reindex_collections(db_session, registry.active_specs(), partitioned=True)
@@ -0,0 +1,133 @@
+"""
+Vector/SQL reconciliation: deletes drop vectors, reconcile removes orphans and
+stale vectors and re-adds missing ones.
+"""
+
+import pytest
+
+from app.db import models
+from app.vectorstore import chroma_store
+
+TEXT = "Reconcile me. " * 50
+
+
+def _ingest(client, project_id: int, name: str, text: str = TEXT) -> int:
+    resp = client.post(
+        "/docs/text",
+        json={"project_id": project_id, "name": name, "text": text},
+    )
+    assert resp.status_code == 200, resp.text
+    return resp.json()["document"]["id"]
+
+
+def _ids(collection) -> set[str]:
+    return set(collection.get(include=[])["ids"])
+
+
+def _report(resp, name: str) -> dict:
+    assert resp.status_code == 200, resp.text
+    return next(c for c in resp.json()["collections"] if c["collection"] == name)
+
+
+def test_delete_document_removes_its_vectors(client, project, db_session):
+    doc_id = _ingest(client, project["id"], "gone.txt", "unique text for deletion " * 20)
+    chunk_ids = {
+        str(c.id)
+        for c in db_session.query(models.DocumentChunk).filter_by(document_id=doc_id)
+    }
+    docs = chroma_store.get_docs_collection()
+    assert chunk_ids <= _ids(docs)
+
+    assert client.delete(f"/docs/{doc_id}").status_code == 200
+    assert not chunk_ids & _ids(docs)
+
+
+def test_reconcile_repairs_drift(client, project, db_session):
+    first = _ingest(client, project["id"], "a.txt")
+    _ingest(client, project["id"], "b.txt")  # duplicates of a.txt: no vectors of their own
+    memory = client.post(
+        f"/projects/{project['id']}/memory",
+        json={"title": "Pref", "content": "Use tabs"},
+    )
+    assert memory.status_code == 200, memory.text
+    memory_id = memory.json()["id"]
+    chat = client.post("/chat", json={"project_id": project["id"], "message": "hello"})
+    assert chat.status_code == 200, chat.text
+
+    docs = chroma_store.get_docs_collection()
+    memories = chroma_store.get_memory_collection()
+    messages = chroma_store.get_messages_collection()
+    # Orphan: the SQL row is gone but the vector stayed (pre-fix deletes).
+    chunk = db_session.query(models.DocumentChunk).filter_by(document_id=first).first()
+    docs.add(ids=["99999", "not-an-id"], embeddings=[[0.1], [0.2]], documents=["x", "y"],
+             metadatas=[{"project_id": project["id"]}, {}])
+    # Stale: the vector claims another project.
+    message_id = messages.get(include=[])["ids"][0]
+    messages.delete(ids=[message_id])
+    messages.add(ids=[message_id], embeddings=[[0.3]], documents=["hello"],
+                 metadatas=[{"project_id": -1, "conversation_id": -1}])
+    # Missing: a memory item whose vector was lost.
+    memories.delete(ids=[str(memory_id)])
+
+    dry = client.post("/vectors/reconcile", params={"dry_run": True})
+    assert _report(dry, "docs")["orphans"] == 2
+    assert _report(dry, "messages")["stale"] == 1
+    assert _report(dry, "memory_items")["missing"] == 1
+    assert "99999" in _ids(docs)
+    assert client.get("/vectors/reconcile").json()["last_run"] is None
+
+    run = client.post("/vectors/reconcile")
+    docs_report = _report(run, "docs")
+    assert docs_report["deleted"] == 2
+    assert docs_report["missing"] == 0  # duplicates are not expected to have vectors
+    assert _report(run, "messages")["readded"] == 1
+    assert _report(run, "memory_items")["readded"] == 1
+    assert _ids(docs) == {str(chunk.id)}
+    assert str(memory_id) in _ids(memories)
+    restored = messages.get(ids=[message_id])["metadatas"][0]
+    assert restored["project_id"] == project["id"]
+
+    again = client.post("/vectors/reconcile")
+    for report in again.json()["collections"]:
+        assert report["orphans"] == report["stale"] == report["missing"] == 0, report
+    assert client.get("/vectors/reconcile").json()["last_run"]["trigger"] == "manual"
+    assert 'iw_vector_drift{collection="docs",kind="orphan"} 0' in client.get("/metrics").text
+
+    assert client.post("/vectors/reconcile", params={"collection": "nope"}).status_code == 400
+
+
+def test_memory_vector_failures_are_not_swallowed(client, project, monkeypatch):
+    memory = client.post(
+        f"/projects/{project['id']}/memory",
+        json={"title": "Pref", "content": "Use spaces"},
+    )
+    memory_id = memory.json()["id"]
+
+    def _boom(*_, **__):
+        raise RuntimeError("vector store down")
+
+    monkeypatch.setattr(chroma_store.get_memory_collection(), "delete", _boom)
+    with pytest.raises(RuntimeError):
+        chroma_store.delete_memory_embedding(memory_id)
+    update = client.patch(f"/memory_items/{memory_id}", json={"content": "Use tabs"})
+    assert update.status_code == 503
+    # Deleting still succeeds; the orphan is left for reconcile.
+    assert client.delete(f"/memory_items/{memory_id}").status_code == 200
+
+
+def test_reingesting_a_changed_file_drops_superseded_vectors(db_session, project, tmp_path):
+    from app.ingestion.github_ingestor import ingest_local_repo
+
+    repo_root = tmp_path / "repo"
+    repo_root.mkdir()
+    target = repo_root / "notes.md"
+    target.write_text("first version of the notes " * 20, encoding="utf-8")
+    ingest_local_repo(db_session, project["id"], str(repo_root), include_globs=["*.md"])
+
+    target.write_text("second version, rewritten " * 20, encoding="utf-8")
+    ingest_local_repo(db_session, project["id"], str(repo_root), include_globs=["*.md"])
+
+    documents = db_session.query(models.Document).filter_by(project_id=project["id"]).all()
+    assert [d.name for d in documents] == ["notes.md"]
+    stored = chroma_store.get_docs_collection().get(include=["documents"])["documents"]
+    assert stored and all("second version" in text for text in stored)
@@ -0,0 +1,158 @@
+"""
+Embedding dimensions, per-collection model/dimension records and the online
+shadow re-index with its atomic swap.
+"""
+
+import pytest
+
+from app.api import main
+from app.db import models
+from app.llm import embeddings
+from app.llm.embeddings import EmbeddingSpec, embedding_spec
+from app.vectorstore import chroma_store, registry, reindex
+
+TEXT = "Shadow collections keep search online. " * 30
+
+
+@pytest.fixture
+def sized_embeddings(monkeypatch):
+    """
+    Fake embedder whose vectors have the requested spec's size.
+    """
+    calls = []
+
+    def fake(texts, model=None, dimensions=None, **_):
+        spec = embeddings._resolve_spec(model, dimensions)
+        calls.append(spec)
+        size = spec.vector_size or 8
+        return [[float(len(t) % 7)] + [0.01] * (size - 1) for t in texts]
+
+    monkeypatch.setattr(embeddings, "embed_texts_batched", fake)
+    return calls
+
+
+def _sizes(collection) -> set:
+    return {len(v) for v in collection.get(include=["embeddings"])["embeddings"]}
+
+
+def test_embedding_spec_validation():
+    assert embedding_spec("text-embedding-3-small", 256) == EmbeddingSpec("text-embedding-3-small", 256)
+    # The native size is the same spec as no override.
+    assert embedding_spec("text-embedding-3-small", 1536).dimensions is None
+    with pytest.raises(ValueError):
+        embedding_spec("text-embedding-ada-002", 256)
+    with pytest.raises(ValueError):
+        embedding_spec("text-embedding-3-small", 4096)
+
+
+def test_reindex_swaps_in_reduced_dimension_collections(client, project, db_session, sized_embeddings):
+    main._check_vector_collections()
+    doc = client.post("/docs/text", json={"project_id": project["id"], "name": "a.md", "text": TEXT})
+    assert doc.status_code == 200, doc.text
+    memory = client.post(f"/projects/{project['id']}/memory", json={"title": "T", "content": "Use tabs"})
+    assert memory.status_code == 200, memory.text
+    assert client.post("/chat", json={"project_id": project["id"], "message": "hi"}).status_code == 200
+
+    before = client.get("/vectors/reindex").json()
+    recorded = {c["name"]: c for c in before["collections"] if c["state"] == "active"}
+    assert recorded["docs"]["physical_name"] == "docs"
+    assert recorded["docs"]["vector_size"] == 1536
+    assert recorded["docs"]["id"] is not None
+
+    assert client.post("/vectors/reindex", json={}).status_code == 400  # already active
+    assert client.post("/vectors/reindex", json={"dimensions": 9999}).status_code == 400
+
+    started = client.post("/vectors/reindex", json={"dimensions": 256})
+    assert started.status_code == 200, started.text
+    assert reindex.wait_for_reindex(timeout=30)
+
+    status = client.get("/vectors/reindex").json()
+    job = status["job"]
+    assert job["state"] == "completed", job
+    assert {spec["dimensions"] for spec in job["target"]["specs"].values()} == {256}
+    assert job["collections"]["docs"]["backfill"]["readded"] >= 1
+    assert job["verification"]["docs"]["samples"] >= 1
+    states = {(c["name"], c["state"]): c for c in status["collections"]}
+    assert states[("docs", "retired")]["physical_name"] == "docs"
+    assert states[("docs", "active")]["dimensions"] == 256
+
+    active_docs = chroma_store.get_docs_collection(project["id"])
+    assert active_docs.name == f"{states[('docs', 'active')]['physical_name']}__p{project['id']}"
+    chunk_ids = {str(c.id) for c in db_session.query(models.DocumentChunk)}
+    assert set(active_docs.get(include=[])["ids"]) == chunk_ids
+    assert _sizes(active_docs) == {256}
+    assert str(memory.json()["id"]) in chroma_store.get_memory_collection(project["id"]).get(include=[])["ids"]
+
+    # New writes and queries embed with the recorded spec, not the env default.
+    assert embeddings.active_embedding_spec() == EmbeddingSpec("text-embedding-3-small", 256)
+    assert client.post("/chat", json={"project_id": project["id"], "message": "after"}).status_code == 200
+    assert _sizes(chroma_store.get_messages_collection(project["id"])) == {256}
+
+    # The retired collection is dropped by the next purge (startup or re-index).
+    assert reindex.purge_retired(db_session) == ["messages", "docs", "memory_items"]
+
+
+def test_writes_are_mirrored_while_building(client, project, db_session, sized_embeddings):
+    spec = EmbeddingSpec("text-embedding-3-small", 512)
+    shadows = registry.begin_building(db_session, {name: spec for name in registry.LOGICAL_NAMES}, False)
+    shadow_memory = chroma_store.get_collection_by_name(shadows["memory_items"].physical_name)
+
+    memory = client.post(f"/projects/{project['id']}/memory", json={"title": "T", "content": "Mirror me"})
+    assert memory.status_code == 200, memory.text
+    memory_id = str(memory.json()["id"])
+    assert memory_id in shadow_memory.get(include=[])["ids"]
+    assert _sizes(shadow_memory) == {512}
+    # Reads stay on the live collection until the swap.
+    assert chroma_store.get_memory_collection(project["id"]).name == f"memory_items__p{project['id']}"
+
+    assert client.delete(f"/memory_items/{memory_id}").status_code == 200
+    assert shadow_memory.get(include=[])["ids"] == []
+
+    with pytest.raises(reindex.ReindexInProgress):
+        reindex._job_lock.acquire()
+        try:
+            reindex.reindex_collections(db_session, EmbeddingSpec("text-embedding-3-small", 256))
+        finally:
+            reindex._job_lock.release()
+    abandoned = registry.abandon_building(db_session)
+    assert {v.name for v in abandoned} == set(registry.LOGICAL_NAMES)
+    assert registry.building("memory_items") is None
+
+
+def test_copy_falls_back_to_reembedding_when_vectors_are_not_returned(
+    client, project, db_session, sized_embeddings, monkeypatch
+):
+    doc = client.post("/docs/text", json={"project_id": project["id"], "name": "a.md", "text": TEXT})
+    assert doc.status_code == 200, doc.text
+    live = registry.active("docs")
+    shadows = registry.begin_building(
+        db_session, {name: registry.active(name).spec for name in registry.LOGICAL_NAMES}, live.partitioned
+    )
+    shadow = shadows["docs"]
+
+    class WithoutVectors:
+        # Like a store whose get() ignores include=["embeddings"].
+        def __init__(self, inner):
+            self._inner = inner
+
+        def get(self, **kwargs):
+            page = dict(self._inner.get(**kwargs))
+            page.pop("embeddings", None)
+            return page
+
+    original = chroma_store.get_collection_by_name
+    live_name = live.collection_name(project["id"])
+    monkeypatch.setattr(
+        chroma_store,
+        "get_collection_by_name",
+        lambda name: WithoutVectors(original(name)) if name == live_name else original(name),
+    )
+    try:
+        assert reindex._copy(db_session, "docs", live, shadow) == 0
+        monkeypatch.setattr(chroma_store, "get_collection_by_name", original)
+        assert reindex._fill(db_session, "docs", shadow)["readded"] >= 1
+        chunk_ids = {str(c.id) for c in db_session.query(models.DocumentChunk)}
+        shadow_docs = chroma_store.get_collection_by_name(shadow.collection_name(project["id"]))
+        assert set(shadow_docs.get(include=[])["ids"]) == chunk_ids
+    finally:
+        registry.abandon_building(db_session)
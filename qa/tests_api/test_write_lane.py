@@ -0,0 +1,133 @@
+"""
+SQLite single-writer lane: serialized sessions, group-committed write units, PRAGMAs.
+"""
+
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+import app.db.session as session_module
+from app.db import models
+from app.db import write_lane
+from app.db.write_lane import WRITE_LANE, get_write_lane_stats, run_write
+
+
+def _wait_for(predicate, timeout: float = 5.0) -> None:
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def test_concurrent_sessions_write_one_at_a_time(db_session):
+    active = 0
+    max_active = 0
+    guard = threading.Lock()
+    errors = []
+
+    def writer(i: int) -> None:
+        nonlocal active, max_active
+        session = session_module.SessionLocal()
+        try:
+            session.add(models.Project(name=f"lane-{i}"))
+            session.flush()
+            with guard:
+                active += 1
+                max_active = max(max_active, active)
+            time.sleep(0.02)
+            with guard:
+                active -= 1
+            session.commit()
+        except Exception as exc:  # noqa: BLE001
+            errors.append(exc)
+        finally:
+            session.close()
+
+    get_write_lane_stats(reset=True)
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert max_active == 1
+    assert db_session.query(models.Project).filter(models.Project.name.like("lane-%")).count() == 6
+    stats = get_write_lane_stats()
+    assert stats["contended"] >= 1
+    assert stats["timeouts"] == 0
+    assert not stats["held"]
+
+
+def test_queued_write_units_are_group_committed(db_session):
+    get_write_lane_stats(reset=True)
+    assert WRITE_LANE.acquire()
+    try:
+        threads = [
+            threading.Thread(
+                target=run_write,
+                args=(lambda s, i=i: s.add(models.Project(name=f"unit-{i}")),),
+            )
+            for i in range(5)
+        ]
+        for t in threads:
+            t.start()
+        _wait_for(lambda: len(write_lane._PENDING) == 5)
+    finally:
+        WRITE_LANE.release()
+    for t in threads:
+        t.join()
+
+    assert db_session.query(models.Project).filter(models.Project.name.like("unit-%")).count() == 5
+    stats = get_write_lane_stats()
+    assert stats["units_committed"] == 5
+    assert stats["groups_committed"] == 1
+
+
+def test_failing_write_unit_does_not_sink_the_group(db_session):
+    def boom(session):
+        session.add(models.Project(name="never"))
+        raise ValueError("bad unit")
+
+    with pytest.raises(ValueError):
+        run_write(boom)
+    assert run_write(lambda s: s.add(models.Project(name="kept")) or "ok") == "ok"
+    names = {p.name for p in db_session.query(models.Project).all()}
+    assert "kept" in names and "never" not in names
+
+
+def test_sqlite_pragmas_applied(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pragma.db'}")
+    event.listen(engine, "connect", session_module.set_sqlite_pragma)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA temp_store")).scalar() == 2  # MEMORY
+    engine.dispose()
+
+
+def test_write_unit_on_the_thread_holding_the_lane(db_session):
+    session = session_module.SessionLocal()
+    try:
+        session.add(models.Project(name="held-by-request"))
+        session.flush()  # this thread now holds the lane, uncommitted
+        assert WRITE_LANE.held_by_current_thread()
+
+        started = time.perf_counter()
+        with pytest.raises(RuntimeError, match="write lane"):
+            run_write(lambda s: s.add(models.Project(name="queued-unit")))
+        assert time.perf_counter() - started < 1.0
+        assert not write_lane._PENDING
+
+        run_write(lambda s: s.add(models.Project(name="inline-unit")), session=session)
+        session.commit()
+    finally:
+        session.close()
+
+    names = {p.name for p in db_session.query(models.Project).all()}
+    assert {"held-by-request", "inline-unit"} <= names
+    assert "queued-unit" not in names
+    assert not get_write_lane_stats()["held"]